@@ -0,0 +1,51 @@
+"""Points per second for Parquet export and import, and TensorBoard loading.
+
+    python benchmarks/bench_bulk_io.py --metrics 100 --points 100000
+    python benchmarks/bench_bulk_io.py --logdir runs/
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from clog import ClogTracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--metrics", type=int, default=100)
+    parser.add_argument("--points", type=int, default=100_000, help="points per metric")
+    parser.add_argument("--logdir", help="also time loading this TensorBoard log directory")
+    args = parser.parse_args()
+
+    tracker = ClogTracker()
+    steps = np.arange(args.points)
+    for m in range(args.metrics):
+        tracker.log_metric_array(f"layer_{m}/loss", np.random.default_rng(m).random(args.points), steps)
+    total = args.metrics * args.points
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "run.parquet")
+        start = time.perf_counter()
+        tracker.export(path)
+        elapsed = time.perf_counter() - start
+        print(f"export:          {total / elapsed / 1e6:6.1f} M points/s, {os.path.getsize(path) / total:.1f} bytes/point")
+
+        start = time.perf_counter()
+        ClogTracker.from_parquet(path)
+        elapsed = time.perf_counter() - start
+        print(f"from_parquet:    {total / elapsed / 1e6:6.1f} M points/s")
+
+    if args.logdir:
+        start = time.perf_counter()
+        loaded = ClogTracker.from_tensorboard(args.logdir)
+        elapsed = time.perf_counter() - start
+        points = int(loaded._tracker.export_columns()[1].sum())
+        print(f"from_tensorboard: {points / elapsed / 1e6:6.1f} M points/s ({points} points)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Throughput of one collector fed by many RemoteTracker processes.
+
+    python benchmarks/bench_collector.py --ranks 64 --metrics 20 --steps 2000
+"""
+
+import argparse
+import multiprocessing
+import time
+
+from clog import ClogTracker, RemoteTracker
+
+
+def rank_main(address, rank, metrics, steps):
+    tracker = RemoteTracker(address, rank=rank)
+    names = [f"layer_{i}/grad_norm" for i in range(metrics)]
+    for step in range(steps):
+        tracker.log_metrics({name: rank + 1.0 / (step + 1) for name in names}, step)
+    tracker.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ranks", type=int, default=64)
+    parser.add_argument("--metrics", type=int, default=20)
+    parser.add_argument("--steps", type=int, default=2_000)
+    parser.add_argument("--address", default="127.0.0.1:0", help="host:port or unix:/path")
+    args = parser.parse_args()
+
+    collector = ClogTracker()
+    address = collector.serve(args.address, args.ranks)
+    start = time.perf_counter()
+    ranks = [
+        multiprocessing.Process(target=rank_main, args=(address, rank, args.metrics, args.steps))
+        for rank in range(args.ranks)
+    ]
+    for process in ranks:
+        process.start()
+    for process in ranks:
+        process.join()
+    last = f"layer_{args.metrics - 1}/grad_norm@max"
+    while (collector.summary(last) or {}).get("count") != args.steps:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    points = args.ranks * args.metrics * args.steps
+    print(f"{args.ranks} ranks, {points} points in {elapsed:.2f} s: {points / elapsed / 1e6:.2f} M points/s")
+    print(f"per rank: {args.steps / elapsed:.0f} steps/s")
+
+
+if __name__ == "__main__":
+    main()
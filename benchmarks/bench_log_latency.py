@@ -0,0 +1,42 @@
+"""Per-call latency of log_metric, synchronous versus async ingestion.
+
+    python benchmarks/bench_log_latency.py --calls 1000000
+"""
+
+import argparse
+import time
+
+from clog import ClogTracker
+
+
+def measure(tracker, calls):
+    log_metric = tracker._tracker.log_metric
+    start = time.perf_counter_ns()
+    for step in range(calls):
+        log_metric("train/loss", 0.5, step)
+    elapsed = time.perf_counter_ns() - start
+    tracker.flush()
+    return elapsed / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter_ns()
+    for step in range(args.calls):
+        pass
+    loop = (time.perf_counter_ns() - start) / args.calls
+
+    sync = measure(ClogTracker(), args.calls)
+    tracker = ClogTracker(async_ingest=True, queue_capacity=1 << 20)
+    queued = measure(tracker, args.calls)
+
+    print(f"empty loop:        {loop:7.1f} ns/iteration")
+    print(f"synchronous:       {sync - loop:7.1f} ns/call")
+    print(f"async_ingest=True: {queued - loop:7.1f} ns/call  {tracker.ingest_stats()}")
+
+
+if __name__ == "__main__":
+    main()
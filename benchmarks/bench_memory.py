@@ -0,0 +1,29 @@
+"""Heap bytes per stored metric point.
+
+    python benchmarks/bench_memory.py --metrics 100 --steps 100000
+"""
+
+import argparse
+
+from clog import ClogTracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--metrics", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=100_000)
+    args = parser.parse_args()
+
+    tracker = ClogTracker()
+    names = [f"layer_{i}/grad_norm" for i in range(args.metrics)]
+    for step in range(args.steps):
+        for name in names:
+            tracker.log_metric(name, 1.0 / (step + 1), step)
+
+    points = args.metrics * args.steps
+    used = tracker.memory_usage()
+    print(f"{points} points, {used / 2**20:.1f} MiB, {used / points:.1f} bytes/point")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Cost of logging a loss tensor per step with .item() versus deferred.
+
+    python benchmarks/bench_tensor_logging.py --device cuda --steps 10000
+"""
+
+import argparse
+import time
+
+import torch
+
+from clog import ClogTracker
+
+
+def train_steps(model, batch, steps, log):
+    for step in range(steps):
+        loss = model(batch).square().mean()
+        log(loss, step)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--steps", type=int, default=10_000)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    model = torch.nn.Sequential(*[torch.nn.Linear(512, 512) for _ in range(4)]).to(device)
+    batch = torch.randn(256, 512, device=device)
+
+    def synchronize():
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    with torch.no_grad():
+        train_steps(model, batch, 100, lambda loss, step: None)
+        for label, log in [
+            ("no logging", lambda tracker: lambda loss, step: None),
+            ("loss.item()", lambda tracker: lambda loss, step: tracker.log_metric("loss", loss.item(), step)),
+            ("deferred tensor", lambda tracker: lambda loss, step: tracker.log_metric("loss", loss, step)),
+        ]:
+            tracker = ClogTracker()
+            synchronize()
+            start = time.perf_counter()
+            train_steps(model, batch, args.steps, log(tracker))
+            tracker.flush()
+            synchronize()
+            elapsed = time.perf_counter() - start
+            print(f"{label:>16}: {elapsed / args.steps * 1e6:8.1f} µs per step")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Overhead of timing a section with tracker.timer versus logging perf_counter deltas.
+
+    python benchmarks/bench_timer.py --calls 1000000
+"""
+
+import argparse
+import time
+
+from clog import ClogTracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    args = parser.parse_args()
+    tracker = ClogTracker()
+
+    start = time.perf_counter_ns()
+    for _ in range(args.calls):
+        pass
+    loop = (time.perf_counter_ns() - start) / args.calls
+
+    timer = tracker.timer
+    start = time.perf_counter_ns()
+    for _ in range(args.calls):
+        with timer("forward"):
+            pass
+    timed = (time.perf_counter_ns() - start) / args.calls
+
+    @tracker.timed("decorated")
+    def step():
+        pass
+
+    start = time.perf_counter_ns()
+    for _ in range(args.calls):
+        step()
+    decorated = (time.perf_counter_ns() - start) / args.calls
+
+    log_metric = tracker.log_metric
+    perf_counter = time.perf_counter
+    start = time.perf_counter_ns()
+    for i in range(args.calls):
+        begin = perf_counter()
+        log_metric("forward_seconds", perf_counter() - begin, i)
+    logged = (time.perf_counter_ns() - start) / args.calls
+
+    print(f"with tracker.timer():  {timed - loop:7.1f} ns/section")
+    print(f"@tracker.timed():      {decorated - loop:7.1f} ns/call")
+    print(f"log_metric per sample: {logged - loop:7.1f} ns/sample")
+    print(f"p99 of an empty section: {tracker.timer_stats('forward')['p99'] * 1e9:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""CPU used by the terminal UI while the training job is idle or logging slowly.
+
+Run it from a real terminal, since the UI needs a TTY:
+
+    python benchmarks/bench_ui_idle.py --seconds 10
+"""
+
+import argparse
+import time
+
+from clog import ClogTracker
+
+
+def measure(seconds, metrics, log_every, max_fps):
+    """Return the process CPU time per wall-clock second while the UI runs."""
+    tracker = ClogTracker()
+    for i in range(metrics):
+        tracker.log_metric(f"layer_{i}/grad_norm", 1.0, 0)
+    tracker.run_ui(threaded=True, max_fps=max_fps)
+    time.sleep(1.0)
+
+    step = 1
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        if log_every:
+            tracker.log_metric("loss", 1.0 / step, step)
+            step += 1
+            time.sleep(log_every)
+        else:
+            time.sleep(0.1)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - start
+    tracker.stop_ui()
+    return cpu / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--metrics", type=int, default=200)
+    args = parser.parse_args()
+
+    results = []
+    for label, log_every in (("idle", 0.0), ("1 point/s", 1.0)):
+        for max_fps in (10.0, 20.0, 60.0):
+            usage = measure(args.seconds, args.metrics, log_every, max_fps)
+            results.append((label, max_fps, usage))
+
+    for label, max_fps, usage in results:
+        print(f"{label:>10}, max_fps {max_fps:4.0f}: {100.0 * usage:5.2f}% of one core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Training-step throughput with the terminal UI running and without it.
+
+Simulates a training loop (a NumPy matmul plus some pure-Python bookkeeping
+and a handful of ``log_metric`` calls per step) alongside a DataLoader-style
+thread that does pure-Python work. Run it from a real terminal, since the UI
+needs a TTY:
+
+    python benchmarks/bench_ui_throughput.py --seconds 10
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from clog import ClogTracker
+
+
+def data_loader(stop_event, counter):
+    """Pure-Python work that needs the GIL, like a collate_fn."""
+    while not stop_event.is_set():
+        batch = [float(i) * 0.5 for i in range(256)]
+        counter[0] += len(batch)
+
+
+def train(tracker, seconds, metrics_per_step):
+    """Run simulated training steps for `seconds` and return steps/s."""
+    a = np.random.rand(128, 128)
+    names = [f"metric_{i}" for i in range(metrics_per_step)]
+    step = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        b = a @ a
+        loss = float(b[0, 0])
+        bookkeeping = sum(i * 0.1 for i in range(200))
+        for name in names:
+            tracker.log_metric(name, loss + bookkeeping, step)
+        step += 1
+    return step / (time.perf_counter() - start)
+
+
+def run(ui, seconds, metrics_per_step):
+    tracker = ClogTracker()
+    stop_event = threading.Event()
+    loaded = [0]
+    loader = threading.Thread(target=data_loader, args=(stop_event, loaded), daemon=True)
+    loader.start()
+    if ui:
+        tracker.run_ui(threaded=True)
+        time.sleep(0.5)
+    try:
+        steps_per_sec = train(tracker, seconds, metrics_per_step)
+    finally:
+        if ui:
+            tracker.stop_ui()
+        stop_event.set()
+        loader.join()
+    return steps_per_sec, loaded[0] / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--metrics-per-step", type=int, default=10)
+    args = parser.parse_args()
+
+    results = {}
+    for ui in (False, True):
+        results[ui] = run(ui, args.seconds, args.metrics_per_step)
+
+    for ui, (steps_per_sec, items_per_sec) in results.items():
+        label = "UI on " if ui else "UI off"
+        print(f"{label}: {steps_per_sec:10.1f} steps/s   loader {items_per_sec:12.0f} items/s")
+    off, on = results[False][0], results[True][0]
+    print(f"UI overhead: {100.0 * (off - on) / off:.1f}% of training throughput")
+
+
+if __name__ == "__main__":
+    main()
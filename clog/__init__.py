@@ -1,21 +1,469 @@
 """Terminal-based training logger for PyTorch models."""
 
 from ._rust import ClogTracker as _ClogTracker
-from typing import Optional, Union
+from ._rust import SharedMemoryWriter as _SharedMemoryWriter
+from ._rust import compare as _compare
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
+import atexit
+import functools
+import logging
+import os
+import sys
 import threading
+import time
+
+import numpy as np
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def _tensor_type() -> Optional[type]:
+    """torch.Tensor if torch has been imported, without importing it."""
+    torch = sys.modules.get("torch")
+    return None if torch is None else torch.Tensor
+
+
+def _pyarrow() -> Any:
+    """pyarrow, with its parquet and compute modules loaded, or a clear ImportError."""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export and import need pyarrow: pip install 'clog[parquet]'") from None
+    return pyarrow
+
+
+# Timestamp export_columns gives points rolled into the archive.
+_NO_TIMESTAMP = np.iinfo(np.int64).min
+
+
+def _parquet_schema(pa: Any) -> Any:
+    """Columns of an exported run: metric rows fill the first four, log rows the last three."""
+    return pa.schema([
+        ("name", pa.dictionary(pa.int32(), pa.string())),
+        ("step", pa.uint64()),
+        ("value", pa.float64()),
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("level", pa.dictionary(pa.int8(), pa.string())),
+        ("message", pa.string()),
+    ])
 
 
 class ClogTracker:
     """Main tracker for logging metrics and messages during training."""
     
-    def __init__(self):
-        self._tracker = _ClogTracker()
+    def __init__(
+        self,
+        max_points: Optional[int] = None,
+        archive_buckets: int = 1024,
+        max_logs: Optional[int] = 100_000,
+        async_ingest: bool = False,
+        queue_capacity: int = 65536,
+        overflow: str = "block",
+        persist_path: Optional[Union[str, os.PathLike]] = None,
+        fsync_interval: float = 1.0,
+        ema_alpha: float = 0.1,
+        stats_window: int = 100,
+        log_spill_path: Optional[Union[str, os.PathLike]] = None,
+        connect: Optional[str] = None,
+        rank: int = 0,
+        duplicates: str = "keep_all",
+        tensor_flush_every: int = 128,
+    ):
+        """Create a tracker.
+        
+        By default every metric point is kept. With `max_points`, each metric
+        keeps that many recent points at full resolution and rolls older ones
+        into at most `archive_buckets` min/max/mean buckets, so memory stays
+        fixed while the chart still spans the whole run. Log messages are kept
+        in a ring of the most recent `max_logs` (None for no limit); with
+        `log_spill_path`, older messages are appended to that text file
+        instead of being dropped.
+        
+        With `async_ingest=True`, metric calls only enqueue into a bounded
+        queue of `queue_capacity` entries and a background thread stores them.
+        `overflow` decides what happens when the queue is full: "block" waits,
+        "drop_oldest" evicts the oldest entry, and "sample" keeps only a
+        fraction of new entries while the queue is under pressure. Dropped
+        entries are counted in `ingest_stats()`.
+        
+        With `persist_path`, every metric and log message is also streamed to
+        an append-only binary run file by a background thread, fsynced every
+        `fsync_interval` seconds. A crash loses at most the last interval.
+        The file is finalised by `close()`, or at interpreter exit.
+        
+        Every metric keeps running statistics for `summary()`: an exponential
+        moving average with weight `ema_alpha` on the newest point, and
+        aggregates over the last `stats_window` points.
+        
+        With `connect`, everything logged is also streamed to the tracker
+        that called `serve()` on that address, tagged with `rank`. See
+        `RemoteTracker`.
+        
+        Each metric is kept sorted by step, so points logged out of order
+        (after resuming from a checkpoint, or by an evaluation loop running
+        behind training) land in place. `duplicates` decides what happens
+        when a step is logged again: "keep_all" keeps every value,
+        "last_wins" keeps the newest and "mean" their average. It applies to
+        the stored series only; `summary` covers every value logged.
+        
+        One-element torch tensors can be logged as values without calling
+        `.item()`. They are held until `tensor_flush_every` are pending, or
+        until the tracker is flushed or read, and then fetched together.
+        """
+        self._tracker = _ClogTracker(
+            max_points,
+            archive_buckets,
+            max_logs,
+            async_ingest,
+            queue_capacity,
+            overflow,
+            None if persist_path is None else os.fspath(persist_path),
+            fsync_interval,
+            ema_alpha,
+            stats_window,
+            None if log_spill_path is None else os.fspath(log_spill_path),
+            connect,
+            rank,
+            duplicates,
+        )
         self._ui_thread = None
+        self._tensor_flush_every = tensor_flush_every
+        self._pending: List[Tuple[str, Any, int, int]] = []
+        self._pending_lock = threading.Lock()
+        if persist_path is not None or connect is not None:
+            atexit.register(self.close)
     
     def log_metric(self, name: str, value: float, step: int) -> None:
-        """Log a metric value."""
+        """Log a metric value, or a one-element torch tensor without syncing."""
+        if type(value) is not float:
+            tensor = _tensor_type()
+            if tensor is not None and isinstance(value, tensor):
+                self._defer(name, value, step)
+                return
         self._tracker.log_metric(name, value, step)
     
+    def log_metrics(self, metrics: Dict[str, float], step: int) -> None:
+        """Log several metric values for the same step in one call.
+        
+        Values may be one-element torch tensors, as with `log_metric`.
+        """
+        tensor = _tensor_type()
+        if tensor is not None and any(isinstance(value, tensor) for value in metrics.values()):
+            scalars = {}
+            for name, value in metrics.items():
+                if isinstance(value, tensor):
+                    self._defer(name, value, step)
+                else:
+                    scalars[name] = value
+            metrics = scalars
+        self._tracker.log_metrics(metrics, step)
+    
+    def _defer(self, name: str, value: Any, step: int) -> None:
+        """Hold a tensor value until enough are pending to fetch them together."""
+        # numel() only reads the shape, so this does not wait for the device.
+        if value.numel() != 1:
+            raise ValueError(f"can only log one-element tensors, got shape {tuple(value.shape)}")
+        # A copy, queued on the device like the ops before it: a detached
+        # tensor shares storage, so an in-place update after this call (an
+        # accumulated total, say) would otherwise change the logged value.
+        value = value.detach().clone()
+        timestamp_ms = time.time_ns() // 1_000_000
+        with self._pending_lock:
+            self._pending.append((name, value, step, timestamp_ms))
+            full = len(self._pending) >= self._tensor_flush_every
+        if full:
+            self._resolve_tensors()
+    
+    def _resolve_tensors(self) -> None:
+        """Log every pending tensor value, with one transfer per device and dtype.
+        
+        The values go to the store in one call, each with the time it was
+        logged rather than the time it was fetched.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        import torch
+        
+        groups: Dict[Tuple[Any, Any], List[int]] = {}
+        for i, (_, value, _, _) in enumerate(pending):
+            groups.setdefault((value.device, value.dtype), []).append(i)
+        values: List[float] = [0.0] * len(pending)
+        for indices in groups.values():
+            stacked = torch.stack([pending[i][1].reshape(()) for i in indices])
+            for i, value in zip(indices, stacked.tolist()):
+                values[i] = float(value)
+        by_name: Dict[str, List[int]] = {}
+        for i, (name, _, _, _) in enumerate(pending):
+            by_name.setdefault(name, []).append(i)
+        order = [i for indices in by_name.values() for i in indices]
+        self._tracker.load_columns(
+            list(by_name),
+            np.array([len(indices) for indices in by_name.values()], dtype=np.uint64),
+            np.array([pending[i][2] for i in order], dtype=np.uint64),
+            np.array([values[i] for i in order], dtype=np.float64),
+            np.array([pending[i][3] for i in order], dtype=np.int64),
+        )
+    
+    def log_metric_array(self, name: str, values: np.ndarray, steps: np.ndarray) -> None:
+        """Append arrays of values and their steps to a metric.
+        
+        Contiguous float64 values and int64 steps are read without copying;
+        anything else is converted first.
+        """
+        values = np.ascontiguousarray(values, dtype=np.float64).reshape(-1)
+        steps = np.ascontiguousarray(steps, dtype=np.int64).reshape(-1)
+        # Tensors logged before these points go to the store first.
+        self._resolve_tensors()
+        self._tracker.log_metric_array(name, values, steps)
+    
+    def get_series(
+        self,
+        name: str,
+        start_step: Optional[int] = None,
+        end_step: Optional[int] = None,
+        max_points: Optional[int] = None,
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """The steps and values of a metric, or None if it was never logged.
+        
+        Only points with `start_step <= step <= end_step` are returned; when
+        steps only ever increased, the range is found by binary search. With
+        `max_points`, the range is downsampled in Rust to the min and max of
+        `max_points // 2` equal step ranges, so spikes survive. Points
+        archived because of the tracker's `max_points` are returned as each
+        archive bucket's min and max. Values are copied once into the
+        returned arrays, which are then independent of the tracker.
+        """
+        self._resolve_tensors()
+        return self._tracker.get_series(name, start_step, end_step, max_points)
+    
+    @classmethod
+    def from_tensorboard(cls, logdir: Union[str, os.PathLike], **kwargs: Any) -> "ClogTracker":
+        """A tracker holding every scalar of the TensorBoard event files under `logdir`.
+        
+        Event files are parsed in Rust, one thread per core, straight into
+        the store. Scalars are named by tag, prefixed with their run's
+        directory under `logdir` as TensorBoard does: `train/loss`. Other
+        keyword arguments go to the constructor.
+        """
+        tracker = cls(**kwargs)
+        tracker._tracker.load_tensorboard(os.fspath(logdir))
+        return tracker
+    
+    @classmethod
+    def from_parquet(cls, path: Union[str, os.PathLike], **kwargs: Any) -> "ClogTracker":
+        """A tracker holding the metrics and log messages of a file written by `export`.
+        
+        The file is decoded by Arrow, points are grouped by metric with
+        NumPy, and the columns are loaded in one call, one thread per core
+        across metrics. Other keyword arguments go to the constructor.
+        Needs pyarrow.
+        """
+        pa = _pyarrow()
+        pc = pa.compute
+        table = pa.parquet.read_table(os.fspath(path))
+        tracker = cls(**kwargs)
+        
+        is_metric = pc.is_valid(table["name"])
+        metrics = table.filter(is_metric)
+        names = metrics["name"].combine_chunks()
+        if not pa.types.is_dictionary(names.type):
+            names = names.dictionary_encode()
+        codes = names.indices.to_numpy()
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(names.dictionary)).astype(np.uint64)
+        # Archived points have no timestamp; borrow their neighbour's.
+        timestamps = metrics["timestamp"].cast(pa.int64())
+        timestamps = pc.fill_null(pc.fill_null_forward(pc.fill_null_backward(timestamps)), 0)
+        tracker._tracker.load_columns(
+            names.dictionary.to_pylist(),
+            counts,
+            np.ascontiguousarray(metrics["step"].to_numpy()[order], dtype=np.uint64),
+            np.ascontiguousarray(metrics["value"].to_numpy()[order], dtype=np.float64),
+            np.ascontiguousarray(timestamps.to_numpy()[order], dtype=np.int64),
+        )
+        
+        logs = table.filter(pc.invert(is_metric))
+        if logs.num_rows:
+            levels = logs["level"].combine_chunks()
+            if not pa.types.is_dictionary(levels.type):
+                levels = levels.dictionary_encode()
+            level_codes = np.array([_LEVEL_NAMES.index(name) if name in _LEVEL_NAMES else _INFO
+                                    for name in levels.dictionary.to_pylist()] + [_INFO])
+            indices = levels.indices.fill_null(len(levels.dictionary)).to_numpy()
+            tracker._tracker.load_logs(
+                logs["timestamp"].cast(pa.int64()).fill_null(0).to_pylist(),
+                level_codes[indices].tolist(),
+                logs["message"].fill_null("").to_pylist(),
+            )
+        return tracker
+    
+    def export(self, path: Union[str, os.PathLike]) -> None:
+        """Write every metric point and retained log message to a Parquet file.
+        
+        Metric rows have a name, step, value and timestamp; log rows a
+        timestamp, level and message; the other columns are null. Points are
+        copied out of Rust once, into arrays Arrow writes as they are, so no
+        Python object is made per point. Points rolled into the archive are
+        written as each bucket's min and max, without a timestamp. Read the
+        file back with `from_parquet`, or with any Parquet reader. Needs
+        pyarrow.
+        """
+        pa = _pyarrow()
+        self._resolve_tensors()
+        schema = _parquet_schema(pa)
+        timestamp_type = schema.field("timestamp").type
+        names, counts, steps, values, timestamps = self._tracker.export_columns()
+        rows = len(steps)
+        metrics = pa.table([
+            pa.DictionaryArray.from_arrays(
+                np.repeat(np.arange(len(names), dtype=np.int32), counts.astype(np.int64)),
+                pa.array(names, pa.string()),
+            ),
+            pa.array(steps),
+            pa.array(values),
+            pa.array(timestamps, timestamp_type, mask=timestamps == _NO_TIMESTAMP),
+            pa.nulls(rows, schema.field("level").type),
+            pa.nulls(rows, pa.string()),
+        ], schema=schema)
+        
+        log_timestamps, levels, messages = self._tracker.export_logs()
+        rows = len(messages)
+        logs = pa.table([
+            pa.nulls(rows, schema.field("name").type),
+            pa.nulls(rows, pa.uint64()),
+            pa.nulls(rows, pa.float64()),
+            pa.array(log_timestamps, timestamp_type),
+            pa.DictionaryArray.from_arrays(levels.astype(np.int8), pa.array(_LEVEL_NAMES, pa.string())),
+            pa.array(messages, pa.string()),
+        ], schema=schema)
+        pa.parquet.write_table(pa.concat_tables([metrics, logs]), os.fspath(path))
+    
+    def log_histogram(self, name: str, values: np.ndarray, step: int) -> None:
+        """Log the distribution of an array of values (weights, gradients...).
+        
+        The array is sketched in Rust without a Python-level loop, and only
+        the sketch is kept: at most 16 KiB per step whatever the array's
+        size, with quantiles accurate to 1%. The UI draws the 5th, 25th,
+        50th, 75th and 95th percentiles over steps, and the metric `name`
+        holds each step's median. float32 arrays are read without copying;
+        other dtypes are converted to float64. NaN and infinite values are
+        skipped.
+        """
+        values = np.asarray(values)
+        if values.dtype != np.float32:
+            values = values.astype(np.float64, copy=False)
+        self._tracker.log_histogram(name, np.ascontiguousarray(values), step)
+    
+    def histogram_quantiles(
+        self, name: str, quantiles: Sequence[float] = (0.05, 0.25, 0.5, 0.75, 0.95)
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Quantiles of a histogram metric at every logged step.
+        
+        Returns the steps and an array with one row per step and one column
+        per quantile, or None if `name` was never logged as a histogram.
+        """
+        return self._tracker.histogram_quantiles(name, list(quantiles))
+    
+    def summary(self, name: str) -> Optional[Dict[str, Any]]:
+        """Running statistics of a metric, or None if it was never logged.
+        
+        Keys: count, nan_count, last, min, min_step, max, max_step, mean,
+        variance, std, ema, window_count, window_mean, window_min, window_max.
+        These are kept up to date as points arrive, so this is O(1), and
+        count every value logged: with duplicates="last_wins" or "mean",
+        values the series no longer holds are still included.
+        """
+        self._resolve_tensors()
+        return self._tracker.summary(name)
+    
+    def timer(self, name: str) -> Any:
+        """Time a block: `with tracker.timer("forward"): ...`.
+        
+        Durations are measured on a monotonic clock in Rust and recorded into
+        a per-section histogram, not logged as metrics. The UI shows each
+        section's p50/p95/p99 over the last 10 seconds.
+        """
+        return self._tracker.timer(name)
+    
+    def timed(self, name: Optional[str] = None) -> Callable[[_F], _F]:
+        """Decorator timing every call of a function, under `name` or its qualified name."""
+        def decorate(fn: _F) -> _F:
+            timer = self._tracker.timer
+            section = name or fn.__qualname__
+            
+            @functools.wraps(fn)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with timer(section):
+                    return fn(*args, **kwargs)
+            return wrapper  # type: ignore[return-value]
+        return decorate
+    
+    def timer_stats(self, name: str) -> Optional[Dict[str, float]]:
+        """Timings of a section in seconds, or None if it was never timed.
+        
+        Keys: count, mean, max, p50, p95, p99 over the whole run, and
+        window_count, window_p50, window_p95, window_p99 over the last 10
+        seconds. Quantiles are accurate to two significant digits.
+        """
+        return self._tracker.timer_stats(name)
+    
+    def flush(self) -> None:
+        """Wait until all queued metrics, and pending tensor values, have been stored."""
+        self._resolve_tensors()
+        self._tracker.flush()
+    
+    def close(self) -> None:
+        """Write everything logged so far to the run file or collector and stop.
+        
+        Also shuts down the server started by `serve_http`.
+        """
+        self._resolve_tensors()
+        self._tracker.close()
+    
+    def serve(self, address: str = "127.0.0.1:0", world_size: Optional[int] = None) -> str:
+        """Collect metrics from other processes' `RemoteTracker`s.
+        
+        `address` is "host:port" or "unix:/path/to.sock". Each rank's metrics
+        appear as `name@rank<N>`, and once every rank has logged a step its
+        mean, min and max across ranks go into `name@mean`, `name@min` and
+        `name@max`. Pass `world_size` so that steps wait for ranks that have
+        not connected yet. Returns the address to connect to, with the actual
+        port when port 0 was asked for.
+        """
+        return self._tracker.serve(address, world_size)
+    
+    def serve_http(self, address: str = "127.0.0.1:0") -> str:
+        """Let `clog attach` follow this tracker from another machine.
+        
+        Viewers long-poll `GET /deltas` for new points and log lines, so a
+        slow or disconnected viewer never holds up logging; `GET /metrics` is
+        an OpenMetrics scrape of each metric's latest value. Returns the
+        address to attach to, with the actual port when port 0 was asked for.
+        """
+        return self._tracker.serve_http(address)
+    
+    def shared_memory(self, capacity: int = 65536) -> str:
+        """Create a channel other processes can log into, and return its name.
+        
+        Pass the name to a `SharedMemoryWriter` in a DataLoader worker or
+        subprocess on the same host. Points go through a lock-free ring of
+        `capacity` slots in /dev/shm, drained into this tracker by a
+        background thread.
+        """
+        return self._tracker.shared_memory(capacity)
+    
+    def ingest_stats(self) -> Dict[str, int]:
+        """Counts of metrics enqueued, applied and dropped by async ingestion."""
+        return self._tracker.ingest_stats()
+    
+    def memory_usage(self) -> int:
+        """Heap bytes used by stored metric points, histogram sketches and names."""
+        return self._tracker.memory_usage()
+    
     def log_message(self, message: str, level: str = "info") -> None:
         """Log a message at the specified level."""
         self._tracker.log_message(message, level)
@@ -32,21 +480,140 @@ class ClogTracker:
         """Log an error message."""
         self.log_message(message, "error")
     
-    def run_ui(self, threaded: bool = True) -> None:
-        """Run the terminal UI."""
+    def run_ui(self, threaded: bool = True, max_fps: float = 20.0) -> None:
+        """Run the terminal UI, redrawing at most `max_fps` times per second."""
         if threaded:
-            self._ui_thread = threading.Thread(target=self._tracker.run_ui)
+            self._ui_thread = threading.Thread(target=self._tracker.run_ui, args=(max_fps,))
             self._ui_thread.daemon = True
             self._ui_thread.start()
         else:
-            self._tracker.run_ui()
+            self._tracker.run_ui(max_fps)
     
-    def stop_ui(self) -> None:
+    def stop_ui(self, timeout: Optional[float] = 1.0) -> None:
         """Stop the UI if running in a thread."""
+        self._tracker.stop_ui()
         if self._ui_thread and self._ui_thread.is_alive():
-            # Note: This doesn't actually stop the thread gracefully
-            # In production you'd want a better shutdown mechanism
-            pass
+            self._ui_thread.join(timeout)
+
+
+class RemoteTracker(ClogTracker):
+    """A tracker that streams everything it logs to a collector process."""
+    
+    def __init__(self, address: str, rank: Optional[int] = None, max_points: Optional[int] = 4096, **kwargs: Any):
+        """Connect to the collector at `address`, started with `serve()`.
+        
+        `rank` defaults to the RANK environment variable set by torchrun, or
+        0. Points are sent in batches every 50 ms by a background thread, so
+        logging costs the same as with a local tracker. Locally only the
+        latest `max_points` points per metric are kept at full resolution.
+        Call `close()` (done at exit) to send the last batch.
+        """
+        if rank is None:
+            rank = int(os.environ.get("RANK", 0))
+        super().__init__(max_points=max_points, connect=address, rank=rank, **kwargs)
+
+
+class SharedMemoryWriter:
+    """Logs metrics from another process through a tracker's shared-memory channel."""
+    
+    def __init__(self, name: str):
+        """Attach to the channel `name` returned by `ClogTracker.shared_memory()`.
+        
+        Metric names are limited to 88 bytes. Points logged while the channel
+        is full are dropped and counted by `dropped()`.
+        """
+        self._writer = _SharedMemoryWriter(name)
+    
+    def log_metric(self, name: str, value: float, step: int) -> None:
+        """Log a metric value."""
+        self._writer.log_metric(name, value, step)
+    
+    def log_metrics(self, metrics: Dict[str, float], step: int) -> None:
+        """Log several metric values for the same step."""
+        self._writer.log_metrics(metrics, step)
+    
+    def dropped(self) -> int:
+        """Points dropped so far because the channel was full."""
+        return self._writer.dropped()
+
+
+# Codes of the Rust LogLevel variants (see LogLevel::code), and their names.
+_INFO, _WARNING, _ERROR, _DEBUG, _CRITICAL = range(5)
+_LEVEL_NAMES = ("info", "warning", "error", "debug", "critical")
+
+# The level code for every logging level number up to CRITICAL, so emitting a
+# record is an index rather than a chain of comparisons.
+_LEVEL_CODES = tuple(
+    _CRITICAL if levelno >= logging.CRITICAL
+    else _ERROR if levelno >= logging.ERROR
+    else _WARNING if levelno >= logging.WARNING
+    else _INFO if levelno >= logging.INFO
+    else _DEBUG
+    for levelno in range(logging.CRITICAL + 1)
+)
+
+
+class LoggingHandler(logging.Handler):
+    """A `logging` handler that sends records to a tracker's logs panel."""
+    
+    def __init__(self, tracker: ClogTracker, level: int = logging.NOTSET):
+        """Create a handler feeding `tracker`.
+        
+        Records below `level` are dropped by `logging` before this handler
+        sees them, so nothing is formatted for them. Without a formatter only
+        the record's message is sent; the panel adds the time and colours
+        by level.
+        """
+        super().__init__(level)
+        self._log_record = tracker._tracker.log_record
+    
+    def handle(self, record: logging.LogRecord) -> bool:
+        """Filter and emit a record without taking the handler lock."""
+        # The log store does its own locking, so the lock Handler.handle
+        # takes around emit would only serialise threads for nothing.
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            record = rv
+        if rv:
+            self.emit(record)
+        return rv
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        """Send one record to the tracker."""
+        try:
+            if self.formatter is None and not record.exc_info:
+                message = record.getMessage()
+            else:
+                message = self.format(record)
+            code = _LEVEL_CODES[min(record.levelno, logging.CRITICAL)]
+            self._log_record(message, code, record.created)
+        except Exception:
+            self.handleError(record)
+
+
+def compare(
+    *runs: Union[ClogTracker, str, os.PathLike],
+    labels: Optional[Sequence[str]] = None,
+    max_fps: float = 20.0,
+) -> None:
+    """Overlay several runs in the terminal UI, one colored line per run.
+    
+    Each run is a tracker, shown live, or the path of a file saved with
+    `persist_path`. Labels default to the file name without its extension,
+    or `run N` for trackers. Blocks until the user quits.
+    """
+    if labels is None:
+        labels = [
+            f"run {i}" if isinstance(run, ClogTracker) else os.path.splitext(os.path.basename(run))[0]
+            for i, run in enumerate(runs)
+        ]
+        if len(set(labels)) < len(labels):
+            labels = [f"run {i}" if isinstance(run, ClogTracker) else os.fspath(run) for i, run in enumerate(runs)]
+    _compare(
+        [run._tracker if isinstance(run, ClogTracker) else os.fspath(run) for run in runs],
+        list(labels),
+        max_fps,
+    )
 
 
-__all__ = ["ClogTracker"]
\ No newline at end of file
+__all__ = ["ClogTracker", "LoggingHandler", "RemoteTracker", "SharedMemoryWriter", "compare"]
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""Command-line entry point: ``clog view run.clog``, ``clog collect :5555``.
+
+``clog view a.clog b.clog ...`` overlays several runs in one UI, and
+``clog attach host:port`` follows a tracker started with ``serve_http``.
+"""
+
+import argparse
+import sys
+from typing import List, Optional
+
+from . import ClogTracker, compare
+from ._rust import attach, view
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="clog", description="Terminal-based training logger.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    view_parser = commands.add_parser("view", help="open runs saved with persist_path in the UI")
+    view_parser.add_argument("paths", nargs="+", metavar="path", help="run file to open; several are overlaid")
+    view_parser.add_argument("--max-fps", type=float, default=20.0, help="redraw at most this often")
+    collect_parser = commands.add_parser("collect", help="show metrics streamed by RemoteTrackers")
+    collect_parser.add_argument("address", help="host:port or unix:/path to listen on")
+    collect_parser.add_argument("--world-size", type=int, help="number of ranks to wait for at each step")
+    collect_parser.add_argument("--max-fps", type=float, default=20.0, help="redraw at most this often")
+    attach_parser = commands.add_parser("attach", help="follow a tracker served with serve_http")
+    attach_parser.add_argument("address", help="host:port the tracker serves on")
+    attach_parser.add_argument("--max-fps", type=float, default=20.0, help="redraw at most this often")
+    args = parser.parse_args(argv)
+
+    if args.command == "view":
+        try:
+            if len(args.paths) == 1:
+                view(args.paths[0], args.max_fps)
+            else:
+                compare(*args.paths, max_fps=args.max_fps)
+        except RuntimeError as e:
+            print(f"clog: {e}", file=sys.stderr)
+            return 1
+    elif args.command == "collect":
+        tracker = ClogTracker()
+        try:
+            tracker.serve(args.address, args.world_size)
+            tracker.run_ui(threaded=False, max_fps=args.max_fps)
+        except RuntimeError as e:
+            print(f"clog: {e}", file=sys.stderr)
+            return 1
+    elif args.command == "attach":
+        try:
+            attach(args.address, args.max_fps)
+        except RuntimeError as e:
+            print(f"clog: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -103,9 +103,10 @@ def train_dummy_model():
             loss.backward()
             optimizer.step()
             
-            # Log metrics
-            tracker.log_metric("batch_loss", loss.item(), global_step)
-            epoch_loss += loss.item()
+            # Log metrics; the tensor is fetched later with others, so the
+            # loop never waits on the device here
+            tracker.log_metric("batch_loss", loss, global_step)
+            epoch_loss += loss.detach()
             batch_count += 1
             global_step += 1
             
@@ -113,7 +114,7 @@ def train_dummy_model():
             time.sleep(0.01)
         
         # Log epoch metrics
-        avg_loss = epoch_loss / batch_count
+        avg_loss = epoch_loss.item() / batch_count
         tracker.log_metric("epoch_loss", avg_loss, epoch)
         tracker.log_metric("learning_rate", optimizer.param_groups[0]['lr'], epoch)
         
@@ -0,0 +1,395 @@
+//! Several runs shown as one, for `clog view a.clog b.clog` and
+//! `clog.compare`.
+
+use std::collections::HashSet;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::{Arc, Mutex};
+
+use crate::logs::{LogFilter, LogLine};
+use crate::series::Decimator;
+use crate::stats::Summary;
+use crate::timers::TimerSummary;
+use crate::ui::DataSource;
+
+/// One run's line in an `Overlay`.
+#[derive(Clone, Debug, PartialEq)]
+pub struct OverlayLine {
+    /// Position of the run in the comparison, which picks its color.
+    pub run: usize,
+    pub label: Arc<str>,
+    pub points: Vec<(f64, f64)>,
+}
+
+/// A metric from every run that logged it, reduced onto the same chart
+/// columns so that equal steps line up.
+#[derive(Clone, Debug, PartialEq)]
+pub struct Overlay {
+    pub lines: Vec<OverlayLine>,
+    pub x_bounds: [f64; 2],
+    pub y_bounds: [f64; 2],
+}
+
+struct Run {
+    label: Arc<str>,
+    source: Arc<dyn DataSource>,
+}
+
+/// Metric names of all runs, each listed once in the order first seen.
+#[derive(Default)]
+struct MergedNames {
+    /// Names read so far from each run.
+    known: Vec<usize>,
+    names: Vec<Arc<str>>,
+    seen: HashSet<Arc<str>>,
+}
+
+/// The last metric overlaid: each run's line and the version it was read at.
+#[derive(Default)]
+struct OverlayCache {
+    name: String,
+    grid: (u64, u64, usize),
+    lines: Vec<Option<(u64, OverlayLine)>>,
+}
+
+/// Columns for overlaying steps `first..=last` on a chart `columns` wide, as
+/// `(first, last, columns)` for `Decimator::new`.
+///
+/// Each column covers a power-of-two number of steps, chosen so that the data
+/// fills between `columns` and twice as many. The grid then stays the same as
+/// runs grow until their span doubles, and lines of runs that have not changed
+/// can be reused.
+fn grid(first: u64, last: u64, columns: usize) -> (u64, u64, usize) {
+    let columns = 2 * columns.max(1) as u64;
+    let span = last - first + 1;
+    let steps = span.div_ceil(columns).next_power_of_two();
+    (first, first.saturating_add(steps.saturating_mul(columns) - 1), columns as usize)
+}
+
+/// Live trackers and saved runs overlaid in one UI.
+///
+/// Charts come from `overlay`, which reads the step range of every run, then
+/// reduces the runs that changed since the last frame onto one set of columns
+/// spanning all of them, on as many threads as there are cores. Each run is
+/// reduced the way a single run is, from chunk summaries wherever a chunk
+/// falls inside one column, so a frame costs about one chart's worth of
+/// decoding per run that grew, and nothing for finished runs.
+pub struct Comparison {
+    runs: Vec<Run>,
+    names: Mutex<MergedNames>,
+    overlay_cache: Mutex<OverlayCache>,
+}
+
+impl Comparison {
+    pub fn new(runs: Vec<(String, Arc<dyn DataSource>)>) -> Self {
+        let names = MergedNames {
+            known: vec![0; runs.len()],
+            ..MergedNames::default()
+        };
+        Comparison {
+            runs: runs
+                .into_iter()
+                .map(|(label, source)| Run {
+                    label: label.into(),
+                    source,
+                })
+                .collect(),
+            names: Mutex::new(names),
+            overlay_cache: Mutex::default(),
+        }
+    }
+}
+
+impl DataSource for Comparison {
+    fn names_since(&self, first_id: usize) -> Vec<Arc<str>> {
+        let mut merged = self.names.lock().unwrap();
+        let MergedNames { known, names, seen } = &mut *merged;
+        for (run, known) in self.runs.iter().zip(known) {
+            let new_names = run.source.names_since(*known);
+            *known += new_names.len();
+            for name in new_names {
+                if seen.insert(name.clone()) {
+                    names.push(name);
+                }
+            }
+        }
+        names.get(first_id..).map_or_else(Vec::new, <[Arc<str>]>::to_vec)
+    }
+
+    /// The summary from the first run that logged `name`.
+    fn summary(&self, name: &str) -> Option<Summary> {
+        self.runs.iter().find_map(|run| run.source.summary(name))
+    }
+
+    fn version(&self, name: &str) -> Option<u64> {
+        self.runs
+            .iter()
+            .filter_map(|run| run.source.version(name))
+            .reduce(u64::wrapping_add)
+    }
+
+    fn generation(&self) -> u64 {
+        self.runs
+            .iter()
+            .fold(0, |generation, run| generation.wrapping_add(run.source.generation()))
+    }
+
+    fn step_range(&self, name: &str) -> Option<(u64, u64)> {
+        self.runs
+            .iter()
+            .filter_map(|run| run.source.step_range(name))
+            .reduce(|(first, last), (run_first, run_last)| (first.min(run_first), last.max(run_last)))
+    }
+
+    /// Every run's points, as if they were one series.
+    fn decimate_into(&self, name: &str, decimator: &mut Decimator) -> bool {
+        self.runs
+            .iter()
+            .fold(false, |found, run| run.source.decimate_into(name, decimator) | found)
+    }
+
+    fn overlay(&self, name: &str, columns: usize) -> Option<Overlay> {
+        let ranges: Vec<_> = self.runs.iter().map(|run| run.source.step_range(name)).collect();
+        let (first, last) = ranges
+            .iter()
+            .flatten()
+            .copied()
+            .reduce(|(first, last), (run_first, run_last)| (first.min(run_first), last.max(run_last)))?;
+        let grid = grid(first, last, columns);
+
+        let mut cache = self.overlay_cache.lock().unwrap();
+        if cache.name != name || cache.grid != grid {
+            *cache = OverlayCache {
+                name: name.to_string(),
+                grid,
+                lines: vec![None; self.runs.len()],
+            };
+        }
+        let versions: Vec<_> = self.runs.iter().map(|run| run.source.version(name)).collect();
+        let stale: Vec<usize> = (0..self.runs.len())
+            .filter(|&run| {
+                let cached = cache.lines[run].as_ref().map(|(version, _)| *version);
+                ranges[run].is_some() && cached != versions[run]
+            })
+            .collect();
+
+        // Workers take the next run from a shared counter, so one long run
+        // does not hold up the others.
+        let next = AtomicUsize::new(0);
+        let threads = std::thread::available_parallelism().map_or(1, |n| n.get()).min(stale.len());
+        let (grid_first, grid_last, grid_columns) = grid;
+        let fresh: Vec<(usize, Option<OverlayLine>)> = std::thread::scope(|scope| {
+            let workers: Vec<_> = (0..threads)
+                .map(|_| {
+                    scope.spawn(|| {
+                        let mut lines = Vec::new();
+                        while let Some(&run) = stale.get(next.fetch_add(1, Ordering::Relaxed)) {
+                            let mut decimator = Decimator::new(grid_first, grid_last, grid_columns);
+                            let line = self.runs[run].source.decimate_into(name, &mut decimator).then(|| OverlayLine {
+                                run,
+                                label: self.runs[run].label.clone(),
+                                points: decimator.finish().points,
+                            });
+                            lines.push((run, line));
+                        }
+                        lines
+                    })
+                })
+                .collect();
+            workers.into_iter().flat_map(|worker| worker.join().unwrap()).collect()
+        });
+        for (run, line) in fresh {
+            cache.lines[run] = line.map(|line| (versions[run].unwrap_or(0), line));
+        }
+
+        let lines: Vec<OverlayLine> = cache.lines.iter().flatten().map(|(_, line)| line.clone()).collect();
+        let mut y_bounds = [f64::INFINITY, f64::NEG_INFINITY];
+        for &(_, value) in lines.iter().flat_map(|line| &line.points) {
+            y_bounds = [y_bounds[0].min(value), y_bounds[1].max(value)];
+        }
+        if !(y_bounds[0] <= y_bounds[1]) {
+            y_bounds = [0.0, 1.0];
+        } else if y_bounds[0] == y_bounds[1] {
+            y_bounds = [y_bounds[0] - 0.5, y_bounds[1] + 0.5];
+        }
+        let x_bounds = if first == last {
+            [first as f64, first as f64 + 1.0]
+        } else {
+            [first as f64, last as f64]
+        };
+        Some(Overlay {
+            lines,
+            x_bounds,
+            y_bounds,
+        })
+    }
+
+    /// The newest lines across all runs.
+    fn recent_logs(&self, count: usize, filter: &LogFilter) -> Vec<LogLine> {
+        let mut logs: Vec<LogLine> = self
+            .runs
+            .iter()
+            .flat_map(|run| run.source.recent_logs(count, filter))
+            .collect();
+        logs.sort_by(|a, b| b.timestamp.cmp(&a.timestamp));
+        logs.truncate(count);
+        logs
+    }
+
+    /// Every run's sections, named `label/section`.
+    fn timers(&self) -> Vec<TimerSummary> {
+        self.runs
+            .iter()
+            .flat_map(|run| {
+                run.source.timers().into_iter().map(|timer| TimerSummary {
+                    name: format!("{}/{}", run.label, timer.name).into(),
+                    ..timer
+                })
+            })
+            .collect()
+    }
+
+    fn stop_requested(&self) -> bool {
+        self.runs.iter().any(|run| run.source.stop_requested())
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::store::MetricStore;
+
+    /// A source with metrics only.
+    struct Metrics(MetricStore);
+
+    impl DataSource for Metrics {
+        fn names_since(&self, first_id: usize) -> Vec<Arc<str>> {
+            self.0.names_since(first_id)
+        }
+
+        fn summary(&self, name: &str) -> Option<Summary> {
+            self.0.with_series(name, |series| series.summary())
+        }
+
+        fn version(&self, name: &str) -> Option<u64> {
+            self.0.with_series(name, |series| series.total_count())
+        }
+
+        fn generation(&self) -> u64 {
+            self.0.generation()
+        }
+
+        fn step_range(&self, name: &str) -> Option<(u64, u64)> {
+            self.0
+                .with_series(name, |series| Some((series.first_step()?, series.last_step()?)))
+                .flatten()
+        }
+
+        fn decimate_into(&self, name: &str, decimator: &mut Decimator) -> bool {
+            self.0
+                .with_series(name, |series| series.decimate_into(0, u64::MAX, decimator))
+                .is_some()
+        }
+
+        fn recent_logs(&self, _count: usize, _filter: &LogFilter) -> Vec<LogLine> {
+            Vec::new()
+        }
+    }
+
+    fn run(metrics: &[(&str, u64, fn(u64) -> f64)]) -> Arc<dyn DataSource> {
+        let store = MetricStore::new();
+        for &(name, steps, value) in metrics {
+            store.extend(name, (0..steps).map(|step| (step, value(step))), 0);
+        }
+        Arc::new(Metrics(store))
+    }
+
+    #[test]
+    fn test_overlay_aligns_steps() {
+        let short = run(&[("loss", 1_000, |step| step as f64), ("lr", 10, |_| 0.1)]);
+        let long = run(&[("loss", 4_000, |step| -(step as f64)), ("acc", 4_000, |_| 0.5)]);
+        let comparison = Comparison::new(vec![("short".into(), short.clone()), ("long".into(), long)]);
+
+        let names: Vec<String> = comparison.names_since(0).iter().map(|name| name.to_string()).collect();
+        assert_eq!(names, ["loss", "lr", "acc"]);
+        assert_eq!(&*comparison.names_since(2)[0], "acc");
+        assert_eq!(comparison.step_range("loss"), Some((0, 3_999)));
+        assert_eq!(comparison.version("loss"), Some(5_000));
+        assert_eq!(comparison.summary("loss").unwrap().last, 999.0);
+
+        // Both runs share 80 columns of 64 steps, so the short run fills only
+        // the first 16.
+        let overlay = comparison.overlay("loss", 40).unwrap();
+        assert_eq!(overlay.x_bounds, [0.0, 3_999.0]);
+        assert_eq!(overlay.y_bounds, [-3_999.0, 999.0]);
+        let labels: Vec<&str> = overlay.lines.iter().map(|line| &*line.label).collect();
+        assert_eq!(labels, ["short", "long"]);
+        assert_eq!(overlay.lines[0].points.len(), 32);
+        assert_eq!(overlay.lines[0].points[..2], [(0.0, 0.0), (63.0, 63.0)]);
+        assert_eq!(overlay.lines[1].points[..2], [(0.0, 0.0), (63.0, -63.0)]);
+
+        // Metrics logged by one run are drawn for that run alone.
+        let acc = comparison.overlay("acc", 40).unwrap();
+        assert_eq!((acc.lines.len(), acc.lines[0].run), (1, 1));
+        assert!(comparison.overlay("missing", 40).is_none());
+    }
+
+    #[test]
+    fn test_overlay_follows_growing_runs() {
+        let store = Arc::new(Metrics(MetricStore::new()));
+        store.0.extend("loss", (0..1_000).map(|step| (step, 1.0)), 0);
+        let done = run(&[("loss", 1_000, |step| step as f64)]);
+        let comparison = Comparison::new(vec![("live".into(), store.clone()), ("done".into(), done)]);
+        let before = comparison.overlay("loss", 40).unwrap();
+
+        // Within the same grid only the live run's line is read again.
+        store.0.extend("loss", (1_000..1_200).map(|step| (step, step as f64)), 0);
+        let after = comparison.overlay("loss", 40).unwrap();
+        assert_eq!(after.lines[1], before.lines[1]);
+        assert_eq!(after.lines[0].points.last(), Some(&(1_199.0, 1_199.0)));
+        assert_eq!(after.x_bounds, [0.0, 1_199.0]);
+
+        // Past the grid's last column the grid widens and every line is
+        // reduced onto the new columns.
+        store.0.extend("loss", (1_200..5_000).map(|step| (step, step as f64)), 0);
+        let wider = comparison.overlay("loss", 40).unwrap();
+        assert_eq!(wider.lines[0].points.last(), Some(&(4_999.0, 4_999.0)));
+        assert!(wider.lines[1].points.len() < before.lines[1].points.len());
+        assert_eq!(wider.y_bounds, [0.0, 4_999.0]);
+    }
+
+    /// Overlay one metric from 50 runs of 1M points each:
+    /// `cargo test --release bench_overlay -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_overlay() {
+        const RUNS: usize = 50;
+        const POINTS: u64 = 1_000_000;
+        let runs: Vec<(String, Arc<dyn DataSource>)> = (0..RUNS)
+            .map(|r| {
+                let store = MetricStore::new();
+                // Offset and strided so that chunks do not line up with
+                // columns.
+                let points = (0..POINTS).map(|i| (3 * i + r as u64, (i as f32 * (1.0 + r as f32 / 100.0)).ln_1p() as f64));
+                store.extend("loss", points, 0);
+                (format!("run_{}", r), Arc::new(Metrics(store)) as Arc<dyn DataSource>)
+            })
+            .collect();
+        let comparison = Comparison::new(runs);
+        for columns in [80, 200] {
+            let start = std::time::Instant::now();
+            let overlay = std::hint::black_box(comparison.overlay("loss", columns)).unwrap();
+            let first = start.elapsed();
+            let start = std::time::Instant::now();
+            std::hint::black_box(comparison.overlay("loss", columns));
+            println!(
+                "{} runs x {} points onto {} columns: first frame {:?}, unchanged {:?} ({} lines)",
+                RUNS,
+                POINTS,
+                columns,
+                first,
+                start.elapsed(),
+                overlay.lines.len()
+            );
+        }
+    }
+}
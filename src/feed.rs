@@ -0,0 +1,367 @@
+use std::io;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::Duration;
+
+use chrono::Utc;
+
+use crate::logs::{LogEntry, LogLevel, LogStore};
+use crate::store::{FeedPoint, MetricStore};
+
+/// A consumer of the tracker's change feed, driven by a `Pump` thread.
+pub trait Sink: Send {
+    /// Newly registered metric names; `names[i]` has id `first_id + i`. Always
+    /// called before any point that refers to those ids.
+    fn names(&mut self, first_id: u32, names: &[Arc<str>]) -> io::Result<()>;
+
+    fn points(&mut self, points: &[FeedPoint]) -> io::Result<()>;
+
+    fn logs(&mut self, entries: &[LogEntry]) -> io::Result<()>;
+
+    /// Called at the end of every pump cycle; `closing` is set on the last one.
+    fn flush(&mut self, closing: bool) -> io::Result<()>;
+
+    /// Whether the next cycle should call `snapshot` instead of `points` and
+    /// `logs`.
+    fn wants_snapshot(&self) -> bool {
+        false
+    }
+
+    /// Everything the stores held as of this cycle's drain, which the
+    /// cycle's new points and logs are already part of.
+    fn snapshot(&mut self, _snapshot: &Snapshot) -> io::Result<()> {
+        Ok(())
+    }
+}
+
+/// The contents of a tracker's stores, taken in the same pass that drains the
+/// change feed, so that later cycles carry exactly the points it lacks.
+#[derive(Default)]
+pub struct Snapshot {
+    /// Each series as `(id, steps, values, timestamps_ms)`, laid out as
+    /// `Series::columns` returns them.
+    pub series: Vec<(u32, Vec<u64>, Vec<f64>, Vec<i64>)>,
+    /// Retained log entries, oldest first.
+    pub logs: Vec<LogEntry>,
+}
+
+struct PumpShared {
+    metrics: Arc<MetricStore>,
+    logs: Arc<LogStore>,
+    sinks: Mutex<Sinks>,
+    interval: Duration,
+    stop: AtomicBool,
+    last_error: Mutex<Option<String>>,
+}
+
+#[derive(Default)]
+struct Sinks {
+    sinks: Vec<Box<dyn Sink>>,
+    known_names: usize,
+    points: Vec<FeedPoint>,
+    logs: Vec<LogEntry>,
+}
+
+impl PumpShared {
+    fn cycle(&self, closing: bool) {
+        let mut guard = self.sinks.lock().unwrap();
+        let state = &mut *guard;
+        state.points.clear();
+        state.logs.clear();
+        let wants_snapshot: Vec<bool> = state.sinks.iter().map(|sink| sink.wants_snapshot()).collect();
+        let snapshot = if wants_snapshot.contains(&true) {
+            let mut snapshot = Snapshot::default();
+            self.metrics.drain_feed_with(&mut state.points, |id, series| {
+                let (steps, values, timestamps_ms) = series.columns();
+                snapshot.series.push((id, steps, values, timestamps_ms));
+            });
+            snapshot.logs = self.logs.drain_feed_with_entries(&mut state.logs);
+            Some(snapshot)
+        } else {
+            self.metrics.drain_feed(&mut state.points);
+            self.logs.drain_feed(&mut state.logs);
+            None
+        };
+        // Fetched after draining, so every drained point's id is covered.
+        let names = self.metrics.names_since(state.known_names);
+        let first_id = state.known_names as u32;
+        state.known_names += names.len();
+
+        let (points, logs) = (&state.points, &state.logs);
+        let mut failed = Vec::new();
+        let mut wants_snapshot = wants_snapshot.into_iter();
+        state.sinks.retain_mut(|sink| {
+            let wants_snapshot = wants_snapshot.next().unwrap_or(false);
+            let result = (|| {
+                if !names.is_empty() {
+                    sink.names(first_id, &names)?;
+                }
+                match &snapshot {
+                    Some(snapshot) if wants_snapshot => sink.snapshot(snapshot)?,
+                    _ => {
+                        if !points.is_empty() {
+                            sink.points(points)?;
+                        }
+                        if !logs.is_empty() {
+                            sink.logs(logs)?;
+                        }
+                    }
+                }
+                sink.flush(closing)
+            })();
+            match result {
+                Ok(()) => true,
+                Err(err) => {
+                    *self.last_error.lock().unwrap() = Some(err.to_string());
+                    failed.push(err.to_string());
+                    false
+                }
+            }
+        });
+        if !failed.is_empty() && state.sinks.is_empty() {
+            self.disable_feeds();
+        }
+        drop(guard);
+        // Keeps the spill file current while the run is live; a failed flush
+        // has already stopped spilling.
+        let _ = self.logs.flush_spill();
+        // Shown in the UI right away, rather than only when `close` reports
+        // the last error, and passed to the remaining sinks next cycle.
+        for err in failed {
+            self.logs.push(LogEntry {
+                message: format!("feed: dropped a sink after an error: {}", err),
+                timestamp: Utc::now(),
+                level: LogLevel::Error,
+            });
+        }
+    }
+
+    /// Stop buffering points and entries that no sink will read.
+    fn disable_feeds(&self) {
+        self.metrics.disable_feed();
+        self.logs.disable_feed();
+    }
+
+    fn run(&self) {
+        while !self.stop.load(Ordering::Acquire) {
+            thread::park_timeout(self.interval);
+            self.cycle(false);
+        }
+        self.cycle(true);
+        self.disable_feeds();
+    }
+}
+
+/// Background thread that drains the metric and log change feeds every
+/// `interval` and hands the batches to each registered `Sink`.
+///
+/// Logging threads only pay for copying a point into a per-shard buffer; all
+/// encoding and I/O happens here.
+pub struct Pump {
+    shared: Arc<PumpShared>,
+    thread: Option<JoinHandle<()>>,
+}
+
+impl Pump {
+    pub fn start(metrics: Arc<MetricStore>, logs: Arc<LogStore>, interval: Duration) -> Self {
+        metrics.enable_feed();
+        logs.enable_feed();
+        let shared = Arc::new(PumpShared {
+            metrics,
+            logs,
+            sinks: Mutex::new(Sinks::default()),
+            interval,
+            stop: AtomicBool::new(false),
+            last_error: Mutex::new(None),
+        });
+        let thread = {
+            let shared = shared.clone();
+            thread::Builder::new()
+                .name("clog-feed".into())
+                .spawn(move || shared.run())
+                .expect("failed to spawn clog feed thread")
+        };
+        Pump {
+            shared,
+            thread: Some(thread),
+        }
+    }
+
+    /// Register a sink. It is first told about every name known so far, so it
+    /// can resolve ids of points logged before it was added.
+    pub fn add_sink(&self, mut sink: Box<dyn Sink>) -> io::Result<()> {
+        let mut state = self.shared.sinks.lock().unwrap();
+        // The feeds are turned off once every sink has failed.
+        self.shared.metrics.enable_feed();
+        self.shared.logs.enable_feed();
+        let names = self.shared.metrics.names();
+        let known = &names[..state.known_names];
+        if !known.is_empty() {
+            sink.names(0, known)?;
+        }
+        state.sinks.push(sink);
+        Ok(())
+    }
+
+    /// Run a cycle now on the calling thread, so that a sink just added gets
+    /// its first batch, or its snapshot, without waiting for the interval.
+    pub fn cycle(&self) {
+        self.shared.cycle(false);
+    }
+
+    /// The error that made the pump drop a sink, if any.
+    pub fn last_error(&self) -> Option<String> {
+        self.shared.last_error.lock().unwrap().clone()
+    }
+
+    /// Drain the feeds and flush every sink, then stop the thread.
+    pub fn close(mut self) -> Option<String> {
+        self.stop();
+        self.last_error()
+    }
+
+    fn stop(&mut self) {
+        self.shared.stop.store(true, Ordering::Release);
+        if let Some(thread) = self.thread.take() {
+            thread.thread().unpark();
+            let _ = thread.join();
+        }
+    }
+}
+
+impl Drop for Pump {
+    fn drop(&mut self) {
+        self.stop();
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::logs::LogFilter;
+
+    #[derive(Default)]
+    struct Recorded {
+        names: Vec<(u32, String)>,
+        points: Vec<FeedPoint>,
+        logs: Vec<String>,
+        closed: bool,
+    }
+
+    struct Recorder(Arc<Mutex<Recorded>>);
+
+    impl Sink for Recorder {
+        fn names(&mut self, first_id: u32, names: &[Arc<str>]) -> io::Result<()> {
+            let mut recorded = self.0.lock().unwrap();
+            for (i, name) in names.iter().enumerate() {
+                recorded.names.push((first_id + i as u32, name.to_string()));
+            }
+            Ok(())
+        }
+
+        fn points(&mut self, points: &[FeedPoint]) -> io::Result<()> {
+            self.0.lock().unwrap().points.extend_from_slice(points);
+            Ok(())
+        }
+
+        fn logs(&mut self, entries: &[LogEntry]) -> io::Result<()> {
+            let mut recorded = self.0.lock().unwrap();
+            recorded.logs.extend(entries.iter().map(|entry| entry.message.clone()));
+            Ok(())
+        }
+
+        fn flush(&mut self, closing: bool) -> io::Result<()> {
+            self.0.lock().unwrap().closed |= closing;
+            Ok(())
+        }
+    }
+
+    #[test]
+    fn test_pump_delivers_everything_before_closing() {
+        let metrics = Arc::new(MetricStore::new());
+        let logs = Arc::new(LogStore::new(None));
+        let pump = Pump::start(metrics.clone(), logs.clone(), Duration::from_millis(5));
+        let recorded = Arc::new(Mutex::new(Recorded::default()));
+        pump.add_sink(Box::new(Recorder(recorded.clone()))).unwrap();
+
+        for step in 0..1_000 {
+            metrics.push("loss", step as f64, step, 0);
+            if step == 500 {
+                metrics.push("late_metric", 1.0, step, 0);
+            }
+        }
+        logs.push(LogEntry {
+            message: "done".to_string(),
+            timestamp: Utc::now(),
+            level: crate::logs::LogLevel::Info,
+        });
+        assert!(pump.close().is_none());
+
+        let recorded = recorded.lock().unwrap();
+        assert_eq!(
+            recorded.names,
+            vec![(0, "loss".to_string()), (1, "late_metric".to_string())]
+        );
+        assert_eq!(recorded.points.len(), 1_001);
+        assert_eq!(recorded.logs, vec!["done".to_string()]);
+        assert!(recorded.closed);
+    }
+
+    struct Failing;
+
+    impl Sink for Failing {
+        fn names(&mut self, _first_id: u32, _names: &[Arc<str>]) -> io::Result<()> {
+            Ok(())
+        }
+
+        fn points(&mut self, _points: &[FeedPoint]) -> io::Result<()> {
+            Err(io::Error::other("disk full"))
+        }
+
+        fn logs(&mut self, _entries: &[LogEntry]) -> io::Result<()> {
+            Ok(())
+        }
+
+        fn flush(&mut self, _closing: bool) -> io::Result<()> {
+            Ok(())
+        }
+    }
+
+    #[test]
+    fn test_failed_sink_is_reported_and_stops_the_feed() {
+        let metrics = Arc::new(MetricStore::new());
+        let logs = Arc::new(LogStore::new(None));
+        let pump = Pump::start(metrics.clone(), logs.clone(), Duration::from_secs(3600));
+        pump.add_sink(Box::new(Failing)).unwrap();
+        metrics.push("loss", 1.0, 0, 0);
+        pump.cycle();
+
+        let lines = logs.recent(usize::MAX, &LogFilter::default());
+        assert_eq!(lines.len(), 1);
+        assert_eq!(lines[0].message(), "feed: dropped a sink after an error: disk full");
+        metrics.push("loss", 2.0, 1, 0);
+        let mut feed = Vec::new();
+        metrics.drain_feed(&mut feed);
+        assert!(feed.is_empty());
+        assert_eq!(pump.close().as_deref(), Some("disk full"));
+    }
+
+    #[test]
+    fn test_late_sink_learns_existing_names() {
+        let metrics = Arc::new(MetricStore::new());
+        let logs = Arc::new(LogStore::new(None));
+        let pump = Pump::start(metrics.clone(), logs, Duration::from_millis(1));
+        metrics.push("early", 1.0, 0, 0);
+        thread::sleep(Duration::from_millis(20));
+
+        let recorded = Arc::new(Mutex::new(Recorded::default()));
+        pump.add_sink(Box::new(Recorder(recorded.clone()))).unwrap();
+        metrics.push("early", 2.0, 1, 0);
+        pump.close();
+
+        let recorded = recorded.lock().unwrap();
+        assert_eq!(recorded.names, vec![(0, "early".to_string())]);
+        assert_eq!(recorded.points.len(), 1);
+    }
+}
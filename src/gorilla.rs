@@ -0,0 +1,400 @@
+//! Gorilla compression of sealed series chunks: delta-of-delta steps and
+//! timestamps, and XOR-encoded values, packed into 64-bit words.
+
+/// Appends values of up to 64 bits, most significant bit first.
+struct BitWriter {
+    words: Vec<u64>,
+    /// Bits used in the last word.
+    used: u32,
+}
+
+impl BitWriter {
+    fn new() -> Self {
+        BitWriter {
+            words: Vec::new(),
+            used: 64,
+        }
+    }
+
+    /// Write the low `bits` bits of `value`; `bits` is 1 to 64.
+    fn write(&mut self, value: u64, bits: u32) {
+        let value = if bits == 64 { value } else { value & ((1 << bits) - 1) };
+        if self.used == 64 {
+            self.words.push(0);
+            self.used = 0;
+        }
+        let free = 64 - self.used;
+        let last = self.words.last_mut().unwrap();
+        if bits <= free {
+            *last |= value << (free - bits);
+            self.used += bits;
+        } else {
+            let spill = bits - free;
+            *last |= value >> spill;
+            self.words.push(value << (64 - spill));
+            self.used = spill;
+        }
+    }
+
+    fn finish(self) -> Box<[u64]> {
+        self.words.into_boxed_slice()
+    }
+}
+
+struct BitReader<'a> {
+    words: &'a [u64],
+    position: usize,
+}
+
+impl BitReader<'_> {
+    /// The next 64 bits, zero-padded past the end, without consuming them.
+    #[inline]
+    fn peek(&self) -> u64 {
+        let word = self.position / 64;
+        let offset = self.position % 64;
+        let high = self.words.get(word).map_or(0, |&word| word << offset);
+        if offset == 0 {
+            high
+        } else {
+            high | self.words.get(word + 1).map_or(0, |&word| word >> (64 - offset))
+        }
+    }
+
+    #[inline]
+    fn skip(&mut self, bits: u32) {
+        self.position += bits as usize;
+    }
+
+    /// Read `bits` bits, 1 to 64.
+    #[inline]
+    fn read(&mut self, bits: u32) -> u64 {
+        let value = self.peek() >> (64 - bits);
+        self.skip(bits);
+        value
+    }
+}
+
+/// Delta-of-deltas within these ranges take 1, 9, 12 or 16 bits; anything
+/// else takes 68.
+fn write_dod(writer: &mut BitWriter, dod: i64) {
+    match dod {
+        0 => writer.write(0b0, 1),
+        -63..=64 => {
+            writer.write(0b10, 2);
+            writer.write((dod + 63) as u64, 7);
+        }
+        -255..=256 => {
+            writer.write(0b110, 3);
+            writer.write((dod + 255) as u64, 9);
+        }
+        -2047..=2048 => {
+            writer.write(0b1110, 4);
+            writer.write((dod + 2047) as u64, 12);
+        }
+        _ => {
+            writer.write(0b1111, 4);
+            writer.write(dod as u64, 64);
+        }
+    }
+}
+
+/// Decode a delta-of-delta written by `write_dod` from the top of `window`,
+/// with the number of bits it took; `None` for the 68-bit form.
+#[inline]
+fn dod_from(window: u64) -> Option<(i64, u32)> {
+    match window.leading_ones() {
+        0 => Some((0, 1)),
+        1 => Some((((window << 2) >> 57) as i64 - 63, 9)),
+        2 => Some((((window << 3) >> 55) as i64 - 255, 12)),
+        3 => Some((((window << 4) >> 52) as i64 - 2047, 16)),
+        _ => None,
+    }
+}
+
+#[inline]
+fn read_dod(reader: &mut BitReader) -> i64 {
+    match dod_from(reader.peek()) {
+        Some((dod, bits)) => {
+            reader.skip(bits);
+            dod
+        }
+        None => {
+            reader.skip(4);
+            reader.read(64) as i64
+        }
+    }
+}
+
+/// Running state of one delta-of-delta column.
+#[derive(Clone, Copy, Default)]
+struct Deltas {
+    previous: u64,
+    delta: u64,
+}
+
+impl Deltas {
+    /// The delta-of-delta of `next`, in wrapping arithmetic so any `u64` or
+    /// `i64` sequence round-trips.
+    fn dod(&mut self, next: u64) -> i64 {
+        let delta = next.wrapping_sub(self.previous);
+        let dod = delta.wrapping_sub(self.delta) as i64;
+        (self.previous, self.delta) = (next, delta);
+        dod
+    }
+
+    #[inline]
+    fn apply(&mut self, dod: i64) -> u64 {
+        self.delta = self.delta.wrapping_add(dod as u64);
+        self.previous = self.previous.wrapping_add(self.delta);
+        self.previous
+    }
+}
+
+/// Running state of the XOR-encoded value column: the previous value's bits
+/// and the window of meaningful bits last written.
+#[derive(Clone, Copy)]
+struct Xor {
+    previous: u64,
+    leading: u32,
+    trailing: u32,
+}
+
+impl Default for Xor {
+    fn default() -> Self {
+        // No window yet: the first non-zero XOR always writes its own.
+        Xor {
+            previous: 0,
+            leading: u32::MAX,
+            trailing: 0,
+        }
+    }
+}
+
+impl Xor {
+    fn write(&mut self, writer: &mut BitWriter, value: f64) {
+        let bits = value.to_bits();
+        let xor = bits ^ self.previous;
+        self.previous = bits;
+        if xor == 0 {
+            writer.write(0b0, 1);
+            return;
+        }
+        // Leading zeros are stored in 5 bits.
+        let leading = xor.leading_zeros().min(31);
+        let trailing = xor.trailing_zeros();
+        if leading >= self.leading && trailing >= self.trailing {
+            writer.write(0b10, 2);
+            writer.write(xor >> self.trailing, 64 - self.leading - self.trailing);
+        } else {
+            let meaningful = 64 - leading - trailing;
+            writer.write(0b11, 2);
+            writer.write(leading as u64, 5);
+            writer.write((meaningful - 1) as u64, 6);
+            writer.write(xor >> trailing, meaningful);
+            (self.leading, self.trailing) = (leading, trailing);
+        }
+    }
+
+    /// Read the next value, given the reader's next `available` bits in
+    /// `window`; at least the 13 bits of a header must be available.
+    #[inline]
+    fn read(&mut self, reader: &mut BitReader, window: u64, available: u32) -> f64 {
+        let header = match window >> 62 {
+            0 | 1 => {
+                reader.skip(1);
+                return f64::from_bits(self.previous);
+            }
+            2 => 2,
+            _ => {
+                self.leading = ((window << 2) >> 59) as u32;
+                let meaningful = ((window << 7) >> 58) as u32 + 1;
+                self.trailing = 64 - self.leading - meaningful;
+                13
+            }
+        };
+        let meaningful = 64 - self.leading - self.trailing;
+        let xor = if header + meaningful <= available {
+            reader.skip(header + meaningful);
+            (window << header) >> (64 - meaningful)
+        } else {
+            reader.skip(header);
+            reader.read(meaningful)
+        };
+        self.previous ^= xor << self.trailing;
+        f64::from_bits(self.previous)
+    }
+}
+
+/// Compress parallel columns of points, which must have the same length.
+pub fn encode(steps: &[u64], values: &[f64], timestamps_ms: &[i64]) -> Box<[u64]> {
+    let mut writer = BitWriter::new();
+    let (mut step_deltas, mut ts_deltas, mut xor) = (Deltas::default(), Deltas::default(), Xor::default());
+    for ((&step, &value), &timestamp_ms) in steps.iter().zip(values).zip(timestamps_ms) {
+        write_dod(&mut writer, step_deltas.dod(step));
+        write_dod(&mut writer, ts_deltas.dod(timestamp_ms as u64));
+        xor.write(&mut writer, value);
+    }
+    writer.finish()
+}
+
+/// Iterates over the `(step, value, timestamp_ms)` points of an encoded
+/// chunk, in the order they were encoded.
+pub struct Decoder<'a> {
+    reader: BitReader<'a>,
+    remaining: usize,
+    steps: Deltas,
+    timestamps: Deltas,
+    xor: Xor,
+}
+
+impl<'a> Decoder<'a> {
+    /// Decode the `len` points held in `words`.
+    pub fn new(words: &'a [u64], len: usize) -> Self {
+        Decoder {
+            reader: BitReader { words, position: 0 },
+            remaining: len,
+            steps: Deltas::default(),
+            timestamps: Deltas::default(),
+            xor: Xor::default(),
+        }
+    }
+}
+
+impl Iterator for Decoder<'_> {
+    type Item = (u64, f64, i64);
+
+    #[inline]
+    fn next(&mut self) -> Option<Self::Item> {
+        if self.remaining == 0 {
+            return None;
+        }
+        self.remaining -= 1;
+        // Both deltas and most values of a regular series fit in one peek.
+        let window = self.reader.peek();
+        let (step_dod, ts_dod, used) = match dod_from(window) {
+            Some((step_dod, step_bits)) => match dod_from(window << step_bits) {
+                Some((ts_dod, ts_bits)) => (step_dod, ts_dod, step_bits + ts_bits),
+                None => {
+                    self.reader.skip(step_bits);
+                    (step_dod, read_dod(&mut self.reader), 64)
+                }
+            },
+            None => (read_dod(&mut self.reader), read_dod(&mut self.reader), 64),
+        };
+        let value = if used < 64 {
+            self.reader.skip(used);
+            self.xor.read(&mut self.reader, window << used, 64 - used)
+        } else {
+            let window = self.reader.peek();
+            self.xor.read(&mut self.reader, window, 64)
+        };
+        let step = self.steps.apply(step_dod);
+        let timestamp_ms = self.timestamps.apply(ts_dod) as i64;
+        Some((step, value, timestamp_ms))
+    }
+
+    fn size_hint(&self) -> (usize, Option<usize>) {
+        (self.remaining, Some(self.remaining))
+    }
+}
+
+impl ExactSizeIterator for Decoder<'_> {}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::time::Instant;
+
+    fn round_trip(points: &[(u64, f64, i64)]) -> usize {
+        let steps: Vec<u64> = points.iter().map(|point| point.0).collect();
+        let values: Vec<f64> = points.iter().map(|point| point.1).collect();
+        let timestamps: Vec<i64> = points.iter().map(|point| point.2).collect();
+        let words = encode(&steps, &values, &timestamps);
+        let decoded: Vec<(u64, f64, i64)> = Decoder::new(&words, points.len()).collect();
+        assert_eq!(decoded.len(), points.len());
+        for (decoded, point) in decoded.iter().zip(points) {
+            // Compare bits so NaNs and signed zeros count.
+            assert_eq!((decoded.0, decoded.1.to_bits(), decoded.2), (point.0, point.1.to_bits(), point.2));
+        }
+        words.len() * 8
+    }
+
+    #[test]
+    fn test_round_trips_any_points() {
+        let mut points = vec![
+            (0, 0.0, 0),
+            (u64::MAX, -0.0, i64::MIN),
+            (1, f64::NAN, i64::MAX),
+            (1, f64::INFINITY, -1),
+            (2, f64::MIN_POSITIVE, 1_700_000_000_000),
+            (1_000_000, f64::MAX, 1_700_000_000_001),
+        ];
+        // Deltas of every encoded width, and values sharing more or fewer
+        // bits with their predecessor.
+        let mut state = 0x9e37_79b9_7f4a_7c15u64;
+        for i in 0..5_000u64 {
+            state ^= state << 13;
+            state ^= state >> 7;
+            state ^= state << 17;
+            let (last_step, _, last_ms) = *points.last().unwrap();
+            let jump = [1, 2, 70, 300, 3_000, 1 << 40][(state % 6) as usize];
+            let value = match i % 4 {
+                0 => 1.0 / (i + 1) as f64,
+                1 => (state as f32) as f64,
+                2 => f64::from_bits(state),
+                _ => 0.5,
+            };
+            points.push((last_step.wrapping_add(jump), value, last_ms.wrapping_add((state % 2_000) as i64)));
+        }
+        round_trip(&points);
+        round_trip(&points[..1]);
+        assert!(Decoder::new(&[], 0).next().is_none());
+    }
+
+    #[test]
+    fn test_smooth_series_compress() {
+        // A constant learning rate, logged every 250 ms with a little jitter.
+        let points: Vec<(u64, f64, i64)> =
+            (0..1_024u64).map(|step| (step, 1e-3, 1_700_000_000_000 + step as i64 * 250 + (step % 3) as i64)).collect();
+        let bytes = round_trip(&points);
+        // At least 10x smaller than the 20 raw bytes per point.
+        assert!(bytes * 10 < points.len() * 20, "{} bytes", bytes);
+    }
+
+    /// Bytes per point and decode throughput for typical metric shapes:
+    /// `cargo test --release bench_gorilla -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_gorilla() {
+        let shapes: [(&str, fn(u64) -> f64); 4] = [
+            ("constant lr", |_| 1e-3),
+            ("step-decayed lr", |step| 0.1 * 0.5f64.powi((step / 30_000) as i32)),
+            ("float32 loss", |step| (2.0 / (1.0 + step as f64 / 1_000.0) + 0.01 * (step as f64).sin()) as f32 as f64),
+            ("float64 loss", |step| 2.0 / (1.0 + step as f64 / 1_000.0) + 0.01 * (step as f64).sin()),
+        ];
+        let len = 1_024u64;
+        for (label, value_at) in shapes {
+            let mut bytes = 0;
+            let mut decoded = 0usize;
+            let mut decode_time = std::time::Duration::ZERO;
+            for chunk in 0..100u64 {
+                let steps: Vec<u64> = (chunk * len..(chunk + 1) * len).collect();
+                let values: Vec<f64> = steps.iter().map(|&step| value_at(step)).collect();
+                let timestamps: Vec<i64> = steps.iter().map(|&step| 1_700_000_000_000 + step as i64 * 50).collect();
+                let words = encode(&steps, &values, &timestamps);
+                bytes += words.len() * 8;
+                let start = Instant::now();
+                for _ in 0..20 {
+                    decoded += std::hint::black_box(Decoder::new(&words, len as usize)).count();
+                }
+                decode_time += start.elapsed();
+            }
+            println!(
+                "{:>16}: {:5.2} bytes per point (raw 20), decode {:6.1} M points/s",
+                label,
+                bytes as f64 / (100 * len) as f64,
+                decoded as f64 / decode_time.as_secs_f64() / 1e6
+            );
+        }
+    }
+}
@@ -0,0 +1,772 @@
+//! Read-only HTTP access to a running tracker, for viewers that cannot share
+//! its terminal, such as a training job on a cluster node.
+//!
+//! `GET /deltas?after=N` returns what the tracker recorded after cursor `N`
+//! as the records of a run file (see `persist`), with the cursor to ask for
+//! next in the `X-Clog-Cursor` header. The stream starts with a snapshot of
+//! everything the tracker held when serving started, followed by one batch of
+//! new names, blocks and log entries per pump cycle. The server keeps only a
+//! bounded tail of it: once the batches outgrow `buffer_bytes` (or the
+//! snapshot, if larger), a fresh snapshot replaces them. A request without a
+//! cursor, or with one the buffer no longer reaches, gets the latest snapshot
+//! and everything after it, marked with `X-Clog-Reset: 1`. With `wait=MS` a
+//! request that is already up to date is held until new data arrives or the
+//! wait runs out, so viewers long-poll rather than spin.
+//!
+//! `GET /metrics` is an OpenMetrics scrape of each metric's last value, its
+//! last step and the number of points logged.
+//!
+//! `Attachment` is the matching viewer: it follows a server's deltas into a
+//! local tracker's stores, which `clog attach` shows in the terminal UI.
+
+use std::collections::HashMap;
+use std::fmt::Write as _;
+use std::io::{self, BufRead, BufReader, Read, Write};
+use std::net::{Shutdown, TcpStream};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::Duration;
+
+use chrono::{DateTime, Utc};
+use tokio::io::{AsyncBufReadExt, AsyncReadExt, AsyncWriteExt};
+use tokio::net::TcpListener;
+use tokio::runtime::Runtime;
+use tokio::sync::watch;
+
+use crate::feed::{Pump, Sink, Snapshot};
+use crate::logs::{LogEntry, LogLevel, LogStore};
+use crate::persist::{self, PendingBlock, Record, RecordWriter, RECORD_HEADER_LEN};
+use crate::series::Series;
+use crate::store::{FeedPoint, MetricStore};
+
+/// Default bound on the batches kept after the latest snapshot.
+pub const DEFAULT_BUFFER_BYTES: usize = 64 << 20;
+
+/// Longest a request may wait for new deltas.
+const MAX_WAIT: Duration = Duration::from_secs(30);
+
+/// How long an attached viewer asks the server to hold each request.
+const ATTACH_WAIT_MS: u64 = 1_000;
+
+/// Points per block when writing out a snapshot.
+const SNAPSHOT_BLOCK_POINTS: usize = 1 << 16;
+
+/// Longest request line or header a server accepts.
+const MAX_LINE_LEN: u64 = 8 << 10;
+
+/// Largest response an attached viewer accepts.
+const MAX_BODY_LEN: usize = 1 << 30;
+
+/// The delta stream as far back as the server still holds it.
+struct DeltaLog {
+    /// Cursor of `bytes[0]`, where the latest snapshot starts.
+    base: u64,
+    /// The latest snapshot, then every batch since.
+    bytes: Vec<u8>,
+    snapshot_len: usize,
+}
+
+struct Shared {
+    log: Mutex<DeltaLog>,
+    /// Cursor just past the end of the stream, sent after every batch.
+    end: watch::Sender<u64>,
+    wants_snapshot: AtomicBool,
+    buffer_bytes: usize,
+    metrics: Arc<MetricStore>,
+}
+
+struct Response {
+    status: &'static str,
+    content_type: &'static str,
+    headers: Vec<(&'static str, String)>,
+    body: Vec<u8>,
+}
+
+impl Response {
+    fn text(status: &'static str, body: &str) -> Self {
+        Response {
+            status,
+            content_type: "text/plain; charset=utf-8",
+            headers: Vec::new(),
+            body: body.as_bytes().to_vec(),
+        }
+    }
+}
+
+/// The value of `key` in a query string such as `after=10&wait=500`.
+fn query_param<'a>(query: &'a str, key: &str) -> Option<&'a str> {
+    query
+        .split('&')
+        .filter_map(|pair| pair.split_once('='))
+        .find_map(|(k, v)| (k == key).then_some(v))
+}
+
+/// A sample value as OpenMetrics spells it.
+fn openmetrics_number(value: f64) -> String {
+    if value.is_nan() {
+        "NaN".to_string()
+    } else if value == f64::INFINITY {
+        "+Inf".to_string()
+    } else if value == f64::NEG_INFINITY {
+        "-Inf".to_string()
+    } else {
+        value.to_string()
+    }
+}
+
+/// Each metric's last value, last step and point count, labelled by name.
+fn openmetrics(metrics: &MetricStore) -> String {
+    let families = [
+        ("clog_value", "gauge", "Last value logged for the metric."),
+        ("clog_step", "gauge", "Highest step logged for the metric."),
+        ("clog_points", "counter", "Points logged for the metric."),
+    ];
+    let mut samples = [String::new(), String::new(), String::new()];
+    for name in metrics.names() {
+        let read = |series: &Series| Some((series.last_value()?, series.last_step()?, series.total_count()));
+        let Some((value, step, count)) = metrics.with_series(&name, read).flatten() else {
+            continue;
+        };
+        let label = name.replace('\\', "\\\\").replace('"', "\\\"").replace('\n', "\\n");
+        let _ = writeln!(samples[0], "clog_value{{metric=\"{}\"}} {}", label, openmetrics_number(value));
+        let _ = writeln!(samples[1], "clog_step{{metric=\"{}\"}} {}", label, step);
+        let _ = writeln!(samples[2], "clog_points_total{{metric=\"{}\"}} {}", label, count);
+    }
+    let mut text = String::new();
+    for ((family, kind, help), samples) in families.iter().zip(&samples) {
+        let _ = write!(text, "# TYPE {} {}\n# HELP {} {}\n{}", family, kind, family, help, samples);
+    }
+    text.push_str("# EOF\n");
+    text
+}
+
+impl Shared {
+    /// The stream after `after` as `(reset, end, bytes)`; the whole buffer,
+    /// with `reset` set, if `after` is missing or out of reach.
+    fn read(&self, after: Option<u64>) -> (bool, u64, Vec<u8>) {
+        let log = self.log.lock().unwrap();
+        let end = log.base + log.bytes.len() as u64;
+        match after {
+            Some(after) if (log.base + log.snapshot_len as u64..=end).contains(&after) => {
+                (false, end, log.bytes[(after - log.base) as usize..].to_vec())
+            }
+            _ => (true, end, log.bytes.clone()),
+        }
+    }
+
+    async fn deltas(&self, query: &str) -> Response {
+        let after = query_param(query, "after").and_then(|after| after.parse().ok());
+        let wait = query_param(query, "wait")
+            .and_then(|wait| wait.parse().ok())
+            .map_or(Duration::ZERO, Duration::from_millis)
+            .min(MAX_WAIT);
+        // Subscribed before reading, so a batch that lands in between still
+        // wakes the wait below.
+        let mut changes = self.end.subscribe();
+        let (mut reset, mut end, mut body) = self.read(after);
+        if !reset && body.is_empty() && !wait.is_zero() {
+            let known = end;
+            let _ = tokio::time::timeout(wait, changes.wait_for(|&end| end != known)).await;
+            (reset, end, body) = self.read(after);
+        }
+        Response {
+            status: "200 OK",
+            content_type: "application/octet-stream",
+            headers: vec![
+                ("X-Clog-Cursor", end.to_string()),
+                ("X-Clog-Reset", (reset as u8).to_string()),
+            ],
+            body,
+        }
+    }
+
+    async fn respond(&self, request_line: &str) -> Response {
+        let mut parts = request_line.split_whitespace();
+        let (Some(method), Some(target)) = (parts.next(), parts.next()) else {
+            return Response::text("400 Bad Request", "malformed request\n");
+        };
+        if method != "GET" {
+            return Response::text("405 Method Not Allowed", "only GET is supported\n");
+        }
+        let (path, query) = target.split_once('?').unwrap_or((target, ""));
+        match path {
+            "/deltas" => self.deltas(query).await,
+            "/metrics" => Response {
+                status: "200 OK",
+                content_type: "application/openmetrics-text; version=1.0.0; charset=utf-8",
+                headers: Vec::new(),
+                body: openmetrics(&self.metrics).into_bytes(),
+            },
+            _ => Response::text("404 Not Found", "try /deltas or /metrics\n"),
+        }
+    }
+
+    /// Answer requests on one keep-alive connection until the client closes
+    /// it or asks to.
+    async fn serve(&self, stream: tokio::net::TcpStream) -> io::Result<()> {
+        let (reader, mut writer) = stream.into_split();
+        let mut reader = tokio::io::BufReader::new(reader);
+        let mut line = String::new();
+        loop {
+            line.clear();
+            if (&mut reader).take(MAX_LINE_LEN).read_line(&mut line).await? == 0 || !line.ends_with('\n') {
+                return Ok(());
+            }
+            let request_line = line.trim_end().to_string();
+            let mut close = request_line.ends_with("HTTP/1.0");
+            loop {
+                line.clear();
+                if (&mut reader).take(MAX_LINE_LEN).read_line(&mut line).await? == 0 || !line.ends_with('\n') {
+                    return Ok(());
+                }
+                let header = line.trim_end();
+                if header.is_empty() {
+                    break;
+                }
+                if let Some((key, value)) = header.split_once(':') {
+                    if key.eq_ignore_ascii_case("connection") && value.trim().eq_ignore_ascii_case("close") {
+                        close = true;
+                    }
+                }
+            }
+
+            let response = self.respond(&request_line).await;
+            let mut head = format!(
+                "HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n",
+                response.status,
+                response.content_type,
+                response.body.len()
+            );
+            for (key, value) in &response.headers {
+                let _ = write!(head, "{}: {}\r\n", key, value);
+            }
+            head.push_str(if close { "Connection: close\r\n\r\n" } else { "\r\n" });
+            writer.write_all(head.as_bytes()).await?;
+            writer.write_all(&response.body).await?;
+            writer.flush().await?;
+            if close {
+                return Ok(());
+            }
+        }
+    }
+}
+
+/// Turns the change feed into the delta stream a `HttpServer` serves.
+struct DeltaSink {
+    shared: Arc<Shared>,
+    /// Every name so far by id, for writing snapshots.
+    names: Vec<Arc<str>>,
+    /// The batch being assembled this cycle.
+    writer: RecordWriter<Vec<u8>>,
+    pending: Vec<PendingBlock>,
+    /// Set when `writer` holds a snapshot rather than a batch.
+    snapshot: bool,
+}
+
+impl Sink for DeltaSink {
+    fn names(&mut self, first_id: u32, names: &[Arc<str>]) -> io::Result<()> {
+        for (i, name) in names.iter().enumerate() {
+            let id = first_id + i as u32;
+            if id as usize >= self.names.len() {
+                self.names.resize(id as usize + 1, Arc::from(""));
+            }
+            self.names[id as usize] = name.clone();
+            self.writer.write_name(id, name)?;
+        }
+        Ok(())
+    }
+
+    fn points(&mut self, points: &[FeedPoint]) -> io::Result<()> {
+        for point in points {
+            persist::group_points(&mut self.pending, point);
+        }
+        Ok(())
+    }
+
+    fn logs(&mut self, entries: &[LogEntry]) -> io::Result<()> {
+        entries.iter().try_for_each(|entry| self.writer.write_log(entry))
+    }
+
+    fn wants_snapshot(&self) -> bool {
+        self.shared.wants_snapshot.load(Ordering::Relaxed)
+    }
+
+    // Replaces whatever this cycle wrote so far, including its new names.
+    fn snapshot(&mut self, snapshot: &Snapshot) -> io::Result<()> {
+        self.writer.get_mut().clear();
+        for (id, name) in self.names.iter().enumerate() {
+            self.writer.write_name(id as u32, name)?;
+        }
+        for (id, steps, values, timestamps_ms) in &snapshot.series {
+            for start in (0..steps.len()).step_by(SNAPSHOT_BLOCK_POINTS) {
+                let end = steps.len().min(start + SNAPSHOT_BLOCK_POINTS);
+                self.writer
+                    .write_block(*id, &steps[start..end], &values[start..end], &timestamps_ms[start..end])?;
+            }
+        }
+        for entry in &snapshot.logs {
+            self.writer.write_log(entry)?;
+        }
+        self.snapshot = true;
+        Ok(())
+    }
+
+    fn flush(&mut self, _closing: bool) -> io::Result<()> {
+        for (id, block) in self.pending.iter_mut().enumerate() {
+            block.write_to(&mut self.writer, id as u32)?;
+        }
+        let batch = self.writer.get_mut();
+        if batch.is_empty() && !self.snapshot {
+            return Ok(());
+        }
+        let end = {
+            let mut log = self.shared.log.lock().unwrap();
+            if std::mem::take(&mut self.snapshot) {
+                log.base += log.bytes.len() as u64;
+                log.bytes.clear();
+                log.snapshot_len = batch.len();
+                self.shared.wants_snapshot.store(false, Ordering::Relaxed);
+            }
+            log.bytes.extend_from_slice(batch);
+            // Rebuilding the snapshot costs about as much as writing it, so
+            // the batches may grow as large as it before they are dropped.
+            if log.bytes.len() - log.snapshot_len > self.shared.buffer_bytes.max(log.snapshot_len) {
+                self.shared.wants_snapshot.store(true, Ordering::Relaxed);
+            }
+            log.base + log.bytes.len() as u64
+        };
+        batch.clear();
+        self.shared.end.send_replace(end);
+        Ok(())
+    }
+}
+
+/// Serves a tracker's delta stream and an OpenMetrics scrape over HTTP on a
+/// small tokio runtime.
+pub struct HttpServer {
+    runtime: Option<Runtime>,
+    address: String,
+}
+
+impl HttpServer {
+    /// Listen on `address` (`host:port`), fed by `pump`. The first snapshot
+    /// is taken before this returns, so the first request already sees
+    /// everything logged so far.
+    pub fn start(address: &str, metrics: Arc<MetricStore>, pump: &Pump, buffer_bytes: usize) -> io::Result<Self> {
+        let shared = Arc::new(Shared {
+            log: Mutex::new(DeltaLog {
+                base: 0,
+                bytes: Vec::new(),
+                snapshot_len: 0,
+            }),
+            end: watch::Sender::new(0),
+            wants_snapshot: AtomicBool::new(true),
+            buffer_bytes,
+            metrics,
+        });
+        pump.add_sink(Box::new(DeltaSink {
+            shared: shared.clone(),
+            names: Vec::new(),
+            writer: RecordWriter::new(Vec::new()),
+            pending: Vec::new(),
+            snapshot: false,
+        }))?;
+        pump.cycle();
+
+        let runtime = tokio::runtime::Builder::new_multi_thread()
+            .enable_all()
+            .thread_name("clog-http")
+            .build()?;
+        let listener = runtime.block_on(TcpListener::bind(address))?;
+        let address = listener.local_addr()?.to_string();
+        runtime.spawn(async move {
+            while let Ok((stream, _)) = listener.accept().await {
+                let _ = stream.set_nodelay(true);
+                let shared = shared.clone();
+                tokio::spawn(async move { shared.serve(stream).await });
+            }
+        });
+        Ok(HttpServer {
+            runtime: Some(runtime),
+            address,
+        })
+    }
+
+    /// The address viewers should use, with the actual port if `:0` was
+    /// asked for.
+    pub fn address(&self) -> &str {
+        &self.address
+    }
+}
+
+impl Drop for HttpServer {
+    fn drop(&mut self) {
+        if let Some(runtime) = self.runtime.take() {
+            runtime.shutdown_background();
+        }
+    }
+}
+
+/// One long-poll of `/deltas` on a keep-alive connection, as `(reset,
+/// cursor, body)`.
+fn poll_deltas(stream: &mut BufReader<TcpStream>, host: &str, cursor: Option<u64>) -> io::Result<(bool, u64, Vec<u8>)> {
+    let after = cursor.map_or_else(String::new, |cursor| format!("after={}&", cursor));
+    let request = format!("GET /deltas?{}wait={} HTTP/1.1\r\nHost: {}\r\n\r\n", after, ATTACH_WAIT_MS, host);
+    stream.get_mut().write_all(request.as_bytes())?;
+
+    let invalid = |message: &str| io::Error::new(io::ErrorKind::InvalidData, message.to_string());
+    let mut line = String::new();
+    stream.read_line(&mut line)?;
+    if line.split_whitespace().nth(1) != Some("200") {
+        return Err(invalid(&format!("unexpected response {:?}", line.trim_end())));
+    }
+    let mut headers = HashMap::new();
+    loop {
+        line.clear();
+        if stream.read_line(&mut line)? == 0 {
+            return Err(io::ErrorKind::UnexpectedEof.into());
+        }
+        match line.trim_end().split_once(':') {
+            Some((key, value)) => headers.insert(key.to_ascii_lowercase(), value.trim().to_string()),
+            None => break,
+        };
+    }
+    let header = |key: &str| headers.get(key).and_then(|value| value.parse::<u64>().ok());
+    let (Some(len), Some(cursor)) = (header("content-length"), header("x-clog-cursor")) else {
+        return Err(invalid("response without a length or cursor"));
+    };
+    if len as usize > MAX_BODY_LEN {
+        return Err(invalid("response too large"));
+    }
+    let mut body = vec![0; len as usize];
+    stream.read_exact(&mut body)?;
+    Ok((header("x-clog-reset") == Some(1), cursor, body))
+}
+
+/// What an `Attachment` has read from its server.
+struct Follower {
+    metrics: Arc<MetricStore>,
+    logs: Arc<LogStore>,
+    /// Metric names by the server's ids.
+    names: Vec<Option<Arc<str>>>,
+    cursor: Option<u64>,
+    /// Time of the newest log entry read.
+    last_log: Option<DateTime<Utc>>,
+}
+
+impl Follower {
+    fn log(&self, level: LogLevel, message: String) {
+        self.logs.push(LogEntry {
+            message,
+            timestamp: Utc::now(),
+            level,
+        });
+    }
+
+    /// Store the records in `body`. After a reset only points past each
+    /// metric's last step, and log entries newer than the last one, are kept,
+    /// since the snapshot repeats the rest.
+    fn apply(&mut self, reset: bool, body: &[u8]) -> io::Result<()> {
+        let seen = reset && self.cursor.is_some();
+        let mut pos = 0;
+        while pos < body.len() {
+            let header = body
+                .get(pos..pos + RECORD_HEADER_LEN)
+                .ok_or_else(|| io::Error::new(io::ErrorKind::InvalidData, "torn record"))?;
+            let len = persist::record_len(header);
+            let record = body
+                .get(pos..pos + len)
+                .ok_or_else(|| io::Error::new(io::ErrorKind::InvalidData, "torn record"))?;
+            pos += len;
+            match persist::decode_record(record)? {
+                Some(Record::Name { id, name }) => {
+                    let id = id as usize;
+                    if id >= self.names.len() {
+                        self.names.resize(id + 1, None);
+                    }
+                    self.names[id] = Some(Arc::from(name));
+                }
+                Some(Record::Block(block)) => {
+                    let Some(Some(name)) = self.names.get(block.id as usize) else {
+                        return Err(io::Error::new(io::ErrorKind::InvalidData, "block for an unknown metric id"));
+                    };
+                    let after = if seen { self.metrics.with_series(name, Series::last_step).flatten() } else { None };
+                    let points = block
+                        .steps()
+                        .zip(block.values())
+                        .zip(block.timestamps_ms())
+                        .map(|((step, value), timestamp_ms)| (step, value, timestamp_ms))
+                        .filter(|&(step, _, _)| after.is_none_or(|after| step > after));
+                    self.metrics.extend_timed(name, points);
+                }
+                Some(Record::Log(entry)) => {
+                    if !seen || self.last_log.is_none_or(|last| entry.timestamp > last) {
+                        self.last_log = Some(entry.timestamp);
+                        self.logs.push(entry);
+                    }
+                }
+                None => {}
+            }
+        }
+        Ok(())
+    }
+}
+
+/// Follows an `HttpServer`'s deltas into a local tracker's stores on a
+/// background thread, reconnecting if the server goes away.
+pub struct Attachment {
+    stop: Arc<AtomicBool>,
+    /// The open connection, shut down to interrupt a pending poll.
+    connection: Arc<Mutex<Option<TcpStream>>>,
+    thread: Option<JoinHandle<()>>,
+}
+
+impl Attachment {
+    /// Connect to the server at `address` (`host:port`, optionally with an
+    /// `http://` prefix) and start following it.
+    pub fn start(address: &str, metrics: Arc<MetricStore>, logs: Arc<LogStore>) -> io::Result<Self> {
+        let host = address.trim_start_matches("http://").trim_end_matches('/').to_string();
+        let first = TcpStream::connect(&host)?;
+        let stop = Arc::new(AtomicBool::new(false));
+        let connection = Arc::new(Mutex::new(Some(first.try_clone()?)));
+        let mut follower = Follower {
+            metrics,
+            logs,
+            names: Vec::new(),
+            cursor: None,
+            last_log: None,
+        };
+        let thread = {
+            let (stop, connection) = (stop.clone(), connection.clone());
+            thread::Builder::new()
+                .name("clog-attach".into())
+                .spawn(move || {
+                    let mut stream = Some(BufReader::new(first));
+                    while !stop.load(Ordering::Relaxed) {
+                        let mut current = match stream.take() {
+                            Some(current) => current,
+                            None => match TcpStream::connect(&host).and_then(|new| Ok((new.try_clone()?, new))) {
+                                Ok((clone, new)) => {
+                                    *connection.lock().unwrap() = Some(clone);
+                                    follower.log(LogLevel::Info, format!("attach: reconnected to {}", host));
+                                    BufReader::new(new)
+                                }
+                                Err(_) => {
+                                    thread::sleep(Duration::from_secs(1));
+                                    continue;
+                                }
+                            },
+                        };
+                        let polled = poll_deltas(&mut current, &host, follower.cursor).and_then(|(reset, cursor, body)| {
+                            follower.apply(reset, &body)?;
+                            follower.cursor = Some(cursor);
+                            Ok(())
+                        });
+                        match polled {
+                            Ok(()) => stream = Some(current),
+                            Err(err) if !stop.load(Ordering::Relaxed) => {
+                                follower.log(LogLevel::Warning, format!("attach: lost {}: {}", host, err));
+                            }
+                            Err(_) => {}
+                        }
+                    }
+                })?
+        };
+        Ok(Attachment {
+            stop,
+            connection,
+            thread: Some(thread),
+        })
+    }
+}
+
+impl Drop for Attachment {
+    fn drop(&mut self) {
+        self.stop.store(true, Ordering::Relaxed);
+        if let Some(connection) = self.connection.lock().unwrap().take() {
+            let _ = connection.shutdown(Shutdown::Both);
+        }
+        if let Some(thread) = self.thread.take() {
+            let _ = thread.join();
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::time::Instant;
+
+    fn wait_for(metrics: &MetricStore, name: &str, count: u64) {
+        let deadline = Instant::now() + Duration::from_secs(30);
+        while metrics.with_series(name, |series| series.total_count()) != Some(count) {
+            assert!(Instant::now() < deadline, "timed out waiting for {}", name);
+            thread::sleep(Duration::from_millis(5));
+        }
+    }
+
+    fn get(address: &str, target: &str) -> (String, Vec<u8>) {
+        let mut stream = TcpStream::connect(address).unwrap();
+        write!(stream, "GET {} HTTP/1.1\r\nConnection: close\r\n\r\n", target).unwrap();
+        let mut response = Vec::new();
+        stream.read_to_end(&mut response).unwrap();
+        let split = response.windows(4).position(|window| window == b"\r\n\r\n").unwrap();
+        let body = response.split_off(split + 4);
+        (String::from_utf8(response).unwrap(), body)
+    }
+
+    fn tracker() -> (Arc<MetricStore>, Arc<LogStore>, Pump) {
+        let metrics = Arc::new(MetricStore::new());
+        let logs = Arc::new(LogStore::new(None));
+        let pump = Pump::start(metrics.clone(), logs.clone(), Duration::from_millis(5));
+        (metrics, logs, pump)
+    }
+
+    #[test]
+    fn test_attachment_follows_deltas() {
+        let (metrics, logs, pump) = tracker();
+        metrics.extend("loss", (0..500).map(|step| (step, step as f64)), 0);
+        logs.push(LogEntry {
+            message: "before serving".to_string(),
+            timestamp: Utc::now(),
+            level: LogLevel::Info,
+        });
+        let server = HttpServer::start("127.0.0.1:0", metrics.clone(), &pump, DEFAULT_BUFFER_BYTES).unwrap();
+
+        let (viewer, viewer_logs) = (Arc::new(MetricStore::new()), Arc::new(LogStore::new(None)));
+        let attachment = Attachment::start(server.address(), viewer.clone(), viewer_logs.clone()).unwrap();
+        wait_for(&viewer, "loss", 500);
+        metrics.extend("loss", (500..1_000).map(|step| (step, step as f64)), 0);
+        metrics.push("acc", 0.5, 0, 0);
+        wait_for(&viewer, "loss", 1_000);
+        wait_for(&viewer, "acc", 1);
+        drop(attachment);
+
+        let original = metrics.with_series("loss", Series::columns);
+        assert_eq!(viewer.with_series("loss", Series::columns), original);
+        let logged = viewer_logs.recent(10, &Default::default());
+        assert_eq!(logged.last().map(|line| line.message()), Some("before serving"));
+
+        let (head, body) = get(server.address(), "/deltas?after=0");
+        assert!(head.contains("X-Clog-Reset: 1"), "{}", head);
+        let cursor = head
+            .lines()
+            .find_map(|line| line.strip_prefix("X-Clog-Cursor: "))
+            .and_then(|cursor| cursor.parse::<u64>().ok())
+            .unwrap();
+        assert_eq!(cursor, body.len() as u64);
+        let (head, body) = get(server.address(), &format!("/deltas?after={}", cursor));
+        assert!(head.contains("X-Clog-Reset: 0") && body.is_empty(), "{}", head);
+    }
+
+    #[test]
+    fn test_lagging_viewer_resumes_from_snapshot() {
+        let (metrics, logs, pump) = tracker();
+        let server = HttpServer::start("127.0.0.1:0", metrics.clone(), &pump, 4096).unwrap();
+        let (viewer, viewer_logs) = (Arc::new(MetricStore::new()), Arc::new(LogStore::new(None)));
+        let mut follower = Follower {
+            metrics: viewer.clone(),
+            logs: viewer_logs,
+            names: Vec::new(),
+            cursor: None,
+            last_log: None,
+        };
+        let mut stream = BufReader::new(TcpStream::connect(server.address()).unwrap());
+        let mut poll = |follower: &mut Follower| {
+            let (reset, cursor, body) = poll_deltas(&mut stream, server.address(), follower.cursor).unwrap();
+            follower.apply(reset, &body).unwrap();
+            follower.cursor = Some(cursor);
+            reset
+        };
+        assert!(poll(&mut follower));
+
+        // Far more than the buffer holds, so the next poll gets a snapshot.
+        for step in 0..10_000 {
+            metrics.push("loss", step as f64, step, 0);
+        }
+        logs.push(LogEntry {
+            message: "logged".to_string(),
+            timestamp: Utc::now(),
+            level: LogLevel::Info,
+        });
+        pump.cycle();
+        pump.cycle();
+        assert!(poll(&mut follower));
+        assert_eq!(viewer.with_series("loss", |series| series.total_count()), Some(10_000));
+
+        metrics.push("loss", 1.0, 10_000, 0);
+        pump.cycle();
+        assert!(!poll(&mut follower));
+        assert_eq!(viewer.with_series("loss", |series| series.total_count()), Some(10_001));
+    }
+
+    #[test]
+    fn test_openmetrics_scrape() {
+        let (metrics, _logs, pump) = tracker();
+        metrics.push("train/loss", 0.25, 7, 0);
+        metrics.push("weird \"name\"", f64::INFINITY, 1, 0);
+        let server = HttpServer::start("127.0.0.1:0", metrics.clone(), &pump, DEFAULT_BUFFER_BYTES).unwrap();
+
+        let (head, body) = get(server.address(), "/metrics");
+        assert!(head.starts_with("HTTP/1.1 200 OK") && head.contains("application/openmetrics-text"));
+        let body = String::from_utf8(body).unwrap();
+        assert!(body.contains("# TYPE clog_value gauge\n"));
+        assert!(body.contains("clog_value{metric=\"train/loss\"} 0.25\n"));
+        assert!(body.contains("clog_step{metric=\"train/loss\"} 7\n"));
+        assert!(body.contains("clog_points_total{metric=\"train/loss\"} 1\n"));
+        assert!(body.contains("clog_value{metric=\"weird \\\"name\\\"\"} +Inf\n"));
+        assert!(body.ends_with("# EOF\n"));
+        assert!(get(server.address(), "/nope").0.starts_with("HTTP/1.1 404"));
+    }
+
+    /// Many viewers following one busy tracker:
+    /// `cargo test --release bench_viewers -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_viewers() {
+        const VIEWERS: usize = 32;
+        const METRICS: usize = 100;
+        const STEPS: u64 = 10_000;
+        let (metrics, _logs, pump) = tracker();
+        let server = HttpServer::start("127.0.0.1:0", metrics.clone(), &pump, DEFAULT_BUFFER_BYTES).unwrap();
+        let viewers: Vec<_> = (0..VIEWERS)
+            .map(|_| {
+                let viewer = Arc::new(MetricStore::new());
+                let attachment =
+                    Attachment::start(server.address(), viewer.clone(), Arc::new(LogStore::new(None))).unwrap();
+                (viewer, attachment)
+            })
+            .collect();
+
+        let names: Vec<String> = (0..METRICS).map(|m| format!("metric_{}", m)).collect();
+        let start = Instant::now();
+        for step in 0..STEPS {
+            let points: Vec<(&str, f64)> = names.iter().map(|name| (name.as_str(), step as f64)).collect();
+            metrics.push_many(&points, step, 0);
+        }
+        let logged = start.elapsed();
+        for (viewer, _) in &viewers {
+            for name in &names {
+                wait_for(viewer, name, STEPS);
+            }
+        }
+        let bytes = server_bytes(&server);
+        println!(
+            "{} viewers of {} points: logged in {:?}, all caught up after {:?}; stream {:.1} bytes/point",
+            VIEWERS,
+            METRICS as u64 * STEPS,
+            logged,
+            start.elapsed(),
+            bytes as f64 / (METRICS as u64 * STEPS) as f64
+        );
+    }
+
+    fn server_bytes(server: &HttpServer) -> usize {
+        let (head, _) = get(server.address(), "/deltas?wait=0");
+        head.lines()
+            .find_map(|line| line.strip_prefix("X-Clog-Cursor: "))
+            .and_then(|cursor| cursor.parse().ok())
+            .unwrap()
+    }
+}
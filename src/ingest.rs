@@ -0,0 +1,532 @@
+use std::cell::UnsafeCell;
+use std::mem::MaybeUninit;
+use std::sync::atomic::{AtomicBool, AtomicI64, AtomicU64, AtomicUsize, Ordering};
+use std::sync::{Arc, Condvar, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::Duration;
+
+use chrono::Utc;
+
+use crate::names::Interner;
+use crate::store::{MetricStore, Padded};
+
+/// After draining entries, the worker waits this long for more before it
+/// parks until a producer wakes it. A steady stream is then applied in
+/// batches without a wake-up per entry, and an idle tracker costs nothing.
+const LINGER: Duration = Duration::from_millis(1);
+
+/// Under `Overflow::Sample`, once the queue is half full only one entry in
+/// this many is admitted.
+const SAMPLE_EVERY: u64 = 8;
+
+struct Slot<T> {
+    sequence: AtomicUsize,
+    value: UnsafeCell<MaybeUninit<T>>,
+}
+
+/// Bounded lock-free multi-producer multi-consumer ring buffer (Vyukov).
+///
+/// Each slot carries a sequence number that tells producers and consumers
+/// whether it is free or filled for the current lap, so `push` and `pop` are a
+/// single compare-and-swap on the uncontended path.
+pub struct BoundedQueue<T> {
+    slots: Box<[Slot<T>]>,
+    mask: usize,
+    head: Padded<AtomicUsize>,
+    tail: Padded<AtomicUsize>,
+}
+
+unsafe impl<T: Send> Send for BoundedQueue<T> {}
+unsafe impl<T: Send> Sync for BoundedQueue<T> {}
+
+impl<T> BoundedQueue<T> {
+    /// Create a queue holding at least `capacity` entries (rounded up to a
+    /// power of two).
+    pub fn new(capacity: usize) -> Self {
+        let capacity = capacity.max(2).next_power_of_two();
+        let slots = (0..capacity)
+            .map(|i| Slot {
+                sequence: AtomicUsize::new(i),
+                value: UnsafeCell::new(MaybeUninit::uninit()),
+            })
+            .collect();
+        BoundedQueue {
+            slots,
+            mask: capacity - 1,
+            head: Padded(AtomicUsize::new(0)),
+            tail: Padded(AtomicUsize::new(0)),
+        }
+    }
+
+    pub fn capacity(&self) -> usize {
+        self.mask + 1
+    }
+
+    /// Approximate number of queued entries.
+    pub fn len(&self) -> usize {
+        let tail = self.tail.0.load(Ordering::Relaxed);
+        let head = self.head.0.load(Ordering::Relaxed);
+        tail.saturating_sub(head)
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// Enqueue `value`, or hand it back if the queue is full.
+    pub fn push(&self, value: T) -> Result<(), T> {
+        let mut pos = self.tail.0.load(Ordering::Relaxed);
+        loop {
+            let slot = &self.slots[pos & self.mask];
+            let sequence = slot.sequence.load(Ordering::Acquire);
+            let lag = sequence as isize - pos as isize;
+            if lag == 0 {
+                match self.tail.0.compare_exchange_weak(pos, pos + 1, Ordering::Relaxed, Ordering::Relaxed) {
+                    Ok(_) => {
+                        unsafe { (*slot.value.get()).write(value) };
+                        slot.sequence.store(pos + 1, Ordering::Release);
+                        return Ok(());
+                    }
+                    Err(current) => pos = current,
+                }
+            } else if lag < 0 {
+                return Err(value);
+            } else {
+                pos = self.tail.0.load(Ordering::Relaxed);
+            }
+        }
+    }
+
+    pub fn pop(&self) -> Option<T> {
+        let mut pos = self.head.0.load(Ordering::Relaxed);
+        loop {
+            let slot = &self.slots[pos & self.mask];
+            let sequence = slot.sequence.load(Ordering::Acquire);
+            let lag = sequence as isize - (pos + 1) as isize;
+            if lag == 0 {
+                match self.head.0.compare_exchange_weak(pos, pos + 1, Ordering::Relaxed, Ordering::Relaxed) {
+                    Ok(_) => {
+                        let value = unsafe { (*slot.value.get()).assume_init_read() };
+                        slot.sequence.store(pos + self.mask + 1, Ordering::Release);
+                        return Some(value);
+                    }
+                    Err(current) => pos = current,
+                }
+            } else if lag < 0 {
+                return None;
+            } else {
+                pos = self.head.0.load(Ordering::Relaxed);
+            }
+        }
+    }
+}
+
+impl<T> Drop for BoundedQueue<T> {
+    fn drop(&mut self) {
+        while self.pop().is_some() {}
+    }
+}
+
+/// What `AsyncIngest::submit` does when the queue is full.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum Overflow {
+    /// Wait for the worker to make room.
+    Block,
+    /// Evict the oldest queued entry to make room.
+    DropOldest,
+    /// Once the queue is half full, admit only every `SAMPLE_EVERY`th entry;
+    /// drop new entries while it is completely full.
+    Sample,
+}
+
+impl Overflow {
+    pub fn parse(policy: &str) -> Option<Self> {
+        match policy {
+            "block" => Some(Overflow::Block),
+            "drop_oldest" => Some(Overflow::DropOldest),
+            "sample" => Some(Overflow::Sample),
+            _ => None,
+        }
+    }
+}
+
+struct Entry {
+    /// Id of the metric's name in `Shared::names`.
+    name: u32,
+    value: f64,
+    step: u64,
+    timestamp_ms: i64,
+}
+
+#[derive(Clone, Copy, Debug, Default, PartialEq)]
+pub struct IngestStats {
+    pub enqueued: u64,
+    pub applied: u64,
+    pub dropped: u64,
+}
+
+struct Shared {
+    queue: BoundedQueue<Entry>,
+    overflow: Overflow,
+    store: Arc<MetricStore>,
+    names: Interner,
+    /// Wall clock in milliseconds, refreshed by the worker on every wake-up,
+    /// and by the first producer to find it asleep, so producers can
+    /// timestamp entries with a single atomic load.
+    clock_ms: AtomicI64,
+    /// Set while the worker is parked, or about to be; producers that see it
+    /// unpark the worker.
+    sleeping: AtomicBool,
+    /// Entries enqueued but not yet applied or evicted.
+    in_flight: AtomicU64,
+    enqueued: AtomicU64,
+    applied: AtomicU64,
+    dropped: AtomicU64,
+    sampled: AtomicU64,
+    shutdown: AtomicBool,
+    /// Notified by the worker after each drain, for `AsyncIngest::flush` and
+    /// producers waiting for room.
+    flushed: (Mutex<()>, Condvar),
+}
+
+impl Shared {
+    /// Apply every queued entry; `names` is the worker's copy of the name
+    /// table, extended as new ids show up. Returns whether there were any.
+    fn drain(&self, names: &mut Vec<Arc<str>>) -> bool {
+        let mut drained = 0u64;
+        while let Some(entry) = self.queue.pop() {
+            if entry.name as usize >= names.len() {
+                self.names.names_since(names);
+            }
+            self.store.push(&names[entry.name as usize], entry.value, entry.step, entry.timestamp_ms);
+            drained += 1;
+            if drained % 4096 == 0 {
+                self.tick();
+            }
+        }
+        if drained > 0 {
+            self.applied.fetch_add(drained, Ordering::Relaxed);
+            self.in_flight.fetch_sub(drained, Ordering::Release);
+        }
+        drained > 0
+    }
+
+    fn tick(&self) {
+        self.clock_ms.store(Utc::now().timestamp_millis(), Ordering::Relaxed);
+    }
+
+    fn run(&self) {
+        let mut names = Vec::new();
+        loop {
+            self.tick();
+            let drained = self.drain(&mut names);
+            {
+                let _lock = self.flushed.0.lock().unwrap();
+                self.flushed.1.notify_all();
+            }
+            if self.shutdown.load(Ordering::Acquire) && self.queue.is_empty() {
+                return;
+            }
+            if drained {
+                thread::park_timeout(LINGER);
+                continue;
+            }
+            // Producers count an entry in `in_flight` before queueing it and
+            // check `sleeping` after, all SeqCst: either a producer sees
+            // `sleeping` and unparks us, or we see its entry and skip parking.
+            self.sleeping.store(true, Ordering::SeqCst);
+            if self.in_flight.load(Ordering::SeqCst) == 0 && !self.shutdown.load(Ordering::Acquire) {
+                thread::park();
+            } else if self.queue.is_empty() {
+                // A producer has counted an entry but not pushed it yet.
+                thread::yield_now();
+            }
+            self.sleeping.store(false, Ordering::Relaxed);
+        }
+    }
+}
+
+/// Asynchronous ingestion: `submit` only enqueues into a bounded ring buffer
+/// and a background worker applies entries to the store.
+pub struct AsyncIngest {
+    shared: Arc<Shared>,
+    worker: Option<JoinHandle<()>>,
+}
+
+impl AsyncIngest {
+    pub fn new(store: Arc<MetricStore>, capacity: usize, overflow: Overflow) -> Self {
+        let shared = Arc::new(Shared {
+            queue: BoundedQueue::new(capacity),
+            overflow,
+            store,
+            names: Interner::new(),
+            clock_ms: AtomicI64::new(Utc::now().timestamp_millis()),
+            sleeping: AtomicBool::new(false),
+            in_flight: AtomicU64::new(0),
+            enqueued: AtomicU64::new(0),
+            applied: AtomicU64::new(0),
+            dropped: AtomicU64::new(0),
+            sampled: AtomicU64::new(0),
+            shutdown: AtomicBool::new(false),
+            flushed: (Mutex::new(()), Condvar::new()),
+        });
+        let worker = {
+            let shared = shared.clone();
+            thread::Builder::new()
+                .name("clog-ingest".into())
+                .spawn(move || shared.run())
+                .expect("failed to spawn clog ingest thread")
+        };
+        AsyncIngest {
+            shared,
+            worker: Some(worker),
+        }
+    }
+
+    /// Queue a point without blocking.
+    ///
+    /// Returns `false` only under `Overflow::Block` when the queue is full; the
+    /// caller should then release whatever it holds and call `submit_blocking`.
+    pub fn try_submit(&self, name: &str, value: f64, step: u64) -> bool {
+        let shared = &*self.shared;
+        if shared.overflow == Overflow::Sample
+            && shared.queue.len() >= shared.queue.capacity() / 2
+            && shared.sampled.fetch_add(1, Ordering::Relaxed) % SAMPLE_EVERY != 0
+        {
+            shared.dropped.fetch_add(1, Ordering::Relaxed);
+            return true;
+        }
+
+        // A parked worker has not refreshed the clock since it went idle.
+        if shared.sleeping.load(Ordering::Relaxed) {
+            shared.tick();
+        }
+        let mut entry = Entry {
+            name: shared.names.intern(name),
+            value,
+            step,
+            timestamp_ms: shared.clock_ms.load(Ordering::Relaxed),
+        };
+        shared.in_flight.fetch_add(1, Ordering::SeqCst);
+        loop {
+            match shared.queue.push(entry) {
+                Ok(()) => {
+                    shared.enqueued.fetch_add(1, Ordering::Relaxed);
+                    if shared.sleeping.load(Ordering::SeqCst) {
+                        self.wake_worker();
+                    }
+                    return true;
+                }
+                Err(rejected) => entry = rejected,
+            }
+            match shared.overflow {
+                Overflow::Block => {
+                    shared.in_flight.fetch_sub(1, Ordering::Relaxed);
+                    return false;
+                }
+                Overflow::DropOldest => {
+                    if shared.queue.pop().is_some() {
+                        shared.in_flight.fetch_sub(1, Ordering::Release);
+                        shared.dropped.fetch_add(1, Ordering::Relaxed);
+                    }
+                }
+                Overflow::Sample => {
+                    shared.in_flight.fetch_sub(1, Ordering::Relaxed);
+                    shared.dropped.fetch_add(1, Ordering::Relaxed);
+                    return true;
+                }
+            }
+        }
+    }
+
+    /// Queue a point, waiting for room if the queue is full.
+    pub fn submit_blocking(&self, name: &str, value: f64, step: u64) {
+        if self.try_submit(name, value, step) {
+            return;
+        }
+        let (lock, drained) = &self.shared.flushed;
+        let mut guard = lock.lock().unwrap();
+        while !self.try_submit(name, value, step) {
+            self.wake_worker();
+            guard = drained.wait(guard).unwrap();
+        }
+    }
+
+    fn wake_worker(&self) {
+        if let Some(worker) = &self.worker {
+            worker.thread().unpark();
+        }
+    }
+
+    /// Wait until every entry queued so far has been applied to the store.
+    pub fn flush(&self) {
+        let (lock, drained) = &self.shared.flushed;
+        let mut guard = lock.lock().unwrap();
+        // The worker notifies under the lock after every drain, so it cannot
+        // slip in between this check and the wait.
+        while self.shared.in_flight.load(Ordering::Acquire) > 0 {
+            self.wake_worker();
+            guard = drained.wait(guard).unwrap();
+        }
+    }
+
+    pub fn stats(&self) -> IngestStats {
+        IngestStats {
+            enqueued: self.shared.enqueued.load(Ordering::Relaxed),
+            applied: self.shared.applied.load(Ordering::Relaxed),
+            dropped: self.shared.dropped.load(Ordering::Relaxed),
+        }
+    }
+}
+
+impl Drop for AsyncIngest {
+    fn drop(&mut self) {
+        self.shared.shutdown.store(true, Ordering::Release);
+        if let Some(worker) = self.worker.take() {
+            worker.thread().unpark();
+            let _ = worker.join();
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::series::Series;
+    use std::time::Instant;
+
+    #[test]
+    fn test_queue_fifo_and_full() {
+        let queue = BoundedQueue::new(3);
+        assert_eq!(queue.capacity(), 4);
+        for i in 0..4 {
+            assert!(queue.push(i).is_ok());
+        }
+        assert_eq!(queue.push(4), Err(4));
+        assert_eq!(queue.pop(), Some(0));
+        assert!(queue.push(4).is_ok());
+        assert_eq!((0..4).map(|_| queue.pop().unwrap()).collect::<Vec<_>>(), vec![1, 2, 3, 4]);
+        assert_eq!(queue.pop(), None);
+    }
+
+    #[test]
+    fn test_queue_many_producers() {
+        let queue = BoundedQueue::new(64);
+        let total = AtomicU64::new(0);
+        thread::scope(|scope| {
+            for t in 0..4u64 {
+                let queue = &queue;
+                scope.spawn(move || {
+                    for i in 0..10_000u64 {
+                        let mut value = t * 10_000 + i;
+                        while let Err(rejected) = queue.push(value) {
+                            value = rejected;
+                            thread::yield_now();
+                        }
+                    }
+                });
+            }
+            scope.spawn(|| {
+                let mut seen = 0;
+                while seen < 40_000 {
+                    match queue.pop() {
+                        Some(value) => {
+                            total.fetch_add(value, Ordering::Relaxed);
+                            seen += 1;
+                        }
+                        None => thread::yield_now(),
+                    }
+                }
+            });
+        });
+        assert_eq!(total.load(Ordering::Relaxed), (0..40_000u64).sum::<u64>());
+    }
+
+    #[test]
+    fn test_async_ingest_applies_entries() {
+        let store = Arc::new(MetricStore::new());
+        let ingest = AsyncIngest::new(store.clone(), 1024, Overflow::Block);
+        for step in 0..10_000 {
+            ingest.submit_blocking("loss", step as f64, step);
+        }
+        ingest.flush();
+
+        assert_eq!(store.with_series("loss", Series::total_count), Some(10_000));
+        assert_eq!(
+            ingest.stats(),
+            IngestStats {
+                enqueued: 10_000,
+                applied: 10_000,
+                dropped: 0
+            }
+        );
+    }
+
+    #[test]
+    fn test_idle_worker_is_woken_with_a_fresh_clock() {
+        let store = Arc::new(MetricStore::new());
+        let ingest = AsyncIngest::new(store.clone(), 1024, Overflow::Block);
+        ingest.submit_blocking("loss", 1.0, 0);
+        ingest.flush();
+        // Long enough for the worker to stop lingering and park.
+        thread::sleep(Duration::from_millis(50));
+
+        let before = Utc::now().timestamp_millis();
+        assert!(ingest.try_submit("loss", 2.0, 1));
+        let deadline = Instant::now() + Duration::from_secs(5);
+        while store.with_series("loss", Series::total_count) != Some(2) {
+            assert!(Instant::now() < deadline, "parked worker was not woken");
+            thread::yield_now();
+        }
+        let last = store.with_series("loss", |series| series.timestamps_ms().last()).flatten();
+        assert!(last.unwrap() >= before);
+    }
+
+    #[test]
+    fn test_drop_oldest_counts_evictions() {
+        let store = Arc::new(MetricStore::new());
+        let ingest = AsyncIngest::new(store.clone(), 16, Overflow::DropOldest);
+        for step in 0..100_000 {
+            assert!(ingest.try_submit("loss", step as f64, step));
+        }
+        ingest.flush();
+
+        let stats = ingest.stats();
+        let stored = store.with_series("loss", Series::total_count).unwrap();
+        assert_eq!(stats.applied, stored);
+        assert_eq!(stats.applied + stats.dropped, 100_000);
+        assert_eq!(store.with_series("loss", Series::last_value), Some(Some(99_999.0)));
+    }
+
+    #[test]
+    fn test_overflow_parse() {
+        assert_eq!(Overflow::parse("sample"), Some(Overflow::Sample));
+        assert_eq!(Overflow::parse("sometimes"), None);
+    }
+
+    /// `cargo test --release bench_submit_latency -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_submit_latency() {
+        let store = Arc::new(MetricStore::new());
+        let ingest = AsyncIngest::new(store.clone(), 1 << 20, Overflow::Block);
+        let n = 1_000_000u64;
+        let start = Instant::now();
+        for step in 0..n {
+            ingest.submit_blocking("train/loss", step as f64, step);
+        }
+        let submit = start.elapsed();
+        ingest.flush();
+
+        let start = Instant::now();
+        for step in 0..n {
+            store.push("direct/loss", step as f64, step, Utc::now().timestamp_millis());
+        }
+        let direct = start.elapsed();
+        println!(
+            "async submit: {:.1} ns/point, synchronous push: {:.1} ns/point",
+            submit.as_nanos() as f64 / n as f64,
+            direct.as_nanos() as f64 / n as f64
+        );
+    }
+}
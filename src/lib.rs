@@ -1,11 +1,53 @@
 use std::collections::HashMap;
+use std::sync::atomic::{AtomicBool, Ordering};
 use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant};
 use chrono::{DateTime, Utc};
 use serde::{Deserialize, Serialize};
+use numpy::{PyArray1, PyArray2, PyArrayMethods, PyReadonlyArray1, PyReadonlyArrayDyn};
+use pyo3::exceptions::{PyRuntimeError, PyValueError};
 use pyo3::prelude::*;
+use pyo3::types::{PyDict, PyString, PyTuple};
 
+pub mod compare;
+pub mod feed;
+pub mod gorilla;
+pub mod http;
+pub mod ingest;
+pub mod logs;
+pub mod names;
+pub mod persist;
+pub mod remote;
+pub mod replay;
+pub mod series;
+pub mod shm;
+pub mod sketch;
+pub mod stats;
+pub mod store;
+pub mod tensorboard;
+pub mod timers;
 pub mod ui;
 
+use compare::Comparison;
+use feed::{Pump, Sink};
+use http::{Attachment, HttpServer};
+use ingest::{AsyncIngest, Overflow};
+pub use logs::{LogEntry, LogLevel};
+use logs::LogStore;
+use persist::Persister;
+use remote::{Collector, Sender};
+use replay::Replay;
+use series::{Duplicates, Retention, Series};
+use shm::{ShmChannel, ShmWriter};
+use sketch::{HistogramStore, Sketch};
+use stats::StatsConfig;
+use store::MetricStore;
+use timers::{TimerCell, TimerStore};
+
+/// How often the feed pump hands new points to the persister and to a
+/// collector.
+const PUMP_INTERVAL: Duration = Duration::from_millis(50);
+
 #[derive(Clone, Debug, Serialize, Deserialize)]
 pub struct Metric {
     pub name: String,
@@ -14,80 +56,857 @@ pub struct Metric {
     pub step: usize,
 }
 
-#[derive(Clone, Debug)]
-pub struct LogEntry {
-    pub message: String,
-    pub timestamp: DateTime<Utc>,
-    pub level: LogLevel,
+#[pyclass]
+#[derive(Clone)]
+pub struct ClogTracker {
+    metrics: Arc<MetricStore>,
+    logs: Arc<LogStore>,
+    timers: Arc<TimerStore>,
+    histograms: Arc<HistogramStore>,
+    ingest: Option<Arc<AsyncIngest>>,
+    pump: Arc<Mutex<Option<Pump>>>,
+    collector: Arc<Mutex<Option<Collector>>>,
+    http: Arc<Mutex<Option<HttpServer>>>,
+    channels: Arc<Mutex<Vec<ShmChannel>>>,
+    stop_requested: Arc<AtomicBool>,
 }
 
-#[derive(Clone, Debug, PartialEq)]
-pub enum LogLevel {
-    Info,
-    Warning,
-    Error,
+impl Default for ClogTracker {
+    fn default() -> Self {
+        ClogTracker {
+            metrics: Arc::new(MetricStore::new()),
+            logs: Arc::new(LogStore::new(None)),
+            timers: Arc::new(TimerStore::new()),
+            histograms: Arc::new(HistogramStore::new()),
+            ingest: None,
+            pump: Arc::new(Mutex::new(None)),
+            collector: Arc::new(Mutex::new(None)),
+            http: Arc::new(Mutex::new(None)),
+            channels: Arc::new(Mutex::new(Vec::new())),
+            stop_requested: Arc::new(AtomicBool::new(false)),
+        }
+    }
 }
 
-#[pyclass]
-#[derive(Clone)]
-pub struct ClogTracker {
-    metrics: Arc<Mutex<HashMap<String, Vec<Metric>>>>,
-    logs: Arc<Mutex<Vec<LogEntry>>>,
+impl ClogTracker {
+    fn record_metric(&self, name: &str, value: f64, step: u64) {
+        let timestamp_ms = Utc::now().timestamp_millis();
+        self.metrics.push(name, value, step, timestamp_ms);
+    }
+
+    /// Hand a point to the async ingest queue, releasing the GIL only if the
+    /// queue is full and the overflow policy says to wait.
+    fn submit(&self, py: Python<'_>, ingest: &AsyncIngest, name: &str, value: f64, step: u64) {
+        if !ingest.try_submit(name, value, step) {
+            py.allow_threads(|| ingest.submit_blocking(name, value, step));
+        }
+    }
+
+    fn record_message(&self, message: String, level: &str) {
+        self.logs.push(LogEntry {
+            message,
+            timestamp: Utc::now(),
+            level: LogLevel::parse(level),
+        });
+    }
+
+    pub(crate) fn stop_requested(&self) -> bool {
+        self.stop_requested.load(Ordering::Relaxed)
+    }
 }
 
 #[pymethods]
 impl ClogTracker {
+    /// Create a tracker.
+    ///
+    /// `max_points` bounds the full-resolution points kept per metric (rounded
+    /// up to whole chunks); older points are rolled into at most
+    /// `archive_buckets` min/max/mean buckets; `None` keeps every point.
+    /// Log messages live in a ring of `max_logs` entries (`None` for no
+    /// limit); with `log_spill_path`, entries that fall out of it are appended
+    /// to that text file instead of being dropped.
+    ///
+    /// With `async_ingest`, metric calls only enqueue into a ring buffer of
+    /// `queue_capacity` entries that a background thread applies to the store.
+    /// `overflow` picks what happens when it is full: "block", "drop_oldest"
+    /// or "sample".
+    ///
+    /// Every metric keeps running statistics (see `summary`): `ema_alpha` is
+    /// the weight of the newest point in its moving average and
+    /// `stats_window` the number of recent points in its window aggregates.
+    ///
+    /// With `persist_path`, every metric point and log message is also
+    /// appended to a binary run file by a background thread. The file is
+    /// fsynced at most every `fsync_interval` seconds and on `close`.
+    ///
+    /// With `connect`, they are also streamed to the collector started by
+    /// `serve` at that address, which files them under this `rank`.
+    ///
+    /// Series are kept in step order whatever order points arrive in.
+    /// `duplicates` decides what a step logged again holds: "keep_all",
+    /// "last_wins" or "mean". `summary` still counts every value logged.
     #[new]
-    pub fn new() -> Self {
-        ClogTracker {
-            metrics: Arc::new(Mutex::new(HashMap::new())),
-            logs: Arc::new(Mutex::new(Vec::new())),
+    #[pyo3(signature = (
+        max_points=None,
+        archive_buckets=1024,
+        max_logs=Some(100_000),
+        async_ingest=false,
+        queue_capacity=65536,
+        overflow="block",
+        persist_path=None,
+        fsync_interval=1.0,
+        ema_alpha=0.1,
+        stats_window=100,
+        log_spill_path=None,
+        connect=None,
+        rank=0,
+        duplicates="keep_all",
+    ))]
+    pub fn new(
+        py: Python<'_>,
+        max_points: Option<usize>,
+        archive_buckets: usize,
+        max_logs: Option<usize>,
+        async_ingest: bool,
+        queue_capacity: usize,
+        overflow: &str,
+        persist_path: Option<std::path::PathBuf>,
+        fsync_interval: f64,
+        ema_alpha: f64,
+        stats_window: usize,
+        log_spill_path: Option<std::path::PathBuf>,
+        connect: Option<String>,
+        rank: u32,
+        duplicates: &str,
+    ) -> PyResult<Self> {
+        let duplicates = Duplicates::parse(duplicates).ok_or_else(|| {
+            PyValueError::new_err(format!(
+                "duplicates must be 'keep_all', 'last_wins' or 'mean', got '{}'",
+                duplicates
+            ))
+        })?;
+        let retention = Retention {
+            max_points,
+            archive_buckets,
+            duplicates,
+        };
+        let overflow = Overflow::parse(overflow).ok_or_else(|| {
+            PyValueError::new_err(format!(
+                "overflow must be 'block', 'drop_oldest' or 'sample', got '{}'",
+                overflow
+            ))
+        })?;
+        let fsync_interval = Duration::try_from_secs_f64(fsync_interval)
+            .map_err(|_| PyValueError::new_err("fsync_interval must be a non-negative number of seconds"))?;
+        if !(ema_alpha > 0.0 && ema_alpha <= 1.0) {
+            return Err(PyValueError::new_err(format!("ema_alpha must be in (0, 1], got {}", ema_alpha)));
         }
+        let stats = StatsConfig {
+            ema_alpha,
+            window: stats_window,
+        };
+        let metrics = Arc::new(MetricStore::with_config(retention, stats));
+        let logs = match log_spill_path {
+            Some(path) => LogStore::with_spill(max_logs, &path).map_err(|e| {
+                PyRuntimeError::new_err(format!("cannot open {}: {}", path.display(), e))
+            })?,
+            None => LogStore::new(max_logs),
+        };
+        let logs = Arc::new(logs);
+        let ingest = async_ingest
+            .then(|| Arc::new(AsyncIngest::new(metrics.clone(), queue_capacity, overflow)));
+        let mut sinks: Vec<Box<dyn Sink>> = Vec::new();
+        if let Some(path) = persist_path {
+            let persister = Persister::create(&path, fsync_interval).map_err(|e| {
+                PyRuntimeError::new_err(format!("cannot create {}: {}", path.display(), e))
+            })?;
+            sinks.push(Box::new(persister));
+        }
+        if let Some(address) = connect {
+            let sender = py.allow_threads(|| Sender::connect(&address, rank)).map_err(|e| {
+                PyRuntimeError::new_err(format!("cannot connect to {}: {}", address, e))
+            })?;
+            sinks.push(Box::new(sender));
+        }
+        let pump = if sinks.is_empty() {
+            None
+        } else {
+            let pump = Pump::start(metrics.clone(), logs.clone(), PUMP_INTERVAL);
+            for sink in sinks {
+                pump.add_sink(sink)
+                    .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
+            }
+            Some(pump)
+        };
+        Ok(ClogTracker {
+            metrics,
+            logs,
+            ingest,
+            pump: Arc::new(Mutex::new(pump)),
+            ..ClogTracker::default()
+        })
     }
 
-    pub fn log_metric(&self, name: String, value: f64, step: usize) -> PyResult<()> {
-        let metric = Metric {
-            name: name.clone(),
-            value,
-            timestamp: Utc::now(),
-            step,
-        };
-        
-        let mut metrics = self.metrics.lock().unwrap();
-        metrics.entry(name).or_insert_with(Vec::new).push(metric);
+    // The lock-and-push below never touches Python objects, so other Python
+    // threads (the training loop, DataLoader workers) keep running meanwhile.
+    pub fn log_metric(&self, py: Python<'_>, name: &str, value: f64, step: u64) -> PyResult<()> {
+        match &self.ingest {
+            Some(ingest) => self.submit(py, ingest, name, value, step),
+            None => py.allow_threads(|| self.record_metric(name, value, step)),
+        }
+        Ok(())
+    }
+
+    /// Log several metrics for the same step with one call and one lock per
+    /// shard.
+    pub fn log_metrics(&self, py: Python<'_>, metrics: &Bound<'_, PyDict>, step: u64) -> PyResult<()> {
+        let mut entries = Vec::with_capacity(metrics.len());
+        for (name, value) in metrics.iter() {
+            entries.push((name.downcast_into::<PyString>()?, value.extract::<f64>()?));
+        }
+        let points = entries
+            .iter()
+            .map(|(name, value)| Ok((name.to_str()?, *value)))
+            .collect::<PyResult<Vec<(&str, f64)>>>()?;
+
+        match &self.ingest {
+            Some(ingest) => {
+                for &(name, value) in &points {
+                    self.submit(py, ingest, name, value, step);
+                }
+            }
+            None => {
+                let timestamp_ms = Utc::now().timestamp_millis();
+                py.allow_threads(|| self.metrics.push_many(&points, step, timestamp_ms));
+            }
+        }
         Ok(())
     }
 
-    pub fn log_message(&self, message: String, level: String) -> PyResult<()> {
-        let log_level = match level.as_str() {
-            "info" => LogLevel::Info,
-            "warning" => LogLevel::Warning,
-            "error" => LogLevel::Error,
-            _ => LogLevel::Info,
+    /// Append a whole array of points to one metric, reading the NumPy buffers
+    /// in place.
+    ///
+    /// The GIL stays held while the arrays are borrowed so that no Python
+    /// thread can write to them mid-copy.
+    pub fn log_metric_array(
+        &self,
+        py: Python<'_>,
+        name: &str,
+        values: PyReadonlyArray1<'_, f64>,
+        steps: PyReadonlyArray1<'_, i64>,
+    ) -> PyResult<()> {
+        let values = values.as_slice()?;
+        let steps = steps.as_slice()?;
+        if values.len() != steps.len() {
+            return Err(PyValueError::new_err(format!(
+                "values and steps must have the same length, got {} and {}",
+                values.len(),
+                steps.len()
+            )));
+        }
+        if steps.iter().any(|&step| step < 0) {
+            return Err(PyValueError::new_err("steps must be non-negative"));
+        }
+
+        // Keep this metric's points in order relative to anything still queued.
+        self.flush(py);
+        let timestamp_ms = Utc::now().timestamp_millis();
+        let points = steps.iter().zip(values).map(|(&step, &value)| (step as u64, value));
+        self.metrics.extend(name, points, timestamp_ms);
+        Ok(())
+    }
+
+    /// Sketch the distribution of a NumPy array of any shape and store it
+    /// for `step`, reading the buffer in place.
+    ///
+    /// Only the DDSketch is kept, so a step costs at most 16 KiB however
+    /// large the array. The metric `name` itself gets the median, so it is
+    /// listed, summarised, persisted and sent like any other metric.
+    pub fn log_histogram(&self, py: Python<'_>, name: &str, values: HistogramValues<'_>, step: u64) -> PyResult<()> {
+        let sketch = match &values {
+            HistogramValues::F32(values) => Sketch::from_values(values.as_slice()?),
+            HistogramValues::F64(values) => Sketch::from_values(values.as_slice()?),
         };
-        
-        let entry = LogEntry {
-            message,
-            timestamp: Utc::now(),
-            level: log_level,
+        if sketch.count() > 0 {
+            self.log_metric(py, name, sketch.quantile(0.5), step)?;
+        }
+        py.allow_threads(|| self.histograms.record(name, step, sketch));
+        Ok(())
+    }
+
+    /// Steps of histogram `name` and, for each, the given quantiles, or
+    /// `None` if it was never logged. Steps where every value was NaN or
+    /// infinite read as NaN.
+    pub fn histogram_quantiles<'py>(
+        &self,
+        py: Python<'py>,
+        name: &str,
+        quantiles: Vec<f64>,
+    ) -> PyResult<Option<(Bound<'py, PyArray1<u64>>, Bound<'py, PyArray2<f64>>)>> {
+        let Some((steps, values)) = self.histograms.with_steps(name, |steps| {
+            let values: Vec<f64> = steps
+                .iter()
+                .flat_map(|(_, sketch)| quantiles.iter().map(|&q| sketch.quantile(q)))
+                .collect();
+            (steps.iter().map(|(step, _)| *step).collect::<Vec<u64>>(), values)
+        }) else {
+            return Ok(None);
         };
-        
-        let mut logs = self.logs.lock().unwrap();
-        logs.push(entry);
+        let values = PyArray1::from_vec(py, values).reshape([steps.len(), quantiles.len()])?;
+        Ok(Some((PyArray1::from_vec(py, steps), values)))
+    }
+
+    pub fn log_message(&self, py: Python<'_>, message: String, level: String) -> PyResult<()> {
+        py.allow_threads(|| self.record_message(message, &level));
         Ok(())
     }
-    
-    pub fn run_ui(&self) -> PyResult<()> {
+
+    /// Log a message with a level code (see `LogLevel::code`) and a Unix
+    /// timestamp in seconds, as `clog.LoggingHandler` does for each record.
+    pub fn log_record(&self, py: Python<'_>, message: String, level: u8, created: f64) -> PyResult<()> {
+        let level = LogLevel::from_code(level)
+            .ok_or_else(|| PyValueError::new_err(format!("unknown log level code {}", level)))?;
+        let timestamp = DateTime::from_timestamp_micros((created * 1e6) as i64).unwrap_or_else(Utc::now);
+        py.allow_threads(|| {
+            self.logs.push(LogEntry {
+                message,
+                timestamp,
+                level,
+            })
+        });
+        Ok(())
+    }
+
+    /// Run the terminal UI until the user quits or `stop_ui` is called.
+    ///
+    /// The whole event loop (input polling and drawing) runs with the GIL
+    /// released. The screen is redrawn at most `max_fps` times per second,
+    /// and only when new data arrived or on input.
+    #[pyo3(signature = (max_fps=ui::DEFAULT_MAX_FPS))]
+    pub fn run_ui(&self, py: Python<'_>, max_fps: f64) -> PyResult<()> {
         let tracker = Arc::new(self.clone());
-        let mut ui = ui::TerminalUI::new(tracker);
-        ui.run().map_err(|e| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>(e.to_string()))?;
+        let result = py.allow_threads(move || {
+            let mut ui = ui::TerminalUI::new(tracker);
+            ui.max_fps = max_fps;
+            ui.run()
+        });
+        // Cleared on the way out rather than on entry, where it could undo a
+        // `stop_ui` made while a UI thread was still starting.
+        self.stop_requested.store(false, Ordering::Relaxed);
+        result.map_err(|e| PyRuntimeError::new_err(e.to_string()))
+    }
+
+    /// Ask a running UI loop to exit at its next poll.
+    pub fn stop_ui(&self) {
+        self.stop_requested.store(true, Ordering::Relaxed);
+    }
+
+    /// Wait until every metric queued for async ingestion, or written to a
+    /// shared-memory channel so far, is in the store, and write log lines
+    /// evicted to the spill file out to it.
+    pub fn flush(&self, py: Python<'_>) {
+        if let Some(ingest) = &self.ingest {
+            py.allow_threads(|| ingest.flush());
+        }
+        py.allow_threads(|| {
+            for channel in self.channels.lock().unwrap().iter() {
+                channel.drain();
+            }
+            // A failed flush has already stopped spilling; logging goes on.
+            let _ = self.logs.flush_spill();
+        });
+    }
+
+    /// Create a shared-memory channel of `capacity` slots that other
+    /// processes on this host can log into with `SharedMemoryWriter`, and
+    /// return its name.
+    ///
+    /// The channel lives as long as this tracker.
+    #[pyo3(signature = (capacity=65536))]
+    pub fn shared_memory(&self, capacity: usize) -> PyResult<String> {
+        let channel = ShmChannel::create(self.metrics.clone(), capacity)
+            .map_err(|e| PyRuntimeError::new_err(format!("cannot create shared-memory channel: {}", e)))?;
+        let name = channel.name().to_string();
+        self.channels.lock().unwrap().push(channel);
+        Ok(name)
+    }
+
+    /// Accept metrics from trackers created with `connect` and show them
+    /// alongside this tracker's own, tagged by rank and aggregated per step.
+    ///
+    /// `address` is `host:port` or `unix:/path`; returns the address senders
+    /// should use (with the real port if it was 0). With `world_size`, each
+    /// step's cross-rank mean, min and max wait for that many ranks.
+    #[pyo3(signature = (address="127.0.0.1:0", world_size=None))]
+    pub fn serve(&self, address: &str, world_size: Option<usize>) -> PyResult<String> {
+        let mut collector = self.collector.lock().unwrap();
+        if collector.is_some() {
+            return Err(PyRuntimeError::new_err("this tracker is already serving"));
+        }
+        let started = Collector::start(address, world_size, self.metrics.clone(), self.logs.clone())
+            .map_err(|e| PyRuntimeError::new_err(format!("cannot listen on {}: {}", address, e)))?;
+        let bound = started.address().to_string();
+        *collector = Some(started);
+        Ok(bound)
+    }
+
+    /// Let viewers on other machines follow this tracker over HTTP, with
+    /// `clog attach`, and expose an OpenMetrics scrape at `/metrics`.
+    ///
+    /// `address` is `host:port`; returns the address viewers should use (with
+    /// the real port if it was 0). Viewers get everything logged so far, then
+    /// long-poll for what is logged after, so a slow viewer never holds up
+    /// logging.
+    #[pyo3(signature = (address="127.0.0.1:0"))]
+    pub fn serve_http(&self, py: Python<'_>, address: &str) -> PyResult<String> {
+        // Both locks are taken with the GIL released, so a thread that holds
+        // the GIL while waiting for one of them, as `close` does, cannot
+        // deadlock with this one.
+        py.allow_threads(|| {
+            let mut server = self.http.lock().unwrap();
+            if server.is_some() {
+                return Err(PyRuntimeError::new_err("this tracker is already serving over HTTP"));
+            }
+            let mut pump = self.pump.lock().unwrap();
+            let pump = pump.get_or_insert_with(|| Pump::start(self.metrics.clone(), self.logs.clone(), PUMP_INTERVAL));
+            let started = HttpServer::start(address, self.metrics.clone(), pump, http::DEFAULT_BUFFER_BYTES)
+                .map_err(|e| PyRuntimeError::new_err(format!("cannot listen on {}: {}", address, e)))?;
+            let bound = started.address().to_string();
+            *server = Some(started);
+            Ok(bound)
+        })
+    }
+
+    /// Flush everything logged so far to the run file and collector, and stop
+    /// sending. The server started by `serve_http` shuts down too.
+    ///
+    /// Raises `RuntimeError` if writing the run file or sending failed at any
+    /// point.
+    /// Calling it again, or without `persist_path`, does nothing.
+    pub fn close(&self, py: Python<'_>) -> PyResult<()> {
+        self.flush(py);
+        let pump = self.pump.lock().unwrap().take();
+        let error = pump.and_then(|pump| py.allow_threads(|| pump.close()));
+        let server = self.http.lock().unwrap().take();
+        py.allow_threads(|| drop(server));
+        match error {
+            Some(error) => Err(PyRuntimeError::new_err(format!("persisting failed: {}", error))),
+            None => Ok(()),
+        }
+    }
+
+    /// Counters of the async ingest queue: entries enqueued, applied to the
+    /// store, and dropped by the overflow policy.
+    pub fn ingest_stats(&self) -> HashMap<&'static str, u64> {
+        let stats = self.ingest.as_ref().map(|ingest| ingest.stats()).unwrap_or_default();
+        HashMap::from([
+            ("enqueued", stats.enqueued),
+            ("applied", stats.applied),
+            ("dropped", stats.dropped),
+        ])
+    }
+
+    /// Running statistics of a metric, or `None` if it was never logged.
+    ///
+    /// Maintained as points arrive, so this costs the same at any series
+    /// length. NaN values are only counted in `count` and `nan_count`. Every
+    /// value logged is included, whatever the `duplicates` policy stored.
+    pub fn summary<'py>(&self, py: Python<'py>, name: &str) -> PyResult<Option<Bound<'py, PyDict>>> {
+        self.flush(py);
+        let Some(summary) = self.metrics.with_series(name, Series::summary) else {
+            return Ok(None);
+        };
+        let dict = PyDict::new(py);
+        dict.set_item("count", summary.count)?;
+        dict.set_item("nan_count", summary.nan_count)?;
+        dict.set_item("last", summary.last)?;
+        dict.set_item("min", summary.min)?;
+        dict.set_item("min_step", summary.min_step)?;
+        dict.set_item("max", summary.max)?;
+        dict.set_item("max_step", summary.max_step)?;
+        dict.set_item("mean", summary.mean)?;
+        dict.set_item("variance", summary.variance)?;
+        dict.set_item("std", summary.variance.sqrt())?;
+        dict.set_item("ema", summary.ema)?;
+        dict.set_item("window_count", summary.window_count)?;
+        dict.set_item("window_mean", summary.window_mean)?;
+        dict.set_item("window_min", summary.window_min)?;
+        dict.set_item("window_max", summary.window_max)?;
+        Ok(Some(dict))
+    }
+
+    /// The points of metric `name` with `start_step <= step <= end_step` as
+    /// NumPy step and value arrays, or `None` if it was never logged.
+    ///
+    /// The points are copied once, under the metric's shard lock with the
+    /// GIL released, into buffers the arrays then own. With `max_points`,
+    /// the range is reduced to the minimum and maximum of each of
+    /// `max_points / 2` equal step ranges instead, as the chart does.
+    #[pyo3(signature = (name, start_step=None, end_step=None, max_points=None))]
+    pub fn get_series<'py>(
+        &self,
+        py: Python<'py>,
+        name: &str,
+        start_step: Option<u64>,
+        end_step: Option<u64>,
+        max_points: Option<usize>,
+    ) -> PyResult<Option<(Bound<'py, PyArray1<u64>>, Bound<'py, PyArray1<f64>>)>> {
+        self.flush(py);
+        let (start, end) = (start_step.unwrap_or(0), end_step.unwrap_or(u64::MAX));
+        let read = |series: &Series| match max_points {
+            None => series.range(start, end),
+            Some(max_points) => match series.decimate_range(start, end, (max_points / 2).max(1)) {
+                Some(chart) => chart.points.into_iter().map(|(step, value)| (step as u64, value)).unzip(),
+                None => (Vec::new(), Vec::new()),
+            },
+        };
+        let Some((steps, values)) = py.allow_threads(|| self.metrics.with_series(name, read)) else {
+            return Ok(None);
+        };
+        Ok(Some((PyArray1::from_vec(py, steps), PyArray1::from_vec(py, values))))
+    }
+
+    /// Every metric's points as flat columns: the names, the number of
+    /// points of each, and the concatenated steps, values and timestamps in
+    /// milliseconds (`i64::MIN` for archive extrema, which have none), each
+    /// series in step order.
+    ///
+    /// Copied once with the GIL released, one shard lock at a time.
+    pub fn export_columns<'py>(&self, py: Python<'py>) -> PyResult<ExportedColumns<'py>> {
+        self.flush(py);
+        let (names, counts, steps, values, timestamps) = py.allow_threads(|| {
+            let names = self.metrics.names();
+            let mut counts = Vec::with_capacity(names.len());
+            let (mut steps, mut values, mut timestamps) = (Vec::new(), Vec::new(), Vec::new());
+            for name in &names {
+                self.metrics.with_series(name, |series| {
+                    let (series_steps, series_values, series_timestamps) = series.columns();
+                    counts.push(series_steps.len() as u64);
+                    steps.extend_from_slice(&series_steps);
+                    values.extend_from_slice(&series_values);
+                    timestamps.extend_from_slice(&series_timestamps);
+                });
+            }
+            let names: Vec<String> = names.iter().map(|name| name.to_string()).collect();
+            (names, counts, steps, values, timestamps)
+        });
+        Ok((
+            names,
+            PyArray1::from_vec(py, counts),
+            PyArray1::from_vec(py, steps),
+            PyArray1::from_vec(py, values),
+            PyArray1::from_vec(py, timestamps),
+        ))
+    }
+
+    /// The retained log messages, oldest first, as timestamps in
+    /// milliseconds, level codes (see `LogLevel::code`) and messages.
+    pub fn export_logs<'py>(
+        &self,
+        py: Python<'py>,
+    ) -> (Bound<'py, PyArray1<i64>>, Bound<'py, PyArray1<u8>>, Vec<String>) {
+        let lines = py.allow_threads(|| self.logs.recent(usize::MAX, &logs::LogFilter::default()));
+        let timestamps = lines.iter().rev().map(|line| line.timestamp.timestamp_millis()).collect();
+        let levels = lines.iter().rev().map(|line| line.level.code()).collect();
+        let messages = lines.iter().rev().map(|line| line.message().to_string()).collect();
+        (PyArray1::from_vec(py, timestamps), PyArray1::from_vec(py, levels), messages)
+    }
+
+    /// Load columns laid out as `export_columns` returns them, one thread
+    /// per core across metrics.
+    ///
+    /// The GIL stays held while the arrays are borrowed so that no Python
+    /// thread can write to them mid-copy.
+    pub fn load_columns(
+        &self,
+        py: Python<'_>,
+        names: Vec<String>,
+        counts: PyReadonlyArray1<'_, u64>,
+        steps: PyReadonlyArray1<'_, u64>,
+        values: PyReadonlyArray1<'_, f64>,
+        timestamps_ms: PyReadonlyArray1<'_, i64>,
+    ) -> PyResult<()> {
+        let counts = counts.as_slice()?;
+        let (steps, values, timestamps_ms) = (steps.as_slice()?, values.as_slice()?, timestamps_ms.as_slice()?);
+        if names.len() != counts.len() {
+            return Err(PyValueError::new_err(format!(
+                "names and counts must have the same length, got {} and {}",
+                names.len(),
+                counts.len()
+            )));
+        }
+        let total = counts.iter().sum::<u64>() as usize;
+        if steps.len() != total || values.len() != total || timestamps_ms.len() != total {
+            return Err(PyValueError::new_err(format!(
+                "steps, values and timestamps must each hold the {} points counted, got {}, {} and {}",
+                total,
+                steps.len(),
+                values.len(),
+                timestamps_ms.len()
+            )));
+        }
+        let mut start = 0;
+        let mut series = Vec::with_capacity(names.len());
+        for (name, &count) in names.iter().zip(counts) {
+            let range = start..start + count as usize;
+            series.push((name.as_str(), &steps[range.clone()], &values[range.clone()], &timestamps_ms[range]));
+            start += count as usize;
+        }
+        // Keep these points in order relative to anything still queued.
+        self.flush(py);
+        self.metrics.load_columns(&series);
+        Ok(())
+    }
+
+    /// Append log messages with their timestamps in milliseconds and level
+    /// codes, as `export_logs` returns them.
+    pub fn load_logs(
+        &self,
+        py: Python<'_>,
+        timestamps_ms: Vec<i64>,
+        levels: Vec<u8>,
+        messages: Vec<String>,
+    ) -> PyResult<()> {
+        if timestamps_ms.len() != messages.len() || levels.len() != messages.len() {
+            return Err(PyValueError::new_err("timestamps, levels and messages must have the same length"));
+        }
+        let mut entries = Vec::with_capacity(messages.len());
+        for ((timestamp_ms, level), message) in timestamps_ms.into_iter().zip(levels).zip(messages) {
+            let level = LogLevel::from_code(level)
+                .ok_or_else(|| PyValueError::new_err(format!("unknown log level code {}", level)))?;
+            let timestamp = DateTime::from_timestamp_millis(timestamp_ms).unwrap_or_else(Utc::now);
+            entries.push(LogEntry {
+                message,
+                timestamp,
+                level,
+            });
+        }
+        py.allow_threads(|| entries.into_iter().for_each(|entry| self.logs.push(entry)));
+        Ok(())
+    }
+
+    /// Load the scalars of every TensorBoard event file under `logdir`, and
+    /// return the number of points loaded.
+    ///
+    /// Files are parsed in Rust, one thread per core, with the GIL
+    /// released. Each scalar is named by its tag, prefixed with its run's
+    /// directory under `logdir`.
+    pub fn load_tensorboard(&self, py: Python<'_>, logdir: std::path::PathBuf) -> PyResult<usize> {
+        py.allow_threads(|| tensorboard::load_dir(&logdir, &self.metrics))
+            .map_err(|e| PyRuntimeError::new_err(format!("cannot load {}: {}", logdir.display(), e)))
+    }
+
+    /// A context manager that times the block it wraps into the histogram
+    /// of section `name`.
+    pub fn timer(&self, name: &str) -> Timer {
+        Timer {
+            timers: self.timers.clone(),
+            cell: self.timers.get(name),
+            start: None,
+        }
+    }
+
+    /// Timings of section `name` in seconds, or `None` if it was never timed.
+    ///
+    /// Quantiles come from a histogram with two significant digits, over the
+    /// whole run and over the last `timers::WINDOW_SLICES` seconds.
+    pub fn timer_stats<'py>(&self, py: Python<'py>, name: &str) -> PyResult<Option<Bound<'py, PyDict>>> {
+        let Some(summary) = self.timers.summary(name) else {
+            return Ok(None);
+        };
+        let seconds = |nanos: u64| nanos as f64 / 1e9;
+        let dict = PyDict::new(py);
+        dict.set_item("count", summary.count)?;
+        dict.set_item("mean", summary.mean / 1e9)?;
+        dict.set_item("max", seconds(summary.max))?;
+        dict.set_item("p50", seconds(summary.p50))?;
+        dict.set_item("p95", seconds(summary.p95))?;
+        dict.set_item("p99", seconds(summary.p99))?;
+        dict.set_item("window_count", summary.window_count)?;
+        dict.set_item("window_p50", seconds(summary.window_p50))?;
+        dict.set_item("window_p95", seconds(summary.window_p95))?;
+        dict.set_item("window_p99", seconds(summary.window_p99))?;
+        Ok(Some(dict))
+    }
+
+    /// Heap bytes currently used by stored metric points, histogram
+    /// sketches and names.
+    pub fn memory_usage(&self) -> usize {
+        self.metrics.heap_bytes() + self.histograms.heap_bytes()
+    }
+}
+
+/// What `export_columns` returns: names, per-metric point counts, and the
+/// step, value and timestamp columns.
+type ExportedColumns<'py> = (
+    Vec<String>,
+    Bound<'py, PyArray1<u64>>,
+    Bound<'py, PyArray1<u64>>,
+    Bound<'py, PyArray1<f64>>,
+    Bound<'py, PyArray1<i64>>,
+);
+
+/// The array dtypes `log_histogram` sketches without converting.
+#[derive(FromPyObject)]
+pub enum HistogramValues<'py> {
+    F32(PyReadonlyArrayDyn<'py, f32>),
+    F64(PyReadonlyArrayDyn<'py, f64>),
+}
+
+/// Times a `with` block on a monotonic clock; made by `ClogTracker.timer`.
+#[pyclass]
+pub struct Timer {
+    timers: Arc<TimerStore>,
+    cell: Arc<TimerCell>,
+    start: Option<Instant>,
+}
+
+#[pymethods]
+impl Timer {
+    fn __enter__(mut slf: PyRefMut<'_, Self>) -> PyRefMut<'_, Self> {
+        slf.start = Some(Instant::now());
+        slf
+    }
+
+    /// Record the section, whether or not it raised.
+    #[pyo3(signature = (*_exc_info))]
+    fn __exit__(&mut self, _exc_info: &Bound<'_, PyTuple>) -> bool {
+        let end = Instant::now();
+        if let Some(start) = self.start.take() {
+            self.timers.record(&self.cell, start, end);
+        }
+        false
+    }
+}
+
+/// Writes metrics into a tracker's shared-memory channel from another
+/// process.
+///
+/// Each call claims a slot in the mapped ring with one compare-and-swap and
+/// copies the point in, without releasing the GIL or making a syscall. Points
+/// that find the ring full are dropped and counted.
+#[pyclass]
+pub struct SharedMemoryWriter {
+    writer: ShmWriter,
+}
+
+#[pymethods]
+impl SharedMemoryWriter {
+    #[new]
+    pub fn new(name: &str) -> PyResult<Self> {
+        let writer = ShmWriter::open(name)
+            .map_err(|e| PyRuntimeError::new_err(format!("cannot open shared-memory channel {}: {}", name, e)))?;
+        Ok(SharedMemoryWriter { writer })
+    }
+
+    pub fn log_metric(&self, name: &str, value: f64, step: u64) -> PyResult<()> {
+        self.writer
+            .push(name, value, step)
+            .map_err(|e| PyValueError::new_err(e.to_string()))?;
+        Ok(())
+    }
+
+    pub fn log_metrics(&self, metrics: &Bound<'_, PyDict>, step: u64) -> PyResult<()> {
+        for (name, value) in metrics.iter() {
+            self.log_metric(name.downcast::<PyString>()?.to_str()?, value.extract()?, step)?;
+        }
         Ok(())
     }
+
+    /// Points dropped because the channel was full, by any writer.
+    pub fn dropped(&self) -> u64 {
+        self.writer.dropped()
+    }
+}
+
+/// Open a saved run file in the terminal UI.
+///
+/// The file is memory-mapped and indexed by metric, so this starts quickly
+/// and keeps memory flat however many points the run holds.
+#[pyfunction]
+#[pyo3(signature = (path, max_fps=ui::DEFAULT_MAX_FPS))]
+pub fn view(py: Python<'_>, path: std::path::PathBuf, max_fps: f64) -> PyResult<()> {
+    let replay = Replay::open(&path)
+        .map_err(|e| PyRuntimeError::new_err(format!("cannot open {}: {}", path.display(), e)))?;
+    let replay = Arc::new(replay);
+    py.allow_threads(move || {
+        let mut ui = ui::TerminalUI::new(replay);
+        ui.max_fps = max_fps;
+        ui.run()
+    })
+    .map_err(|e| PyRuntimeError::new_err(e.to_string()))
+}
+
+/// Overlay several runs in the terminal UI, each metric's chart drawing one
+/// line per run in its own color.
+///
+/// `runs` holds trackers, shown live, and paths of saved run files; `labels`
+/// names them in the chart legend.
+#[pyfunction]
+#[pyo3(signature = (runs, labels, max_fps=ui::DEFAULT_MAX_FPS))]
+pub fn compare(py: Python<'_>, runs: Vec<Bound<'_, PyAny>>, labels: Vec<String>, max_fps: f64) -> PyResult<()> {
+    if labels.len() != runs.len() {
+        return Err(PyValueError::new_err(format!(
+            "got {} labels for {} runs",
+            labels.len(),
+            runs.len()
+        )));
+    }
+    let mut sources: Vec<(String, Arc<dyn ui::DataSource>)> = Vec::with_capacity(runs.len());
+    for (run, label) in runs.iter().zip(labels) {
+        let source: Arc<dyn ui::DataSource> = match run.downcast::<ClogTracker>() {
+            Ok(tracker) => {
+                let tracker = tracker.borrow().clone();
+                tracker.stop_requested.store(false, Ordering::Relaxed);
+                Arc::new(tracker)
+            }
+            Err(_) => {
+                let path: std::path::PathBuf = run.extract()?;
+                let replay = Replay::open(&path)
+                    .map_err(|e| PyRuntimeError::new_err(format!("cannot open {}: {}", path.display(), e)))?;
+                Arc::new(replay)
+            }
+        };
+        sources.push((label, source));
+    }
+    let comparison = Arc::new(Comparison::new(sources));
+    py.allow_threads(move || {
+        let mut ui = ui::TerminalUI::new(comparison);
+        ui.max_fps = max_fps;
+        ui.run()
+    })
+    .map_err(|e| PyRuntimeError::new_err(e.to_string()))
+}
+
+/// Follow a tracker served with `serve_http` from another machine in the
+/// terminal UI.
+///
+/// Reconnects on its own if the connection drops, carrying on from the last
+/// point it has.
+#[pyfunction]
+#[pyo3(signature = (address, max_fps=ui::DEFAULT_MAX_FPS))]
+pub fn attach(py: Python<'_>, address: String, max_fps: f64) -> PyResult<()> {
+    let tracker = ClogTracker::default();
+    let _attachment = py
+        .allow_threads(|| Attachment::start(&address, tracker.metrics.clone(), tracker.logs.clone()))
+        .map_err(|e| PyRuntimeError::new_err(format!("cannot attach to {}: {}", address, e)))?;
+    let tracker = Arc::new(tracker);
+    py.allow_threads(move || {
+        let mut ui = ui::TerminalUI::new(tracker);
+        ui.max_fps = max_fps;
+        ui.run()
+    })
+    .map_err(|e| PyRuntimeError::new_err(e.to_string()))
 }
 
 #[pymodule]
 fn _rust(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<ClogTracker>()?;
+    m.add_class::<SharedMemoryWriter>()?;
+    m.add_class::<Timer>()?;
+    m.add_function(wrap_pyfunction!(view, m)?)?;
+    m.add_function(wrap_pyfunction!(compare, m)?)?;
+    m.add_function(wrap_pyfunction!(attach, m)?)?;
     Ok(())
 }
 
@@ -97,10 +916,24 @@ mod tests {
 
     #[test]
     fn test_metric_tracking() {
-        let tracker = ClogTracker::new();
-        tracker.log_metric("test_metric".to_string(), 42.0, 1).unwrap();
-        
-        let metrics = tracker.metrics.lock().unwrap();
-        assert!(metrics.contains_key("test_metric"));
+        let tracker = ClogTracker::default();
+        tracker.record_metric("test_metric", 42.0, 1);
+
+        assert!(tracker.metrics.contains("test_metric"));
+    }
+
+    #[test]
+    fn test_max_logs() {
+        let tracker = ClogTracker {
+            logs: Arc::new(LogStore::new(Some(3))),
+            ..ClogTracker::default()
+        };
+        for i in 0..10 {
+            tracker.record_message(format!("message {}", i), "info");
+        }
+
+        assert_eq!(tracker.logs.len(), 3);
+        let oldest = tracker.logs.recent(3, &logs::LogFilter::default()).pop().unwrap();
+        assert_eq!(oldest.message(), "message 7");
     }
 }
\ No newline at end of file
@@ -0,0 +1,427 @@
+use std::collections::VecDeque;
+use std::fs::{File, OpenOptions};
+use std::io::{self, BufWriter, Write};
+use std::path::Path;
+use std::sync::atomic::{AtomicBool, AtomicU64, Ordering};
+use std::sync::Mutex;
+
+use chrono::{DateTime, Utc};
+
+#[derive(Clone, Debug)]
+pub struct LogEntry {
+    pub message: String,
+    pub timestamp: DateTime<Utc>,
+    pub level: LogLevel,
+}
+
+/// Severity of a log entry; variants are declared from least to most severe.
+#[derive(Clone, Copy, Debug, PartialEq, Eq, PartialOrd, Ord)]
+pub enum LogLevel {
+    Debug,
+    Info,
+    Warning,
+    Error,
+    Critical,
+}
+
+impl LogLevel {
+    pub const ALL: [LogLevel; 5] = [
+        LogLevel::Debug,
+        LogLevel::Info,
+        LogLevel::Warning,
+        LogLevel::Error,
+        LogLevel::Critical,
+    ];
+
+    /// Parse a level name, falling back to `Info` for anything unknown.
+    pub fn parse(level: &str) -> Self {
+        match level {
+            "debug" => LogLevel::Debug,
+            "warning" => LogLevel::Warning,
+            "error" => LogLevel::Error,
+            "critical" => LogLevel::Critical,
+            _ => LogLevel::Info,
+        }
+    }
+
+    /// Stable code used in run files and by `clog.LoggingHandler`; Debug and
+    /// Critical came later, so codes do not follow severity.
+    pub fn code(self) -> u8 {
+        match self {
+            LogLevel::Info => 0,
+            LogLevel::Warning => 1,
+            LogLevel::Error => 2,
+            LogLevel::Debug => 3,
+            LogLevel::Critical => 4,
+        }
+    }
+
+    pub fn from_code(code: u8) -> Option<Self> {
+        match code {
+            0 => Some(LogLevel::Info),
+            1 => Some(LogLevel::Warning),
+            2 => Some(LogLevel::Error),
+            3 => Some(LogLevel::Debug),
+            4 => Some(LogLevel::Critical),
+            _ => None,
+        }
+    }
+
+    pub fn name(self) -> &'static str {
+        match self {
+            LogLevel::Debug => "DEBUG",
+            LogLevel::Info => "INFO",
+            LogLevel::Warning => "WARNING",
+            LogLevel::Error => "ERROR",
+            LogLevel::Critical => "CRITICAL",
+        }
+    }
+
+    fn index(self) -> usize {
+        self as usize
+    }
+}
+
+/// A log entry with its display line rendered once, when it was logged.
+#[derive(Clone, Debug, PartialEq)]
+pub struct LogLine {
+    pub timestamp: DateTime<Utc>,
+    pub level: LogLevel,
+    line: Box<str>,
+}
+
+/// Length of the `[HH:MM:SS] ` prefix of a rendered line.
+const TIME_PREFIX_LEN: usize = 11;
+
+impl LogLine {
+    pub fn new(entry: &LogEntry) -> Self {
+        LogLine {
+            timestamp: entry.timestamp,
+            level: entry.level,
+            line: format!("[{}] {}", entry.timestamp.format("%H:%M:%S"), entry.message).into(),
+        }
+    }
+
+    /// `[HH:MM:SS] message`, ready to draw.
+    pub fn text(&self) -> &str {
+        &self.line
+    }
+
+    pub fn message(&self) -> &str {
+        &self.line[TIME_PREFIX_LEN..]
+    }
+
+    pub fn into_text(self) -> String {
+        self.line.into_string()
+    }
+}
+
+/// Which log lines to show: those at or above `min_level` whose message
+/// contains `text`.
+#[derive(Clone, Debug, PartialEq)]
+pub struct LogFilter {
+    pub min_level: LogLevel,
+    pub text: String,
+}
+
+impl Default for LogFilter {
+    fn default() -> Self {
+        LogFilter {
+            min_level: LogLevel::Debug,
+            text: String::new(),
+        }
+    }
+}
+
+impl LogFilter {
+    pub fn matches(&self, line: &LogLine) -> bool {
+        line.level >= self.min_level && (self.text.is_empty() || line.message().contains(&self.text))
+    }
+}
+
+#[derive(Default)]
+struct LogBuffer {
+    lines: VecDeque<LogLine>,
+    /// Sequence number of `lines[0]`.
+    first_seq: u64,
+    /// Sequence numbers of the retained lines of each level, oldest first.
+    by_level: [VecDeque<u64>; LogLevel::ALL.len()],
+    feed: Vec<LogEntry>,
+    spill: Option<BufWriter<File>>,
+}
+
+impl LogBuffer {
+    fn evict(&mut self) {
+        let Some(line) = self.lines.pop_front() else {
+            return;
+        };
+        let seq = self.first_seq;
+        self.first_seq += 1;
+        let index = &mut self.by_level[line.level.index()];
+        if index.front() == Some(&seq) {
+            index.pop_front();
+        }
+        if let Some(spill) = &mut self.spill {
+            let written = writeln!(
+                spill,
+                "{} {} {}",
+                line.timestamp.to_rfc3339(),
+                line.level.name(),
+                line.message()
+            );
+            // A full disk should not take logging down with it; stop spilling.
+            if written.is_err() {
+                self.spill = None;
+            }
+        }
+    }
+
+    fn get(&self, seq: u64) -> &LogLine {
+        &self.lines[(seq - self.first_seq) as usize]
+    }
+}
+
+/// The tracker's log messages: a ring buffer of at most `max_logs` rendered
+/// lines, indexed by level.
+///
+/// Lines are formatted once on push, so drawing never formats. Showing only
+/// warnings or errors walks the per-level indices instead of every line.
+/// With a spill file, lines evicted from the ring are appended to it as text
+/// rather than lost.
+#[derive(Default)]
+pub struct LogStore {
+    inner: Mutex<LogBuffer>,
+    max_logs: Option<usize>,
+    feed_enabled: AtomicBool,
+    generation: AtomicU64,
+}
+
+impl LogStore {
+    pub fn new(max_logs: Option<usize>) -> Self {
+        LogStore {
+            max_logs,
+            ..Self::default()
+        }
+    }
+
+    /// Like `new`, but lines evicted from the ring are appended to `path`.
+    pub fn with_spill(max_logs: Option<usize>, path: impl AsRef<Path>) -> io::Result<Self> {
+        let file = OpenOptions::new().create(true).append(true).open(path)?;
+        let store = Self::new(max_logs);
+        store.inner.lock().unwrap().spill = Some(BufWriter::new(file));
+        Ok(store)
+    }
+
+    pub fn push(&self, entry: LogEntry) {
+        let line = LogLine::new(&entry);
+        let mut inner = self.inner.lock().unwrap();
+        let seq = inner.first_seq + inner.lines.len() as u64;
+        inner.by_level[line.level.index()].push_back(seq);
+        inner.lines.push_back(line);
+        if self.feed_enabled.load(Ordering::Relaxed) {
+            inner.feed.push(entry);
+        }
+        if let Some(max_logs) = self.max_logs {
+            while inner.lines.len() > max_logs {
+                inner.evict();
+            }
+        }
+        self.generation.fetch_add(1, Ordering::Release);
+    }
+
+    /// Number of entries ever pushed; read without locking.
+    pub fn generation(&self) -> u64 {
+        self.generation.load(Ordering::Acquire)
+    }
+
+    pub fn len(&self) -> usize {
+        self.inner.lock().unwrap().lines.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// Up to `count` retained lines matching `filter`, newest first.
+    pub fn recent(&self, count: usize, filter: &LogFilter) -> Vec<LogLine> {
+        let inner = self.inner.lock().unwrap();
+        if filter.min_level == LogLevel::ALL[0] {
+            return inner
+                .lines
+                .iter()
+                .rev()
+                .filter(|line| filter.matches(line))
+                .take(count)
+                .cloned()
+                .collect();
+        }
+
+        // Merge the indices of the selected levels from their newest ends.
+        let mut cursors: Vec<_> = LogLevel::ALL
+            .iter()
+            .filter(|&&level| level >= filter.min_level)
+            .map(|level| inner.by_level[level.index()].iter().rev().peekable())
+            .collect();
+        let mut lines = Vec::with_capacity(count);
+        while lines.len() < count {
+            let Some(newest) = cursors
+                .iter_mut()
+                .filter_map(|cursor| cursor.peek().map(|&&seq| seq))
+                .max()
+            else {
+                break;
+            };
+            for cursor in &mut cursors {
+                cursor.next_if_eq(&&newest);
+            }
+            let line = inner.get(newest);
+            if filter.matches(line) {
+                lines.push(line.clone());
+            }
+        }
+        lines
+    }
+
+    /// Write buffered spill lines out to the file. As with a failed append,
+    /// a failed flush stops spilling.
+    pub fn flush_spill(&self) -> io::Result<()> {
+        let mut inner = self.inner.lock().unwrap();
+        let Some(spill) = &mut inner.spill else {
+            return Ok(());
+        };
+        let flushed = spill.flush();
+        if flushed.is_err() {
+            inner.spill = None;
+        }
+        flushed
+    }
+
+    /// Start copying every new entry into the change feed.
+    pub fn enable_feed(&self) {
+        self.feed_enabled.store(true, Ordering::Relaxed);
+    }
+
+    /// Stop copying entries into the change feed, and free any not drained
+    /// yet.
+    pub fn disable_feed(&self) {
+        self.feed_enabled.store(false, Ordering::Relaxed);
+        self.inner.lock().unwrap().feed = Vec::new();
+    }
+
+    /// Move entries logged since the last call into `out`.
+    pub fn drain_feed(&self, out: &mut Vec<LogEntry>) {
+        out.append(&mut self.inner.lock().unwrap().feed);
+    }
+
+    /// Like `drain_feed`, also returning every retained entry, oldest first,
+    /// as of the drain.
+    pub fn drain_feed_with_entries(&self, out: &mut Vec<LogEntry>) -> Vec<LogEntry> {
+        let mut inner = self.inner.lock().unwrap();
+        out.append(&mut inner.feed);
+        inner
+            .lines
+            .iter()
+            .map(|line| LogEntry {
+                message: line.message().to_string(),
+                timestamp: line.timestamp,
+                level: line.level,
+            })
+            .collect()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn entry(message: &str, level: LogLevel) -> LogEntry {
+        LogEntry {
+            message: message.to_string(),
+            timestamp: Utc::now(),
+            level,
+        }
+    }
+
+    fn messages(lines: &[LogLine]) -> Vec<&str> {
+        lines.iter().map(LogLine::message).collect()
+    }
+
+    #[test]
+    fn test_feed_only_sees_entries_after_enabling() {
+        let logs = LogStore::new(None);
+        logs.push(entry("before", LogLevel::Info));
+        logs.enable_feed();
+        logs.push(entry("after", LogLevel::Info));
+
+        let mut feed = Vec::new();
+        logs.drain_feed(&mut feed);
+        assert_eq!(feed.len(), 1);
+        assert_eq!(feed[0].message, "after");
+        logs.drain_feed(&mut feed);
+        assert_eq!(feed.len(), 1);
+
+        logs.disable_feed();
+        logs.push(entry("disabled", LogLevel::Info));
+        logs.drain_feed(&mut feed);
+        assert_eq!(feed.len(), 1);
+    }
+
+    #[test]
+    fn test_level_codes_round_trip() {
+        for level in LogLevel::ALL {
+            assert_eq!(LogLevel::from_code(level.code()), Some(level));
+        }
+        assert_eq!(LogLevel::parse("nonsense"), LogLevel::Info);
+        assert_eq!(LogLevel::parse("critical"), LogLevel::Critical);
+        assert!(LogLevel::Debug < LogLevel::Info && LogLevel::Error < LogLevel::Critical);
+    }
+
+    #[test]
+    fn test_filters_use_level_indices_across_evictions() {
+        let logs = LogStore::new(Some(100));
+        for i in 0..1_000 {
+            let level = match i % 10 {
+                0 => LogLevel::Error,
+                1 | 2 => LogLevel::Warning,
+                _ => LogLevel::Info,
+            };
+            logs.push(entry(&format!("step {}", i), level));
+        }
+        let errors = LogFilter {
+            min_level: LogLevel::Error,
+            ..LogFilter::default()
+        };
+        let warnings = LogFilter {
+            min_level: LogLevel::Warning,
+            ..LogFilter::default()
+        };
+        let text = LogFilter {
+            text: "step 99".to_string(),
+            ..LogFilter::default()
+        };
+
+        assert_eq!(logs.len(), 100);
+        assert_eq!(messages(&logs.recent(3, &errors)), vec!["step 990", "step 980", "step 970"]);
+        assert_eq!(logs.recent(1_000, &errors).len(), 10);
+        assert_eq!(messages(&logs.recent(4, &warnings)), vec!["step 992", "step 991", "step 990", "step 982"]);
+        assert_eq!(logs.recent(1_000, &text).len(), 10);
+        assert!(logs.recent(1, &LogFilter::default())[0].text().ends_with("] step 999"));
+    }
+
+    #[test]
+    fn test_evicted_lines_spill_to_disk() {
+        let path = std::env::temp_dir().join(format!("clog-{}-spill.log", std::process::id()));
+        let logs = LogStore::with_spill(Some(2), &path).unwrap();
+        for i in 0..5 {
+            logs.push(entry(&format!("message {}", i), LogLevel::Warning));
+        }
+        logs.flush_spill().unwrap();
+
+        let spilled = std::fs::read_to_string(&path).unwrap();
+        std::fs::remove_file(&path).unwrap();
+        let lines: Vec<&str> = spilled.lines().collect();
+        assert_eq!(lines.len(), 3);
+        assert!(lines[0].ends_with(" WARNING message 0"));
+        assert_eq!(logs.len(), 2);
+    }
+}
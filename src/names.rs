@@ -0,0 +1,300 @@
+use std::ops::Range;
+use std::sync::{Arc, RwLock};
+
+use crate::store::FnvMap;
+
+/// How a search query is matched against metric names.
+#[derive(Clone, Copy, Debug, PartialEq)]
+enum Mode {
+    /// `loss`: names containing the query.
+    Substring,
+    /// `^train/`: names starting with the query, found by binary search.
+    Prefix,
+    /// `~tl`: names containing the query's characters in order, ignoring
+    /// ASCII case.
+    Fuzzy,
+}
+
+fn parse_query(query: &str) -> (Mode, &str) {
+    if let Some(prefix) = query.strip_prefix('^') {
+        (Mode::Prefix, prefix)
+    } else if let Some(pattern) = query.strip_prefix('~') {
+        (Mode::Fuzzy, pattern)
+    } else {
+        (Mode::Substring, query)
+    }
+}
+
+fn fuzzy_match(name: &str, pattern: &str) -> bool {
+    let mut name = name.chars();
+    pattern
+        .chars()
+        .all(|p| name.any(|c| c.eq_ignore_ascii_case(&p)))
+}
+
+fn matches(mode: Mode, pattern: &str, name: &str) -> bool {
+    match mode {
+        Mode::Substring => name.contains(pattern),
+        Mode::Prefix => name.starts_with(pattern),
+        Mode::Fuzzy => fuzzy_match(name, pattern),
+    }
+}
+
+/// Metric names in sorted order, plus the names matching the current search
+/// query.
+///
+/// New names are merged in as they appear, and the match list is updated
+/// with them instead of being rebuilt. Typing more characters only re-checks
+/// the names that matched before, and prefix queries are a binary search, so
+/// the list stays responsive with 100k names.
+#[derive(Default)]
+pub struct NameIndex {
+    sorted: Vec<Arc<str>>,
+    known: usize,
+    query: String,
+    matches: Vec<Arc<str>>,
+    /// Prefix matches are a contiguous run of `sorted`, kept as a range
+    /// instead of copied into `matches`.
+    prefix_range: Option<Range<usize>>,
+}
+
+impl NameIndex {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    /// How many names have been added; new names are fetched from this id on.
+    pub fn known(&self) -> usize {
+        self.known
+    }
+
+    /// Add names that appeared since the last call.
+    pub fn extend(&mut self, names: Vec<Arc<str>>) {
+        if names.is_empty() {
+            return;
+        }
+        self.known += names.len();
+        // Inserting one at a time moves the tail each time; past a point a
+        // merge by sorting is cheaper.
+        if names.len() > 64 && names.len() > self.sorted.len() / 16 {
+            self.sorted.extend(names);
+            self.sorted.sort_unstable();
+            self.rebuild_matches();
+            return;
+        }
+        let (mode, pattern) = parse_query(&self.query);
+        for name in names {
+            if !self.query.is_empty() && mode != Mode::Prefix && matches(mode, pattern, &name) {
+                let at = self.matches.partition_point(|other| *other < name);
+                self.matches.insert(at, name.clone());
+            }
+            let at = self.sorted.partition_point(|other| *other < name);
+            self.sorted.insert(at, name);
+        }
+        if mode == Mode::Prefix {
+            self.rebuild_matches();
+        }
+    }
+
+    /// Set the search query, reusing the previous result where possible.
+    pub fn set_query(&mut self, query: &str) {
+        if query == self.query {
+            return;
+        }
+        let (old_mode, _) = parse_query(&self.query);
+        let (mode, pattern) = parse_query(query);
+        // Extending a query can only drop names from its matches.
+        let narrowing = !self.query.is_empty() && query.starts_with(self.query.as_str()) && mode == old_mode;
+        self.query = query.to_string();
+        if narrowing && mode != Mode::Prefix {
+            self.matches.retain(|name| matches(mode, pattern, name));
+        } else {
+            self.rebuild_matches();
+        }
+    }
+
+    fn rebuild_matches(&mut self) {
+        self.matches.clear();
+        self.prefix_range = None;
+        if self.query.is_empty() {
+            return;
+        }
+        let (mode, pattern) = parse_query(&self.query);
+        match mode {
+            Mode::Prefix => {
+                let start = self.sorted.partition_point(|name| &**name < pattern);
+                let len = self.sorted[start..]
+                    .partition_point(|name| name.starts_with(pattern));
+                self.prefix_range = Some(start..start + len);
+            }
+            _ => self.matches.extend(
+                self.sorted
+                    .iter()
+                    .filter(|name| matches(mode, pattern, name))
+                    .cloned(),
+            ),
+        }
+    }
+
+    /// Names matching the current query, sorted. All names if it is empty.
+    pub fn matches(&self) -> &[Arc<str>] {
+        match &self.prefix_range {
+            _ if self.query.is_empty() => &self.sorted,
+            Some(range) => &self.sorted[range.clone()],
+            None => &self.matches,
+        }
+    }
+
+    /// Position of `name` in `matches()`.
+    pub fn position(&self, name: &str) -> Option<usize> {
+        self.matches().binary_search_by(|other| (**other).cmp(name)).ok()
+    }
+
+    pub fn len(&self) -> usize {
+        self.sorted.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.sorted.is_empty()
+    }
+}
+
+/// Dense ids for metric names, so that a hot path can hand a `u32` to
+/// another thread instead of a copy of the name.
+///
+/// Looking up a known name takes a read lock and allocates nothing; only the
+/// first sighting of a name takes the write lock.
+#[derive(Default)]
+pub struct Interner {
+    ids: RwLock<FnvMap<Arc<str>, u32>>,
+    names: RwLock<Vec<Arc<str>>>,
+}
+
+impl Interner {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    pub fn intern(&self, name: &str) -> u32 {
+        if let Some(&id) = self.ids.read().unwrap().get(name) {
+            return id;
+        }
+        let mut ids = self.ids.write().unwrap();
+        if let Some(&id) = ids.get(name) {
+            return id;
+        }
+        let mut names = self.names.write().unwrap();
+        let id = names.len() as u32;
+        let name: Arc<str> = Arc::from(name);
+        names.push(name.clone());
+        ids.insert(name, id);
+        id
+    }
+
+    /// Append the names with ids from `names.len()` on to `names`, for a
+    /// consumer that keeps its own copy of the table.
+    pub fn names_since(&self, names: &mut Vec<Arc<str>>) {
+        let all = self.names.read().unwrap();
+        names.extend_from_slice(all.get(names.len()..).unwrap_or_default());
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn names(names: &[&str]) -> Vec<Arc<str>> {
+        names.iter().map(|&name| Arc::from(name)).collect()
+    }
+
+    fn matched(index: &NameIndex) -> Vec<&str> {
+        index.matches().iter().map(|name| &**name).collect()
+    }
+
+    #[test]
+    fn test_names_stay_sorted_as_they_arrive() {
+        let mut index = NameIndex::new();
+        index.extend(names(&["val/loss", "train/loss"]));
+        index.set_query("loss");
+        index.extend(names(&["lr", "train/acc", "eval/loss"]));
+
+        assert_eq!(index.known(), 5);
+        assert_eq!(matched(&index), vec!["eval/loss", "train/loss", "val/loss"]);
+        index.set_query("");
+        assert_eq!(matched(&index), vec!["eval/loss", "lr", "train/acc", "train/loss", "val/loss"]);
+        assert_eq!(index.position("train/acc"), Some(2));
+    }
+
+    #[test]
+    fn test_query_modes() {
+        let mut index = NameIndex::new();
+        index.extend(names(&["train/loss", "train/lr", "val/train_loss", "grad_norm"]));
+
+        index.set_query("^train");
+        assert_eq!(matched(&index), vec!["train/loss", "train/lr"]);
+        index.set_query("train");
+        assert_eq!(matched(&index), vec!["train/loss", "train/lr", "val/train_loss"]);
+        index.set_query("train/l");
+        assert_eq!(matched(&index), vec!["train/loss", "train/lr"]);
+        index.set_query("~TL");
+        assert_eq!(matched(&index), vec!["train/loss", "train/lr", "val/train_loss"]);
+        index.set_query("~TLS");
+        assert_eq!(matched(&index), vec!["train/loss", "val/train_loss"]);
+        assert_eq!(index.position("train/lr"), None);
+    }
+
+    #[test]
+    fn test_bulk_extend_matches_incremental() {
+        let all: Vec<Arc<str>> = (0..5_000).rev().map(|i| Arc::from(format!("layer_{}/grad", i))).collect();
+        let mut bulk = NameIndex::new();
+        bulk.set_query("~l9g");
+        bulk.extend(all.clone());
+        let mut incremental = NameIndex::new();
+        incremental.set_query("~l9g");
+        for name in all {
+            incremental.extend(vec![name]);
+        }
+
+        assert_eq!(matched(&bulk), matched(&incremental));
+        assert!(!bulk.matches().is_empty());
+    }
+
+    #[test]
+    fn test_interner() {
+        let interner = Interner::new();
+        assert_eq!(interner.intern("loss"), 0);
+        assert_eq!(interner.intern("acc"), 1);
+        assert_eq!(interner.intern("loss"), 0);
+
+        let mut table = names(&["loss"]);
+        interner.names_since(&mut table);
+        assert_eq!(table, names(&["loss", "acc"]));
+    }
+
+    /// Filtering 100k names as a query is typed:
+    /// `cargo test --release bench_name_filter -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_name_filter() {
+        let mut index = NameIndex::new();
+        index.extend(
+            (0..100_000)
+                .map(|i| Arc::from(format!("model/layer_{}/block_{}/grad_norm", i / 10, i % 10)))
+                .collect(),
+        );
+        for query in ["layer_42", "^model/layer_42", "~l42b3gn"] {
+            index.set_query("");
+            let start = std::time::Instant::now();
+            for end in 1..=query.len() {
+                index.set_query(&query[..end]);
+            }
+            println!(
+                "{:>16}: {:?} for {} keystrokes, {} matches",
+                query,
+                start.elapsed(),
+                query.len(),
+                index.matches().len()
+            );
+        }
+    }
+}
@@ -0,0 +1,617 @@
+//! Append-only binary run files.
+//!
+//! A run file is an 8-byte header (`CLOG`, then a little-endian `u32`
+//! version) followed by records. Every record is 8-byte aligned:
+//!
+//! ```text
+//! u32 payload length | u8 kind | 3 bytes padding | payload | u32 CRC-32 of payload | padding to 8
+//! ```
+//!
+//! * `NAME`:  `u32 id`, UTF-8 name
+//! * `BLOCK`: `u32 id`, `u32 count`, then the block's summary (`u64 first
+//!   step`, `u64 last step`, `f64 min`, `u64 min step`, `f64 max`, `u64 max
+//!   step`, `f64 sum`), then `count` steps (`u64`), `count` values (`f64`) and
+//!   `count` timestamps (`i64` ms)
+//! * `LOG`:   `i64 timestamp ms`, `u8 level`, UTF-8 message
+//!
+//! Because the block columns start 8-byte aligned, a reader can view them in
+//! place over a memory map, and the summary lets it index and chart a block
+//! without reading its columns at all. A crash can only leave a torn record at the end of
+//! the file, which readers detect through the length or CRC and ignore.
+
+use std::fs::File;
+use std::io::{self, BufWriter, Write};
+use std::path::Path;
+use std::sync::Arc;
+use std::time::{Duration, Instant};
+
+use chrono::DateTime;
+
+use crate::feed::Sink;
+use crate::logs::{LogEntry, LogLevel};
+use crate::series::Bucket;
+use crate::store::FeedPoint;
+
+pub const MAGIC: &[u8; 4] = b"CLOG";
+pub const VERSION: u32 = 1;
+pub const HEADER_LEN: usize = 8;
+
+const KIND_NAME: u8 = 1;
+const KIND_BLOCK: u8 = 2;
+const KIND_LOG: u8 = 3;
+
+pub const RECORD_HEADER_LEN: usize = 8;
+const BLOCK_HEADER_LEN: usize = 64;
+
+/// Points per metric buffered before a block is written out ahead of the next
+/// fsync.
+const MAX_BLOCK_POINTS: usize = 4096;
+
+const fn crc32_table() -> [u32; 256] {
+    let mut table = [0u32; 256];
+    let mut i = 0;
+    while i < 256 {
+        let mut crc = i as u32;
+        let mut bit = 0;
+        while bit < 8 {
+            crc = if crc & 1 != 0 { 0xedb8_8320 ^ (crc >> 1) } else { crc >> 1 };
+            bit += 1;
+        }
+        table[i] = crc;
+        i += 1;
+    }
+    table
+}
+
+static CRC32_TABLE: [u32; 256] = crc32_table();
+
+/// CRC-32 (IEEE), as used by zlib and PNG.
+pub fn crc32(bytes: &[u8]) -> u32 {
+    !bytes.iter().fold(!0u32, |crc, &byte| {
+        CRC32_TABLE[((crc ^ byte as u32) & 0xff) as usize] ^ (crc >> 8)
+    })
+}
+
+fn padding(len: usize) -> usize {
+    (8 - len % 8) % 8
+}
+
+/// Encodes records into any writer.
+pub struct RecordWriter<W: Write> {
+    out: W,
+    scratch: Vec<u8>,
+}
+
+impl<W: Write> RecordWriter<W> {
+    pub fn new(out: W) -> Self {
+        RecordWriter {
+            out,
+            scratch: Vec::new(),
+        }
+    }
+
+    pub fn write_header(&mut self) -> io::Result<()> {
+        self.out.write_all(MAGIC)?;
+        self.out.write_all(&VERSION.to_le_bytes())
+    }
+
+    fn write_record(&mut self, kind: u8) -> io::Result<()> {
+        let payload = &self.scratch;
+        let mut header = [0u8; RECORD_HEADER_LEN];
+        header[..4].copy_from_slice(&(payload.len() as u32).to_le_bytes());
+        header[4] = kind;
+        self.out.write_all(&header)?;
+        self.out.write_all(payload)?;
+        self.out.write_all(&crc32(payload).to_le_bytes())?;
+        self.out.write_all(&[0u8; 8][..padding(payload.len() + 4)])
+    }
+
+    pub fn write_name(&mut self, id: u32, name: &str) -> io::Result<()> {
+        self.scratch.clear();
+        self.scratch.extend_from_slice(&id.to_le_bytes());
+        self.scratch.extend_from_slice(name.as_bytes());
+        self.write_record(KIND_NAME)
+    }
+
+    /// Write one block; `steps`, `values` and `timestamps_ms` must be the same
+    /// non-zero length.
+    pub fn write_block(&mut self, id: u32, steps: &[u64], values: &[f64], timestamps_ms: &[i64]) -> io::Result<()> {
+        let summary = Bucket::summarize(steps.iter().copied().zip(values.iter().copied()))
+            .ok_or_else(|| io::Error::new(io::ErrorKind::InvalidInput, "empty block"))?;
+        let scratch = &mut self.scratch;
+        scratch.clear();
+        scratch.reserve(BLOCK_HEADER_LEN + 24 * steps.len());
+        scratch.extend_from_slice(&id.to_le_bytes());
+        scratch.extend_from_slice(&(steps.len() as u32).to_le_bytes());
+        scratch.extend_from_slice(&summary.first_step.to_le_bytes());
+        scratch.extend_from_slice(&summary.last_step.to_le_bytes());
+        scratch.extend_from_slice(&summary.min.to_le_bytes());
+        scratch.extend_from_slice(&summary.min_step.to_le_bytes());
+        scratch.extend_from_slice(&summary.max.to_le_bytes());
+        scratch.extend_from_slice(&summary.max_step.to_le_bytes());
+        scratch.extend_from_slice(&summary.sum.to_le_bytes());
+        steps.iter().for_each(|step| scratch.extend_from_slice(&step.to_le_bytes()));
+        values.iter().for_each(|value| scratch.extend_from_slice(&value.to_le_bytes()));
+        timestamps_ms.iter().for_each(|ts| scratch.extend_from_slice(&ts.to_le_bytes()));
+        self.write_record(KIND_BLOCK)
+    }
+
+    pub fn write_log(&mut self, entry: &LogEntry) -> io::Result<()> {
+        self.scratch.clear();
+        self.scratch.extend_from_slice(&entry.timestamp.timestamp_millis().to_le_bytes());
+        self.scratch.push(entry.level.code());
+        self.scratch.extend_from_slice(entry.message.as_bytes());
+        self.write_record(KIND_LOG)
+    }
+
+    pub fn get_mut(&mut self) -> &mut W {
+        &mut self.out
+    }
+
+    pub fn into_inner(self) -> W {
+        self.out
+    }
+}
+
+/// Points of one metric waiting to be written out as a block.
+#[derive(Default)]
+pub(crate) struct PendingBlock {
+    steps: Vec<u64>,
+    values: Vec<f64>,
+    timestamps_ms: Vec<i64>,
+}
+
+impl PendingBlock {
+    pub(crate) fn push(&mut self, point: &FeedPoint) {
+        self.steps.push(point.step);
+        self.values.push(point.value);
+        self.timestamps_ms.push(point.timestamp_ms);
+    }
+
+    pub(crate) fn len(&self) -> usize {
+        self.steps.len()
+    }
+
+    /// Write the buffered points as one block, if there are any, and clear
+    /// them.
+    pub(crate) fn write_to<W: Write>(&mut self, writer: &mut RecordWriter<W>, id: u32) -> io::Result<()> {
+        if self.steps.is_empty() {
+            return Ok(());
+        }
+        writer.write_block(id, &self.steps, &self.values, &self.timestamps_ms)?;
+        self.steps.clear();
+        self.values.clear();
+        self.timestamps_ms.clear();
+        Ok(())
+    }
+}
+
+/// Buffer each point with the others of its metric, indexed by feed id.
+pub(crate) fn group_points<'a>(pending: &'a mut Vec<PendingBlock>, point: &FeedPoint) -> &'a mut PendingBlock {
+    let id = point.id as usize;
+    if id >= pending.len() {
+        pending.resize_with(id + 1, PendingBlock::default);
+    }
+    let block = &mut pending[id];
+    block.push(point);
+    block
+}
+
+/// Streams the change feed into a run file.
+///
+/// Points are grouped into one block per metric per `fsync_interval` (or per
+/// `MAX_BLOCK_POINTS`), so even slowly logged metrics get blocks large enough
+/// to amortise their headers. Everything buffered is written and fsynced once
+/// per interval and when closing; a crash loses at most the last interval.
+pub struct Persister {
+    writer: RecordWriter<BufWriter<File>>,
+    pending: Vec<PendingBlock>,
+    fsync_interval: Duration,
+    last_sync: Instant,
+}
+
+impl Persister {
+    /// Create (or truncate) the run file at `path`.
+    pub fn create(path: impl AsRef<Path>, fsync_interval: Duration) -> io::Result<Self> {
+        let file = File::create(path)?;
+        let mut writer = RecordWriter::new(BufWriter::with_capacity(1 << 20, file));
+        writer.write_header()?;
+        Ok(Persister {
+            writer,
+            pending: Vec::new(),
+            fsync_interval,
+            last_sync: Instant::now(),
+        })
+    }
+
+    fn write_pending(&mut self, id: usize) -> io::Result<()> {
+        self.pending[id].write_to(&mut self.writer, id as u32)
+    }
+}
+
+impl Sink for Persister {
+    fn names(&mut self, first_id: u32, names: &[Arc<str>]) -> io::Result<()> {
+        for (i, name) in names.iter().enumerate() {
+            self.writer.write_name(first_id + i as u32, name)?;
+        }
+        Ok(())
+    }
+
+    fn points(&mut self, points: &[FeedPoint]) -> io::Result<()> {
+        for point in points {
+            if group_points(&mut self.pending, point).len() >= MAX_BLOCK_POINTS {
+                self.write_pending(point.id as usize)?;
+            }
+        }
+        Ok(())
+    }
+
+    fn logs(&mut self, entries: &[LogEntry]) -> io::Result<()> {
+        entries.iter().try_for_each(|entry| self.writer.write_log(entry))
+    }
+
+    fn flush(&mut self, closing: bool) -> io::Result<()> {
+        if !closing && self.last_sync.elapsed() < self.fsync_interval {
+            return Ok(());
+        }
+        for id in 0..self.pending.len() {
+            self.write_pending(id)?;
+        }
+        let out = self.writer.get_mut();
+        out.flush()?;
+        out.get_ref().sync_data()?;
+        self.last_sync = Instant::now();
+        Ok(())
+    }
+}
+
+/// A block of points as stored in a run file.
+#[derive(Clone, Copy, Debug)]
+pub struct BlockRecord<'a> {
+    pub id: u32,
+    pub count: usize,
+    pub summary: Bucket,
+    columns: &'a [u8],
+}
+
+impl<'a> BlockRecord<'a> {
+    fn parse(payload: &'a [u8]) -> Option<Self> {
+        let header = payload.get(..BLOCK_HEADER_LEN)?;
+        let count = u32_at(header, 4) as usize;
+        let columns = &payload[BLOCK_HEADER_LEN..];
+        if count == 0 || columns.len() != 24 * count {
+            return None;
+        }
+        Some(BlockRecord {
+            id: u32_at(header, 0),
+            count,
+            summary: Bucket {
+                first_step: u64_at(header, 8),
+                last_step: u64_at(header, 16),
+                min: f64_at(header, 24),
+                min_step: u64_at(header, 32),
+                max: f64_at(header, 40),
+                max_step: u64_at(header, 48),
+                sum: f64_at(header, 56),
+                count: count as u64,
+            },
+            columns,
+        })
+    }
+
+    /// The block whose payload starts at `offset` (as returned by
+    /// `Records::next_with_offset`), for readers that index a file once and
+    /// come back to individual blocks later.
+    pub fn at(bytes: &'a [u8], offset: usize) -> Option<Self> {
+        let count = u32_at(bytes.get(offset..offset + BLOCK_HEADER_LEN)?, 4) as usize;
+        Self::parse(bytes.get(offset..offset + BLOCK_HEADER_LEN + 24 * count)?)
+    }
+
+    fn column(&self, index: usize) -> &'a [u8] {
+        &self.columns[index * 8 * self.count..(index + 1) * 8 * self.count]
+    }
+
+    pub fn steps(&self) -> impl Iterator<Item = u64> + 'a {
+        self.column(0).chunks_exact(8).map(|b| u64::from_le_bytes(b.try_into().unwrap()))
+    }
+
+    pub fn values(&self) -> impl Iterator<Item = f64> + 'a {
+        self.column(1).chunks_exact(8).map(|b| f64::from_le_bytes(b.try_into().unwrap()))
+    }
+
+    pub fn timestamps_ms(&self) -> impl Iterator<Item = i64> + 'a {
+        self.column(2).chunks_exact(8).map(|b| i64::from_le_bytes(b.try_into().unwrap()))
+    }
+}
+
+#[derive(Clone, Debug)]
+pub enum Record<'a> {
+    Name { id: u32, name: &'a str },
+    Block(BlockRecord<'a>),
+    Log(LogEntry),
+}
+
+fn u32_at(bytes: &[u8], at: usize) -> u32 {
+    u32::from_le_bytes(bytes[at..at + 4].try_into().unwrap())
+}
+
+fn u64_at(bytes: &[u8], at: usize) -> u64 {
+    u64::from_le_bytes(bytes[at..at + 8].try_into().unwrap())
+}
+
+fn f64_at(bytes: &[u8], at: usize) -> f64 {
+    f64::from_le_bytes(bytes[at..at + 8].try_into().unwrap())
+}
+
+fn decode(kind: u8, payload: &[u8]) -> Option<Record<'_>> {
+    match kind {
+        KIND_NAME if payload.len() >= 4 => Some(Record::Name {
+            id: u32_at(payload, 0),
+            name: std::str::from_utf8(&payload[4..]).ok()?,
+        }),
+        KIND_BLOCK => BlockRecord::parse(payload).map(Record::Block),
+        KIND_LOG if payload.len() >= 9 => {
+            let timestamp_ms = i64::from_le_bytes(payload[..8].try_into().unwrap());
+            Some(Record::Log(LogEntry {
+                message: String::from_utf8_lossy(&payload[9..]).into_owned(),
+                timestamp: DateTime::from_timestamp_millis(timestamp_ms)?,
+                level: LogLevel::from_code(payload[8])?,
+            }))
+        }
+        _ => None,
+    }
+}
+
+/// Total length of the record whose 8-byte header is `header`: the header,
+/// payload, CRC and padding.
+pub fn record_len(header: &[u8]) -> usize {
+    let len = u32_at(header, 0) as usize;
+    RECORD_HEADER_LEN + len + 4 + padding(len + 4)
+}
+
+/// Decode one whole record read from a stream, checking its CRC. Records of
+/// unknown kinds decode to `None`.
+pub fn decode_record(record: &[u8]) -> io::Result<Option<Record<'_>>> {
+    let corrupt = || io::Error::new(io::ErrorKind::InvalidData, "corrupt clog record");
+    let len = u32_at(record, 0) as usize;
+    let payload = record.get(RECORD_HEADER_LEN..RECORD_HEADER_LEN + len).ok_or_else(corrupt)?;
+    let crc = record.get(RECORD_HEADER_LEN + len..RECORD_HEADER_LEN + len + 4).ok_or_else(corrupt)?;
+    if crc32(payload) != u32_at(crc, 0) {
+        return Err(corrupt());
+    }
+    let kind = record[4];
+    if !(KIND_NAME..=KIND_LOG).contains(&kind) {
+        return Ok(None);
+    }
+    decode(kind, payload).map(Some).ok_or_else(corrupt)
+}
+
+/// Iterates over the records of a run file held in memory (or mapped).
+///
+/// Stops at the first torn or corrupt record; `valid_len` then tells how many
+/// bytes of the file are intact. Records of unknown kinds are skipped.
+pub struct Records<'a> {
+    bytes: &'a [u8],
+    pos: usize,
+    verify: bool,
+}
+
+impl<'a> Records<'a> {
+    pub fn new(bytes: &'a [u8]) -> io::Result<Self> {
+        if bytes.len() < HEADER_LEN || &bytes[..4] != MAGIC {
+            return Err(io::Error::new(io::ErrorKind::InvalidData, "not a clog run file"));
+        }
+        let version = u32_at(bytes, 4);
+        if version != VERSION {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                format!("unsupported clog run file version {}", version),
+            ));
+        }
+        Ok(Records {
+            bytes,
+            pos: HEADER_LEN,
+            verify: true,
+        })
+    }
+
+    /// Skip CRC checks, so that indexing a mapped file only touches record
+    /// headers instead of reading every payload. Truncated records are still
+    /// detected through their lengths.
+    pub fn without_crc(mut self) -> Self {
+        self.verify = false;
+        self
+    }
+
+    /// Records from `pos` on, where `pos` is the start of a record found by an
+    /// earlier pass over the same bytes.
+    pub fn at(bytes: &'a [u8], pos: usize) -> Option<Self> {
+        (pos >= HEADER_LEN && pos <= bytes.len()).then_some(Records {
+            bytes,
+            pos,
+            verify: true,
+        })
+    }
+
+    /// Offset just past the last intact record read so far.
+    pub fn valid_len(&self) -> usize {
+        self.pos
+    }
+
+    /// The next intact record, with the offset of its payload.
+    pub fn next_with_offset(&mut self) -> Option<(usize, Record<'a>)> {
+        loop {
+            let bytes = self.bytes;
+            let header = bytes.get(self.pos..self.pos + RECORD_HEADER_LEN)?;
+            let len = u32_at(header, 0) as usize;
+            let start = self.pos + RECORD_HEADER_LEN;
+            let end = start + len;
+            let payload = bytes.get(start..end)?;
+            let crc = bytes.get(end..end + 4)?;
+            if self.verify && crc32(payload) != u32_at(crc, 0) {
+                return None;
+            }
+            let next = end + 4 + padding(len + 4);
+            let kind = header[4];
+            if !(KIND_NAME..=KIND_LOG).contains(&kind) {
+                self.pos = next;
+                continue;
+            }
+            let record = decode(kind, payload)?;
+            self.pos = next;
+            return Some((start, record));
+        }
+    }
+}
+
+impl<'a> Iterator for Records<'a> {
+    type Item = Record<'a>;
+
+    fn next(&mut self) -> Option<Record<'a>> {
+        self.next_with_offset().map(|(_, record)| record)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::feed::Pump;
+    use crate::logs::LogStore;
+    use crate::store::MetricStore;
+    use crate::Metric;
+    use chrono::Utc;
+
+    fn temp_path(name: &str) -> std::path::PathBuf {
+        std::env::temp_dir().join(format!("clog-{}-{}", std::process::id(), name))
+    }
+
+    #[test]
+    fn test_crc32() {
+        assert_eq!(crc32(b"123456789"), 0xcbf4_3926);
+    }
+
+    #[test]
+    fn test_round_trip_through_pump() {
+        let path = temp_path("round-trip.clog");
+        let metrics = Arc::new(MetricStore::new());
+        let logs = Arc::new(LogStore::new(None));
+        let pump = Pump::start(metrics.clone(), logs.clone(), Duration::from_millis(2));
+        pump.add_sink(Box::new(Persister::create(&path, Duration::from_secs(1)).unwrap()))
+            .unwrap();
+
+        for step in 0..10_000u64 {
+            metrics.push("loss", 1.0 / (step + 1) as f64, step, 1_000 + step as i64);
+            if step % 10 == 0 {
+                metrics.push("val/acc", step as f64, step, 2_000);
+            }
+        }
+        logs.push(LogEntry {
+            message: "finished".to_string(),
+            timestamp: Utc::now(),
+            level: LogLevel::Warning,
+        });
+        assert!(pump.close().is_none());
+
+        let bytes = std::fs::read(&path).unwrap();
+        let mut names = Vec::new();
+        let mut loss = Vec::new();
+        let mut acc_points = 0;
+        let mut logged = Vec::new();
+        for record in Records::new(&bytes).unwrap() {
+            match record {
+                Record::Name { id, name } => names.push((id, name.to_string())),
+                Record::Block(block) if block.id == 0 => {
+                    assert!(block.summary.min <= block.summary.max);
+                    loss.extend(block.steps().zip(block.values()).zip(block.timestamps_ms()));
+                }
+                Record::Block(block) => acc_points += block.count,
+                Record::Log(entry) => logged.push((entry.level, entry.message)),
+            }
+        }
+        std::fs::remove_file(&path).unwrap();
+
+        assert_eq!(names, vec![(0, "loss".to_string()), (1, "val/acc".to_string())]);
+        assert_eq!(loss.len(), 10_000);
+        assert_eq!(loss[9_999], ((9_999, 1.0 / 10_000.0), 1_000 + 9_999));
+        assert_eq!(acc_points, 1_000);
+        assert_eq!(logged, vec![(LogLevel::Warning, "finished".to_string())]);
+    }
+
+    #[test]
+    fn test_torn_tail_is_ignored() {
+        let mut writer = RecordWriter::new(Vec::new());
+        writer.write_header().unwrap();
+        writer.write_name(0, "loss").unwrap();
+        writer.write_block(0, &[1, 2], &[0.5, 0.25], &[10, 20]).unwrap();
+        let intact = writer.get_mut().len();
+        writer.write_block(0, &[3], &[0.125], &[30]).unwrap();
+        let mut bytes = writer.into_inner();
+        bytes.truncate(bytes.len() - 5);
+
+        let mut records = Records::new(&bytes).unwrap();
+        assert_eq!(records.by_ref().count(), 2);
+        assert_eq!(records.valid_len(), intact);
+
+        bytes.truncate(intact);
+        bytes[intact - 8] ^= 0xff;
+        assert_eq!(Records::new(&bytes).unwrap().count(), 1);
+    }
+
+    /// Binary run file versus one JSON line per `Metric`:
+    /// `cargo test --release bench_persist_throughput -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_persist_throughput() {
+        const POINTS: u64 = 5_000_000;
+        let names: Vec<Arc<str>> = (0..10).map(|i| Arc::from(format!("metric_{}", i))).collect();
+        let points: Vec<FeedPoint> = (0..POINTS)
+            .map(|i| FeedPoint {
+                id: (i % 10) as u32,
+                step: i / 10,
+                value: (i as f64).sin(),
+                timestamp_ms: 1_700_000_000_000 + i as i64,
+            })
+            .collect();
+
+        let path = temp_path("bench.clog");
+        let start = Instant::now();
+        let mut persister = Persister::create(&path, Duration::from_secs(1)).unwrap();
+        persister.names(0, &names).unwrap();
+        for batch in points.chunks(50_000) {
+            persister.points(batch).unwrap();
+            persister.flush(false).unwrap();
+        }
+        persister.flush(true).unwrap();
+        let binary = start.elapsed();
+        let binary_len = std::fs::metadata(&path).unwrap().len();
+
+        let json_path = temp_path("bench.jsonl");
+        let start = Instant::now();
+        let mut out = BufWriter::with_capacity(1 << 20, File::create(&json_path).unwrap());
+        for point in &points {
+            let metric = Metric {
+                name: names[point.id as usize].to_string(),
+                value: point.value,
+                timestamp: DateTime::from_timestamp_millis(point.timestamp_ms).unwrap(),
+                step: point.step as usize,
+            };
+            serde_json::to_writer(&mut out, &metric).unwrap();
+            out.write_all(b"\n").unwrap();
+        }
+        out.flush().unwrap();
+        out.get_ref().sync_data().unwrap();
+        let json = start.elapsed();
+        let json_len = std::fs::metadata(&json_path).unwrap().len();
+
+        std::fs::remove_file(&path).unwrap();
+        std::fs::remove_file(&json_path).unwrap();
+        for (label, elapsed, len) in [("binary", binary, binary_len), ("json lines", json, json_len)] {
+            println!(
+                "{:>10}: {:6.1} Mpts/s  {:5.1} bytes/point",
+                label,
+                POINTS as f64 / elapsed.as_secs_f64() / 1e6,
+                len as f64 / POINTS as f64
+            );
+        }
+    }
+}
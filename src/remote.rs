@@ -0,0 +1,575 @@
+//! Streaming metrics from other processes, such as the ranks of a DDP job, to
+//! one collector that owns the terminal.
+//!
+//! A sender connects over TCP (`host:port`) or a Unix domain socket
+//! (`unix:/path`) and writes a 16-byte hello: the run-file header, its `u32`
+//! rank and 4 bytes of padding. After that the stream carries the records of
+//! a run file (see `persist`), one block per metric per pump cycle, so a
+//! connection costs 24 bytes per point plus one small header per batch.
+//!
+//! The collector files each rank's points under `name@rank<N>` and, once
+//! every rank that logs a metric has reported a step, adds that step's mean,
+//! min and max across ranks to `name@mean`, `name@min` and `name@max`. Given
+//! the world size it waits for that many ranks; otherwise it waits for the
+//! ranks connected so far, and steps aggregated before a late rank connects
+//! do not include it. Ranks that disconnect are no longer waited for.
+
+use std::collections::{BTreeMap, HashMap, HashSet};
+use std::io::{self, BufWriter, Write};
+use std::net::{Shutdown, TcpStream};
+use std::os::unix::net::UnixStream;
+use std::path::PathBuf;
+use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant};
+
+use chrono::Utc;
+use tokio::io::{AsyncRead, AsyncReadExt, BufReader};
+use tokio::net::{TcpListener, UnixListener};
+use tokio::runtime::Runtime;
+
+use crate::feed::Sink;
+use crate::logs::{LogEntry, LogLevel, LogStore};
+use crate::persist::{self, PendingBlock, Record, RecordWriter, RECORD_HEADER_LEN};
+use crate::store::{FeedPoint, MetricStore};
+
+const HELLO_LEN: usize = 16;
+
+/// Largest record a collector accepts; a sender's blocks are far smaller.
+const MAX_RECORD_LEN: usize = 64 << 20;
+
+/// Steps of one metric waiting for slower ranks before the oldest is
+/// aggregated with the ranks it has.
+const MAX_PENDING_STEPS: usize = 1024;
+
+/// How long a sender keeps retrying while its collector is still starting.
+const CONNECT_TIMEOUT: Duration = Duration::from_secs(10);
+
+/// Where a collector listens: `unix:/path/to.sock` or `host:port`.
+#[derive(Clone, Debug, PartialEq)]
+pub enum Address {
+    Tcp(String),
+    Unix(PathBuf),
+}
+
+impl Address {
+    pub fn parse(address: &str) -> Self {
+        match address.strip_prefix("unix:") {
+            Some(path) => Address::Unix(PathBuf::from(path)),
+            None => Address::Tcp(address.to_string()),
+        }
+    }
+}
+
+enum Connection {
+    Tcp(TcpStream),
+    Unix(UnixStream),
+}
+
+impl Connection {
+    fn open(address: &Address) -> io::Result<Self> {
+        match address {
+            Address::Tcp(address) => {
+                let stream = TcpStream::connect(address)?;
+                stream.set_nodelay(true)?;
+                Ok(Connection::Tcp(stream))
+            }
+            Address::Unix(path) => UnixStream::connect(path).map(Connection::Unix),
+        }
+    }
+
+    fn shutdown(&self) -> io::Result<()> {
+        match self {
+            Connection::Tcp(stream) => stream.shutdown(Shutdown::Write),
+            Connection::Unix(stream) => stream.shutdown(Shutdown::Write),
+        }
+    }
+}
+
+impl Write for Connection {
+    fn write(&mut self, buf: &[u8]) -> io::Result<usize> {
+        match self {
+            Connection::Tcp(stream) => stream.write(buf),
+            Connection::Unix(stream) => stream.write(buf),
+        }
+    }
+
+    fn flush(&mut self) -> io::Result<()> {
+        match self {
+            Connection::Tcp(stream) => stream.flush(),
+            Connection::Unix(stream) => stream.flush(),
+        }
+    }
+}
+
+/// Streams the change feed to a collector.
+///
+/// Every pump cycle becomes one write: a block per metric that got points,
+/// plus any new names and log messages.
+pub struct Sender {
+    writer: RecordWriter<BufWriter<Connection>>,
+    pending: Vec<PendingBlock>,
+}
+
+impl Sender {
+    /// Connect to the collector at `address`, retrying for a few seconds in
+    /// case it is still starting up.
+    pub fn connect(address: &str, rank: u32) -> io::Result<Self> {
+        let address = Address::parse(address);
+        let deadline = Instant::now() + CONNECT_TIMEOUT;
+        let connection = loop {
+            match Connection::open(&address) {
+                Ok(connection) => break connection,
+                Err(_) if Instant::now() < deadline => std::thread::sleep(Duration::from_millis(100)),
+                Err(err) => return Err(err),
+            }
+        };
+        let mut writer = RecordWriter::new(BufWriter::with_capacity(1 << 16, connection));
+        writer.write_header()?;
+        let out = writer.get_mut();
+        out.write_all(&rank.to_le_bytes())?;
+        out.write_all(&[0u8; 4])?;
+        Ok(Sender {
+            writer,
+            pending: Vec::new(),
+        })
+    }
+}
+
+impl Sink for Sender {
+    fn names(&mut self, first_id: u32, names: &[Arc<str>]) -> io::Result<()> {
+        for (i, name) in names.iter().enumerate() {
+            self.writer.write_name(first_id + i as u32, name)?;
+        }
+        Ok(())
+    }
+
+    fn points(&mut self, points: &[FeedPoint]) -> io::Result<()> {
+        for point in points {
+            persist::group_points(&mut self.pending, point);
+        }
+        Ok(())
+    }
+
+    fn logs(&mut self, entries: &[LogEntry]) -> io::Result<()> {
+        entries.iter().try_for_each(|entry| self.writer.write_log(entry))
+    }
+
+    fn flush(&mut self, closing: bool) -> io::Result<()> {
+        for (id, block) in self.pending.iter_mut().enumerate() {
+            block.write_to(&mut self.writer, id as u32)?;
+        }
+        let out = self.writer.get_mut();
+        out.flush()?;
+        if closing {
+            out.get_ref().shutdown()?;
+        }
+        Ok(())
+    }
+}
+
+/// One step of one metric, accumulated across ranks.
+#[derive(Clone, Copy)]
+struct StepAccumulator {
+    ranks: usize,
+    sum: f64,
+    min: f64,
+    max: f64,
+    timestamp_ms: i64,
+}
+
+impl StepAccumulator {
+    fn new() -> Self {
+        StepAccumulator {
+            ranks: 0,
+            sum: 0.0,
+            min: f64::INFINITY,
+            max: f64::NEG_INFINITY,
+            timestamp_ms: i64::MIN,
+        }
+    }
+
+    fn add(&mut self, value: f64, timestamp_ms: i64) {
+        self.ranks += 1;
+        self.sum += value;
+        self.min = self.min.min(value);
+        self.max = self.max.max(value);
+        self.timestamp_ms = self.timestamp_ms.max(timestamp_ms);
+    }
+}
+
+/// Cross-rank aggregation of one metric name.
+struct MetricAggregate {
+    /// `name@mean`, `name@min` and `name@max`.
+    names: [String; 3],
+    /// Connected ranks that have logged this metric.
+    ranks: HashSet<u32>,
+    /// Ranks that logged this metric and then disconnected.
+    departed: usize,
+    pending: BTreeMap<u64, StepAccumulator>,
+    /// Steps up to here have been aggregated; later points for them are only
+    /// kept per rank.
+    done_through: Option<u64>,
+}
+
+impl MetricAggregate {
+    fn new(name: &str) -> Self {
+        MetricAggregate {
+            names: ["mean", "min", "max"].map(|suffix| format!("{}@{}", name, suffix)),
+            ranks: HashSet::new(),
+            departed: 0,
+            pending: BTreeMap::new(),
+            done_through: None,
+        }
+    }
+
+    fn add(&mut self, step: u64, value: f64, timestamp_ms: i64) {
+        if self.done_through.is_some_and(|done| step <= done) {
+            return;
+        }
+        self.pending.entry(step).or_insert_with(StepAccumulator::new).add(value, timestamp_ms);
+    }
+
+    /// Store the oldest steps every rank has reported, in step order.
+    fn emit_ready(&mut self, world_size: usize, metrics: &MetricStore) {
+        let expected = self.ranks.len().max(world_size.saturating_sub(self.departed));
+        let mut ready = Vec::new();
+        while let Some((_, acc)) = self.pending.first_key_value() {
+            if acc.ranks < expected && self.pending.len() <= MAX_PENDING_STEPS {
+                break;
+            }
+            let (step, acc) = self.pending.pop_first().unwrap();
+            ready.push((step, acc));
+            self.done_through = Some(step);
+        }
+        if ready.is_empty() {
+            return;
+        }
+        let [mean, min, max] = &self.names;
+        metrics.extend_timed(mean, ready.iter().map(|(step, acc)| (*step, acc.sum / acc.ranks as f64, acc.timestamp_ms)));
+        metrics.extend_timed(min, ready.iter().map(|(step, acc)| (*step, acc.min, acc.timestamp_ms)));
+        metrics.extend_timed(max, ready.iter().map(|(step, acc)| (*step, acc.max, acc.timestamp_ms)));
+    }
+}
+
+struct CollectorShared {
+    metrics: Arc<MetricStore>,
+    logs: Arc<LogStore>,
+    /// Ranks expected to log each metric; 0 if unknown.
+    world_size: usize,
+    aggregates: Mutex<HashMap<Arc<str>, MetricAggregate>>,
+}
+
+/// What a collector knows about one sender.
+struct RankStream {
+    rank: u32,
+    /// Metric names by the sender's ids, and the same names tagged with its
+    /// rank.
+    names: Vec<Option<(Arc<str>, String)>>,
+}
+
+impl CollectorShared {
+    fn log(&self, level: LogLevel, message: String) {
+        self.logs.push(LogEntry {
+            message,
+            timestamp: Utc::now(),
+            level,
+        });
+    }
+
+    fn apply(&self, stream: &mut RankStream, record: Record<'_>) -> io::Result<()> {
+        match record {
+            Record::Name { id, name } => {
+                let id = id as usize;
+                if id >= stream.names.len() {
+                    stream.names.resize(id + 1, None);
+                }
+                let name: Arc<str> = Arc::from(name);
+                let tagged = format!("{}@rank{}", name, stream.rank);
+                self.aggregates
+                    .lock()
+                    .unwrap()
+                    .entry(name.clone())
+                    .or_insert_with(|| MetricAggregate::new(&name))
+                    .ranks
+                    .insert(stream.rank);
+                stream.names[id] = Some((name, tagged));
+            }
+            Record::Block(block) => {
+                let Some(Some((name, tagged))) = stream.names.get(block.id as usize) else {
+                    return Err(io::Error::new(io::ErrorKind::InvalidData, "block for an unknown metric id"));
+                };
+                let points = || {
+                    block
+                        .steps()
+                        .zip(block.values())
+                        .zip(block.timestamps_ms())
+                        .map(|((step, value), timestamp_ms)| (step, value, timestamp_ms))
+                };
+                self.metrics.extend_timed(tagged, points());
+                // Held while storing, so that two ranks completing steps at
+                // once still store them in step order.
+                let mut aggregates = self.aggregates.lock().unwrap();
+                let aggregate = aggregates.get_mut(name).expect("registered with its name");
+                for (step, value, timestamp_ms) in points() {
+                    aggregate.add(step, value, timestamp_ms);
+                }
+                aggregate.emit_ready(self.world_size, &self.metrics);
+            }
+            Record::Log(entry) => self.logs.push(LogEntry {
+                message: format!("[rank {}] {}", stream.rank, entry.message),
+                ..entry
+            }),
+        }
+        Ok(())
+    }
+
+    /// Stop waiting for a rank that went away.
+    fn disconnect(&self, stream: &RankStream) {
+        let mut aggregates = self.aggregates.lock().unwrap();
+        for (name, _) in stream.names.iter().flatten() {
+            if let Some(aggregate) = aggregates.get_mut(name) {
+                if aggregate.ranks.remove(&stream.rank) {
+                    aggregate.departed += 1;
+                }
+                aggregate.emit_ready(self.world_size, &self.metrics);
+            }
+        }
+    }
+
+    async fn serve<S: AsyncRead + Unpin>(&self, stream: S) {
+        let mut reader = BufReader::with_capacity(1 << 16, stream);
+        let mut hello = [0u8; HELLO_LEN];
+        if reader.read_exact(&mut hello).await.is_err() || persist::Records::new(&hello[..persist::HEADER_LEN]).is_err() {
+            self.log(LogLevel::Warning, "collector: rejected a connection without a clog hello".to_string());
+            return;
+        }
+        let mut stream = RankStream {
+            rank: u32::from_le_bytes(hello[8..12].try_into().unwrap()),
+            names: Vec::new(),
+        };
+        self.log(LogLevel::Info, format!("collector: rank {} connected", stream.rank));
+
+        let result = self.read_records(&mut reader, &mut stream).await;
+        self.disconnect(&stream);
+        match result {
+            Ok(()) => self.log(LogLevel::Info, format!("collector: rank {} finished", stream.rank)),
+            Err(err) => self.log(
+                LogLevel::Warning,
+                format!("collector: lost rank {}: {}", stream.rank, err),
+            ),
+        }
+    }
+
+    async fn read_records<S: AsyncRead + Unpin>(&self, reader: &mut BufReader<S>, stream: &mut RankStream) -> io::Result<()> {
+        let mut record = Vec::new();
+        loop {
+            let mut header = [0u8; RECORD_HEADER_LEN];
+            match reader.read_exact(&mut header).await {
+                Ok(_) => {}
+                Err(err) if err.kind() == io::ErrorKind::UnexpectedEof => return Ok(()),
+                Err(err) => return Err(err),
+            }
+            let len = persist::record_len(&header);
+            if len > MAX_RECORD_LEN {
+                return Err(io::Error::new(io::ErrorKind::InvalidData, "record too large"));
+            }
+            record.clear();
+            record.extend_from_slice(&header);
+            record.resize(len, 0);
+            reader.read_exact(&mut record[RECORD_HEADER_LEN..]).await?;
+            if let Some(decoded) = persist::decode_record(&record)? {
+                self.apply(stream, decoded)?;
+            }
+        }
+    }
+}
+
+/// Accepts connections from `Sender`s on a small tokio runtime and merges
+/// what they send into a tracker's stores.
+pub struct Collector {
+    runtime: Option<Runtime>,
+    address: String,
+    socket_path: Option<PathBuf>,
+}
+
+impl Collector {
+    /// Listen on `address`. With `world_size`, each step is aggregated once
+    /// that many ranks (less any that disconnected) have reported it.
+    pub fn start(
+        address: &str,
+        world_size: Option<usize>,
+        metrics: Arc<MetricStore>,
+        logs: Arc<LogStore>,
+    ) -> io::Result<Self> {
+        let runtime = tokio::runtime::Builder::new_multi_thread()
+            .enable_io()
+            .thread_name("clog-collector")
+            .build()?;
+        let shared = Arc::new(CollectorShared {
+            metrics,
+            logs,
+            world_size: world_size.unwrap_or(0),
+            aggregates: Mutex::new(HashMap::new()),
+        });
+        let (address, socket_path) = match Address::parse(address) {
+            Address::Tcp(address) => {
+                let listener = runtime.block_on(TcpListener::bind(&address))?;
+                let bound = listener.local_addr()?.to_string();
+                runtime.spawn(async move {
+                    while let Ok((stream, _)) = listener.accept().await {
+                        let _ = stream.set_nodelay(true);
+                        let shared = shared.clone();
+                        tokio::spawn(async move { shared.serve(stream).await });
+                    }
+                });
+                (bound, None)
+            }
+            Address::Unix(path) => {
+                // A socket file left behind by an earlier collector would
+                // make binding fail.
+                match std::fs::remove_file(&path) {
+                    Err(err) if err.kind() != io::ErrorKind::NotFound => return Err(err),
+                    _ => {}
+                }
+                let listener = {
+                    let _guard = runtime.enter();
+                    UnixListener::bind(&path)?
+                };
+                runtime.spawn(async move {
+                    while let Ok((stream, _)) = listener.accept().await {
+                        let shared = shared.clone();
+                        tokio::spawn(async move { shared.serve(stream).await });
+                    }
+                });
+                (format!("unix:{}", path.display()), Some(path))
+            }
+        };
+        Ok(Collector {
+            runtime: Some(runtime),
+            address,
+            socket_path,
+        })
+    }
+
+    /// The address senders should connect to, with the actual port if `:0`
+    /// was asked for.
+    pub fn address(&self) -> &str {
+        &self.address
+    }
+}
+
+impl Drop for Collector {
+    fn drop(&mut self) {
+        if let Some(runtime) = self.runtime.take() {
+            runtime.shutdown_background();
+        }
+        if let Some(path) = &self.socket_path {
+            let _ = std::fs::remove_file(path);
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::feed::Pump;
+
+    fn wait_for(metrics: &MetricStore, name: &str, count: u64) {
+        let deadline = Instant::now() + Duration::from_secs(30);
+        while metrics.with_series(name, |series| series.total_count()) != Some(count) {
+            assert!(Instant::now() < deadline, "timed out waiting for {}", name);
+            std::thread::sleep(Duration::from_millis(5));
+        }
+    }
+
+    /// Run `ranks` senders, each logging `metrics` metrics for `steps` steps
+    /// through its own store and pump, as separate processes would.
+    fn run_ranks(address: &str, ranks: u32, metrics: usize, steps: u64) {
+        let names: Vec<String> = (0..metrics).map(|i| format!("metric_{}", i)).collect();
+        std::thread::scope(|scope| {
+            for rank in 0..ranks {
+                let names = &names;
+                scope.spawn(move || {
+                    let store = Arc::new(MetricStore::new());
+                    let pump = Pump::start(store.clone(), Arc::new(LogStore::new(None)), Duration::from_millis(50));
+                    pump.add_sink(Box::new(Sender::connect(address, rank).unwrap())).unwrap();
+                    let points: Vec<(&str, f64)> = names.iter().map(|name| (name.as_str(), 0.0)).collect();
+                    for step in 0..steps {
+                        let points: Vec<(&str, f64)> =
+                            points.iter().map(|&(name, _)| (name, (rank as u64 * step) as f64)).collect();
+                        store.push_many(&points, step, 0);
+                    }
+                    assert!(pump.close().is_none());
+                });
+            }
+        });
+    }
+
+    #[test]
+    fn test_ranks_are_tagged_and_aggregated() {
+        for address in [
+            "127.0.0.1:0".to_string(),
+            format!("unix:{}", std::env::temp_dir().join(format!("clog-{}.sock", std::process::id())).display()),
+        ] {
+            let metrics = Arc::new(MetricStore::new());
+            let logs = Arc::new(LogStore::new(None));
+            let collector = Collector::start(&address, Some(3), metrics.clone(), logs.clone()).unwrap();
+            run_ranks(collector.address(), 3, 2, 100);
+            wait_for(&metrics, "metric_1@max", 100);
+
+            assert_eq!(metrics.with_series("metric_0@rank2", |series| series.total_count()), Some(100));
+            let last = |name: &str| metrics.with_series(name, |series| series.last_value()).flatten();
+            // Rank r logs r * step, so step 99 is 0, 99 and 198 across ranks.
+            assert_eq!(last("metric_1@mean"), Some(99.0));
+            assert_eq!(last("metric_1@min"), Some(0.0));
+            assert_eq!(last("metric_1@max"), Some(198.0));
+            assert_eq!(metrics.len(), 2 * (3 + 3));
+            drop(collector);
+        }
+    }
+
+    #[test]
+    fn test_departed_rank_releases_waiting_steps() {
+        let metrics = Arc::new(MetricStore::new());
+        let collector = Collector::start("127.0.0.1:0", Some(2), metrics.clone(), Arc::new(LogStore::new(None))).unwrap();
+        let mut slow = Sender::connect(collector.address(), 1).unwrap();
+        slow.names(0, &[Arc::from("loss")]).unwrap();
+        slow.points(&[FeedPoint { id: 0, step: 0, value: 4.0, timestamp_ms: 0 }]).unwrap();
+        slow.flush(false).unwrap();
+        let mut fast = Sender::connect(collector.address(), 0).unwrap();
+        fast.names(0, &[Arc::from("loss")]).unwrap();
+        let points: Vec<FeedPoint> = (0..3).map(|step| FeedPoint { id: 0, step, value: 2.0, timestamp_ms: 0 }).collect();
+        fast.points(&points).unwrap();
+        fast.flush(false).unwrap();
+        wait_for(&metrics, "loss@rank0", 3);
+        wait_for(&metrics, "loss@mean", 1);
+
+        slow.flush(true).unwrap();
+        wait_for(&metrics, "loss@mean", 3);
+        assert_eq!(metrics.with_series("loss@mean", |series| series.iter().next()), Some(Some((0, 3.0))));
+    }
+
+    /// 64 ranks each logging 20 metrics every step:
+    /// `cargo test --release bench_collector -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_collector() {
+        let (ranks, metrics_per_rank, steps) = (64, 20, 5_000);
+        let metrics = Arc::new(MetricStore::new());
+        let collector =
+            Collector::start("127.0.0.1:0", Some(ranks as usize), metrics.clone(), Arc::new(LogStore::new(None))).unwrap();
+        let start = Instant::now();
+        run_ranks(collector.address(), ranks, metrics_per_rank, steps);
+        wait_for(&metrics, &format!("metric_{}@max", metrics_per_rank - 1), steps);
+        let elapsed = start.elapsed();
+        let points = ranks as u64 * metrics_per_rank as u64 * steps;
+        println!(
+            "{} ranks x {} metrics x {} steps: {:?}, {:.1} M points/s collected",
+            ranks,
+            metrics_per_rank,
+            steps,
+            elapsed,
+            points as f64 / elapsed.as_secs_f64() / 1e6
+        );
+    }
+}
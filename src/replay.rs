@@ -0,0 +1,305 @@
+//! Read-only view of a saved run file, for `clog view`.
+
+use std::collections::HashMap;
+use std::fs::File;
+use std::io;
+use std::path::Path;
+use std::sync::Arc;
+
+use memmap2::Mmap;
+
+use crate::logs::{LogFilter, LogLine};
+use crate::persist::{BlockRecord, Record, Records};
+use crate::series::{Bucket, Decimator};
+use crate::stats::Summary;
+use crate::ui::DataSource;
+
+/// Where one block of a metric lives in the file, plus its summary.
+struct BlockIndex {
+    offset: usize,
+    summary: Bucket,
+}
+
+#[derive(Default)]
+struct MetricIndex {
+    blocks: Vec<BlockIndex>,
+    /// All block summaries merged.
+    summary: Option<Bucket>,
+}
+
+/// A run file mapped into memory and indexed by metric.
+///
+/// Opening reads only record headers: each block's summary goes into a small
+/// per-metric index and its points stay in the page cache until a chart needs
+/// them. Charting a metric merges the summaries of blocks that fall inside one
+/// chart column and reads points only from blocks that straddle a column
+/// boundary, so the work and resident memory depend on the chart width rather
+/// than on the length of the run.
+pub struct Replay {
+    map: Mmap,
+    names: Vec<Arc<str>>,
+    ids: HashMap<Arc<str>, usize>,
+    metrics: Vec<MetricIndex>,
+    log_offsets: Vec<usize>,
+}
+
+impl Replay {
+    pub fn open(path: impl AsRef<Path>) -> io::Result<Self> {
+        let file = File::open(path)?;
+        // Safety: run files are only ever appended to, so bytes already mapped
+        // are not modified underneath us. Appends made after opening are not
+        // seen.
+        let map = unsafe { Mmap::map(&file)? };
+
+        let mut names: Vec<Arc<str>> = Vec::new();
+        let mut metrics: Vec<MetricIndex> = Vec::new();
+        let mut log_offsets = Vec::new();
+        let mut records = Records::new(&map)?.without_crc();
+        while let Some((offset, record)) = records.next_with_offset() {
+            match record {
+                Record::Name { id, name } => {
+                    let id = id as usize;
+                    if id >= names.len() {
+                        names.resize(id + 1, Arc::from(""));
+                    }
+                    names[id] = Arc::from(name);
+                }
+                Record::Block(block) => {
+                    let id = block.id as usize;
+                    if id >= metrics.len() {
+                        metrics.resize_with(id + 1, MetricIndex::default);
+                    }
+                    let metric = &mut metrics[id];
+                    match &mut metric.summary {
+                        Some(summary) => summary.merge(&block.summary),
+                        summary => *summary = Some(block.summary),
+                    }
+                    metric.blocks.push(BlockIndex {
+                        offset,
+                        summary: block.summary,
+                    });
+                }
+                Record::Log(_) => log_offsets.push(offset - 8),
+            }
+        }
+
+        metrics.resize_with(names.len(), MetricIndex::default);
+        let ids = names.iter().enumerate().map(|(id, name)| (name.clone(), id)).collect();
+        Ok(Replay {
+            map,
+            names,
+            ids,
+            metrics,
+            log_offsets,
+        })
+    }
+
+    fn metric(&self, name: &str) -> Option<&MetricIndex> {
+        self.ids.get(name).and_then(|&id| self.metrics.get(id))
+    }
+
+    fn block(&self, index: &BlockIndex) -> BlockRecord<'_> {
+        BlockRecord::at(&self.map, index.offset).expect("block was validated while indexing")
+    }
+
+    /// Total number of points stored for `name`.
+    pub fn point_count(&self, name: &str) -> Option<u64> {
+        self.metric(name).map(|metric| metric.summary.map_or(0, |summary| summary.count))
+    }
+
+    pub fn log_count(&self) -> usize {
+        self.log_offsets.len()
+    }
+}
+
+impl DataSource for Replay {
+    fn names_since(&self, first_id: usize) -> Vec<Arc<str>> {
+        self.names.get(first_id..).map_or_else(Vec::new, <[Arc<str>]>::to_vec)
+    }
+
+    // Block summaries give the whole-run extremes and mean; the EMA, variance
+    // and window aggregates are not stored in run files.
+    fn summary(&self, name: &str) -> Option<Summary> {
+        let metric = self.metric(name)?;
+        let bucket = metric.summary?;
+        let last = self.block(metric.blocks.last()?).values().last()?;
+        Some(Summary {
+            count: bucket.count,
+            nan_count: 0,
+            last,
+            min: bucket.min,
+            min_step: bucket.min_step,
+            max: bucket.max,
+            max_step: bucket.max_step,
+            mean: bucket.mean(),
+            variance: f64::NAN,
+            ema: f64::NAN,
+            window_count: 0,
+            window_mean: f64::NAN,
+            window_min: f64::NAN,
+            window_max: f64::NAN,
+        })
+    }
+
+    fn version(&self, name: &str) -> Option<u64> {
+        self.point_count(name)
+    }
+
+    // A replayed run never changes.
+    fn generation(&self) -> u64 {
+        0
+    }
+
+    fn step_range(&self, name: &str) -> Option<(u64, u64)> {
+        let summary = self.metric(name)?.summary?;
+        Some((summary.first_step, summary.last_step))
+    }
+
+    fn decimate_into(&self, name: &str, decimator: &mut Decimator) -> bool {
+        let Some(metric) = self.metric(name) else {
+            return false;
+        };
+        for index in &metric.blocks {
+            if decimator.spans_one_column(&index.summary) {
+                decimator.add_bucket(&index.summary);
+            } else {
+                let block = self.block(index);
+                decimator.add_points(block.steps().zip(block.values()));
+            }
+        }
+        true
+    }
+
+    fn recent_logs(&self, count: usize, filter: &LogFilter) -> Vec<LogLine> {
+        self.log_offsets
+            .iter()
+            .rev()
+            .filter_map(|&offset| match Records::at(&self.map, offset)?.next()? {
+                Record::Log(entry) => Some(LogLine::new(&entry)),
+                _ => None,
+            })
+            .filter(|line| filter.matches(line))
+            .take(count)
+            .collect()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::logs::{LogEntry, LogLevel};
+    use crate::persist::RecordWriter;
+    use chrono::Utc;
+    use std::io::Write;
+
+    fn value_at(step: u64, points: u64) -> f64 {
+        if step == points / 3 {
+            100.0
+        } else {
+            (step as f64 / 50.0).sin()
+        }
+    }
+
+    fn write_run(name: &str, points: u64) -> std::path::PathBuf {
+        let path = std::env::temp_dir().join(format!("clog-{}-{}", std::process::id(), name));
+        let mut writer = RecordWriter::new(io::BufWriter::new(File::create(&path).unwrap()));
+        writer.write_header().unwrap();
+        writer.write_name(0, "loss").unwrap();
+        writer.write_name(1, "lr").unwrap();
+        for start in (0..points).step_by(1_000) {
+            let steps: Vec<u64> = (start..points.min(start + 1_000)).collect();
+            let values: Vec<f64> = steps.iter().map(|&step| value_at(step, points)).collect();
+            let timestamps: Vec<i64> = steps.iter().map(|&step| step as i64).collect();
+            writer.write_block(0, &steps, &values, &timestamps).unwrap();
+        }
+        writer.write_block(1, &[0, 10], &[0.1, 0.01], &[0, 1]).unwrap();
+        for i in 0..5 {
+            writer
+                .write_log(&LogEntry {
+                    message: format!("epoch {}", i),
+                    timestamp: Utc::now(),
+                    level: LogLevel::Info,
+                })
+                .unwrap();
+        }
+        writer.into_inner().flush().unwrap();
+        path
+    }
+
+    #[test]
+    fn test_replay_matches_live_series() {
+        let path = write_run("replay.clog", 250_000);
+        let replay = Replay::open(&path).unwrap();
+        std::fs::remove_file(&path).unwrap();
+
+        assert_eq!(&*replay.names_since(0)[0], "loss");
+        assert_eq!(replay.point_count("loss"), Some(250_000));
+        let lr = replay.summary("lr").unwrap();
+        assert_eq!((lr.last, lr.min, lr.max, lr.count), (0.01, 0.01, 0.1, 2));
+
+        let mut series = crate::series::Series::default();
+        for step in 0..250_000 {
+            series.push(step, value_at(step, 250_000), 0);
+        }
+        let chart = replay.decimate("loss", 80).unwrap();
+        assert_eq!(chart, series.decimate(80).unwrap());
+        assert!(chart.points.contains(&((250_000 / 3) as f64, 100.0)));
+
+        let logs = replay.recent_logs(2, &LogFilter::default());
+        assert_eq!(
+            logs.iter().map(LogLine::message).collect::<Vec<_>>(),
+            vec!["epoch 4", "epoch 3"]
+        );
+        assert!(replay.decimate("missing", 80).is_none());
+    }
+
+    #[test]
+    fn test_replay_unsorted_blocks() {
+        // Late steps are persisted in arrival order, so a block's steps need
+        // not be sorted.
+        let mut steps: Vec<u64> = (0..1_000).collect();
+        steps.swap(10, 990);
+        steps[500..600].reverse();
+        let values: Vec<f64> = steps.iter().map(|&step| value_at(step, 1_000)).collect();
+        let path = std::env::temp_dir().join(format!("clog-{}-unsorted.clog", std::process::id()));
+        let mut writer = RecordWriter::new(io::BufWriter::new(File::create(&path).unwrap()));
+        writer.write_header().unwrap();
+        writer.write_name(0, "loss").unwrap();
+        writer.write_block(0, &steps, &values, &vec![0; steps.len()]).unwrap();
+        writer.into_inner().flush().unwrap();
+        let replay = Replay::open(&path).unwrap();
+        std::fs::remove_file(&path).unwrap();
+
+        let mut series = crate::series::Series::default();
+        for (&step, &value) in steps.iter().zip(&values) {
+            series.push(step, value, 0);
+        }
+        series.settle();
+        for columns in [7, 40, 333] {
+            assert_eq!(replay.decimate("loss", columns), series.decimate(columns));
+        }
+    }
+
+    /// Open and chart a 100M-point run:
+    /// `cargo test --release bench_replay_open -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_replay_open() {
+        let path = write_run("bench-replay.clog", 100_000_000);
+        let size = std::fs::metadata(&path).unwrap().len();
+        let start = std::time::Instant::now();
+        let replay = Replay::open(&path).unwrap();
+        let opened = start.elapsed();
+        let start = std::time::Instant::now();
+        std::hint::black_box(replay.decimate("loss", 200));
+        let charted = start.elapsed();
+        std::fs::remove_file(&path).unwrap();
+        println!(
+            "{:.1} GB file: open {:?}, first chart {:?}, index {} KB",
+            size as f64 / 1e9,
+            opened,
+            charted,
+            replay.metrics[0].blocks.capacity() * size_of::<BlockIndex>() / 1024
+        );
+    }
+}
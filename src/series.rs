@@ -0,0 +1,1272 @@
+use std::collections::{BTreeMap, VecDeque};
+use std::mem::size_of;
+
+use crate::gorilla;
+use crate::stats::{RunningStats, StatsConfig, Summary};
+
+/// Points per chunk of full-resolution storage.
+pub const CHUNK_POINTS: usize = 1024;
+
+/// Points that arrive with a step lower than the series' last one (or equal
+/// to it, unless every duplicate is kept) wait in a buffer until this many
+/// have gathered, or until the series is next read, and are then merged into
+/// their chunks together.
+const LATE_BATCH: usize = 256;
+
+/// What a series does with a point whose step it already holds.
+///
+/// This decides the points stored, not the series' running statistics:
+/// those are updated as each value is logged, so they count every value,
+/// including ones later replaced or averaged away.
+#[derive(Clone, Copy, Debug, Default, PartialEq)]
+pub enum Duplicates {
+    /// Keep every point, in the order they were logged.
+    #[default]
+    KeepAll,
+    /// Replace the value held for the step.
+    LastWins,
+    /// Hold the mean of every value logged for the step.
+    Mean,
+}
+
+impl Duplicates {
+    pub fn parse(policy: &str) -> Option<Self> {
+        match policy {
+            "keep_all" => Some(Duplicates::KeepAll),
+            "last_wins" => Some(Duplicates::LastWins),
+            "mean" => Some(Duplicates::Mean),
+            _ => None,
+        }
+    }
+}
+
+/// How much history a series keeps at full resolution, and how it treats
+/// repeated steps.
+///
+/// Once more than `max_points` raw points are held, whole chunks of the oldest
+/// points are rolled into min/max/mean buckets. The archive holds at most
+/// `archive_buckets` buckets: when it fills up, neighbouring buckets merge
+/// pairwise, so it always spans the whole run at a coarser resolution.
+/// Points for steps already archived are added to the bucket covering them,
+/// whatever `duplicates` says.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub struct Retention {
+    pub max_points: Option<usize>,
+    pub archive_buckets: usize,
+    pub duplicates: Duplicates,
+}
+
+impl Default for Retention {
+    fn default() -> Self {
+        Retention {
+            max_points: None,
+            archive_buckets: 1024,
+            duplicates: Duplicates::default(),
+        }
+    }
+}
+
+/// Summary of a run of consecutive points that were rolled out of raw storage.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub struct Bucket {
+    pub first_step: u64,
+    pub last_step: u64,
+    pub min: f64,
+    pub min_step: u64,
+    pub max: f64,
+    pub max_step: u64,
+    pub sum: f64,
+    pub count: u64,
+}
+
+impl Bucket {
+    fn new(step: u64, value: f64) -> Self {
+        Bucket {
+            first_step: step,
+            last_step: step,
+            min: value,
+            min_step: step,
+            max: value,
+            max_step: step,
+            sum: value,
+            count: 1,
+        }
+    }
+
+    fn add(&mut self, step: u64, value: f64) {
+        self.merge(&Bucket::new(step, value));
+    }
+
+    pub fn merge(&mut self, other: &Bucket) {
+        self.first_step = self.first_step.min(other.first_step);
+        self.last_step = self.last_step.max(other.last_step);
+        // A NaN never wins against a real value, from either side, so one
+        // NaN point cannot hide a chunk's extrema.
+        if other.min < self.min || self.min.is_nan() {
+            self.min = other.min;
+            self.min_step = other.min_step;
+        }
+        if other.max > self.max || self.max.is_nan() {
+            self.max = other.max;
+            self.max_step = other.max_step;
+        }
+        self.sum += other.sum;
+        self.count += other.count;
+    }
+
+    /// Summary of `points`, or `None` if there are none.
+    pub fn summarize(points: impl IntoIterator<Item = (u64, f64)>) -> Option<Self> {
+        let mut points = points.into_iter();
+        let (step, value) = points.next()?;
+        let mut bucket = Bucket::new(step, value);
+        points.for_each(|(step, value)| bucket.add(step, value));
+        Some(bucket)
+    }
+
+    pub fn mean(&self) -> f64 {
+        self.sum / self.count as f64
+    }
+
+    /// The bucket's minimum and maximum as points, in step order.
+    pub fn extrema(&self) -> impl Iterator<Item = (u64, f64)> {
+        let (first, second) = if self.min_step <= self.max_step {
+            ((self.min_step, self.min), (self.max_step, self.max))
+        } else {
+            ((self.max_step, self.max), (self.min_step, self.min))
+        };
+        std::iter::once(first).chain((first != second).then_some(second))
+    }
+}
+
+/// A run of up to `CHUNK_POINTS` full-resolution points.
+///
+/// Only the newest chunk of a series is open for appends. Once full, or once
+/// a later chunk exists, it is sealed: compressed with `gorilla::encode` and
+/// never changed in place again. `summary` is kept up to date on every push
+/// so readers can skip over whole chunks without decoding them.
+#[derive(Clone, Debug)]
+struct Chunk {
+    points: Points,
+    summary: Bucket,
+}
+
+#[derive(Clone, Debug)]
+enum Points {
+    /// Plain columns, with timestamps delta-encoded as milliseconds since the
+    /// previous point.
+    Open {
+        steps: Vec<u64>,
+        values: Vec<f64>,
+        ts_deltas: Vec<u32>,
+        base_ms: i64,
+        last_ms: i64,
+    },
+    /// `len` points compressed by `gorilla::encode`.
+    Sealed {
+        words: Box<[u64]>,
+        len: usize,
+    },
+}
+
+impl Chunk {
+    fn new(step: u64, value: f64, timestamp_ms: i64) -> Self {
+        Chunk {
+            points: Points::Open {
+                steps: vec![step],
+                values: vec![value],
+                ts_deltas: vec![0],
+                base_ms: timestamp_ms,
+                last_ms: timestamp_ms,
+            },
+            summary: Bucket::new(step, value),
+        }
+    }
+
+    /// Append a point to an open chunk.
+    fn push(&mut self, step: u64, value: f64, timestamp_ms: i64) {
+        let Points::Open {
+            steps,
+            values,
+            ts_deltas,
+            last_ms,
+            ..
+        } = &mut self.points
+        else {
+            unreachable!("push to a sealed chunk");
+        };
+        // Clocks can step backwards; clamp rather than store a negative delta.
+        let delta = (timestamp_ms - *last_ms).clamp(0, u32::MAX as i64);
+        *last_ms += delta;
+
+        steps.push(step);
+        values.push(value);
+        ts_deltas.push(delta as u32);
+        self.summary.add(step, value);
+    }
+
+    /// A chunk holding the given points, whose steps and timestamps must be
+    /// sorted; sealed unless `open`.
+    fn from_columns(steps: &[u64], values: &[f64], timestamps_ms: &[i64], open: bool) -> Self {
+        let mut chunk = Chunk::new(steps[0], values[0], timestamps_ms[0]);
+        if open {
+            for ((&step, &value), &timestamp_ms) in steps.iter().zip(values).zip(timestamps_ms).skip(1) {
+                chunk.push(step, value, timestamp_ms);
+            }
+        } else {
+            chunk.points = Points::Sealed {
+                words: gorilla::encode(steps, values, timestamps_ms),
+                len: steps.len(),
+            };
+            chunk.summary = Bucket::summarize(steps.iter().copied().zip(values.iter().copied())).unwrap();
+        }
+        chunk
+    }
+
+    fn is_open(&self) -> bool {
+        matches!(self.points, Points::Open { .. })
+    }
+
+    /// Compress the chunk's points; a no-op if already sealed.
+    fn seal(&mut self) {
+        let Points::Open { steps, values, .. } = &self.points else {
+            return;
+        };
+        let timestamps_ms: Vec<i64> = self.points().map(|(_, _, timestamp_ms)| timestamp_ms).collect();
+        self.points = Points::Sealed {
+            words: gorilla::encode(steps, values, &timestamps_ms),
+            len: steps.len(),
+        };
+    }
+
+    fn len(&self) -> usize {
+        match &self.points {
+            Points::Open { steps, .. } => steps.len(),
+            Points::Sealed { len, .. } => *len,
+        }
+    }
+
+    /// The chunk's points as `(step, value, timestamp_ms)`, in step order.
+    fn points(&self) -> ChunkPoints<'_> {
+        match &self.points {
+            Points::Open {
+                steps,
+                values,
+                ts_deltas,
+                base_ms,
+                ..
+            } => ChunkPoints::Open {
+                steps,
+                values,
+                ts_deltas,
+                timestamp_ms: *base_ms,
+            },
+            Points::Sealed { words, len } => ChunkPoints::Sealed(gorilla::Decoder::new(words, *len)),
+        }
+    }
+
+    fn last_value(&self) -> Option<f64> {
+        match &self.points {
+            Points::Open { values, .. } => values.last().copied(),
+            Points::Sealed { .. } => self.points().last().map(|(_, value, _)| value),
+        }
+    }
+
+    fn heap_bytes(&self) -> usize {
+        match &self.points {
+            Points::Open {
+                steps,
+                values,
+                ts_deltas,
+                ..
+            } => {
+                steps.capacity() * size_of::<u64>()
+                    + values.capacity() * size_of::<f64>()
+                    + ts_deltas.capacity() * size_of::<u32>()
+            }
+            Points::Sealed { words, .. } => words.len() * size_of::<u64>(),
+        }
+    }
+}
+
+/// Iterator over the points of a `Chunk`.
+enum ChunkPoints<'a> {
+    Open {
+        steps: &'a [u64],
+        values: &'a [f64],
+        ts_deltas: &'a [u32],
+        timestamp_ms: i64,
+    },
+    Sealed(gorilla::Decoder<'a>),
+}
+
+impl Iterator for ChunkPoints<'_> {
+    type Item = (u64, f64, i64);
+
+    #[inline]
+    fn next(&mut self) -> Option<Self::Item> {
+        match self {
+            ChunkPoints::Open {
+                steps,
+                values,
+                ts_deltas,
+                timestamp_ms,
+            } => {
+                let (&step, rest) = steps.split_first()?;
+                *timestamp_ms += ts_deltas[0] as i64;
+                let point = (step, values[0], *timestamp_ms);
+                (*steps, *values, *ts_deltas) = (rest, &values[1..], &ts_deltas[1..]);
+                Some(point)
+            }
+            ChunkPoints::Sealed(decoder) => decoder.next(),
+        }
+    }
+}
+
+/// Columnar storage for the points of a single metric, in step order.
+///
+/// Recent points are kept at full resolution in chunks, all but the newest
+/// of them compressed; older points are summarised in `archive` according to
+/// the series' `Retention`. Running statistics over every point ever
+/// pushed are kept alongside, so summaries never need a scan.
+///
+/// Points logged in step order are appended. Late ones, say after resuming
+/// from a checkpoint, go to `late` and are merged into their chunks in
+/// batches by `settle`, which readers of a series shared through
+/// `MetricStore` get for free.
+#[derive(Clone, Debug)]
+pub struct Series {
+    chunks: VecDeque<Chunk>,
+    raw_len: usize,
+    total: u64,
+    archive: Vec<Bucket>,
+    bucket_span: u64,
+    retention: Retention,
+    stats: RunningStats,
+    /// Points waiting to be merged, as `(step, value, timestamp_ms)`.
+    late: Vec<(u64, f64, i64)>,
+    /// Values averaged into each step so far, for `Duplicates::Mean`; only
+    /// steps logged more than once and still held at full resolution are
+    /// present.
+    mean_counts: BTreeMap<u64, u64>,
+}
+
+/// A series reduced to at most two points (the min and max) per chart column.
+#[derive(Clone, Debug, PartialEq)]
+pub struct Decimated {
+    pub points: Vec<(f64, f64)>,
+    pub x_bounds: [f64; 2],
+    pub y_bounds: [f64; 2],
+}
+
+/// A chunk's points with `start <= step <= end`, as `(step, value)`.
+fn points_in(chunk: &Chunk, start: u64, end: u64) -> impl Iterator<Item = (u64, f64)> + '_ {
+    chunk
+        .points()
+        .skip_while(move |&(step, _, _)| step < start)
+        .take_while(move |&(step, _, _)| step <= end)
+        .map(|(step, value, _)| (step, value))
+}
+
+/// Accumulates the min and max of each of `columns` equal step ranges
+/// between `first` and `last`.
+///
+/// Callers feed whole summaries where they fit inside one column and
+/// individual points elsewhere; see `Series::decimate`.
+pub struct Decimator {
+    first: u64,
+    last: u64,
+    steps_per_column: f64,
+    bins: Vec<Option<Bucket>>,
+}
+
+impl Decimator {
+    pub fn new(first: u64, last: u64, columns: usize) -> Self {
+        let columns = columns.max(1);
+        Decimator {
+            first,
+            last,
+            steps_per_column: (last - first + 1) as f64 / columns as f64,
+            bins: vec![None; columns],
+        }
+    }
+
+    fn column_of(&self, step: u64) -> usize {
+        let offset = step.saturating_sub(self.first) as f64;
+        ((offset / self.steps_per_column) as usize).min(self.bins.len() - 1)
+    }
+
+    /// Whether all of `bucket`'s points land in the same column.
+    pub fn spans_one_column(&self, bucket: &Bucket) -> bool {
+        self.column_of(bucket.first_step) == self.column_of(bucket.last_step)
+    }
+
+    /// Merge a bucket that `spans_one_column`.
+    pub fn add_bucket(&mut self, bucket: &Bucket) {
+        let column = self.column_of(bucket.first_step);
+        match &mut self.bins[column] {
+            Some(bin) => bin.merge(bucket),
+            bin => *bin = Some(*bucket),
+        }
+    }
+
+    /// Add only a bucket's extreme points, each to its own column.
+    pub fn add_extrema(&mut self, bucket: &Bucket) {
+        for (step, value) in bucket.extrema() {
+            self.add_point(step, value);
+        }
+    }
+
+    pub fn add_point(&mut self, step: u64, value: f64) {
+        self.add_bucket(&Bucket::new(step, value));
+    }
+
+    /// Add points, summarizing each run of consecutive points that share a
+    /// column before merging it rather than looking up a column per point.
+    /// Points in step order cost one lookup per column; out-of-order points,
+    /// as in run-file blocks written in arrival order, still land in their
+    /// own columns.
+    pub fn add_points(&mut self, points: impl IntoIterator<Item = (u64, f64)>) {
+        let mut points = points.into_iter();
+        let Some((step, value)) = points.next() else {
+            return;
+        };
+        let mut bucket = Bucket::new(step, value);
+        let mut column = self.column_of(step);
+        let mut end = self.column_end(step);
+        for (step, value) in points {
+            if step >= end || (step < bucket.first_step && self.column_of(step) != column) {
+                self.add_bucket(&bucket);
+                bucket = Bucket::new(step, value);
+                column = self.column_of(step);
+                end = self.column_end(step);
+            } else {
+                bucket.add(step, value);
+            }
+        }
+        self.add_bucket(&bucket);
+    }
+
+    /// The first step past the column holding `step`, or `u64::MAX` for the
+    /// last column.
+    fn column_end(&self, step: u64) -> u64 {
+        let column = self.column_of(step);
+        if column + 1 == self.bins.len() {
+            return u64::MAX;
+        }
+        // Start from the exact boundary and settle any rounding against
+        // `column_of`, which decides where points go.
+        let mut end = self.first.saturating_add(((column + 1) as f64 * self.steps_per_column).ceil() as u64);
+        while end > step + 1 && self.column_of(end - 1) > column {
+            end -= 1;
+        }
+        while self.column_of(end) == column {
+            end += 1;
+        }
+        end
+    }
+
+    pub fn finish(self) -> Decimated {
+        let mut points = Vec::with_capacity(2 * self.bins.len());
+        let mut y_bounds = [f64::INFINITY, f64::NEG_INFINITY];
+        for bin in self.bins.iter().flatten() {
+            points.extend(bin.extrema().map(|(step, value)| (step as f64, value)));
+            y_bounds = [y_bounds[0].min(bin.min), y_bounds[1].max(bin.max)];
+        }
+        if !(y_bounds[0] <= y_bounds[1]) {
+            y_bounds = [0.0, 1.0];
+        } else if y_bounds[0] == y_bounds[1] {
+            y_bounds = [y_bounds[0] - 0.5, y_bounds[1] + 0.5];
+        }
+        let x_bounds = if self.first == self.last {
+            [self.first as f64, self.first as f64 + 1.0]
+        } else {
+            [self.first as f64, self.last as f64]
+        };
+
+        Decimated {
+            points,
+            x_bounds,
+            y_bounds,
+        }
+    }
+}
+
+impl Default for Series {
+    fn default() -> Self {
+        Series::new(Retention::default())
+    }
+}
+
+impl Series {
+    pub fn new(retention: Retention) -> Self {
+        Self::with_stats(retention, StatsConfig::default())
+    }
+
+    pub fn with_stats(retention: Retention, stats: StatsConfig) -> Self {
+        Series {
+            chunks: VecDeque::new(),
+            raw_len: 0,
+            total: 0,
+            archive: Vec::new(),
+            bucket_span: 1,
+            retention,
+            stats: RunningStats::new(stats),
+            late: Vec::new(),
+            mean_counts: BTreeMap::new(),
+        }
+    }
+
+    pub fn push(&mut self, step: u64, value: f64, timestamp_ms: i64) {
+        self.total += 1;
+        self.stats.push(step, value);
+        let in_order = match self.chunks.back() {
+            None => self.archive.is_empty(),
+            Some(chunk) => {
+                let last = chunk.summary.last_step;
+                step > last || (step == last && self.retention.duplicates == Duplicates::KeepAll)
+            }
+        };
+        if !in_order {
+            self.late.push((step, value, timestamp_ms));
+            if self.late.len() >= LATE_BATCH {
+                self.settle();
+            }
+            return;
+        }
+        match self.chunks.back_mut() {
+            Some(chunk) if chunk.is_open() && chunk.len() < CHUNK_POINTS => chunk.push(step, value, timestamp_ms),
+            back => {
+                if let Some(chunk) = back {
+                    chunk.seal();
+                }
+                self.chunks.push_back(Chunk::new(step, value, timestamp_ms));
+            }
+        }
+        self.raw_len += 1;
+        self.enforce_retention();
+    }
+
+    /// Merge the points waiting in `late` into their chunks, or into the
+    /// archive buckets covering their steps.
+    ///
+    /// Each chunk that receives points is rebuilt once, by a merge of its
+    /// sorted columns with the sorted late points, so a batch costs the size
+    /// of the chunks it touches rather than a shift per point.
+    pub fn settle(&mut self) {
+        if self.late.is_empty() {
+            return;
+        }
+        let mut late = std::mem::take(&mut self.late);
+        // Stable, so duplicates keep the order they were logged in.
+        late.sort_by_key(|&(step, _, _)| step);
+
+        let first_raw = self.chunks.front().map_or(u64::MAX, |chunk| chunk.summary.first_step);
+        let archived = if self.archive.is_empty() {
+            0
+        } else {
+            late.partition_point(|&(step, _, _)| step < first_raw)
+        };
+        for &(step, value, _) in &late[..archived] {
+            let index = self.archive.partition_point(|bucket| bucket.last_step < step);
+            let last = self.archive.len() - 1;
+            self.archive[index.min(last)].add(step, value);
+        }
+        let late = &late[archived..];
+
+        // The first point of a series is always in order, so there is a chunk
+        // to merge into. Work from the last chunk back, so that splitting one
+        // never moves those still to be merged. A point goes to the last
+        // chunk starting at or before its step: the one holding that step if
+        // any, or else the one before the gap it falls in. With KeepAll
+        // duplicates that span two chunks, that puts it after every point
+        // already logged for its step.
+        let mut end = late.len();
+        while end > 0 {
+            let step = late[end - 1].0;
+            let index = self
+                .chunks
+                .partition_point(|chunk| chunk.summary.first_step <= step)
+                .saturating_sub(1);
+            let start = match index {
+                0 => 0,
+                _ => {
+                    let first = self.chunks[index].summary.first_step;
+                    late[..end].partition_point(|&(step, _, _)| step < first)
+                }
+            };
+            self.merge_into(index, &late[start..end]);
+            end = start;
+        }
+        self.enforce_retention();
+    }
+
+    /// Merge sorted `points` into chunk `index`, applying the duplicate
+    /// policy, and split the result if it grew past two chunks' worth.
+    ///
+    /// The chunks written are sealed again, except the newest chunk of the
+    /// series while it has room for appends.
+    fn merge_into(&mut self, index: usize, points: &[(u64, f64, i64)]) {
+        if points.is_empty() {
+            return;
+        }
+        let chunk = &self.chunks[index];
+        let len = chunk.len() + points.len();
+        let mut steps = Vec::with_capacity(len);
+        let mut values = Vec::with_capacity(len);
+        let mut timestamps_ms = Vec::with_capacity(len);
+        let mut held = chunk.points().peekable();
+        for &(step, value, timestamp_ms) in points {
+            while let Some((held_step, held_value, held_ms)) = held.next_if(|&(held_step, _, _)| held_step <= step) {
+                steps.push(held_step);
+                values.push(held_value);
+                timestamps_ms.push(held_ms);
+            }
+            let duplicate = steps.last() == Some(&step);
+            match self.retention.duplicates {
+                Duplicates::LastWins if duplicate => {
+                    *values.last_mut().unwrap() = value;
+                    *timestamps_ms.last_mut().unwrap() = timestamp_ms;
+                }
+                Duplicates::Mean if duplicate => {
+                    let count = self.mean_counts.entry(step).or_insert(1);
+                    *count += 1;
+                    let mean = values.last_mut().unwrap();
+                    *mean += (value - *mean) / *count as f64;
+                    *timestamps_ms.last_mut().unwrap() = timestamp_ms;
+                }
+                _ => {
+                    steps.push(step);
+                    values.push(value);
+                    timestamps_ms.push(timestamp_ms);
+                }
+            }
+        }
+        for (step, value, timestamp_ms) in held {
+            steps.push(step);
+            values.push(value);
+            timestamps_ms.push(timestamp_ms);
+        }
+        // A late point's timestamp is newer than the points after it, up to
+        // the first point of the next chunk; lower it to theirs so timestamps
+        // stay ordered across the whole series without moving any point that
+        // was already held. A late point is never merged ahead of a chunk's
+        // first point, except in the first chunk, so a stamped batch older
+        // than the point before it only needs raising to that point.
+        let next_ms = self.chunks.get(index + 1).and_then(|next| next.points().next());
+        let mut later_ms = next_ms.map_or(i64::MAX, |(_, _, timestamp_ms)| timestamp_ms);
+        for timestamp_ms in timestamps_ms.iter_mut().rev() {
+            later_ms = later_ms.min(*timestamp_ms);
+            *timestamp_ms = later_ms;
+        }
+        let mut earlier_ms = i64::MIN;
+        for timestamp_ms in timestamps_ms.iter_mut() {
+            earlier_ms = earlier_ms.max(*timestamp_ms);
+            *timestamp_ms = earlier_ms;
+        }
+
+        self.raw_len += steps.len() - self.chunks[index].len();
+        let pieces = if steps.len() <= 2 * CHUNK_POINTS {
+            1
+        } else {
+            steps.len().div_ceil(CHUNK_POINTS)
+        };
+        let piece_len = if pieces == 1 { steps.len() } else { CHUNK_POINTS };
+        let newest = index + 1 == self.chunks.len();
+        for piece in 0..pieces {
+            let range = piece * piece_len..((piece + 1) * piece_len).min(steps.len());
+            let open = newest && piece + 1 == pieces && range.len() < CHUNK_POINTS;
+            let chunk = Chunk::from_columns(&steps[range.clone()], &values[range.clone()], &timestamps_ms[range], open);
+            if piece == 0 {
+                self.chunks[index] = chunk;
+            } else {
+                self.chunks.insert(index + piece, chunk);
+            }
+        }
+    }
+
+    fn enforce_retention(&mut self) {
+        let Some(max_points) = self.retention.max_points else {
+            return;
+        };
+        while self.chunks.len() > 1 && self.raw_len - self.chunks[0].len() >= max_points {
+            let chunk = self.chunks.pop_front().unwrap();
+            self.raw_len -= chunk.len();
+            self.archive_chunk(&chunk);
+            // Archived steps take any further points into their bucket, so
+            // their counts are no longer needed.
+            self.mean_counts = self.mean_counts.split_off(&(chunk.summary.last_step + 1));
+        }
+    }
+
+    fn archive_chunk(&mut self, chunk: &Chunk) {
+        for (step, value, _) in chunk.points() {
+            match self.archive.last_mut() {
+                Some(bucket) if bucket.count < self.bucket_span => bucket.add(step, value),
+                _ => {
+                    self.archive.push(Bucket::new(step, value));
+                    if self.archive.len() > self.retention.archive_buckets.max(2) {
+                        self.compact_archive();
+                    }
+                }
+            }
+        }
+    }
+
+    /// Halve the archive's resolution by merging neighbouring buckets.
+    fn compact_archive(&mut self) {
+        let len = self.archive.len();
+        for i in 0..(len + 1) / 2 {
+            let mut bucket = self.archive[2 * i];
+            if let Some(next) = self.archive.get(2 * i + 1) {
+                bucket.merge(next);
+            }
+            self.archive[i] = bucket;
+        }
+        self.archive.truncate((len + 1) / 2);
+        self.bucket_span *= 2;
+    }
+
+    /// Number of points held at full resolution.
+    pub fn len(&self) -> usize {
+        self.raw_len
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.raw_len == 0 && self.archive.is_empty()
+    }
+
+    /// Number of points ever logged, including those rolled into the archive.
+    ///
+    /// This only grows, so readers can use it to tell whether a cached view of
+    /// the series is stale.
+    pub fn total_count(&self) -> u64 {
+        self.total
+    }
+
+    pub fn first_step(&self) -> Option<u64> {
+        match self.archive.first() {
+            Some(bucket) => Some(bucket.first_step),
+            None => self.chunks.front().map(|chunk| chunk.summary.first_step),
+        }
+    }
+
+    pub fn last_step(&self) -> Option<u64> {
+        match self.chunks.back() {
+            Some(chunk) => Some(chunk.summary.last_step),
+            None => self.archive.last().map(|bucket| bucket.last_step),
+        }
+    }
+
+    /// Reduce the whole series to the min and max of each of `columns` equal
+    /// step ranges, in step order.
+    ///
+    /// Chunks that fall inside a single column are merged using their
+    /// summaries without touching their points, so the cost is proportional to
+    /// the number of chunks plus the points of the chunks that straddle a
+    /// column boundary, not to the length of the series.
+    pub fn decimate(&self, columns: usize) -> Option<Decimated> {
+        self.decimate_range(0, u64::MAX, columns)
+    }
+
+    /// Like `decimate`, over the points with `start <= step <= end` only;
+    /// `None` if there are none.
+    pub fn decimate_range(&self, start: u64, end: u64, columns: usize) -> Option<Decimated> {
+        let first = self.first_step()?.max(start);
+        let last = self.last_step()?.min(end);
+        if first > last {
+            return None;
+        }
+        let mut decimator = Decimator::new(first, last, columns);
+        self.decimate_into(start, end, &mut decimator);
+        let chart = decimator.finish();
+        (!chart.points.is_empty()).then_some(chart)
+    }
+
+    /// Add the points with `start <= step <= end` to `decimator`, whose
+    /// columns may cover a wider step range than the series, so that several
+    /// series can be reduced onto the same columns.
+    pub fn decimate_into(&self, start: u64, end: u64, decimator: &mut Decimator) {
+        for bucket in self.archive_in(start, end) {
+            for (step, value) in bucket.extrema() {
+                if (start..=end).contains(&step) {
+                    decimator.add_point(step, value);
+                }
+            }
+        }
+        for chunk in self.chunks_in(start, end) {
+            let inside = start <= chunk.summary.first_step && chunk.summary.last_step <= end;
+            if inside && decimator.spans_one_column(&chunk.summary) {
+                decimator.add_bucket(&chunk.summary);
+            } else {
+                decimator.add_points(points_in(chunk, start, end));
+            }
+        }
+    }
+
+    /// The points with `start <= step <= end` as step and value columns, in
+    /// step order.
+    ///
+    /// Points rolled into the archive are represented by each bucket's
+    /// minimum and maximum, which are points that were logged. The chunks
+    /// covering the range are found by binary search over their summaries,
+    /// and only those are decoded. Points not yet merged by `settle` are left
+    /// out.
+    pub fn range(&self, start: u64, end: u64) -> (Vec<u64>, Vec<f64>) {
+        let bound = 2 * self.archive_in(start, end).count()
+            + self.chunks_in(start, end).map(Chunk::len).sum::<usize>();
+        let mut steps = Vec::with_capacity(bound);
+        let mut values = Vec::with_capacity(bound);
+        for bucket in self.archive_in(start, end) {
+            for (step, value) in bucket.extrema() {
+                if (start..=end).contains(&step) {
+                    steps.push(step);
+                    values.push(value);
+                }
+            }
+        }
+        for chunk in self.chunks_in(start, end) {
+            for (step, value) in points_in(chunk, start, end) {
+                steps.push(step);
+                values.push(value);
+            }
+        }
+        (steps, values)
+    }
+
+    /// Every point as step, value and timestamp columns, in step order, as
+    /// `range` returns them over the whole series. Archive buckets' minima
+    /// and maxima have no timestamp of their own and get `i64::MIN`.
+    pub fn columns(&self) -> (Vec<u64>, Vec<f64>, Vec<i64>) {
+        let len = 2 * self.archive.len() + self.raw_len;
+        let (mut steps, mut values, mut timestamps_ms) =
+            (Vec::with_capacity(len), Vec::with_capacity(len), Vec::with_capacity(len));
+        for bucket in &self.archive {
+            for (step, value) in bucket.extrema() {
+                steps.push(step);
+                values.push(value);
+                timestamps_ms.push(i64::MIN);
+            }
+        }
+        for chunk in &self.chunks {
+            for (step, value, timestamp_ms) in chunk.points() {
+                steps.push(step);
+                values.push(value);
+                timestamps_ms.push(timestamp_ms);
+            }
+        }
+        (steps, values, timestamps_ms)
+    }
+
+    fn archive_in(&self, start: u64, end: u64) -> impl Iterator<Item = &Bucket> {
+        self.archive
+            .iter()
+            .filter(move |bucket| bucket.last_step >= start && bucket.first_step <= end)
+    }
+
+    /// Chunks holding any point with `start <= step <= end`.
+    fn chunks_in(&self, start: u64, end: u64) -> impl Iterator<Item = &Chunk> {
+        let first = self.chunks.partition_point(|chunk| chunk.summary.last_step < start);
+        self.chunks
+            .range(first..)
+            .take_while(move |chunk| chunk.summary.first_step <= end)
+    }
+
+    /// Full-resolution points as `(step, value)`, oldest first.
+    pub fn iter(&self) -> impl Iterator<Item = (u64, f64)> + '_ {
+        self.chunks
+            .iter()
+            .flat_map(|chunk| chunk.points().map(|(step, value, _)| (step, value)))
+    }
+
+    /// Summaries of points older than the full-resolution window, oldest first.
+    pub fn archive(&self) -> &[Bucket] {
+        &self.archive
+    }
+
+    /// Running statistics over every point pushed, including archived ones
+    /// and duplicates that the `Duplicates` policy replaced or averaged.
+    pub fn summary(&self) -> Summary {
+        self.stats.summary()
+    }
+
+    pub fn last_value(&self) -> Option<f64> {
+        self.chunks.back().and_then(Chunk::last_value)
+    }
+
+    /// Timestamps of the full-resolution points in milliseconds since the Unix
+    /// epoch, oldest first.
+    pub fn timestamps_ms(&self) -> impl Iterator<Item = i64> + '_ {
+        self.chunks
+            .iter()
+            .flat_map(|chunk| chunk.points().map(|(_, _, timestamp_ms)| timestamp_ms))
+    }
+
+    /// Bytes allocated on the heap for this series' points and statistics.
+    pub fn heap_bytes(&self) -> usize {
+        self.chunks.capacity() * size_of::<Chunk>()
+            + self.chunks.iter().map(Chunk::heap_bytes).sum::<usize>()
+            + self.archive.capacity() * size_of::<Bucket>()
+            + self.late.capacity() * size_of::<(u64, f64, i64)>()
+            + self.mean_counts.len() * size_of::<(u64, u64)>()
+            + self.stats.heap_bytes()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_push_and_read_back() {
+        let mut series = Series::default();
+        series.push(0, 1.0, 1_000);
+        series.push(1, 0.5, 1_250);
+        series.push(2, 0.25, 1_250);
+
+        assert_eq!(series.len(), 3);
+        assert_eq!(series.iter().collect::<Vec<_>>(), vec![(0, 1.0), (1, 0.5), (2, 0.25)]);
+        assert_eq!(series.last_value(), Some(0.25));
+        assert_eq!(series.timestamps_ms().collect::<Vec<_>>(), vec![1_000, 1_250, 1_250]);
+    }
+
+    #[test]
+    fn test_backwards_clock_is_clamped() {
+        let mut series = Series::default();
+        series.push(0, 1.0, 5_000);
+        series.push(1, 1.0, 4_000);
+        series.push(2, 1.0, 5_500);
+
+        assert_eq!(series.timestamps_ms().collect::<Vec<_>>(), vec![5_000, 5_000, 5_500]);
+    }
+
+    #[test]
+    fn test_bytes_per_point() {
+        let mut series = Series::default();
+        for step in 0..(1u64 << 20) {
+            series.push(step, step as f64, step as i64);
+        }
+        let per_point = series.heap_bytes() as f64 / series.len() as f64;
+        // Sealed chunks store evenly spaced steps and timestamps in a bit
+        // each, leaving little more than the XORed values.
+        assert!(per_point < 4.0, "{per_point} bytes per point");
+        assert!(series.iter().eq((0..(1u64 << 20)).map(|step| (step, step as f64))));
+        assert!(series.timestamps_ms().eq(0..(1i64 << 20)));
+        series.push(1 << 20, -1.0, 0);
+        assert_eq!(series.last_value(), Some(-1.0));
+    }
+
+    #[test]
+    fn test_retention_bounds_memory() {
+        let retention = Retention {
+            max_points: Some(2_000),
+            archive_buckets: 64,
+            ..Retention::default()
+        };
+        let mut series = Series::new(retention);
+        let mut peak = 0;
+        for step in 0..1_000_000u64 {
+            series.push(step, step as f64, 0);
+            peak = peak.max(series.heap_bytes());
+        }
+
+        assert!(series.len() >= 2_000 && series.len() <= 2_000 + CHUNK_POINTS);
+        assert!(series.archive().len() <= 64);
+        assert_eq!(series.total_count(), 1_000_000);
+        // At most four chunks of raw points, plus the archive, chunk headers and
+        // the fixed-size statistics window.
+        let bound = 4 * CHUNK_POINTS * 20 + 2 * 65 * size_of::<Bucket>() + 1_024;
+        assert!(peak < bound + series.stats.heap_bytes());
+
+        let archive = series.archive();
+        assert_eq!(archive[0].first_step, 0);
+        assert_eq!(archive[0].min, 0.0);
+        let first_raw = series.iter().next().unwrap().0;
+        assert_eq!(archive.last().unwrap().last_step + 1, first_raw);
+    }
+
+    #[test]
+    fn test_archive_keeps_spikes() {
+        let retention = Retention {
+            max_points: Some(CHUNK_POINTS),
+            archive_buckets: 8,
+            ..Retention::default()
+        };
+        let mut series = Series::new(retention);
+        for step in 0..100_000u64 {
+            let value = if step == 12_345 { 1e6 } else { 1.0 };
+            series.push(step, value, 0);
+        }
+
+        let spike = series.archive().iter().find(|bucket| bucket.max == 1e6).unwrap();
+        assert_eq!(series.total_count(), 100_000);
+        assert_eq!(spike.max_step, 12_345);
+        let sum: f64 = series.archive().iter().map(|bucket| bucket.sum).sum();
+        let count = series.archive().iter().map(|bucket| bucket.count).sum::<u64>();
+        assert_eq!(sum, 1e6 + (count - 1) as f64);
+    }
+
+    #[test]
+    fn test_decimate_small_series_is_exact() {
+        let mut series = Series::default();
+        series.push(0, 3.0, 0);
+        series.push(5, 1.0, 0);
+        series.push(10, 2.0, 0);
+
+        let chart = series.decimate(100).unwrap();
+        assert_eq!(chart.points, vec![(0.0, 3.0), (5.0, 1.0), (10.0, 2.0)]);
+        assert_eq!(chart.x_bounds, [0.0, 10.0]);
+        assert_eq!(chart.y_bounds, [1.0, 3.0]);
+    }
+
+    #[test]
+    fn test_nan_does_not_hide_extrema() {
+        let mut series = Series::default();
+        for (step, value) in [1.0, 5.0, f64::NAN, 3.0].into_iter().enumerate() {
+            series.push(step as u64, value, 0);
+        }
+        let bucket = Bucket::summarize(series.iter()).unwrap();
+        assert_eq!((bucket.min, bucket.min_step, bucket.max, bucket.max_step), (1.0, 0, 5.0, 1));
+
+        let chart = series.decimate(1).unwrap();
+        assert_eq!(chart.points, vec![(0.0, 1.0), (1.0, 5.0)]);
+        assert_eq!(chart.y_bounds, [1.0, 5.0]);
+
+        let leading = Bucket::summarize([(0, f64::NAN), (1, 2.0), (2, -2.0)]).unwrap();
+        assert_eq!((leading.min, leading.max), (-2.0, 2.0));
+    }
+
+    #[test]
+    fn test_decimate_keeps_extremes() {
+        let retention = Retention {
+            max_points: Some(10_000),
+            archive_buckets: 256,
+            ..Retention::default()
+        };
+        let mut series = Series::new(retention);
+        for step in 0..1_000_000u64 {
+            let value = match step {
+                1_234 => -50.0,
+                777_777 => 50.0,
+                _ => (step as f64 / 1_000.0).sin(),
+            };
+            series.push(step, value, 0);
+        }
+
+        let chart = series.decimate(120).unwrap();
+        assert!(chart.points.len() <= 240);
+        assert_eq!(chart.x_bounds, [0.0, 999_999.0]);
+        assert_eq!(chart.y_bounds, [-50.0, 50.0]);
+        assert!(chart.points.contains(&(1_234.0, -50.0)));
+        assert!(chart.points.contains(&(777_777.0, 50.0)));
+        assert!(chart.points.windows(2).all(|pair| pair[0].0 <= pair[1].0));
+    }
+
+    #[test]
+    fn test_range() {
+        let retention = Retention {
+            max_points: Some(CHUNK_POINTS),
+            archive_buckets: 4,
+            ..Retention::default()
+        };
+        let mut series = Series::new(retention);
+        for step in 0..10_000u64 {
+            series.push(step * 2, step as f64, 0);
+        }
+
+        let (steps, values) = series.range(19_001, 19_010);
+        assert_eq!(steps, vec![19_002, 19_004, 19_006, 19_008, 19_010]);
+        assert_eq!(values, vec![9_501.0, 9_502.0, 9_503.0, 9_504.0, 9_505.0]);
+        let (steps, _) = series.range(0, u64::MAX);
+        assert_eq!(steps.len(), series.len() + 2 * series.archive().len());
+        let (all_steps, _, timestamps) = series.columns();
+        assert_eq!(all_steps, steps);
+        assert_eq!(timestamps.iter().filter(|&&timestamp_ms| timestamp_ms == i64::MIN).count(), steps.len() - series.len());
+        assert!(steps.windows(2).all(|pair| pair[0] < pair[1]));
+        assert!(series.range(20_000, 30_000).0.is_empty());
+
+        let chart = series.decimate_range(18_000, 19_998, 10).unwrap();
+        assert_eq!(chart.x_bounds, [18_000.0, 19_998.0]);
+        assert!(chart.points.len() <= 20);
+        assert_eq!(chart.points.first(), Some(&(18_000.0, 9_000.0)));
+        assert_eq!(chart.points.last(), Some(&(19_998.0, 9_999.0)));
+        assert!(series.decimate_range(20_000, 30_000, 10).is_none());
+    }
+
+    #[test]
+    fn test_late_points_are_merged_in_step_order() {
+        let retention = Retention {
+            max_points: Some(4 * CHUNK_POINTS),
+            archive_buckets: 16,
+            ..Retention::default()
+        };
+        let mut series = Series::new(retention);
+        // Even steps in order, then the odd ones late in reverse, as after
+        // an evaluation loop that logs behind training.
+        for step in (0..20_000u64).step_by(2) {
+            series.push(step, step as f64, step as i64);
+        }
+        for step in (15_001..20_000u64).rev().step_by(2) {
+            series.push(step, step as f64, 100_000);
+        }
+        series.push(7, -1.0, 100_000);
+        series.settle();
+
+        let (steps, values) = series.range(15_000, u64::MAX);
+        assert_eq!(steps, (15_000..20_000).collect::<Vec<u64>>());
+        assert_eq!(values, steps.iter().map(|&step| step as f64).collect::<Vec<f64>>());
+        assert_eq!(series.total_count(), 12_501);
+        assert_eq!(series.last_step(), Some(19_999));
+        assert!(series.chunks.iter().all(|chunk| chunk.len() <= 2 * CHUNK_POINTS));
+        // The archived step went into the bucket covering it.
+        assert_eq!(series.archive()[0].min, -1.0);
+        let timestamps: Vec<i64> = series.timestamps_ms().collect();
+        assert!(timestamps.windows(2).all(|pair| pair[0] <= pair[1]));
+    }
+
+    #[test]
+    fn test_late_timestamps_stay_ordered_across_chunks() {
+        let mut series = Series::new(Retention {
+            duplicates: Duplicates::LastWins,
+            ..Retention::default()
+        });
+        // Even steps, stamped with their step, filling two chunks.
+        let boundary = 2 * CHUNK_POINTS as u64;
+        for step in (0..2 * boundary).step_by(2) {
+            series.push(step, 0.0, step as i64);
+        }
+        // A newer value for the last step of the first chunk, and a late
+        // point in the second stamped before the point ahead of it.
+        series.push(boundary - 2, 1.0, 1_000_000);
+        series.push(boundary + 1, 2.0, 0);
+        series.settle();
+
+        let (steps, values) = series.range(boundary - 2, boundary + 1);
+        assert_eq!(steps, vec![boundary - 2, boundary, boundary + 1]);
+        assert_eq!(values, vec![1.0, 0.0, 2.0]);
+        let timestamps: Vec<i64> = series.timestamps_ms().collect();
+        assert!(timestamps.windows(2).all(|pair| pair[0] <= pair[1]));
+    }
+
+    #[test]
+    fn test_duplicate_policies() {
+        let read = |duplicates| {
+            let mut series = Series::new(Retention {
+                duplicates,
+                ..Retention::default()
+            });
+            for step in 0..10u64 {
+                series.push(step, step as f64, 0);
+            }
+            // A resume from step 5, then a repeat of the newest step.
+            for step in 5..10u64 {
+                series.push(step, 10.0 * step as f64, 0);
+            }
+            series.push(9, 0.0, 0);
+            series.settle();
+            series.range(5, 9)
+        };
+
+        let (steps, values) = read(Duplicates::KeepAll);
+        assert_eq!(steps, vec![5, 5, 6, 6, 7, 7, 8, 8, 9, 9, 9]);
+        assert_eq!(&values[..2], &[5.0, 50.0]);
+        assert_eq!(read(Duplicates::LastWins), (vec![5, 6, 7, 8, 9], vec![50.0, 60.0, 70.0, 80.0, 0.0]));
+        assert_eq!(read(Duplicates::Mean), (vec![5, 6, 7, 8, 9], vec![27.5, 33.0, 38.5, 44.0, 33.0]));
+
+        // Duplicates that span two chunks keep the order they were logged in.
+        let mut series = Series::default();
+        let last = CHUNK_POINTS as u64 - 1;
+        for step in 0..=last {
+            series.push(step, 1.0, 0);
+        }
+        series.push(last, 2.0, 0);
+        series.push(last + 1, 0.0, 0);
+        series.push(last, 3.0, 0);
+        series.settle();
+        assert_eq!(series.chunks.len(), 2);
+        assert_eq!(series.range(last, last), (vec![last; 3], vec![1.0, 2.0, 3.0]));
+
+        assert_eq!(Duplicates::parse("last_wins"), Some(Duplicates::LastWins));
+        assert_eq!(Duplicates::parse("first"), None);
+    }
+
+    #[test]
+    fn test_mean_counts_are_bounded_by_retention() {
+        let mut series = Series::new(Retention {
+            max_points: Some(CHUNK_POINTS),
+            archive_buckets: 16,
+            duplicates: Duplicates::Mean,
+        });
+        // Every step logged twice, the second time just after the next step.
+        for step in 0..100_000u64 {
+            series.push(step + 1, 1.0, 0);
+            series.push(step, 3.0, 0);
+        }
+        series.settle();
+        assert!(series.mean_counts.len() <= 2 * CHUNK_POINTS + LATE_BATCH);
+        let (_, values) = series.range(99_000, 99_998);
+        assert!(values.iter().all(|&value| value == 2.0));
+    }
+
+    /// Merging late points, interleaved with in-order ones, into a 1M-point
+    /// series: `cargo test --release bench_late_points -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_late_points() {
+        let mut series = Series::default();
+        for step in 0..1_000_000u64 {
+            series.push(step * 10, 1.0, 0);
+        }
+        let late = 1_000_000u64;
+        let start = std::time::Instant::now();
+        for i in 0..late {
+            series.push(10_000_000 + i * 10, 1.0, 0);
+            // Each late point lands about 1000 steps behind the newest.
+            series.push(10_000_000 + i * 10 - 9_995, 2.0, 0);
+        }
+        series.settle();
+        println!(
+            "{:.1} ns per in-order plus late point pair, {} points",
+            start.elapsed().as_nanos() as f64 / late as f64,
+            series.len()
+        );
+    }
+
+    /// Copying out a 1000-step range and the whole of a 10M-point series:
+    /// `cargo test --release bench_range -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_range() {
+        let mut series = Series::default();
+        for step in 0..10_000_000u64 {
+            series.push(step, (step as f64).sqrt(), 0);
+        }
+        let start = std::time::Instant::now();
+        let rounds = 10_000;
+        for round in 0..rounds {
+            let first = round * 997;
+            std::hint::black_box(series.range(first, first + 999));
+        }
+        let small = start.elapsed() / rounds as u32;
+        let start = std::time::Instant::now();
+        std::hint::black_box(series.range(0, u64::MAX));
+        println!("1000-step range: {:?}, all 10M points: {:?}", small, start.elapsed());
+    }
+
+    #[test]
+    #[ignore]
+    fn bench_decimate() {
+        let mut series = Series::default();
+        for step in 0..10_000_000u64 {
+            series.push(step, (step as f64).sqrt(), 0);
+        }
+        let start = std::time::Instant::now();
+        let rounds = 100;
+        for _ in 0..rounds {
+            std::hint::black_box(series.decimate(200));
+        }
+        println!(
+            "decimate 10M points to 200 columns: {:?} per frame",
+            start.elapsed() / rounds
+        );
+    }
+}
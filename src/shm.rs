@@ -0,0 +1,420 @@
+//! Shared-memory channel for logging from other processes on the same host,
+//! such as DataLoader workers.
+//!
+//! The tracker creates a file under `/dev/shm` (the temp directory where that
+//! does not exist) holding a bounded lock-free ring of fixed-size slots, the
+//! same Vyukov design as `ingest::BoundedQueue`. Child processes map it by
+//! name and push into it directly, so logging a point costs one
+//! compare-and-swap and a copy, with no syscall or pickling. A thread in the
+//! tracker drains the ring into the store.
+//!
+//! Layout: a 256-byte header (`CLOGSHM1`, `u64` capacity, then the enqueue
+//! position, the dequeue position, and the drop counter with a millisecond
+//! clock on separate cache lines), followed by `capacity` slots of 128 bytes:
+//!
+//! ```text
+//! u64 sequence | u64 step | f64 value | i64 timestamp ms | u32 name length | 4 bytes padding | name
+//! ```
+//!
+//! A writer killed between claiming a slot and publishing it stalls the
+//! drain at that slot; other writers then see a full ring and count drops.
+
+use std::fs::{File, OpenOptions};
+use std::io;
+use std::path::PathBuf;
+use std::sync::atomic::{AtomicBool, AtomicU64, AtomicUsize, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::Duration;
+
+use chrono::Utc;
+use memmap2::MmapRaw;
+
+use crate::store::MetricStore;
+
+const MAGIC: &[u8; 8] = b"CLOGSHM1";
+const HEADER_LEN: usize = 256;
+const CAPACITY_AT: usize = 8;
+const TAIL_AT: usize = 64;
+const HEAD_AT: usize = 128;
+const DROPPED_AT: usize = 192;
+/// Wall clock in milliseconds, refreshed by the draining thread so writers
+/// timestamp points with one load instead of reading the clock.
+const CLOCK_AT: usize = 200;
+
+const SLOT_LEN: usize = 128;
+const NAME_AT: usize = 40;
+
+/// Longest metric name that fits in a slot.
+pub const MAX_NAME_LEN: usize = SLOT_LEN - NAME_AT;
+
+/// How often the tracker drains its channels.
+const DRAIN_INTERVAL: Duration = Duration::from_millis(5);
+
+static NEXT_CHANNEL: AtomicUsize = AtomicUsize::new(0);
+
+/// Where the channel called `name` lives. A name containing `/` is taken as
+/// a path.
+pub fn path_of(name: &str) -> PathBuf {
+    if name.contains('/') {
+        return PathBuf::from(name);
+    }
+    let shm = std::path::Path::new("/dev/shm");
+    if shm.is_dir() {
+        shm.join(name)
+    } else {
+        std::env::temp_dir().join(name)
+    }
+}
+
+/// The mapped ring, as seen by either side.
+struct Ring {
+    map: MmapRaw,
+    mask: u64,
+}
+
+// Safety: every access to the mapping goes through atomics or through slots
+// owned by one side at a time, as handed over by their sequence numbers.
+unsafe impl Send for Ring {}
+unsafe impl Sync for Ring {}
+
+impl Ring {
+    fn map(file: &File) -> io::Result<Self> {
+        let map = MmapRaw::map_raw(file)?;
+        let invalid = |message: &str| io::Error::new(io::ErrorKind::InvalidData, message.to_string());
+        if map.len() < HEADER_LEN {
+            return Err(invalid("not a clog shared-memory channel"));
+        }
+        // Safety: the mapping is at least HEADER_LEN bytes long.
+        let header = unsafe { std::slice::from_raw_parts(map.as_ptr(), HEADER_LEN) };
+        if &header[..8] != MAGIC {
+            return Err(invalid("not a clog shared-memory channel"));
+        }
+        let capacity = u64::from_le_bytes(header[CAPACITY_AT..CAPACITY_AT + 8].try_into().unwrap());
+        if !capacity.is_power_of_two() || map.len() != HEADER_LEN + capacity as usize * SLOT_LEN {
+            return Err(invalid("corrupt clog shared-memory channel"));
+        }
+        Ok(Ring {
+            map,
+            mask: capacity - 1,
+        })
+    }
+
+    fn atomic(&self, offset: usize) -> &AtomicU64 {
+        // Safety: offsets are 8-byte aligned within the mapping, which is
+        // page aligned, and only ever accessed atomically.
+        unsafe { &*(self.map.as_mut_ptr().add(offset) as *const AtomicU64) }
+    }
+
+    fn slot(&self, pos: u64) -> usize {
+        HEADER_LEN + (pos & self.mask) as usize * SLOT_LEN
+    }
+
+    fn push(&self, name: &[u8], value: f64, step: u64, timestamp_ms: i64) -> bool {
+        let tail = self.atomic(TAIL_AT);
+        let mut pos = tail.load(Ordering::Relaxed);
+        loop {
+            let slot = self.slot(pos);
+            let sequence = self.atomic(slot).load(Ordering::Acquire);
+            let lag = sequence as i64 - pos as i64;
+            if lag == 0 {
+                match tail.compare_exchange_weak(pos, pos + 1, Ordering::Relaxed, Ordering::Relaxed) {
+                    Ok(_) => {
+                        // Safety: winning the exchange gives this writer the
+                        // slot until it publishes the next sequence number.
+                        unsafe {
+                            let base = self.map.as_mut_ptr().add(slot);
+                            base.add(8).cast::<u64>().write(step);
+                            base.add(16).cast::<f64>().write(value);
+                            base.add(24).cast::<i64>().write(timestamp_ms);
+                            base.add(32).cast::<u32>().write(name.len() as u32);
+                            std::ptr::copy_nonoverlapping(name.as_ptr(), base.add(NAME_AT), name.len());
+                        }
+                        self.atomic(slot).store(pos + 1, Ordering::Release);
+                        return true;
+                    }
+                    Err(current) => pos = current,
+                }
+            } else if lag < 0 {
+                self.atomic(DROPPED_AT).fetch_add(1, Ordering::Relaxed);
+                return false;
+            } else {
+                pos = tail.load(Ordering::Relaxed);
+            }
+        }
+    }
+
+    /// Hand every published entry to `f`, oldest first. Only one thread may
+    /// drain at a time.
+    fn drain(&self, mut f: impl FnMut(&str, f64, u64, i64)) -> usize {
+        let head = self.atomic(HEAD_AT);
+        let start = head.load(Ordering::Relaxed);
+        let mut pos = start;
+        loop {
+            let slot = self.slot(pos);
+            if self.atomic(slot).load(Ordering::Acquire) != pos + 1 {
+                break;
+            }
+            // Safety: the sequence number says the writer is done with the
+            // slot, and it stays ours until we bump it below.
+            unsafe {
+                let base = self.map.as_ptr().add(slot);
+                let len = (base.add(32).cast::<u32>().read() as usize).min(MAX_NAME_LEN);
+                let name = std::slice::from_raw_parts(base.add(NAME_AT), len);
+                if let Ok(name) = std::str::from_utf8(name) {
+                    f(
+                        name,
+                        base.add(16).cast::<f64>().read(),
+                        base.add(8).cast::<u64>().read(),
+                        base.add(24).cast::<i64>().read(),
+                    );
+                }
+            }
+            self.atomic(slot).store(pos + self.mask + 1, Ordering::Release);
+            pos += 1;
+            head.store(pos, Ordering::Relaxed);
+        }
+        (pos - start) as usize
+    }
+
+    fn dropped(&self) -> u64 {
+        self.atomic(DROPPED_AT).load(Ordering::Relaxed)
+    }
+}
+
+/// The writing end of a channel, opened by name in another process.
+pub struct ShmWriter {
+    ring: Ring,
+}
+
+impl ShmWriter {
+    pub fn open(name: &str) -> io::Result<Self> {
+        let file = OpenOptions::new().read(true).write(true).open(path_of(name))?;
+        Ok(ShmWriter {
+            ring: Ring::map(&file)?,
+        })
+    }
+
+    /// Queue a point. Returns `Ok(false)` if the ring was full and the point
+    /// was dropped.
+    pub fn push(&self, name: &str, value: f64, step: u64) -> io::Result<bool> {
+        if name.len() > MAX_NAME_LEN {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidInput,
+                format!("metric names sent through shared memory are limited to {} bytes", MAX_NAME_LEN),
+            ));
+        }
+        let timestamp_ms = self.ring.atomic(CLOCK_AT).load(Ordering::Relaxed) as i64;
+        Ok(self.ring.push(name.as_bytes(), value, step, timestamp_ms))
+    }
+
+    /// Points dropped so far because the ring was full, by any writer.
+    pub fn dropped(&self) -> u64 {
+        self.ring.dropped()
+    }
+}
+
+struct ChannelShared {
+    ring: Ring,
+    store: Arc<MetricStore>,
+    draining: Mutex<()>,
+    stop: AtomicBool,
+}
+
+impl ChannelShared {
+    fn tick(&self) {
+        self.ring
+            .atomic(CLOCK_AT)
+            .store(Utc::now().timestamp_millis() as u64, Ordering::Relaxed);
+    }
+
+    fn drain(&self) -> usize {
+        let _draining = self.draining.lock().unwrap();
+        self.ring.drain(|name, value, step, timestamp_ms| self.store.push(name, value, step, timestamp_ms))
+    }
+
+    fn run(&self) {
+        while !self.stop.load(Ordering::Acquire) {
+            self.tick();
+            if self.drain() == 0 {
+                thread::park_timeout(DRAIN_INTERVAL);
+            }
+        }
+        self.drain();
+    }
+}
+
+/// The tracker's end of a channel: creates the ring and drains it into the
+/// store from a background thread. The file is removed when this is dropped;
+/// writers that already mapped it are unaffected.
+pub struct ShmChannel {
+    shared: Arc<ChannelShared>,
+    name: String,
+    path: PathBuf,
+    thread: Option<JoinHandle<()>>,
+}
+
+impl ShmChannel {
+    /// Create a channel of at least `capacity` slots (rounded up to a power
+    /// of two) draining into `store`.
+    pub fn create(store: Arc<MetricStore>, capacity: usize) -> io::Result<Self> {
+        let capacity = capacity.max(2).next_power_of_two();
+        let name = format!(
+            "clog-{}-{}",
+            std::process::id(),
+            NEXT_CHANNEL.fetch_add(1, Ordering::Relaxed)
+        );
+        let path = path_of(&name);
+        let file = OpenOptions::new().read(true).write(true).create_new(true).open(&path)?;
+        let ring = (|| {
+            file.set_len((HEADER_LEN + capacity * SLOT_LEN) as u64)?;
+            let map = MmapRaw::map_raw(&file)?;
+            // Safety: nobody else knows the name yet, and the file was just
+            // sized to hold the header and every slot.
+            unsafe {
+                let base = map.as_mut_ptr();
+                std::ptr::copy_nonoverlapping(MAGIC.as_ptr(), base, MAGIC.len());
+                base.add(CAPACITY_AT).cast::<u64>().write(capacity as u64);
+                for i in 0..capacity {
+                    base.add(HEADER_LEN + i * SLOT_LEN).cast::<u64>().write(i as u64);
+                }
+            }
+            drop(map);
+            Ring::map(&file)
+        })();
+        let ring = ring.inspect_err(|_| {
+            let _ = std::fs::remove_file(&path);
+        })?;
+
+        let shared = Arc::new(ChannelShared {
+            ring,
+            store,
+            draining: Mutex::new(()),
+            stop: AtomicBool::new(false),
+        });
+        shared.tick();
+        let thread = {
+            let shared = shared.clone();
+            thread::Builder::new()
+                .name("clog-shm".into())
+                .spawn(move || shared.run())
+                .expect("failed to spawn clog shared-memory thread")
+        };
+        Ok(ShmChannel {
+            shared,
+            name,
+            path,
+            thread: Some(thread),
+        })
+    }
+
+    /// The name writers pass to `ShmWriter::open`.
+    pub fn name(&self) -> &str {
+        &self.name
+    }
+
+    /// Move everything written so far into the store.
+    pub fn drain(&self) -> usize {
+        self.shared.drain()
+    }
+
+    pub fn dropped(&self) -> u64 {
+        self.shared.ring.dropped()
+    }
+}
+
+impl Drop for ShmChannel {
+    fn drop(&mut self) {
+        self.shared.stop.store(true, Ordering::Release);
+        if let Some(thread) = self.thread.take() {
+            thread.thread().unpark();
+            let _ = thread.join();
+        }
+        let _ = std::fs::remove_file(&self.path);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_writers_reach_the_store() {
+        let store = Arc::new(MetricStore::new());
+        let channel = ShmChannel::create(store.clone(), 1 << 10).unwrap();
+        thread::scope(|scope| {
+            for worker in 0..4 {
+                let name = channel.name();
+                scope.spawn(move || {
+                    // Each worker maps the file itself, as a separate
+                    // process would.
+                    let writer = ShmWriter::open(name).unwrap();
+                    let metric = format!("worker_{}/load_time", worker);
+                    for step in 0..10_000 {
+                        while !writer.push(&metric, step as f64, step).unwrap() {
+                            thread::yield_now();
+                        }
+                    }
+                });
+            }
+        });
+        channel.drain();
+
+        for worker in 0..4 {
+            let points: Vec<(u64, f64)> = store
+                .with_series(&format!("worker_{}/load_time", worker), |series| series.iter().collect())
+                .unwrap();
+            assert_eq!(points.len(), 10_000);
+            assert!(points.iter().all(|&(step, value)| step as f64 == value));
+        }
+    }
+
+    #[test]
+    fn test_full_ring_drops_and_long_names_are_rejected() {
+        let store = Arc::new(MetricStore::new());
+        let channel = ShmChannel::create(store.clone(), 4).unwrap();
+        let writer = ShmWriter::open(channel.name()).unwrap();
+        // Keep the drain thread from racing the writes below.
+        let draining = channel.shared.draining.lock().unwrap();
+        let accepted = (0..10).filter(|&step| writer.push("loss", 1.0, step).unwrap()).count();
+        drop(draining);
+
+        assert_eq!(accepted, 4);
+        assert_eq!(writer.dropped(), 6);
+        assert!(writer.push(&"x".repeat(MAX_NAME_LEN + 1), 1.0, 0).is_err());
+        let path = path_of(channel.name());
+        drop(channel);
+        assert_eq!(store.with_series("loss", |series| series.len()), Some(4));
+        assert!(!path.exists());
+    }
+
+    /// Cost of one write from a worker:
+    /// `cargo test --release bench_shm_write -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_shm_write() {
+        let store = Arc::new(MetricStore::new());
+        let channel = ShmChannel::create(store, 1 << 20).unwrap();
+        let writer = ShmWriter::open(channel.name()).unwrap();
+        let writes = 1_000_000u64;
+        // Fault the ring's pages in first, as a long run would have.
+        for step in 0..writes {
+            writer.push("warm-up", 0.0, step).unwrap();
+        }
+        channel.drain();
+        // Hold the drain back so that only the writer is timed.
+        let draining = channel.shared.draining.lock().unwrap();
+        let start = std::time::Instant::now();
+        for step in 0..writes {
+            writer.push("dataloader/worker_3/batch_time", 0.01, step).unwrap();
+        }
+        let elapsed = start.elapsed();
+        drop(draining);
+        channel.drain();
+        println!(
+            "{:.1} ns/write, {} dropped",
+            elapsed.as_nanos() as f64 / writes as f64,
+            writer.dropped()
+        );
+    }
+}
@@ -0,0 +1,440 @@
+//! Distributions of values per step, kept as DDSketch quantile sketches.
+
+use std::collections::HashMap;
+use std::mem::size_of;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex};
+
+/// Every quantile read from a sketch is within this fraction of the true
+/// value.
+pub const RELATIVE_ACCURACY: f64 = 0.01;
+
+/// Bins kept per sign. Past this, the bins of the smallest magnitudes are
+/// folded together, so a sketch stays under about 16 KiB whatever it was
+/// built from; only quantiles that fall among values more than
+/// `GAMMA^MAX_BINS` (about 8e8) times smaller than the largest lose accuracy.
+const MAX_BINS: usize = 1024;
+
+/// Ratio between the bounds of consecutive bins.
+const GAMMA: f64 = (1.0 + RELATIVE_ACCURACY) / (1.0 - RELATIVE_ACCURACY);
+
+/// The quantiles the UI draws as a band around the median.
+pub const BAND_QUANTILES: [f64; 5] = [0.05, 0.25, 0.5, 0.75, 0.95];
+
+/// Counts of one sign's values by bin key, where key `k` holds magnitudes in
+/// `(GAMMA^(k-1), GAMMA^k]`.
+#[derive(Clone, Debug, Default, PartialEq)]
+struct Bins {
+    /// Key of `counts[0]`.
+    offset: i32,
+    counts: Vec<u64>,
+}
+
+impl Bins {
+    fn add(&mut self, key: i32, count: u64) {
+        if self.counts.is_empty() {
+            self.offset = key;
+        } else if key < self.offset {
+            let grow = (self.offset - key) as usize;
+            self.counts.splice(0..0, std::iter::repeat(0).take(grow));
+            self.offset = key;
+        }
+        let index = (key - self.offset) as usize;
+        if index >= self.counts.len() {
+            self.counts.resize(index + 1, 0);
+        }
+        self.counts[index] += count;
+    }
+
+    fn merge(&mut self, other: &Bins) {
+        // Lowest key first, so the vector grows at the front at most once.
+        for (i, &count) in other.counts.iter().enumerate() {
+            if count > 0 {
+                self.add(other.offset + i as i32, count);
+            }
+        }
+    }
+
+    /// Fold the lowest bins into one so at most `MAX_BINS` remain, trimming
+    /// empty bins at either end first.
+    fn compact(&mut self) {
+        let Some(last) = self.counts.iter().rposition(|&count| count > 0) else {
+            self.counts = Vec::new();
+            return;
+        };
+        self.counts.truncate(last + 1);
+        let first = self.counts.iter().position(|&count| count > 0).unwrap();
+        let first = first.max(self.counts.len().saturating_sub(MAX_BINS));
+        if first > 0 {
+            let folded: u64 = self.counts[..first].iter().sum();
+            self.counts.drain(..first);
+            self.counts[0] += folded;
+            self.offset += first as i32;
+        }
+        self.counts.shrink_to_fit();
+    }
+
+    fn iter(&self) -> impl DoubleEndedIterator<Item = (i32, u64)> + '_ {
+        self.counts
+            .iter()
+            .enumerate()
+            .filter(|(_, &count)| count > 0)
+            .map(|(i, &count)| (self.offset + i as i32, count))
+    }
+}
+
+fn key_of(magnitude: f64) -> i32 {
+    (magnitude.ln() / GAMMA.ln()).ceil() as i32
+}
+
+/// The magnitude reported for bin `key`: within `RELATIVE_ACCURACY` of
+/// anything in the bin.
+fn magnitude_of(key: i32) -> f64 {
+    2.0 * GAMMA.powi(key) / (GAMMA + 1.0)
+}
+
+/// A DDSketch: values are counted in logarithmically sized bins, so any
+/// quantile can be read back with `RELATIVE_ACCURACY` and sketches of
+/// different steps merge by adding counts.
+#[derive(Clone, Debug, Default, PartialEq)]
+pub struct Sketch {
+    positive: Bins,
+    negative: Bins,
+    zero_count: u64,
+    count: u64,
+    /// NaN and infinite values, which are not sketched.
+    non_finite: u64,
+    sum: f64,
+    min: f64,
+    max: f64,
+}
+
+impl Sketch {
+    /// Sketch `values` in one pass.
+    pub fn from_values<T: Copy + Into<f64>>(values: &[T]) -> Sketch {
+        let mut sketch = Sketch {
+            min: f64::INFINITY,
+            max: f64::NEG_INFINITY,
+            ..Sketch::default()
+        };
+        for &value in values {
+            let value: f64 = value.into();
+            if !value.is_finite() {
+                sketch.non_finite += 1;
+                continue;
+            }
+            sketch.count += 1;
+            sketch.sum += value;
+            sketch.min = sketch.min.min(value);
+            sketch.max = sketch.max.max(value);
+            if value > 0.0 {
+                sketch.positive.add(key_of(value), 1);
+            } else if value < 0.0 {
+                sketch.negative.add(key_of(-value), 1);
+            } else {
+                sketch.zero_count += 1;
+            }
+        }
+        sketch.positive.compact();
+        sketch.negative.compact();
+        sketch
+    }
+
+    pub fn merge(&mut self, other: &Sketch) {
+        if self.count == 0 {
+            let non_finite = self.non_finite;
+            *self = other.clone();
+            self.non_finite += non_finite;
+            return;
+        }
+        self.positive.merge(&other.positive);
+        self.negative.merge(&other.negative);
+        self.positive.compact();
+        self.negative.compact();
+        self.zero_count += other.zero_count;
+        self.count += other.count;
+        self.non_finite += other.non_finite;
+        self.sum += other.sum;
+        if other.count > 0 {
+            self.min = self.min.min(other.min);
+            self.max = self.max.max(other.max);
+        }
+    }
+
+    /// Finite values sketched.
+    pub fn count(&self) -> u64 {
+        self.count
+    }
+
+    pub fn non_finite(&self) -> u64 {
+        self.non_finite
+    }
+
+    pub fn min(&self) -> f64 {
+        self.min
+    }
+
+    pub fn max(&self) -> f64 {
+        self.max
+    }
+
+    pub fn mean(&self) -> f64 {
+        self.sum / self.count as f64
+    }
+
+    /// The value below which a fraction `q` of the sketched values fall, or
+    /// NaN if nothing was sketched. The extremes are exact.
+    pub fn quantile(&self, q: f64) -> f64 {
+        if self.count == 0 {
+            return f64::NAN;
+        }
+        let rank = (q.clamp(0.0, 1.0) * (self.count - 1) as f64) as u64;
+        if rank == 0 {
+            return self.min;
+        } else if rank == self.count - 1 {
+            return self.max;
+        }
+        let mut seen = 0;
+        // Most negative values first: the largest magnitudes of `negative`.
+        for (key, count) in self.negative.iter().rev() {
+            seen += count;
+            if seen > rank {
+                return (-magnitude_of(key)).clamp(self.min, self.max);
+            }
+        }
+        seen += self.zero_count;
+        if seen > rank {
+            return 0.0;
+        }
+        for (key, count) in self.positive.iter() {
+            seen += count;
+            if seen > rank {
+                return magnitude_of(key).clamp(self.min, self.max);
+            }
+        }
+        self.max
+    }
+
+    fn heap_bytes(&self) -> usize {
+        (self.positive.counts.capacity() + self.negative.counts.capacity()) * size_of::<u64>()
+    }
+}
+
+/// Quantile lines of a histogram metric, one point per chart column.
+#[derive(Clone, Debug, PartialEq)]
+pub struct QuantileBand {
+    /// One line per entry of `BAND_QUANTILES`.
+    pub lines: Vec<Vec<(f64, f64)>>,
+    pub x_bounds: [f64; 2],
+    pub y_bounds: [f64; 2],
+}
+
+/// The sketch of every step of one histogram metric, in the order logged.
+type Steps = Vec<(u64, Sketch)>;
+
+/// All histogram metrics of a tracker.
+#[derive(Default)]
+pub struct HistogramStore {
+    histograms: Mutex<HashMap<Arc<str>, Arc<Mutex<Steps>>>>,
+    generation: AtomicU64,
+}
+
+impl HistogramStore {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    fn steps_of(&self, name: &str) -> Option<Arc<Mutex<Steps>>> {
+        self.histograms.lock().unwrap().get(name).cloned()
+    }
+
+    /// Add a sketch for `step`, merging it into the last one if that is for
+    /// the same step.
+    pub fn record(&self, name: &str, step: u64, sketch: Sketch) {
+        let steps = {
+            let mut histograms = self.histograms.lock().unwrap();
+            match histograms.get(name) {
+                Some(steps) => steps.clone(),
+                None => histograms.entry(Arc::from(name)).or_default().clone(),
+            }
+        };
+        let mut steps = steps.lock().unwrap();
+        match steps.last_mut() {
+            Some((last, last_sketch)) if *last == step => last_sketch.merge(&sketch),
+            _ => steps.push((step, sketch)),
+        }
+        drop(steps);
+        self.generation.fetch_add(1, Ordering::Relaxed);
+    }
+
+    pub fn contains(&self, name: &str) -> bool {
+        self.histograms.lock().unwrap().contains_key(name)
+    }
+
+    /// Changes whenever any histogram gains a step; read without locking.
+    pub fn generation(&self) -> u64 {
+        self.generation.load(Ordering::Relaxed)
+    }
+
+    /// Run `f` on the steps of `name` while holding only that histogram's
+    /// lock.
+    pub fn with_steps<R>(&self, name: &str, f: impl FnOnce(&[(u64, Sketch)]) -> R) -> Option<R> {
+        let steps = self.steps_of(name)?;
+        let steps = steps.lock().unwrap();
+        Some(f(&steps))
+    }
+
+    /// `BAND_QUANTILES` of `name` across `columns` equal step ranges, each
+    /// read from the merged sketches of the steps in that range.
+    pub fn band(&self, name: &str, columns: usize) -> Option<QuantileBand> {
+        self.with_steps(name, |steps| band(steps, columns)).flatten()
+    }
+
+    pub fn heap_bytes(&self) -> usize {
+        let histograms = self.histograms.lock().unwrap();
+        histograms
+            .iter()
+            .map(|(name, steps)| {
+                let steps = steps.lock().unwrap();
+                name.len()
+                    + steps.capacity() * size_of::<(u64, Sketch)>()
+                    + steps.iter().map(|(_, sketch)| sketch.heap_bytes()).sum::<usize>()
+            })
+            .sum()
+    }
+}
+
+fn band(steps: &[(u64, Sketch)], columns: usize) -> Option<QuantileBand> {
+    let first = steps.iter().map(|(step, _)| *step).min()?;
+    let last = steps.iter().map(|(step, _)| *step).max()?;
+    let columns = columns.max(1);
+    let steps_per_column = (last - first + 1) as f64 / columns as f64;
+    let mut bins: Vec<Option<(u64, Sketch)>> = vec![None; columns];
+    for (step, sketch) in steps {
+        let column = (((step - first) as f64 / steps_per_column) as usize).min(columns - 1);
+        match &mut bins[column] {
+            Some((_, merged)) => merged.merge(sketch),
+            bin => *bin = Some((*step, sketch.clone())),
+        }
+    }
+
+    let mut lines = vec![Vec::new(); BAND_QUANTILES.len()];
+    let mut y_bounds = [f64::INFINITY, f64::NEG_INFINITY];
+    for (step, sketch) in bins.iter().flatten() {
+        if sketch.count() == 0 {
+            continue;
+        }
+        for (line, &q) in lines.iter_mut().zip(&BAND_QUANTILES) {
+            let value = sketch.quantile(q);
+            line.push((*step as f64, value));
+            y_bounds = [y_bounds[0].min(value), y_bounds[1].max(value)];
+        }
+    }
+    if !(y_bounds[0] <= y_bounds[1]) {
+        y_bounds = [0.0, 1.0];
+    } else if y_bounds[0] == y_bounds[1] {
+        y_bounds = [y_bounds[0] - 0.5, y_bounds[1] + 0.5];
+    }
+    let x_bounds = if first == last {
+        [first as f64, first as f64 + 1.0]
+    } else {
+        [first as f64, last as f64]
+    };
+    Some(QuantileBand {
+        lines,
+        x_bounds,
+        y_bounds,
+    })
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::time::Instant;
+
+    /// The exact `q` quantile of sorted values, with the rank `quantile` uses.
+    fn exact(sorted: &[f64], q: f64) -> f64 {
+        sorted[(q * (sorted.len() - 1) as f64) as usize]
+    }
+
+    #[test]
+    fn test_quantiles_within_relative_accuracy() {
+        // Signed values over eight orders of magnitude, zeros and a NaN.
+        let mut values: Vec<f64> = (1..=20_000)
+            .map(|i| {
+                let magnitude = 10f64.powf((i % 800) as f64 / 100.0 - 4.0);
+                if i % 3 == 0 { -magnitude } else { magnitude }
+            })
+            .collect();
+        values.extend([0.0; 50]);
+        let mut sketch = Sketch::from_values(&values);
+        sketch.merge(&Sketch::from_values(&[f64::NAN]));
+        values.sort_by(f64::total_cmp);
+
+        assert_eq!(sketch.count(), 20_050);
+        assert_eq!(sketch.non_finite(), 1);
+        assert_eq!((sketch.min(), sketch.max()), (values[0], values[values.len() - 1]));
+        for q in [0.0, 0.01, 0.1, 0.25, 0.33, 0.34, 0.5, 0.75, 0.9, 0.99, 1.0] {
+            let (estimate, truth) = (sketch.quantile(q), exact(&values, q));
+            assert!(
+                (estimate - truth).abs() <= RELATIVE_ACCURACY * truth.abs() + 1e-12,
+                "q {}: {} vs {}",
+                q,
+                estimate,
+                truth
+            );
+        }
+        assert!(Sketch::default().quantile(0.5).is_nan());
+    }
+
+    #[test]
+    fn test_size_is_bounded() {
+        // Magnitudes from 1e-150 to 1e150 need far more than MAX_BINS bins.
+        let values: Vec<f64> = (0..100_000).map(|i| 10f64.powf(i as f64 * 3e-3 - 150.0)).collect();
+        let sketch = Sketch::from_values(&values);
+        assert!(sketch.positive.counts.len() <= MAX_BINS);
+        assert_eq!(sketch.count(), 100_000);
+        let top = exact(&values, 0.99);
+        assert!((sketch.quantile(0.99) - top).abs() <= RELATIVE_ACCURACY * top);
+    }
+
+    #[test]
+    fn test_band_merges_steps_per_column() {
+        let store = HistogramStore::new();
+        for step in 0..100u64 {
+            let values: Vec<f32> = (0..=100).map(|i| (step * 100 + i) as f32).collect();
+            store.record("weights", step, Sketch::from_values(&values));
+        }
+        store.record("weights", 99, Sketch::from_values(&[1e6f32]));
+
+        let band = store.band("weights", 10).unwrap();
+        assert_eq!(band.lines.len(), BAND_QUANTILES.len());
+        assert_eq!(band.lines[2].len(), 10);
+        // The first column merges steps 0..10, whose values span 0..=1000.
+        let (step, median) = band.lines[2][0];
+        assert_eq!(step, 0.0);
+        assert!((median - 500.0).abs() <= 5.0, "median {}", median);
+        assert_eq!(band.x_bounds, [0.0, 99.0]);
+        assert_eq!(store.with_steps("weights", <[_]>::len), Some(100));
+        assert!(store.band("missing", 10).is_none());
+    }
+
+    /// Sketching throughput for a 10M-element float32 tensor:
+    /// `cargo test --release bench_sketch -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_sketch() {
+        let values: Vec<f32> = (0..10_000_000u32)
+            .map(|i| ((i.wrapping_mul(2_654_435_761) as f32 / u32::MAX as f32) - 0.5) * 0.02)
+            .collect();
+        let start = Instant::now();
+        let sketch = Sketch::from_values(&values);
+        let elapsed = start.elapsed();
+        println!(
+            "{:.2} ns per value, {} bins, {} heap bytes",
+            elapsed.as_nanos() as f64 / values.len() as f64,
+            sketch.positive.counts.len() + sketch.negative.counts.len(),
+            sketch.heap_bytes()
+        );
+    }
+}
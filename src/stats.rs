@@ -0,0 +1,260 @@
+use std::collections::VecDeque;
+use std::mem::size_of;
+
+/// Parameters of the running statistics kept for every series.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub struct StatsConfig {
+    /// Weight of the newest point in the exponential moving average.
+    pub ema_alpha: f64,
+    /// Number of most recent points covered by the window aggregates.
+    pub window: usize,
+}
+
+impl Default for StatsConfig {
+    fn default() -> Self {
+        StatsConfig {
+            ema_alpha: 0.1,
+            window: 100,
+        }
+    }
+}
+
+/// A point-in-time copy of a series' running statistics.
+///
+/// NaN points are only counted in `count` and `nan_count`; every other field
+/// covers the remaining points. Fields are NaN until there is a point to
+/// describe.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub struct Summary {
+    pub count: u64,
+    pub nan_count: u64,
+    pub last: f64,
+    pub min: f64,
+    pub min_step: u64,
+    pub max: f64,
+    pub max_step: u64,
+    pub mean: f64,
+    /// Sample variance (n - 1 denominator); 0 for a single point.
+    pub variance: f64,
+    pub ema: f64,
+    pub window_count: usize,
+    pub window_mean: f64,
+    pub window_min: f64,
+    pub window_max: f64,
+}
+
+/// Sliding min/max/mean over the last `capacity` points.
+///
+/// The min and max use monotonic queues of `(index, value)`, so each push is
+/// amortised O(1) however large the window is.
+#[derive(Clone, Debug)]
+struct Window {
+    capacity: usize,
+    values: VecDeque<f64>,
+    sum: f64,
+    pushed: u64,
+    mins: VecDeque<(u64, f64)>,
+    maxs: VecDeque<(u64, f64)>,
+}
+
+impl Window {
+    fn new(capacity: usize) -> Self {
+        Window {
+            capacity: capacity.max(1),
+            values: VecDeque::new(),
+            sum: 0.0,
+            pushed: 0,
+            mins: VecDeque::new(),
+            maxs: VecDeque::new(),
+        }
+    }
+
+    fn push(&mut self, value: f64) {
+        let index = self.pushed;
+        self.pushed += 1;
+        if self.values.len() == self.capacity {
+            self.sum -= self.values.pop_front().unwrap();
+        }
+        self.values.push_back(value);
+        self.sum += value;
+        // Adding and subtracting drifts; resum once per window length so the
+        // error stays bounded at amortised O(1) cost.
+        if self.pushed % self.capacity as u64 == 0 {
+            self.sum = self.values.iter().sum();
+        }
+
+        let oldest = (index + 1).saturating_sub(self.capacity as u64);
+        while self.mins.back().is_some_and(|&(_, min)| min >= value) {
+            self.mins.pop_back();
+        }
+        self.mins.push_back((index, value));
+        while self.mins.front().is_some_and(|&(i, _)| i < oldest) {
+            self.mins.pop_front();
+        }
+        while self.maxs.back().is_some_and(|&(_, max)| max <= value) {
+            self.maxs.pop_back();
+        }
+        self.maxs.push_back((index, value));
+        while self.maxs.front().is_some_and(|&(i, _)| i < oldest) {
+            self.maxs.pop_front();
+        }
+    }
+
+    fn heap_bytes(&self) -> usize {
+        self.values.capacity() * size_of::<f64>()
+            + (self.mins.capacity() + self.maxs.capacity()) * size_of::<(u64, f64)>()
+    }
+}
+
+/// Statistics of a series, updated in O(1) as points arrive.
+///
+/// Mean and variance use Welford's algorithm, which stays accurate over
+/// billions of points where a naive sum of squares would not.
+#[derive(Clone, Debug)]
+pub struct RunningStats {
+    alpha: f64,
+    count: u64,
+    nan_count: u64,
+    last: f64,
+    min: f64,
+    min_step: u64,
+    max: f64,
+    max_step: u64,
+    mean: f64,
+    m2: f64,
+    ema: f64,
+    window: Window,
+}
+
+impl RunningStats {
+    pub fn new(config: StatsConfig) -> Self {
+        RunningStats {
+            alpha: config.ema_alpha,
+            count: 0,
+            nan_count: 0,
+            last: f64::NAN,
+            min: f64::NAN,
+            min_step: 0,
+            max: f64::NAN,
+            max_step: 0,
+            mean: f64::NAN,
+            m2: 0.0,
+            ema: f64::NAN,
+            window: Window::new(config.window),
+        }
+    }
+
+    pub fn push(&mut self, step: u64, value: f64) {
+        self.count += 1;
+        if value.is_nan() {
+            self.nan_count += 1;
+            return;
+        }
+        self.last = value;
+
+        let n = (self.count - self.nan_count) as f64;
+        if n == 1.0 {
+            self.min = value;
+            self.min_step = step;
+            self.max = value;
+            self.max_step = step;
+            self.mean = value;
+            self.ema = value;
+        } else {
+            if value < self.min {
+                self.min = value;
+                self.min_step = step;
+            }
+            if value > self.max {
+                self.max = value;
+                self.max_step = step;
+            }
+            let delta = value - self.mean;
+            self.mean += delta / n;
+            self.m2 += delta * (value - self.mean);
+            self.ema += self.alpha * (value - self.ema);
+        }
+        self.window.push(value);
+    }
+
+    pub fn summary(&self) -> Summary {
+        let n = self.count - self.nan_count;
+        let window = &self.window;
+        let window_count = window.values.len();
+        Summary {
+            count: self.count,
+            nan_count: self.nan_count,
+            last: self.last,
+            min: self.min,
+            min_step: self.min_step,
+            max: self.max,
+            max_step: self.max_step,
+            mean: self.mean,
+            variance: match n {
+                0 => f64::NAN,
+                1 => 0.0,
+                n => self.m2 / (n - 1) as f64,
+            },
+            ema: self.ema,
+            window_count,
+            window_mean: window.sum / window_count as f64,
+            window_min: window.mins.front().map_or(f64::NAN, |&(_, min)| min),
+            window_max: window.maxs.front().map_or(f64::NAN, |&(_, max)| max),
+        }
+    }
+
+    pub fn heap_bytes(&self) -> usize {
+        self.window.heap_bytes()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_matches_direct_computation() {
+        let values: Vec<f64> = (0..1_000).map(|i| ((i * 7919) % 1_000) as f64 / 10.0).collect();
+        let mut stats = RunningStats::new(StatsConfig {
+            ema_alpha: 0.5,
+            window: 10,
+        });
+        for (step, &value) in values.iter().enumerate() {
+            stats.push(step as u64, value);
+        }
+        let summary = stats.summary();
+
+        let n = values.len() as f64;
+        let mean = values.iter().sum::<f64>() / n;
+        let variance = values.iter().map(|v| (v - mean).powi(2)).sum::<f64>() / (n - 1.0);
+        let tail = &values[values.len() - 10..];
+        assert_eq!(summary.count, 1_000);
+        assert_eq!(summary.min, 0.0);
+        assert_eq!(summary.max, 99.9);
+        assert_eq!(values[summary.max_step as usize], 99.9);
+        assert!((summary.mean - mean).abs() < 1e-9);
+        assert!((summary.variance - variance).abs() < 1e-6);
+        assert_eq!(summary.last, values[999]);
+        assert_eq!(summary.window_count, 10);
+        assert!((summary.window_mean - tail.iter().sum::<f64>() / 10.0).abs() < 1e-9);
+        assert_eq!(summary.window_min, tail.iter().copied().fold(f64::INFINITY, f64::min));
+        assert_eq!(summary.window_max, tail.iter().copied().fold(f64::NEG_INFINITY, f64::max));
+    }
+
+    #[test]
+    fn test_nan_points_are_counted_separately() {
+        let mut stats = RunningStats::new(StatsConfig::default());
+        stats.push(0, 2.0);
+        stats.push(1, f64::NAN);
+        stats.push(2, 4.0);
+        stats.push(3, f64::NAN);
+        let summary = stats.summary();
+
+        assert_eq!((summary.count, summary.nan_count), (4, 2));
+        assert_eq!(summary.last, 4.0);
+        assert_eq!(summary.mean, 3.0);
+        assert_eq!(summary.ema, 2.2);
+        assert_eq!((summary.min, summary.max), (2.0, 4.0));
+        assert!(RunningStats::new(StatsConfig::default()).summary().mean.is_nan());
+    }
+}
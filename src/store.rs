@@ -0,0 +1,486 @@
+use std::collections::HashMap;
+use std::hash::{BuildHasherDefault, Hasher};
+use std::sync::atomic::{AtomicBool, AtomicU64, AtomicUsize, Ordering};
+use std::sync::{Arc, Mutex};
+
+use crate::series::{Retention, Series};
+use crate::stats::StatsConfig;
+
+/// Number of independently locked shards. Threads logging different metrics
+/// rarely land on the same shard, so ingestion scales with cores instead of
+/// serialising on one lock.
+const SHARDS: usize = 64;
+
+/// Below this many points, `MetricStore::load_columns` costs less than
+/// starting threads for it.
+const INLINE_LOAD_POINTS: usize = 1 << 16;
+
+/// FNV-1a: much cheaper than SipHash for short metric names.
+#[derive(Default)]
+pub struct FnvHasher(u64);
+
+impl Hasher for FnvHasher {
+    fn write(&mut self, bytes: &[u8]) {
+        let mut hash = if self.0 == 0 { 0xcbf2_9ce4_8422_2325 } else { self.0 };
+        for &byte in bytes {
+            hash ^= byte as u64;
+            hash = hash.wrapping_mul(0x0100_0000_01b3);
+        }
+        self.0 = hash;
+    }
+
+    fn finish(&self) -> u64 {
+        self.0
+    }
+}
+
+pub(crate) type FnvMap<K, V> = HashMap<K, V, BuildHasherDefault<FnvHasher>>;
+
+fn shard_of(name: &str) -> usize {
+    let mut hasher = FnvHasher::default();
+    hasher.write(name.as_bytes());
+    // The low bits also pick the bucket inside the shard's map; use the high
+    // bits so the two choices are independent.
+    (hasher.finish() >> 58) as usize % SHARDS
+}
+
+/// One point as recorded in the change feed. `id` indexes `MetricStore::names`.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub struct FeedPoint {
+    pub id: u32,
+    pub step: u64,
+    pub value: f64,
+    pub timestamp_ms: i64,
+}
+
+struct Slot {
+    id: u32,
+    series: Series,
+}
+
+#[derive(Default)]
+struct Shard {
+    slots: FnvMap<Arc<str>, Slot>,
+    feed: Vec<FeedPoint>,
+}
+
+/// Keeps each shard lock on its own cache line.
+#[repr(align(64))]
+pub(crate) struct Padded<T>(pub(crate) T);
+
+/// A shard's lock and a count of writes to it. Both share one cache line, so
+/// bumping the count costs writers nothing beyond the lock they already hold.
+#[derive(Default)]
+struct ShardCell {
+    lock: Mutex<Shard>,
+    generation: AtomicU64,
+}
+
+impl ShardCell {
+    /// Only called with `lock` held, so a plain load and store cannot lose
+    /// an update.
+    fn bump(&self) {
+        let generation = self.generation.load(Ordering::Relaxed);
+        self.generation.store(generation + 1, Ordering::Release);
+    }
+}
+
+/// All metric series of a tracker, keyed by interned metric name.
+///
+/// Series are spread over `SHARDS` mutexes by name hash, so concurrent
+/// writers only contend when they log metrics that share a shard. Each name
+/// is stored once; logging to an existing metric only needs a borrowed `&str`
+/// lookup, with no allocation.
+///
+/// When the change feed is enabled, every point is also copied into a
+/// per-shard buffer under the lock already held, for a background consumer
+/// (see `feed::Pump`) to drain.
+pub struct MetricStore {
+    shards: Box<[Padded<ShardCell>]>,
+    names: Mutex<Vec<Arc<str>>>,
+    retention: Retention,
+    stats: StatsConfig,
+    feed_enabled: AtomicBool,
+}
+
+impl Default for MetricStore {
+    fn default() -> Self {
+        MetricStore::with_retention(Retention::default())
+    }
+}
+
+impl MetricStore {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    pub fn with_retention(retention: Retention) -> Self {
+        Self::with_config(retention, StatsConfig::default())
+    }
+
+    pub fn with_config(retention: Retention, stats: StatsConfig) -> Self {
+        MetricStore {
+            shards: (0..SHARDS).map(|_| Padded(ShardCell::default())).collect(),
+            names: Mutex::new(Vec::new()),
+            retention,
+            stats,
+            feed_enabled: AtomicBool::new(false),
+        }
+    }
+
+    fn shard(&self, name: &str) -> &ShardCell {
+        &self.shards[shard_of(name)].0
+    }
+
+    pub fn push(&self, name: &str, value: f64, step: u64, timestamp_ms: i64) {
+        let cell = self.shard(name);
+        let mut shard = cell.lock.lock().unwrap();
+        self.push_locked(&mut shard, name, step, value, timestamp_ms);
+        cell.bump();
+    }
+
+    /// Log several metrics at the same step, taking each shard lock once.
+    pub fn push_many(&self, points: &[(&str, f64)], step: u64, timestamp_ms: i64) {
+        let mut order: Vec<(usize, usize)> = points
+            .iter()
+            .enumerate()
+            .map(|(i, (name, _))| (shard_of(name), i))
+            .collect();
+        order.sort_unstable();
+
+        for group in order.chunk_by(|a, b| a.0 == b.0) {
+            let cell = &self.shards[group[0].0].0;
+            let mut shard = cell.lock.lock().unwrap();
+            for &(_, i) in group {
+                let (name, value) = points[i];
+                self.push_locked(&mut shard, name, step, value, timestamp_ms);
+            }
+            cell.bump();
+        }
+    }
+
+    /// Append many points to one metric under a single lock.
+    pub fn extend(&self, name: &str, points: impl IntoIterator<Item = (u64, f64)>, timestamp_ms: i64) {
+        let cell = self.shard(name);
+        let mut shard = cell.lock.lock().unwrap();
+        for (step, value) in points {
+            self.push_locked(&mut shard, name, step, value, timestamp_ms);
+        }
+        cell.bump();
+    }
+
+    /// Like `extend`, with a timestamp per point.
+    pub fn extend_timed(&self, name: &str, points: impl IntoIterator<Item = (u64, f64, i64)>) {
+        let cell = self.shard(name);
+        let mut shard = cell.lock.lock().unwrap();
+        for (step, value, timestamp_ms) in points {
+            self.push_locked(&mut shard, name, step, value, timestamp_ms);
+        }
+        cell.bump();
+    }
+
+    /// Load whole series at once, each given as its name and step, value and
+    /// timestamp columns, spread over up to one thread per core. Batches
+    /// under `INLINE_LOAD_POINTS` are loaded on the calling thread.
+    pub fn load_columns(&self, series: &[(&str, &[u64], &[f64], &[i64])]) {
+        let next = AtomicUsize::new(0);
+        let load = || {
+            while let Some(&(name, steps, values, timestamps_ms)) = series.get(next.fetch_add(1, Ordering::Relaxed)) {
+                let points = steps.iter().zip(values).zip(timestamps_ms);
+                self.extend_timed(name, points.map(|((&step, &value), &timestamp_ms)| (step, value, timestamp_ms)));
+            }
+        };
+        let points: usize = series.iter().map(|&(_, steps, _, _)| steps.len()).sum();
+        let threads = if points < INLINE_LOAD_POINTS {
+            1
+        } else {
+            std::thread::available_parallelism().map_or(1, |n| n.get()).min(series.len())
+        };
+        if threads <= 1 {
+            return load();
+        }
+        std::thread::scope(|scope| {
+            for _ in 0..threads {
+                scope.spawn(&load);
+            }
+        });
+    }
+
+    fn push_locked(&self, shard: &mut Shard, name: &str, step: u64, value: f64, timestamp_ms: i64) {
+        let id = match shard.slots.get_mut(name) {
+            Some(slot) => {
+                slot.series.push(step, value, timestamp_ms);
+                slot.id
+            }
+            None => {
+                let name: Arc<str> = Arc::from(name);
+                let mut series = Series::with_stats(self.retention, self.stats);
+                series.push(step, value, timestamp_ms);
+                // Registered while the shard is still locked, so a feed
+                // consumer that sees this point can always resolve its id.
+                let mut names = self.names.lock().unwrap();
+                let id = names.len() as u32;
+                names.push(name.clone());
+                shard.slots.insert(name, Slot { id, series });
+                id
+            }
+        };
+        if self.feed_enabled.load(Ordering::Relaxed) {
+            shard.feed.push(FeedPoint {
+                id,
+                step,
+                value,
+                timestamp_ms,
+            });
+        }
+    }
+
+    /// Start copying every new point into the change feed.
+    pub fn enable_feed(&self) {
+        self.feed_enabled.store(true, Ordering::Relaxed);
+    }
+
+    /// Stop copying points into the change feed, and free any not drained
+    /// yet, once nothing is left to drain it.
+    pub fn disable_feed(&self) {
+        self.feed_enabled.store(false, Ordering::Relaxed);
+        for shard in self.shards.iter() {
+            shard.0.lock.lock().unwrap().feed = Vec::new();
+        }
+    }
+
+    /// Move points logged since the last call into `out`, shard by shard.
+    ///
+    /// Points of one metric stay in the order they were logged.
+    pub fn drain_feed(&self, out: &mut Vec<FeedPoint>) {
+        for shard in self.shards.iter() {
+            out.append(&mut shard.0.lock.lock().unwrap().feed);
+        }
+    }
+
+    /// Like `drain_feed`, also passing every series to `visit` with its id
+    /// under the same lock, so each series seen holds exactly the points
+    /// drained so far and every later point lands in the next drain.
+    pub fn drain_feed_with(&self, out: &mut Vec<FeedPoint>, mut visit: impl FnMut(u32, &Series)) {
+        for shard in self.shards.iter() {
+            let mut shard = shard.0.lock.lock().unwrap();
+            out.append(&mut shard.feed);
+            for slot in shard.slots.values_mut() {
+                slot.series.settle();
+                visit(slot.id, &slot.series);
+            }
+        }
+    }
+
+    /// Run `f` on the series for `name` while holding only its shard's lock.
+    ///
+    /// Late points waiting in the series are merged first, so `f` always
+    /// sees every point in step order.
+    pub fn with_series<R>(&self, name: &str, f: impl FnOnce(&Series) -> R) -> Option<R> {
+        let mut shard = self.shard(name).lock.lock().unwrap();
+        shard.slots.get_mut(name).map(|slot| {
+            slot.series.settle();
+            f(&slot.series)
+        })
+    }
+
+    pub fn contains(&self, name: &str) -> bool {
+        self.shard(name).lock.lock().unwrap().slots.contains_key(name)
+    }
+
+    pub fn len(&self) -> usize {
+        self.names.lock().unwrap().len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// Metric names in the order they were first logged. A name's position
+    /// is its id in the change feed.
+    pub fn names(&self) -> Vec<Arc<str>> {
+        self.names.lock().unwrap().clone()
+    }
+
+    /// A counter that changes whenever any series gains points. Reading it
+    /// takes no locks, so a UI can poll it to decide whether to redraw.
+    pub fn generation(&self) -> u64 {
+        self.shards
+            .iter()
+            .fold(0u64, |sum, shard| sum.wrapping_add(shard.0.generation.load(Ordering::Acquire)))
+    }
+
+    /// Names with ids from `first_id` onwards.
+    pub fn names_since(&self, first_id: usize) -> Vec<Arc<str>> {
+        let names = self.names.lock().unwrap();
+        names.get(first_id..).map_or_else(Vec::new, <[Arc<str>]>::to_vec)
+    }
+
+    /// Bytes allocated on the heap for all series points and interned names.
+    pub fn heap_bytes(&self) -> usize {
+        self.shards
+            .iter()
+            .map(|shard| {
+                let shard = shard.0.lock.lock().unwrap();
+                shard
+                    .slots
+                    .iter()
+                    .map(|(name, slot)| name.len() + slot.series.heap_bytes())
+                    .sum::<usize>()
+            })
+            .sum()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::thread;
+    use std::time::Instant;
+
+    #[test]
+    fn test_names_are_interned_once() {
+        let store = MetricStore::new();
+        for step in 0..10 {
+            store.push("loss", 1.0 / (step + 1) as f64, step, 0);
+            store.push("accuracy", step as f64 / 10.0, step, 0);
+        }
+
+        assert_eq!(store.len(), 2);
+        assert_eq!(store.generation(), 20);
+        let names = store.names();
+        assert_eq!(names.iter().map(|name| name.as_ref()).collect::<Vec<&str>>(), vec!["loss", "accuracy"]);
+        assert_eq!(store.with_series("loss", Series::len), Some(10));
+        assert!(store.with_series("missing", Series::len).is_none());
+    }
+
+    #[test]
+    fn test_push_many_and_extend() {
+        let store = MetricStore::new();
+        let names: Vec<String> = (0..100).map(|i| format!("layer_{}/grad_norm", i)).collect();
+        for step in 0..5 {
+            let points: Vec<(&str, f64)> = names.iter().map(|name| (name.as_str(), step as f64)).collect();
+            store.push_many(&points, step, 0);
+        }
+        store.extend("backfill", (0..1_000).map(|step| (step, step as f64 * 2.0)), 0);
+
+        assert_eq!(store.len(), 101);
+        assert_eq!(store.with_series("layer_42/grad_norm", Series::total_count), Some(5));
+        assert_eq!(store.with_series("layer_42/grad_norm", Series::last_value), Some(Some(4.0)));
+        assert_eq!(store.with_series("backfill", Series::last_value), Some(Some(1_998.0)));
+    }
+
+    #[test]
+    fn test_load_columns() {
+        let store = MetricStore::new();
+        let names: Vec<String> = (0..20).map(|i| format!("run_{}/loss", i)).collect();
+        let steps: Vec<u64> = (0..3_000).collect();
+        let values: Vec<f64> = steps.iter().map(|&step| step as f64).collect();
+        let timestamps: Vec<i64> = steps.iter().map(|&step| step as i64 * 10).collect();
+        let series: Vec<(&str, &[u64], &[f64], &[i64])> =
+            names.iter().map(|name| (name.as_str(), &steps[..], &values[..], &timestamps[..])).collect();
+        store.load_columns(&series);
+
+        assert_eq!(store.len(), 20);
+        assert_eq!(store.with_series("run_7/loss", Series::total_count), Some(3_000));
+        assert_eq!(store.with_series("run_7/loss", |series| series.timestamps_ms().last()), Some(Some(29_990)));
+    }
+
+    #[test]
+    fn test_feed() {
+        let store = MetricStore::new();
+        store.push("before", 1.0, 0, 0);
+        store.enable_feed();
+        store.push("loss", 2.0, 1, 10);
+        store.push_many(&[("loss", 3.0), ("acc", 0.5)], 2, 20);
+
+        let mut feed = Vec::new();
+        store.drain_feed(&mut feed);
+        feed.sort_by_key(|point| (point.id, point.step));
+        assert_eq!(store.names()[feed[0].id as usize].as_ref(), "loss");
+        assert_eq!(
+            feed,
+            vec![
+                FeedPoint { id: 1, step: 1, value: 2.0, timestamp_ms: 10 },
+                FeedPoint { id: 1, step: 2, value: 3.0, timestamp_ms: 20 },
+                FeedPoint { id: 2, step: 2, value: 0.5, timestamp_ms: 20 },
+            ]
+        );
+
+        feed.clear();
+        store.drain_feed(&mut feed);
+        assert!(feed.is_empty());
+
+        store.push("loss", 4.0, 3, 30);
+        store.disable_feed();
+        store.push("loss", 5.0, 4, 40);
+        store.drain_feed(&mut feed);
+        assert!(feed.is_empty());
+    }
+
+    #[test]
+    fn test_concurrent_push() {
+        let store = MetricStore::new();
+        thread::scope(|scope| {
+            for t in 0..8 {
+                let store = &store;
+                scope.spawn(move || {
+                    for step in 0..1_000 {
+                        store.push("shared", t as f64, step, 0);
+                        store.push(&format!("thread_{}", t), step as f64, step, 0);
+                    }
+                });
+            }
+        });
+
+        assert_eq!(store.len(), 9);
+        assert_eq!(store.with_series("shared", Series::total_count), Some(8_000));
+        assert_eq!(store.with_series("thread_3", Series::total_count), Some(1_000));
+    }
+
+    /// Ingestion throughput from 1 to 32 threads, each logging its own set of
+    /// metrics, against a single global lock:
+    /// `cargo test --release bench_ingest_scaling -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_ingest_scaling() {
+        const POINTS: u64 = 200_000;
+        const METRICS: usize = 8;
+
+        fn run(threads: usize, push: &(dyn Fn(&str, u64) + Sync)) -> f64 {
+            let start = Instant::now();
+            thread::scope(|scope| {
+                for t in 0..threads {
+                    scope.spawn(move || {
+                        let names: Vec<String> =
+                            (0..METRICS).map(|m| format!("worker_{}/metric_{}", t, m)).collect();
+                        for step in 0..POINTS {
+                            push(&names[step as usize % METRICS], step);
+                        }
+                    });
+                }
+            });
+            (threads as u64 * POINTS) as f64 / start.elapsed().as_secs_f64() / 1e6
+        }
+
+        println!("threads  sharded Mpts/s  global-lock Mpts/s");
+        for threads in [1, 2, 4, 8, 16, 32] {
+            let store = MetricStore::new();
+            let sharded = run(threads, &|name, step| store.push(name, 1.0, step, 0));
+
+            let global: Mutex<HashMap<String, Series>> = Mutex::new(HashMap::new());
+            let locked = run(threads, &|name, step| {
+                let mut map = global.lock().unwrap();
+                match map.get_mut(name) {
+                    Some(series) => series.push(step, 1.0, 0),
+                    None => {
+                        let mut series = Series::default();
+                        series.push(step, 1.0, 0);
+                        map.insert(name.to_string(), series);
+                    }
+                }
+            });
+            println!("{:>7}  {:>14.1}  {:>18.1}", threads, sharded, locked);
+        }
+    }
+}
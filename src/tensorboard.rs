@@ -0,0 +1,467 @@
+//! Loading scalars from TensorBoard event files, for
+//! `ClogTracker.from_tensorboard`.
+//!
+//! Event files are TFRecord streams of `Event` protobufs. Only what a scalar
+//! chart needs is decoded: each event's `wall_time` and `step`, and the
+//! summary values that hold one number, either as `simple_value` (as written
+//! by PyTorch's `SummaryWriter`) or as a scalar float tensor (as written by
+//! `tf.summary.scalar`). Images, histograms and everything else are skipped
+//! by length without being parsed.
+
+use std::collections::HashMap;
+use std::fs;
+use std::io;
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+
+use crate::store::MetricStore;
+
+/// TensorFlow's `DataType` codes for the tensors read as scalars.
+const DT_FLOAT: u64 = 1;
+const DT_DOUBLE: u64 = 2;
+
+/// Tables for CRC-32C eight bytes at a time: `CRC32C_TABLES[0]` is the usual
+/// byte table, and `CRC32C_TABLES[k][i]` the CRC of byte `i` followed by `k`
+/// zero bytes.
+const CRC32C_TABLES: [[u32; 256]; 8] = {
+    let mut tables = [[0u32; 256]; 8];
+    let mut i = 0;
+    while i < 256 {
+        let mut crc = i as u32;
+        let mut bit = 0;
+        while bit < 8 {
+            crc = if crc & 1 == 1 { (crc >> 1) ^ 0x82f6_3b78 } else { crc >> 1 };
+            bit += 1;
+        }
+        tables[0][i] = crc;
+        i += 1;
+    }
+    let mut k = 1;
+    while k < 8 {
+        let mut i = 0;
+        while i < 256 {
+            let previous = tables[k - 1][i];
+            tables[k][i] = (previous >> 8) ^ tables[0][(previous & 0xff) as usize];
+            i += 1;
+        }
+        k += 1;
+    }
+    tables
+};
+
+fn crc32c(bytes: &[u8]) -> u32 {
+    let tables = &CRC32C_TABLES;
+    let mut crc = !0u32;
+    let mut words = bytes.chunks_exact(8);
+    for word in &mut words {
+        let low = crc ^ u32::from_le_bytes(word[..4].try_into().unwrap());
+        let high = u32::from_le_bytes(word[4..].try_into().unwrap());
+        crc = tables[7][(low & 0xff) as usize]
+            ^ tables[6][(low >> 8 & 0xff) as usize]
+            ^ tables[5][(low >> 16 & 0xff) as usize]
+            ^ tables[4][(low >> 24) as usize]
+            ^ tables[3][(high & 0xff) as usize]
+            ^ tables[2][(high >> 8 & 0xff) as usize]
+            ^ tables[1][(high >> 16 & 0xff) as usize]
+            ^ tables[0][(high >> 24) as usize];
+    }
+    for &byte in words.remainder() {
+        crc = tables[0][((crc ^ byte as u32) & 0xff) as usize] ^ (crc >> 8);
+    }
+    !crc
+}
+
+/// The CRC as stored in TFRecords.
+fn masked_crc(bytes: &[u8]) -> u32 {
+    let crc = crc32c(bytes);
+    ((crc >> 15) | (crc << 17)).wrapping_add(0xa282_ead8)
+}
+
+fn corrupt() -> io::Error {
+    io::Error::new(io::ErrorKind::InvalidData, "corrupt event record")
+}
+
+/// Iterates over the payloads of a TFRecord stream held in memory.
+///
+/// A record cut short at the end of the file, as when the writer is still
+/// running, ends the stream; a record whose CRCs do not match is an error.
+struct TfRecords<'a> {
+    bytes: &'a [u8],
+}
+
+impl<'a> Iterator for TfRecords<'a> {
+    type Item = io::Result<&'a [u8]>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        let header = self.bytes.get(..12)?;
+        let len = usize::try_from(u64::from_le_bytes(header[..8].try_into().unwrap())).ok()?;
+        if masked_crc(&header[..8]) != u32::from_le_bytes(header[8..12].try_into().unwrap()) {
+            self.bytes = &[];
+            return Some(Err(corrupt()));
+        }
+        let end = len.checked_add(16)?;
+        let record = self.bytes.get(..end)?;
+        let (payload, crc) = record[12..].split_at(len);
+        self.bytes = &self.bytes[end..];
+        if masked_crc(payload) != u32::from_le_bytes(crc.try_into().unwrap()) {
+            self.bytes = &[];
+            return Some(Err(corrupt()));
+        }
+        Some(Ok(payload))
+    }
+}
+
+/// A protobuf field's payload, by wire type.
+#[derive(Clone, Copy, Debug, PartialEq)]
+enum Field<'a> {
+    Varint(u64),
+    Fixed64(u64),
+    Bytes(&'a [u8]),
+    Fixed32(u32),
+}
+
+/// Iterates over the `(field number, payload)` pairs of an encoded protobuf
+/// message. Malformed input ends the iteration with an error.
+struct Fields<'a> {
+    bytes: &'a [u8],
+}
+
+impl<'a> Fields<'a> {
+    fn varint(&mut self) -> Option<u64> {
+        let mut value = 0u64;
+        for (i, &byte) in self.bytes.iter().enumerate().take(10) {
+            value |= ((byte & 0x7f) as u64) << (7 * i);
+            if byte & 0x80 == 0 {
+                self.bytes = &self.bytes[i + 1..];
+                return Some(value);
+            }
+        }
+        None
+    }
+
+    fn take(&mut self, len: usize) -> Option<&'a [u8]> {
+        let taken = self.bytes.get(..len)?;
+        self.bytes = &self.bytes[len..];
+        Some(taken)
+    }
+
+    fn field(&mut self) -> Option<(u64, Field<'a>)> {
+        let key = self.varint()?;
+        let field = match key & 7 {
+            0 => Field::Varint(self.varint()?),
+            1 => Field::Fixed64(u64::from_le_bytes(self.take(8)?.try_into().unwrap())),
+            2 => {
+                let len = usize::try_from(self.varint()?).ok()?;
+                Field::Bytes(self.take(len)?)
+            }
+            5 => Field::Fixed32(u32::from_le_bytes(self.take(4)?.try_into().unwrap())),
+            _ => return None,
+        };
+        Some((key >> 3, field))
+    }
+}
+
+impl<'a> Iterator for Fields<'a> {
+    type Item = io::Result<(u64, Field<'a>)>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        if self.bytes.is_empty() {
+            return None;
+        }
+        let field = self.field().ok_or_else(corrupt);
+        if field.is_err() {
+            self.bytes = &[];
+        }
+        Some(field)
+    }
+}
+
+fn fields(bytes: &[u8]) -> Fields<'_> {
+    Fields { bytes }
+}
+
+/// The number held by a `TensorProto`, if it is a float or double scalar.
+fn tensor_scalar(tensor: &[u8]) -> io::Result<Option<f64>> {
+    let mut dtype = 0;
+    let mut value = None;
+    for field in fields(tensor) {
+        match field? {
+            (1, Field::Varint(code)) => dtype = code,
+            // A shape with any dimension is not a scalar.
+            (2, Field::Bytes(shape)) => {
+                for field in fields(shape) {
+                    if field?.0 == 2 {
+                        return Ok(None);
+                    }
+                }
+            }
+            (4, Field::Bytes(content)) => {
+                value = match content.len() {
+                    4 => Some(f32::from_le_bytes(content.try_into().unwrap()) as f64),
+                    8 => Some(f64::from_le_bytes(content.try_into().unwrap())),
+                    _ => value,
+                }
+            }
+            (5, Field::Fixed32(bits)) => value = Some(f32::from_bits(bits) as f64),
+            (5, Field::Bytes(packed)) if packed.len() >= 4 => {
+                value = Some(f32::from_le_bytes(packed[..4].try_into().unwrap()) as f64)
+            }
+            (6, Field::Fixed64(bits)) => value = Some(f64::from_bits(bits)),
+            (6, Field::Bytes(packed)) if packed.len() >= 8 => {
+                value = Some(f64::from_le_bytes(packed[..8].try_into().unwrap()))
+            }
+            _ => {}
+        }
+    }
+    Ok(value.filter(|_| dtype == DT_FLOAT || dtype == DT_DOUBLE))
+}
+
+/// Call `f(tag, step, value, timestamp_ms)` for each scalar in one `Event`.
+fn read_event(event: &[u8], mut f: impl FnMut(&str, u64, f64, i64)) -> io::Result<()> {
+    let (mut wall_time, mut step, mut summary) = (0.0, 0, None);
+    for field in fields(event) {
+        match field? {
+            (1, Field::Fixed64(bits)) => wall_time = f64::from_bits(bits),
+            // Steps are int64; clog's are unsigned.
+            (2, Field::Varint(value)) => step = (value as i64).max(0) as u64,
+            (5, Field::Bytes(bytes)) => summary = Some(bytes),
+            _ => {}
+        }
+    }
+    let Some(summary) = summary else {
+        return Ok(());
+    };
+    let timestamp_ms = (wall_time * 1e3) as i64;
+    for field in fields(summary) {
+        let (1, Field::Bytes(value)) = field? else {
+            continue;
+        };
+        let (mut tag, mut scalar) = ("", None);
+        for field in fields(value) {
+            match field? {
+                (1, Field::Bytes(bytes)) => tag = std::str::from_utf8(bytes).map_err(|_| corrupt())?,
+                (2, Field::Fixed32(bits)) => scalar = Some(f32::from_bits(bits) as f64),
+                (8, Field::Bytes(tensor)) => scalar = tensor_scalar(tensor)?,
+                _ => {}
+            }
+        }
+        if let Some(value) = scalar {
+            f(tag, step, value, timestamp_ms);
+        }
+    }
+    Ok(())
+}
+
+/// Every scalar in an event file's contents, grouped by tag in the order
+/// they were written, as `(step, value, timestamp_ms)`.
+pub fn read_scalars(bytes: &[u8]) -> io::Result<HashMap<String, Vec<(u64, f64, i64)>>> {
+    let mut scalars: HashMap<String, Vec<(u64, f64, i64)>> = HashMap::new();
+    for record in (TfRecords { bytes }) {
+        read_event(record?, |tag, step, value, timestamp_ms| {
+            match scalars.get_mut(tag) {
+                Some(points) => points.push((step, value, timestamp_ms)),
+                None => {
+                    scalars.insert(tag.to_string(), vec![(step, value, timestamp_ms)]);
+                }
+            }
+        })?;
+    }
+    Ok(scalars)
+}
+
+/// Event files under `dir`, at any depth, in path order.
+fn event_files(dir: &Path, files: &mut Vec<PathBuf>) -> io::Result<()> {
+    for entry in fs::read_dir(dir)? {
+        let path = entry?.path();
+        if path.is_dir() {
+            event_files(&path, files)?;
+        } else if path.file_name().and_then(|name| name.to_str()).is_some_and(|name| name.contains("tfevents")) {
+            files.push(path);
+        }
+    }
+    Ok(())
+}
+
+/// Load every scalar of every event file under `logdir` into `store`, and
+/// return the number of points loaded.
+///
+/// Files are read and parsed on up to one thread per core. A file's scalars
+/// are named by their tag, prefixed with the file's directory relative to
+/// `logdir` as TensorBoard names runs, e.g. `train/loss`. Each tag of a file
+/// goes into the store under one lock.
+pub fn load_dir(logdir: &Path, store: &MetricStore) -> io::Result<usize> {
+    let mut files = Vec::new();
+    event_files(logdir, &mut files)?;
+    files.sort();
+
+    let next = AtomicUsize::new(0);
+    let loaded = AtomicUsize::new(0);
+    let error = Mutex::new(None);
+    let threads = std::thread::available_parallelism().map_or(1, |n| n.get()).min(files.len());
+    let load = |path: &Path| -> io::Result<()> {
+        let scalars = read_scalars(&fs::read(path)?)?;
+        let run = path.parent().and_then(|dir| dir.strip_prefix(logdir).ok());
+        let run = run.map(|run| run.to_string_lossy().replace('\\', "/")).unwrap_or_default();
+        for (tag, points) in scalars {
+            let name = if run.is_empty() { tag } else { format!("{}/{}", run, tag) };
+            loaded.fetch_add(points.len(), Ordering::Relaxed);
+            store.extend_timed(&name, points);
+        }
+        Ok(())
+    };
+    std::thread::scope(|scope| {
+        for _ in 0..threads {
+            scope.spawn(|| {
+                while let Some(path) = files.get(next.fetch_add(1, Ordering::Relaxed)) {
+                    if let Err(e) = load(path) {
+                        let e = io::Error::new(e.kind(), format!("{}: {}", path.display(), e));
+                        error.lock().unwrap().get_or_insert(e);
+                    }
+                }
+            });
+        }
+    });
+    match error.into_inner().unwrap() {
+        Some(e) => Err(e),
+        None => Ok(loaded.into_inner()),
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn varint(mut value: u64, out: &mut Vec<u8>) {
+        while value >= 0x80 {
+            out.push(value as u8 | 0x80);
+            value >>= 7;
+        }
+        out.push(value as u8);
+    }
+
+    fn bytes_field(number: u64, bytes: &[u8], out: &mut Vec<u8>) {
+        varint(number << 3 | 2, out);
+        varint(bytes.len() as u64, out);
+        out.extend_from_slice(bytes);
+    }
+
+    /// An `Event` with one summary value: a `simple_value`, or else a scalar
+    /// double tensor.
+    fn event(step: i64, wall_time: f64, tag: &str, value: f64, simple: bool) -> Vec<u8> {
+        let mut summary_value = Vec::new();
+        bytes_field(1, tag.as_bytes(), &mut summary_value);
+        if simple {
+            varint(2 << 3 | 5, &mut summary_value);
+            summary_value.extend_from_slice(&(value as f32).to_le_bytes());
+        } else {
+            let mut tensor = vec![1 << 3];
+            varint(DT_DOUBLE, &mut tensor);
+            bytes_field(2, &[], &mut tensor);
+            bytes_field(6, &value.to_le_bytes(), &mut tensor);
+            bytes_field(8, &tensor, &mut summary_value);
+        }
+        let mut summary = Vec::new();
+        bytes_field(1, &summary_value, &mut summary);
+
+        let mut event = vec![1 << 3 | 1];
+        event.extend_from_slice(&wall_time.to_le_bytes());
+        varint(2 << 3, &mut event);
+        varint(step as u64, &mut event);
+        bytes_field(5, &summary, &mut event);
+        event
+    }
+
+    fn record(payload: &[u8], out: &mut Vec<u8>) {
+        let len = (payload.len() as u64).to_le_bytes();
+        out.extend_from_slice(&len);
+        out.extend_from_slice(&masked_crc(&len).to_le_bytes());
+        out.extend_from_slice(payload);
+        out.extend_from_slice(&masked_crc(payload).to_le_bytes());
+    }
+
+    fn event_file(tag: &str, steps: std::ops::Range<i64>, simple: bool) -> Vec<u8> {
+        let mut file = Vec::new();
+        // The file_version event that starts every file has no summary.
+        record(&[1 << 3 | 1, 0, 0, 0, 0, 0, 0, 0, 0, 3 << 3 | 2, 0], &mut file);
+        for step in steps {
+            record(&event(step, 1_700_000_000.5 + step as f64, tag, step as f64 / 4.0, simple), &mut file);
+        }
+        file
+    }
+
+    #[test]
+    fn test_crc32c() {
+        assert_eq!(crc32c(b"123456789"), 0xe306_9283);
+        assert_eq!(crc32c(b"123456789123456789"), 0xa86c_53f4);
+    }
+
+    #[test]
+    fn test_read_scalars() {
+        let mut file = event_file("loss", 0..3, true);
+        file.extend(event_file("lr", 5..7, false));
+        let scalars = read_scalars(&file).unwrap();
+        assert_eq!(
+            scalars["loss"],
+            vec![(0, 0.0, 1_700_000_000_500), (1, 0.25, 1_700_000_001_500), (2, 0.5, 1_700_000_002_500)]
+        );
+        assert_eq!(scalars["lr"], vec![(5, 1.25, 1_700_000_005_500), (6, 1.5, 1_700_000_006_500)]);
+
+        // A record still being written ends the file; a damaged one is an error.
+        assert_eq!(read_scalars(&file[..file.len() - 3]).unwrap()["lr"].len(), 1);
+        let last = file.len() - 6;
+        file[last] ^= 1;
+        assert_eq!(read_scalars(&file).unwrap_err().kind(), io::ErrorKind::InvalidData);
+    }
+
+    #[test]
+    fn test_load_dir() {
+        let logdir = std::env::temp_dir().join(format!("clog-{}-tensorboard", std::process::id()));
+        let _ = fs::remove_dir_all(&logdir);
+        fs::create_dir_all(logdir.join("train")).unwrap();
+        fs::create_dir_all(logdir.join("eval")).unwrap();
+        fs::write(logdir.join("train/events.out.tfevents.1.host"), event_file("loss", 0..100, true)).unwrap();
+        fs::write(logdir.join("train/events.out.tfevents.2.host"), event_file("loss", 100..150, true)).unwrap();
+        fs::write(logdir.join("eval/events.out.tfevents.1.host"), event_file("loss", 0..10, false)).unwrap();
+        fs::write(logdir.join("eval/notes.txt"), b"not an event file").unwrap();
+
+        let store = MetricStore::new();
+        assert_eq!(load_dir(&logdir, &store).unwrap(), 160);
+        assert_eq!(store.with_series("train/loss", |series| series.len()), Some(150));
+        assert_eq!(store.with_series("eval/loss", |series| series.last_value()), Some(Some(2.25)));
+
+        fs::write(logdir.join("events.out.tfevents.3.host"), b"\x01\0\0\0\0\0\0\0garbage!").unwrap();
+        let error = load_dir(&logdir, &MetricStore::new()).unwrap_err();
+        assert!(error.to_string().contains("events.out.tfevents.3.host"));
+        fs::remove_dir_all(&logdir).unwrap();
+    }
+
+    /// Loading 64 event files of 100k scalars each:
+    /// `cargo test --release bench_load_dir -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_load_dir() {
+        let logdir = std::env::temp_dir().join(format!("clog-{}-tensorboard-bench", std::process::id()));
+        let _ = fs::remove_dir_all(&logdir);
+        for run in 0..64 {
+            fs::create_dir_all(logdir.join(format!("run{}", run))).unwrap();
+            let mut file = Vec::new();
+            for step in 0..100_000 {
+                let tag = ["loss", "lr", "grad_norm", "accuracy"][step as usize % 4];
+                record(&event(step, 1_700_000_000.0 + step as f64, tag, (step as f64).sqrt(), run % 2 == 0), &mut file);
+            }
+            fs::write(logdir.join(format!("run{}/events.out.tfevents.1.host", run)), file).unwrap();
+        }
+        let store = MetricStore::new();
+        let start = std::time::Instant::now();
+        let points = load_dir(&logdir, &store).unwrap();
+        let elapsed = start.elapsed();
+        println!(
+            "{} points from 64 files in {:?}: {:.1} M points/s",
+            points,
+            elapsed,
+            points as f64 / elapsed.as_secs_f64() / 1e6
+        );
+        fs::remove_dir_all(&logdir).unwrap();
+    }
+}
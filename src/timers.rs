@@ -0,0 +1,352 @@
+//! Wall-clock timings of training-loop sections, kept as histograms.
+
+use std::collections::HashMap;
+use std::mem::size_of;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant};
+
+/// Durations below this many nanoseconds get a bucket each; every
+/// power-of-two range above is split into half as many, so buckets are at most
+/// 1/64 of their values wide and quantiles keep two significant digits.
+const SUB_BUCKET_BITS: u32 = 7;
+const SUB_BUCKETS: u64 = 1 << SUB_BUCKET_BITS;
+const HALF_SUB_BUCKETS: u64 = SUB_BUCKETS / 2;
+
+/// Durations are clamped to 2^41 ns, about 36 minutes.
+const MAX_BIT: u32 = 40;
+const BUCKETS: usize = (SUB_BUCKETS + (MAX_BIT - SUB_BUCKET_BITS + 1) as u64 * HALF_SUB_BUCKETS) as usize;
+
+/// Length of one slice of the sliding window.
+const WINDOW_SLICE: Duration = Duration::from_secs(1);
+
+/// Number of slices in the sliding window.
+pub const WINDOW_SLICES: usize = 10;
+
+fn bucket_of(nanos: u64) -> usize {
+    let nanos = nanos.min((1 << (MAX_BIT + 1)) - 1);
+    if nanos < SUB_BUCKETS {
+        return nanos as usize;
+    }
+    let bit = 63 - nanos.leading_zeros();
+    let shift = bit + 1 - SUB_BUCKET_BITS;
+    let sub = (nanos >> shift) - HALF_SUB_BUCKETS;
+    (SUB_BUCKETS + (bit - SUB_BUCKET_BITS) as u64 * HALF_SUB_BUCKETS + sub) as usize
+}
+
+/// The middle of the range of durations that fall into `bucket`.
+fn value_of(bucket: usize) -> u64 {
+    let bucket = bucket as u64;
+    if bucket < SUB_BUCKETS {
+        return bucket;
+    }
+    let range = (bucket - SUB_BUCKETS) / HALF_SUB_BUCKETS;
+    let sub = (bucket - SUB_BUCKETS) % HALF_SUB_BUCKETS + HALF_SUB_BUCKETS;
+    let shift = range + 1;
+    (sub << shift) + (1 << shift) / 2
+}
+
+/// A log-linear histogram of durations in nanoseconds, in the style of
+/// HdrHistogram: recording is an index computation and an increment, and
+/// quantiles are read from the counts with two significant digits.
+#[derive(Clone, Debug, Default)]
+pub struct Histogram {
+    /// Allocated on the first record.
+    counts: Vec<u64>,
+    count: u64,
+    sum: u64,
+    max: u64,
+}
+
+impl Histogram {
+    pub fn record(&mut self, nanos: u64) {
+        if self.counts.is_empty() {
+            self.counts = vec![0; BUCKETS];
+        }
+        self.counts[bucket_of(nanos)] += 1;
+        self.count += 1;
+        self.sum = self.sum.saturating_add(nanos);
+        self.max = self.max.max(nanos);
+    }
+
+    pub fn merge(&mut self, other: &Histogram) {
+        if other.count == 0 {
+            return;
+        }
+        if self.counts.is_empty() {
+            self.counts = vec![0; BUCKETS];
+        }
+        for (count, other) in self.counts.iter_mut().zip(&other.counts) {
+            *count += other;
+        }
+        self.count += other.count;
+        self.sum = self.sum.saturating_add(other.sum);
+        self.max = self.max.max(other.max);
+    }
+
+    fn clear(&mut self) {
+        self.counts.fill(0);
+        self.count = 0;
+        self.sum = 0;
+        self.max = 0;
+    }
+
+    pub fn count(&self) -> u64 {
+        self.count
+    }
+
+    pub fn mean(&self) -> f64 {
+        self.sum as f64 / self.count as f64
+    }
+
+    pub fn max(&self) -> u64 {
+        self.max
+    }
+
+    /// The duration below which a fraction `q` of the recorded ones fall, or
+    /// `None` if nothing was recorded.
+    pub fn quantile(&self, q: f64) -> Option<u64> {
+        if self.count == 0 {
+            return None;
+        }
+        let rank = ((q * self.count as f64).ceil() as u64).clamp(1, self.count);
+        let mut seen = 0;
+        for (bucket, &count) in self.counts.iter().enumerate() {
+            seen += count;
+            if seen >= rank {
+                return Some(value_of(bucket).min(self.max));
+            }
+        }
+        Some(self.max)
+    }
+
+    fn heap_bytes(&self) -> usize {
+        self.counts.capacity() * size_of::<u64>()
+    }
+}
+
+/// Quantiles of one timer, all durations in nanoseconds.
+#[derive(Clone, Debug, PartialEq)]
+pub struct TimerSummary {
+    pub name: Arc<str>,
+    pub count: u64,
+    pub mean: f64,
+    pub max: u64,
+    pub p50: u64,
+    pub p95: u64,
+    pub p99: u64,
+    /// Over the last `WINDOW_SLICES` seconds; quantiles are 0 when the window
+    /// is empty.
+    pub window_count: u64,
+    pub window_p50: u64,
+    pub window_p95: u64,
+    pub window_p99: u64,
+}
+
+#[derive(Default)]
+struct TimerState {
+    total: Histogram,
+    /// One histogram per slice of the sliding window, each tagged with the
+    /// slice it currently holds.
+    slices: [(u64, Histogram); WINDOW_SLICES],
+}
+
+impl TimerState {
+    fn summary(&self, name: &Arc<str>, current_slice: u64) -> TimerSummary {
+        let mut window = Histogram::default();
+        for (slice, histogram) in &self.slices {
+            if current_slice.saturating_sub(*slice) < WINDOW_SLICES as u64 {
+                window.merge(histogram);
+            }
+        }
+        let total = &self.total;
+        let quantile = |histogram: &Histogram, q| histogram.quantile(q).unwrap_or(0);
+        TimerSummary {
+            name: name.clone(),
+            count: total.count(),
+            mean: total.mean(),
+            max: total.max(),
+            p50: quantile(total, 0.5),
+            p95: quantile(total, 0.95),
+            p99: quantile(total, 0.99),
+            window_count: window.count(),
+            window_p50: quantile(&window, 0.5),
+            window_p95: quantile(&window, 0.95),
+            window_p99: quantile(&window, 0.99),
+        }
+    }
+}
+
+/// One named timer. Callers keep the `Arc` so recording skips the name
+/// lookup.
+pub struct TimerCell {
+    state: Mutex<TimerState>,
+}
+
+#[derive(Default)]
+struct Timers {
+    by_name: HashMap<Arc<str>, Arc<TimerCell>>,
+    /// In the order they were first used.
+    in_order: Vec<(Arc<str>, Arc<TimerCell>)>,
+}
+
+/// All timers of a tracker.
+pub struct TimerStore {
+    epoch: Instant,
+    timers: Mutex<Timers>,
+    generation: AtomicU64,
+}
+
+impl Default for TimerStore {
+    fn default() -> Self {
+        TimerStore {
+            epoch: Instant::now(),
+            timers: Mutex::default(),
+            generation: AtomicU64::new(0),
+        }
+    }
+}
+
+impl TimerStore {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    /// The timer called `name`, created on first use.
+    pub fn get(&self, name: &str) -> Arc<TimerCell> {
+        let mut timers = self.timers.lock().unwrap();
+        if let Some(cell) = timers.by_name.get(name) {
+            return cell.clone();
+        }
+        let name: Arc<str> = Arc::from(name);
+        let cell = Arc::new(TimerCell {
+            state: Mutex::new(TimerState::default()),
+        });
+        timers.by_name.insert(name.clone(), cell.clone());
+        timers.in_order.push((name, cell.clone()));
+        cell
+    }
+
+    fn slice_at(&self, instant: Instant) -> u64 {
+        (instant.saturating_duration_since(self.epoch).as_nanos() / WINDOW_SLICE.as_nanos()) as u64
+    }
+
+    /// Record a section that ran from `start` until `end`.
+    pub fn record(&self, cell: &TimerCell, start: Instant, end: Instant) {
+        let nanos = end.saturating_duration_since(start).as_nanos() as u64;
+        let slice = self.slice_at(end);
+        let mut state = cell.state.lock().unwrap();
+        state.total.record(nanos);
+        let (held, histogram) = &mut state.slices[slice as usize % WINDOW_SLICES];
+        if *held != slice {
+            *held = slice;
+            histogram.clear();
+        }
+        histogram.record(nanos);
+        drop(state);
+        self.generation.fetch_add(1, Ordering::Relaxed);
+    }
+
+    /// Changes whenever any timer records; read without locking.
+    pub fn generation(&self) -> u64 {
+        self.generation.load(Ordering::Relaxed)
+    }
+
+    pub fn summary(&self, name: &str) -> Option<TimerSummary> {
+        let (name, cell) = {
+            let timers = self.timers.lock().unwrap();
+            let (name, cell) = timers.by_name.get_key_value(name)?;
+            (name.clone(), cell.clone())
+        };
+        let current = self.slice_at(Instant::now());
+        let summary = cell.state.lock().unwrap().summary(&name, current);
+        Some(summary)
+    }
+
+    /// Summaries of every timer, in the order they were first used.
+    pub fn summaries(&self) -> Vec<TimerSummary> {
+        let timers = self.timers.lock().unwrap().in_order.clone();
+        let current = self.slice_at(Instant::now());
+        timers
+            .iter()
+            .map(|(name, cell)| cell.state.lock().unwrap().summary(name, current))
+            .collect()
+    }
+
+    pub fn heap_bytes(&self) -> usize {
+        let timers = self.timers.lock().unwrap();
+        timers
+            .in_order
+            .iter()
+            .map(|(name, cell)| {
+                let state = cell.state.lock().unwrap();
+                name.len()
+                    + state.total.heap_bytes()
+                    + state.slices.iter().map(|(_, histogram)| histogram.heap_bytes()).sum::<usize>()
+            })
+            .sum()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_buckets_keep_two_significant_digits() {
+        let mut previous = 0;
+        for nanos in (0..1_000_000u64).chain([1 << 30, (1 << 41) - 1]) {
+            let bucket = bucket_of(nanos);
+            assert!(bucket >= previous && bucket < BUCKETS);
+            previous = bucket;
+            let error = value_of(bucket).abs_diff(nanos) as f64;
+            assert!(error <= nanos as f64 / 64.0, "{} ns read back as {}", nanos, value_of(bucket));
+        }
+        assert_eq!(bucket_of(u64::MAX), BUCKETS - 1);
+    }
+
+    #[test]
+    fn test_quantiles_and_window() {
+        let timers = TimerStore::new();
+        let cell = timers.get("forward");
+        let start = timers.epoch;
+        // 1..=1000 µs, recorded long ago; then one 5 ms section now.
+        for micros in 1..=1_000u64 {
+            timers.record(&cell, start, start + Duration::from_micros(micros));
+        }
+        let now = start + WINDOW_SLICE * (WINDOW_SLICES as u32 + 3);
+        timers.record(&cell, now - Duration::from_millis(5), now);
+        let summary = cell.state.lock().unwrap().summary(&Arc::from("forward"), timers.slice_at(now));
+
+        let close = |nanos: u64, expected: u64| nanos.abs_diff(expected) as f64 <= expected as f64 / 64.0;
+        assert_eq!(summary.count, 1_001);
+        assert!(close(summary.p50, 501_000), "p50 {}", summary.p50);
+        assert!(close(summary.p99, 991_000), "p99 {}", summary.p99);
+        assert_eq!(summary.max, 5_000_000);
+        assert_eq!(summary.window_count, 1);
+        assert!(close(summary.window_p50, 5_000_000));
+        assert_eq!(timers.summaries()[0].name.as_ref(), "forward");
+        assert!(timers.summary("backward").is_none());
+    }
+
+    /// Cost of recording one section:
+    /// `cargo test --release bench_timer_record -- --ignored --nocapture`
+    #[test]
+    #[ignore]
+    fn bench_timer_record() {
+        let timers = TimerStore::new();
+        let cell = timers.get("forward");
+        let records = 10_000_000u32;
+        let start = Instant::now();
+        for _ in 0..records {
+            let begin = Instant::now();
+            timers.record(&cell, begin, Instant::now());
+        }
+        let elapsed = start.elapsed();
+        println!(
+            "{:.1} ns per timed section (two clock reads and a record), p99 of the empty section {} ns",
+            elapsed.as_nanos() as f64 / records as f64,
+            timers.summary("forward").unwrap().p99
+        );
+    }
+}
@@ -1,5 +1,5 @@
 use std::io;
-use std::time::Duration;
+use std::time::{Duration, Instant};
 use std::sync::Arc;
 
 use ratatui::{
@@ -16,28 +16,197 @@ use crossterm::{
     terminal::{disable_raw_mode, enable_raw_mode, EnterAlternateScreen, LeaveAlternateScreen},
 };
 
-use crate::{Metric, ClogTracker};
+use crate::compare::Overlay;
+use crate::logs::{LogFilter, LogLevel, LogLine};
+use crate::names::NameIndex;
+use crate::series::{Decimated, Decimator, Series};
+use crate::sketch::{QuantileBand, BAND_QUANTILES};
+use crate::stats::Summary;
+use crate::timers::{TimerSummary, WINDOW_SLICES};
+use crate::ClogTracker;
+
+/// What the UI displays: a live tracker or a saved run.
+pub trait DataSource: Send + Sync {
+    /// Metric names with ids from `first_id` on, in the order they were first
+    /// logged.
+    fn names_since(&self, first_id: usize) -> Vec<Arc<str>>;
+
+    /// Statistics of `name`, read without scanning its points. Sources that
+    /// do not track a field report it as NaN.
+    fn summary(&self, name: &str) -> Option<Summary>;
+
+    /// Changes whenever `name` gains points; `None` for unknown metrics.
+    fn version(&self, name: &str) -> Option<u64>;
+
+    /// Changes whenever anything displayed may have changed. Polled every
+    /// frame, so it must be cheap.
+    fn generation(&self) -> u64;
+
+    /// First and last step logged for `name`.
+    fn step_range(&self, name: &str) -> Option<(u64, u64)>;
+
+    /// Add the points of `name` to `decimator`, whose columns may span more
+    /// steps than `name` does; false for unknown metrics.
+    fn decimate_into(&self, name: &str, decimator: &mut Decimator) -> bool;
+
+    fn decimate(&self, name: &str, columns: usize) -> Option<Decimated> {
+        let (first, last) = self.step_range(name)?;
+        let mut decimator = Decimator::new(first, last, columns);
+        self.decimate_into(name, &mut decimator).then(|| decimator.finish())
+    }
+
+    /// One line per run, for sources that hold several; see `Comparison`.
+    fn overlay(&self, _name: &str, _columns: usize) -> Option<Overlay> {
+        None
+    }
+
+    /// Quantiles of a histogram metric across `columns` step ranges; `None`
+    /// for scalar metrics.
+    fn quantile_band(&self, _name: &str, _columns: usize) -> Option<QuantileBand> {
+        None
+    }
+
+    /// Up to `count` log lines matching `filter`, newest first.
+    fn recent_logs(&self, count: usize, filter: &LogFilter) -> Vec<LogLine>;
+
+    /// Section timings, in the order the sections were first timed.
+    fn timers(&self) -> Vec<TimerSummary> {
+        Vec::new()
+    }
+
+    /// Polled by the event loop, which exits once it returns true.
+    fn stop_requested(&self) -> bool {
+        false
+    }
+}
+
+impl DataSource for ClogTracker {
+    fn names_since(&self, first_id: usize) -> Vec<Arc<str>> {
+        self.metrics.names_since(first_id)
+    }
+
+    fn summary(&self, name: &str) -> Option<Summary> {
+        self.metrics.with_series(name, Series::summary)
+    }
+
+    fn version(&self, name: &str) -> Option<u64> {
+        self.metrics.with_series(name, Series::total_count)
+    }
+
+    fn generation(&self) -> u64 {
+        self.metrics
+            .generation()
+            .wrapping_add(self.logs.generation())
+            .wrapping_add(self.timers.generation())
+            .wrapping_add(self.histograms.generation())
+    }
+
+    fn step_range(&self, name: &str) -> Option<(u64, u64)> {
+        self.metrics
+            .with_series(name, |series| Some((series.first_step()?, series.last_step()?)))
+            .flatten()
+    }
+
+    fn decimate_into(&self, name: &str, decimator: &mut Decimator) -> bool {
+        self.metrics
+            .with_series(name, |series| series.decimate_into(0, u64::MAX, decimator))
+            .is_some()
+    }
+
+    // The series' shard lock is held only while decimating, never while
+    // drawing.
+    fn decimate(&self, name: &str, columns: usize) -> Option<Decimated> {
+        self.metrics.with_series(name, |series| series.decimate(columns)).flatten()
+    }
+
+    fn quantile_band(&self, name: &str, columns: usize) -> Option<QuantileBand> {
+        self.histograms.band(name, columns)
+    }
+
+    fn recent_logs(&self, count: usize, filter: &LogFilter) -> Vec<LogLine> {
+        self.logs.recent(count, filter)
+    }
+
+    fn timers(&self) -> Vec<TimerSummary> {
+        self.timers.summaries()
+    }
+
+    fn stop_requested(&self) -> bool {
+        ClogTracker::stop_requested(self)
+    }
+}
+
+/// Default cap on redraws per second.
+pub const DEFAULT_MAX_FPS: f64 = 20.0;
 
 pub struct TerminalUI {
     pub search_query: String,
     pub selected_metric: Option<String>,
+    pub log_filter: LogFilter,
     pub input_mode: InputMode,
-    tracker: Arc<ClogTracker>,
+    /// Upper bound on redraws per second. The screen is only redrawn when
+    /// new data arrives, a key is pressed or the terminal is resized.
+    pub max_fps: f64,
+    source: Arc<dyn DataSource>,
+    names: NameIndex,
+    /// First row shown in the metrics list.
+    list_offset: usize,
+    chart_cache: Option<ChartCache>,
 }
 
+/// The last decimated chart, reused until the series grows or the chart is
+/// resized.
+struct ChartCache {
+    metric: String,
+    version: u64,
+    columns: usize,
+    lines: ChartLines,
+}
+
+enum ChartLines {
+    Series(Decimated),
+    /// For histogram metrics, whose series holds each step's median.
+    Band(QuantileBand),
+    /// For sources holding several runs.
+    Overlay(Overlay),
+}
+
+/// Line colors of the runs in an overlay, reused from the start past the
+/// twelfth run.
+const RUN_COLORS: [Color; 12] = [
+    Color::Cyan,
+    Color::Yellow,
+    Color::Magenta,
+    Color::Green,
+    Color::Red,
+    Color::Blue,
+    Color::LightCyan,
+    Color::LightYellow,
+    Color::LightMagenta,
+    Color::LightGreen,
+    Color::LightRed,
+    Color::LightBlue,
+];
+
 #[derive(Debug, PartialEq)]
 pub enum InputMode {
     Normal,
     Searching,
+    SearchingLogs,
 }
 
 impl TerminalUI {
-    pub fn new(tracker: Arc<ClogTracker>) -> Self {
+    pub fn new(source: Arc<dyn DataSource>) -> Self {
         TerminalUI {
             search_query: String::new(),
             selected_metric: None,
+            log_filter: LogFilter::default(),
             input_mode: InputMode::Normal,
-            tracker,
+            max_fps: DEFAULT_MAX_FPS,
+            source,
+            names: NameIndex::new(),
+            list_offset: 0,
+            chart_cache: None,
         }
     }
 
@@ -65,21 +234,60 @@ impl TerminalUI {
     }
 
     fn run_app<B: Backend>(&mut self, terminal: &mut Terminal<B>) -> io::Result<()> {
+        let frame = Duration::from_secs_f64(1.0 / self.max_fps.max(0.1));
+        let mut next_frame = Instant::now();
+        let mut drawn_generation = None;
+        let mut dirty = true;
         loop {
-            terminal.draw(|f| self.ui(f))?;
+            if self.source.stop_requested() {
+                return Ok(());
+            }
+
+            let now = Instant::now();
+            if now >= next_frame {
+                let generation = self.source.generation();
+                if dirty || drawn_generation != Some(generation) {
+                    terminal.draw(|f| self.ui(f))?;
+                    drawn_generation = Some(generation);
+                    dirty = false;
+                    next_frame = now + frame;
+                }
+            }
 
-            if event::poll(Duration::from_millis(100))? {
-                if let Event::Key(key) = event::read()? {
+            // Block until input arrives or the next frame is due. An idle UI
+            // wakes once per frame only to compare the generation counter.
+            let until_next_frame = next_frame.saturating_duration_since(Instant::now());
+            let timeout = if dirty { until_next_frame } else { until_next_frame.max(frame) };
+            if event::poll(timeout)? {
+                let event = event::read()?;
+                dirty |= matches!(event, Event::Key(_) | Event::Resize(..));
+                if let Event::Key(key) = event {
                     match self.input_mode {
                         InputMode::Normal => match key.code {
                             KeyCode::Char('q') | KeyCode::Esc => return Ok(()),
                             KeyCode::Char('/') => {
                                 self.input_mode = InputMode::Searching;
                             }
+                            KeyCode::Char('?') => {
+                                self.input_mode = InputMode::SearchingLogs;
+                            }
+                            KeyCode::Char('l') => self.cycle_log_level(),
                             KeyCode::Down => self.next_metric(),
                             KeyCode::Up => self.previous_metric(),
                             _ => {}
                         },
+                        InputMode::SearchingLogs => match key.code {
+                            KeyCode::Char(c) => {
+                                self.log_filter.text.push(c);
+                            }
+                            KeyCode::Backspace => {
+                                self.log_filter.text.pop();
+                            }
+                            KeyCode::Enter | KeyCode::Esc => {
+                                self.input_mode = InputMode::Normal;
+                            }
+                            _ => {}
+                        },
                         InputMode::Searching => match key.code {
                             KeyCode::Char(c) => {
                                 self.search_query.push(c);
@@ -98,7 +306,7 @@ impl TerminalUI {
         }
     }
 
-    fn ui(&self, f: &mut Frame) {
+    fn ui(&mut self, f: &mut Frame) {
         let chunks = Layout::default()
             .direction(Direction::Vertical)
             .constraints([
@@ -109,12 +317,16 @@ impl TerminalUI {
             .split(f.area());
 
         // Search bar
-        let search_widget = Paragraph::new(self.search_query.as_str())
+        let (query, title) = match self.input_mode {
+            InputMode::SearchingLogs => (self.log_filter.text.as_str(), "Search logs"),
+            _ => (self.search_query.as_str(), "Search"),
+        };
+        let search_widget = Paragraph::new(query)
             .style(match self.input_mode {
                 InputMode::Normal => Style::default(),
-                InputMode::Searching => Style::default().fg(Color::Yellow),
+                InputMode::Searching | InputMode::SearchingLogs => Style::default().fg(Color::Yellow),
             })
-            .block(Block::default().borders(Borders::ALL).title("Search"));
+            .block(Block::default().borders(Borders::ALL).title(title));
         f.render_widget(search_widget, chunks[0]);
 
         // Metrics area
@@ -129,63 +341,120 @@ impl TerminalUI {
         // Selected metric chart
         self.render_metric_chart(f, metrics_chunks[1]);
 
-        // Logs area
-        self.render_logs(f, chunks[2]);
+        // Logs area, sharing the row with section timings once there are any
+        let timers = self.source.timers();
+        if timers.is_empty() {
+            self.render_logs(f, chunks[2]);
+        } else {
+            let bottom_chunks = Layout::default()
+                .direction(Direction::Horizontal)
+                .constraints([Constraint::Percentage(60), Constraint::Percentage(40)])
+                .split(chunks[2]);
+            self.render_logs(f, bottom_chunks[0]);
+            self.render_timers(f, bottom_chunks[1], &timers);
+        }
     }
 
-    fn render_metrics_list(&self, f: &mut Frame, area: Rect) {
-        let metrics = self.tracker.metrics.lock().unwrap();
-        let filtered_metrics: Vec<(&String, &Vec<Metric>)> = metrics
-            .iter()
-            .filter(|(name, _)| {
-                self.search_query.is_empty() || name.contains(&self.search_query)
-            })
-            .collect();
+    /// Only the rows that fit are formatted; the window scrolls to keep the
+    /// selected metric in view.
+    fn render_metrics_list(&mut self, f: &mut Frame, area: Rect) {
+        self.refresh_names();
+        let rows = area.height.saturating_sub(2) as usize;
+        let names = self.names.matches();
+        if let Some(pos) = self.selected_metric.as_deref().and_then(|name| self.names.position(name)) {
+            if pos < self.list_offset {
+                self.list_offset = pos;
+            } else if pos >= self.list_offset + rows {
+                self.list_offset = pos + 1 - rows;
+            }
+        }
+        self.list_offset = self.list_offset.min(names.len().saturating_sub(rows));
 
-        let items: Vec<ListItem> = filtered_metrics
+        let items: Vec<ListItem> = names
             .iter()
-            .map(|(name, values)| {
-                let style = if Some((*name).clone()) == self.selected_metric {
+            .skip(self.list_offset)
+            .take(rows)
+            .map(|name| {
+                let style = if self.selected_metric.as_deref() == Some(&**name) {
                     Style::default().fg(Color::Yellow).add_modifier(Modifier::BOLD)
                 } else {
                     Style::default()
                 };
-                let last_value = values.last().map_or(0.0, |m| m.value);
-                ListItem::new(Line::from(Span::raw(format!("{}: {:.3}", name, last_value))))
-                    .style(style)
+                let text = match self.source.summary(name) {
+                    Some(summary) => format!(
+                        "{}: {:.3} [{:.3}, {:.3}]",
+                        name, summary.last, summary.min, summary.max
+                    ),
+                    None => format!("{}: -", name),
+                };
+                ListItem::new(Line::from(Span::raw(text))).style(style)
             })
             .collect();
 
+        let title = if self.search_query.is_empty() {
+            format!("Metrics ({})", names.len())
+        } else {
+            format!("Metrics ({}/{})", names.len(), self.names.len())
+        };
         let list = List::new(items)
-            .block(Block::default().borders(Borders::ALL).title("Metrics"));
+            .block(Block::default().borders(Borders::ALL).title(title));
         
         f.render_widget(list, area);
     }
 
-    fn render_metric_chart(&self, f: &mut Frame, area: Rect) {
-        if let Some(selected) = &self.selected_metric {
-            let metrics = self.tracker.metrics.lock().unwrap();
-            if let Some(data) = metrics.get(selected) {
-                let points: Vec<(f64, f64)> = data
-                    .iter()
-                    .map(|m| (m.step as f64, m.value))
-                    .collect();
-
-                let datasets = vec![Dataset::default()
-                    .name(selected.as_str())
-                    .marker(ratatui::symbols::Marker::Dot)
-                    .graph_type(GraphType::Line)
-                    .style(Style::default().fg(Color::Cyan))
-                    .data(&points)];
-
-                let x_bounds = [
-                    points.first().map_or(0.0, |p| p.0),
-                    points.last().map_or(1.0, |p| p.0),
-                ];
-                let y_bounds = [
-                    points.iter().map(|p| p.1).fold(f64::INFINITY, f64::min),
-                    points.iter().map(|p| p.1).fold(f64::NEG_INFINITY, f64::max),
-                ];
+    fn render_metric_chart(&mut self, f: &mut Frame, area: Rect) {
+        if let Some(selected) = self.selected_metric.clone() {
+            let columns = area.width.saturating_sub(2) as usize;
+            if let Some(cache) = self.chart_data(&selected, columns) {
+                let (datasets, x_bounds, y_bounds) = match &cache.lines {
+                    // Outer quantiles dim, inner ones blue, the median as
+                    // bright as a scalar metric's line.
+                    ChartLines::Band(band) => {
+                        let datasets: Vec<Dataset> = band
+                            .lines
+                            .iter()
+                            .zip(BAND_QUANTILES)
+                            .map(|(line, q)| {
+                                let color = match q {
+                                    q if q == 0.5 => Color::Cyan,
+                                    q if (0.25..=0.75).contains(&q) => Color::Blue,
+                                    _ => Color::DarkGray,
+                                };
+                                Dataset::default()
+                                    .name(format!("p{}", (q * 100.0).round()))
+                                    .marker(ratatui::symbols::Marker::Braille)
+                                    .graph_type(GraphType::Line)
+                                    .style(Style::default().fg(color))
+                                    .data(line)
+                            })
+                            .collect();
+                        (datasets, band.x_bounds, band.y_bounds)
+                    }
+                    ChartLines::Series(chart) => {
+                        let datasets = vec![Dataset::default()
+                            .name(selected.as_str())
+                            .marker(ratatui::symbols::Marker::Dot)
+                            .graph_type(GraphType::Line)
+                            .style(Style::default().fg(Color::Cyan))
+                            .data(&chart.points)];
+                        (datasets, chart.x_bounds, chart.y_bounds)
+                    }
+                    ChartLines::Overlay(overlay) => {
+                        let datasets: Vec<Dataset> = overlay
+                            .lines
+                            .iter()
+                            .map(|line| {
+                                Dataset::default()
+                                    .name(&*line.label)
+                                    .marker(ratatui::symbols::Marker::Braille)
+                                    .graph_type(GraphType::Line)
+                                    .style(Style::default().fg(RUN_COLORS[line.run % RUN_COLORS.len()]))
+                                    .data(&line.points)
+                            })
+                            .collect();
+                        (datasets, overlay.x_bounds, overlay.y_bounds)
+                    }
+                };
 
                 let chart = Chart::new(datasets)
                     .block(Block::default().borders(Borders::ALL).title(selected.as_str()))
@@ -207,78 +476,147 @@ impl TerminalUI {
         }
     }
 
+    /// Decimated points for `metric`, recomputed only when the series has
+    /// grown or the chart width changed.
+    fn chart_data(&mut self, metric: &str, columns: usize) -> Option<&ChartCache> {
+        let version = self.source.version(metric)?;
+        let fresh = matches!(
+            &self.chart_cache,
+            Some(cache) if cache.metric == metric && cache.version == version && cache.columns == columns
+        );
+        if !fresh {
+            let lines = match self.source.overlay(metric, columns) {
+                Some(overlay) => Some(ChartLines::Overlay(overlay)),
+                None => self.source.decimate(metric, columns).map(|chart| {
+                    match self.source.quantile_band(metric, columns) {
+                        Some(band) => ChartLines::Band(band),
+                        None => ChartLines::Series(chart),
+                    }
+                }),
+            };
+            self.chart_cache = lines.map(|lines| ChartCache {
+                metric: metric.to_string(),
+                version,
+                columns,
+                lines,
+            });
+        }
+        self.chart_cache.as_ref()
+    }
+
     fn render_logs(&self, f: &mut Frame, area: Rect) {
-        let logs = self.tracker.logs.lock().unwrap();
-        let items: Vec<ListItem> = logs
-            .iter()
-            .rev()
-            .take(area.height as usize - 2)
+        let items: Vec<ListItem> = self
+            .source
+            .recent_logs(area.height.saturating_sub(2) as usize, &self.log_filter)
+            .into_iter()
             .map(|log| {
                 let style = match log.level {
-                    crate::LogLevel::Info => Style::default(),
-                    crate::LogLevel::Warning => Style::default().fg(Color::Yellow),
-                    crate::LogLevel::Error => Style::default().fg(Color::Red),
+                    LogLevel::Debug => Style::default().fg(Color::DarkGray),
+                    LogLevel::Info => Style::default(),
+                    LogLevel::Warning => Style::default().fg(Color::Yellow),
+                    LogLevel::Error => Style::default().fg(Color::Red),
+                    LogLevel::Critical => Style::default().fg(Color::Red).add_modifier(Modifier::BOLD),
                 };
-                ListItem::new(Line::from(Span::raw(format!(
-                    "[{}] {}",
-                    log.timestamp.format("%H:%M:%S"),
-                    log.message
-                ))))
-                .style(style)
+                ListItem::new(Line::from(Span::raw(log.into_text()))).style(style)
             })
             .collect();
 
+        let mut title = String::from("Logs");
+        if self.log_filter.min_level != LogLevel::ALL[0] {
+            title += &format!(" [{}+]", self.log_filter.min_level.name());
+        }
+        if !self.log_filter.text.is_empty() {
+            title += &format!(" ?{}", self.log_filter.text);
+        }
         let list = List::new(items)
-            .block(Block::default().borders(Borders::ALL).title("Logs"));
+            .block(Block::default().borders(Borders::ALL).title(title));
         
         f.render_widget(list, area);
     }
 
-    fn next_metric(&mut self) {
-        let metrics = self.tracker.metrics.lock().unwrap();
-        let names: Vec<String> = metrics
-            .keys()
-            .filter(|name| self.search_query.is_empty() || name.contains(&self.search_query))
-            .cloned()
+    /// Quantiles of each timed section over the sliding window.
+    fn render_timers(&self, f: &mut Frame, area: Rect, timers: &[TimerSummary]) {
+        let items: Vec<ListItem> = timers
+            .iter()
+            .take(area.height.saturating_sub(2) as usize)
+            .map(|timer| {
+                let text = if timer.window_count == 0 {
+                    format!("{}: idle, p50 {}", timer.name, format_nanos(timer.p50))
+                } else {
+                    format!(
+                        "{}: p50 {} p95 {} p99 {} ({})",
+                        timer.name,
+                        format_nanos(timer.window_p50),
+                        format_nanos(timer.window_p95),
+                        format_nanos(timer.window_p99),
+                        timer.window_count
+                    )
+                };
+                ListItem::new(Line::from(Span::raw(text)))
+            })
             .collect();
+        let title = format!("Timers (last {}s)", WINDOW_SLICES);
+        let list = List::new(items).block(Block::default().borders(Borders::ALL).title(title));
+        f.render_widget(list, area);
+    }
 
+    /// Pick up new metric names and apply the current search query.
+    fn refresh_names(&mut self) {
+        let new_names = self.source.names_since(self.names.known());
+        self.names.extend(new_names);
+        self.names.set_query(&self.search_query);
+    }
+
+    /// Step the minimum level shown in the logs panel, wrapping back to all.
+    fn cycle_log_level(&mut self) {
+        let levels = &LogLevel::ALL;
+        let next = levels.iter().position(|&level| level == self.log_filter.min_level).map_or(0, |i| i + 1);
+        self.log_filter.min_level = levels[next % levels.len()];
+    }
+
+    fn next_metric(&mut self) {
+        self.refresh_names();
+        let names = self.names.matches();
         if names.is_empty() {
             return;
         }
 
-        match &self.selected_metric {
-            None => self.selected_metric = Some(names[0].clone()),
-            Some(current) => {
-                if let Some(pos) = names.iter().position(|n| n == current) {
-                    self.selected_metric = Some(names[(pos + 1) % names.len()].clone());
-                } else {
-                    self.selected_metric = Some(names[0].clone());
-                }
-            }
-        }
+        let next = match self.selected_metric.as_deref().and_then(|current| self.names.position(current)) {
+            Some(pos) => (pos + 1) % names.len(),
+            None => 0,
+        };
+        self.selected_metric = Some(names[next].to_string());
     }
 
     fn previous_metric(&mut self) {
-        let metrics = self.tracker.metrics.lock().unwrap();
-        let names: Vec<String> = metrics
-            .keys()
-            .filter(|name| self.search_query.is_empty() || name.contains(&self.search_query))
-            .cloned()
-            .collect();
-
+        self.refresh_names();
+        let names = self.names.matches();
         if names.is_empty() {
             return;
         }
 
-        match &self.selected_metric {
-            None => self.selected_metric = Some(names.last().unwrap().clone()),
-            Some(current) => {
-                if let Some(pos) = names.iter().position(|n| n == current) {
-                    self.selected_metric = Some(names[if pos == 0 { names.len() - 1 } else { pos - 1 }].clone());
-                } else {
-                    self.selected_metric = Some(names[0].clone());
-                }
-            }
-        }
+        let previous = match self.selected_metric.as_deref() {
+            None => names.len() - 1,
+            Some(current) => match self.names.position(current) {
+                Some(0) => names.len() - 1,
+                Some(pos) => pos - 1,
+                None => 0,
+            },
+        };
+        self.selected_metric = Some(names[previous].to_string());
+    }
+}
+
+/// A duration in nanoseconds, in the largest unit it is at least one of.
+fn format_nanos(nanos: u64) -> String {
+    let nanos = nanos as f64;
+    if nanos < 1e3 {
+        format!("{:.0}ns", nanos)
+    } else if nanos < 1e6 {
+        format!("{:.1}µs", nanos / 1e3)
+    } else if nanos < 1e9 {
+        format!("{:.1}ms", nanos / 1e6)
+    } else {
+        format!("{:.2}s", nanos / 1e9)
     }
-}
\ No newline at end of file
+}
@@ -1,8 +1,13 @@
 """Tests for clog."""
 
+import logging
 import pytest
+import subprocess
+import sys
 import time
-from clog import ClogTracker
+import urllib.request
+import numpy as np
+from clog import ClogTracker, LoggingHandler, RemoteTracker, SharedMemoryWriter, compare
 
 
 def test_tracker_creation():
@@ -21,6 +26,354 @@ def test_log_metric():
     tracker.log_metric("another_metric", 3.0, 0)
 
 
+def test_log_metrics_batch():
+    """Test logging a dict of metrics for one step."""
+    tracker = ClogTracker()
+    
+    for step in range(10):
+        tracker.log_metrics({"loss": 1.0 / (step + 1), "accuracy": step / 10}, step)
+    
+    with pytest.raises(TypeError):
+        tracker.log_metrics({"loss": "not a number"}, 10)
+
+
+def test_log_metric_array():
+    """Test bulk backfill from NumPy arrays."""
+    tracker = ClogTracker()
+    steps = np.arange(100_000)
+    values = np.sin(steps / 1000.0)
+    
+    tracker.log_metric_array("backfill", values, steps)
+    tracker.log_metric_array("backfill_f32", values.astype(np.float32), steps.astype(np.int32))
+    assert tracker.memory_usage() > 2 * 100_000 * 16
+    
+    with pytest.raises(ValueError):
+        tracker.log_metric_array("mismatched", values, steps[:10])
+    with pytest.raises(ValueError):
+        tracker.log_metric_array("negative", values[:3], np.array([0, -1, 2]))
+
+
+def test_get_series():
+    """Test reading metrics back as NumPy arrays."""
+    tracker = ClogTracker()
+    steps = np.arange(0, 200_000, 2)
+    tracker.log_metric_array("loss", 1.0 / (steps + 1), steps)
+    
+    read_steps, values = tracker.get_series("loss")
+    assert np.array_equal(read_steps, steps)
+    assert np.array_equal(values, 1.0 / (steps + 1))
+    
+    read_steps, values = tracker.get_series("loss", start_step=1_001, end_step=1_010)
+    assert read_steps.tolist() == [1_002, 1_004, 1_006, 1_008, 1_010]
+    assert values[0] == 1.0 / 1_003
+    
+    read_steps, values = tracker.get_series("loss", max_points=100)
+    assert len(read_steps) <= 100
+    assert read_steps[0] == 0 and values[0] == 1.0
+    assert np.all(np.diff(read_steps) > 0)
+    
+    assert len(tracker.get_series("loss", start_step=500_000)[0]) == 0
+    assert tracker.get_series("missing") is None
+
+
+def test_parquet_round_trip(tmp_path):
+    """Test exporting a run to Parquet and loading it back."""
+    pytest.importorskip("pyarrow")
+    tracker = ClogTracker()
+    steps = np.arange(10_000)
+    tracker.log_metric_array("loss", 1.0 / (steps + 1), steps)
+    tracker.log_metric("eval/accuracy", 0.9, 500)
+    tracker.warn("learning rate reduced")
+    path = tmp_path / "run.parquet"
+    tracker.export(path)
+    
+    loaded = ClogTracker.from_parquet(path)
+    read_steps, values = loaded.get_series("loss")
+    assert np.array_equal(read_steps, steps)
+    assert np.array_equal(values, 1.0 / (steps + 1))
+    assert loaded.get_series("eval/accuracy")[1].tolist() == [0.9]
+    assert loaded._tracker.export_logs()[2] == ["learning rate reduced"]
+
+
+def test_from_tensorboard(tmp_path):
+    """Test loading scalars from TensorBoard event files."""
+    tensorboard = pytest.importorskip("torch.utils.tensorboard")
+    for run in ("train", "eval"):
+        writer = tensorboard.SummaryWriter(str(tmp_path / run))
+        for step in range(100):
+            writer.add_scalar("loss", step / 4, step)
+        writer.close()
+    
+    tracker = ClogTracker.from_tensorboard(tmp_path)
+    steps, values = tracker.get_series("train/loss")
+    assert steps.tolist() == list(range(100))
+    assert values[10] == 2.5
+    assert tracker.get_series("eval/loss") is not None
+
+
+def test_tensor_values_are_deferred(monkeypatch):
+    """Test logging torch tensors without a per-call .item()."""
+    torch = pytest.importorskip("torch")
+    tracker = ClogTracker(tensor_flush_every=4)
+    monkeypatch.setattr(torch.Tensor, "item", lambda self: pytest.fail("item() called"))
+    
+    for step in range(3):
+        tracker.log_metric("loss", torch.tensor(1.0 / (step + 1)), step)
+    tracker.log_metrics({"acc": torch.tensor([0.5], dtype=torch.float64), "lr": 0.1}, 0)
+    # The fourth pending tensor fetched all four at once.
+    assert tracker._tracker.summary("loss")["count"] == 3
+    
+    tracker.log_metric("loss", torch.tensor(0.2, requires_grad=True) * 2, 3)
+    assert tracker._tracker.summary("loss")["count"] == 3
+    steps, values = tracker.get_series("loss")
+    assert steps.tolist() == [0, 1, 2, 3]
+    assert values.tolist() == pytest.approx([1.0, 0.5, 1 / 3, 0.4])
+    assert tracker.get_series("acc")[1].tolist() == [0.5]
+    assert tracker.summary("lr")["last"] == 0.1
+    
+    with pytest.raises(ValueError):
+        tracker.log_metric("loss", torch.zeros(2), 4)
+    
+    # Updating a tensor in place after logging it leaves the logged value
+    total = torch.tensor(1.0)
+    tracker.log_metric("total", total, 0)
+    total += 1
+    tracker.log_metric("total", total, 1)
+    assert tracker.get_series("total")[1].tolist() == [1.0, 2.0]
+    
+    # Stamped when logged, and stored before arrays logged after them
+    logged_ms = time.time_ns() // 1_000_000
+    tracker.log_metric("grad", torch.tensor(1.0), 0)
+    time.sleep(0.2)
+    tracker.log_metric_array("grad", np.array([2.0]), np.array([0]))
+    assert tracker.get_series("grad")[1].tolist() == [1.0, 2.0]
+    names, counts, _, _, timestamps = tracker._tracker.export_columns()
+    start = int(counts[:list(names).index("grad")].sum())
+    assert logged_ms <= timestamps[start] < logged_ms + 100
+
+
+def test_out_of_order_steps():
+    """Test that late and repeated steps are stored in step order."""
+    tracker = ClogTracker(duplicates="last_wins")
+    for step in range(100):
+        tracker.log_metric("loss", 1.0, step)
+    # Resume from a checkpoint taken at step 50.
+    for step in range(50, 60):
+        tracker.log_metric("loss", 2.0, step)
+    tracker.log_metric("loss", 3.0, 0)
+    
+    steps, values = tracker.get_series("loss")
+    assert steps.tolist() == list(range(100))
+    assert values[0] == 3.0
+    assert values[50:60].tolist() == [2.0] * 10
+    assert values[60:].tolist() == [1.0] * 40
+    
+    mean = ClogTracker(duplicates="mean")
+    mean.log_metrics({"acc": 0.5}, 3)
+    mean.log_metrics({"acc": 0.7}, 3)
+    assert mean.get_series("acc")[1].tolist() == pytest.approx([0.6])
+    
+    with pytest.raises(ValueError):
+        ClogTracker(duplicates="first_wins")
+
+
+def test_log_histogram():
+    """Test logging distributions and reading back their quantiles."""
+    tracker = ClogTracker()
+    rng = np.random.default_rng(0)
+    
+    for step in range(5):
+        weights = rng.normal(step, 1.0, size=(256, 1024)).astype(np.float32)
+        tracker.log_histogram("layer_0/weights", weights, step)
+    tracker.log_histogram("grads", [1, 2, 3, float("nan")], 0)
+    
+    steps, quantiles = tracker.histogram_quantiles("layer_0/weights", [0.5, 0.975])
+    assert steps.tolist() == [0, 1, 2, 3, 4]
+    assert quantiles.shape == (5, 2)
+    assert np.allclose(quantiles[:, 0], np.arange(5), atol=0.02)
+    assert np.allclose(quantiles[1:, 1], np.arange(1, 5) + 1.96, rtol=0.02)
+    # The metric itself holds each step's median.
+    assert tracker.summary("layer_0/weights")["count"] == 5
+    assert tracker.histogram_quantiles("grads", [0.0, 1.0])[1].tolist() == [[1.0, 3.0]]
+    assert tracker.histogram_quantiles("missing") is None
+    # Only the sketches are kept, not the 1.3 million values.
+    assert tracker.memory_usage() < 200_000
+
+
+def test_summary():
+    """Test running statistics of a metric."""
+    tracker = ClogTracker(stats_window=10)
+    values = np.linspace(1.0, 0.0, 1_000)
+    
+    for step, value in enumerate(values):
+        tracker.log_metric("val_loss", float(value), step)
+    summary = tracker.summary("val_loss")
+    
+    assert summary["count"] == 1_000
+    assert summary["min"] == 0.0
+    assert summary["min_step"] == 999
+    assert summary["max"] == 1.0
+    assert summary["mean"] == pytest.approx(values.mean())
+    assert summary["std"] == pytest.approx(values.std(ddof=1))
+    assert summary["window_mean"] == pytest.approx(values[-10:].mean())
+    assert tracker.summary("missing") is None
+
+
+def test_async_ingest():
+    """Test queued ingestion with each overflow policy."""
+    tracker = ClogTracker(async_ingest=True, queue_capacity=1024)
+    for step in range(10_000):
+        tracker.log_metric("loss", 1.0 / (step + 1), step)
+    tracker.log_metrics({"a": 1.0, "b": 2.0}, 0)
+    tracker.flush()
+    
+    assert tracker.ingest_stats() == {"enqueued": 10_002, "applied": 10_002, "dropped": 0}
+    
+    for overflow in ("drop_oldest", "sample"):
+        tracker = ClogTracker(async_ingest=True, queue_capacity=16, overflow=overflow)
+        for step in range(10_000):
+            tracker.log_metric("loss", float(step), step)
+        tracker.flush()
+        stats = tracker.ingest_stats()
+        assert stats["applied"] + stats["dropped"] == 10_000
+    
+    with pytest.raises(ValueError):
+        ClogTracker(async_ingest=True, overflow="sometimes")
+
+
+def test_memory_per_point():
+    """Test that stored points stay compact."""
+    tracker = ClogTracker()
+    
+    for step in range(10_000):
+        tracker.log_metric("loss", 1.0 / (step + 1), step)
+        tracker.log_metric("accuracy", step / 10_000, step)
+    
+    # 20 bytes per point plus Vec growth slack; a Metric per point was 70+.
+    assert tracker.memory_usage() / 20_000 < 40
+
+
+def test_retention_bounds_memory():
+    """Test that a retention policy keeps memory fixed."""
+    tracker = ClogTracker(max_points=1_000, archive_buckets=64, max_logs=10)
+    
+    for step in range(20_000):
+        tracker.log_metric("loss", 1.0 / (step + 1), step)
+    bounded = tracker.memory_usage()
+    for step in range(20_000, 100_000):
+        tracker.log_metric("loss", 1.0 / (step + 1), step)
+    
+    assert tracker.memory_usage() < 2 * bounded
+
+
+def test_persist_run_file(tmp_path):
+    """Test that a persisted run is written out on close."""
+    path = tmp_path / "run.clog"
+    tracker = ClogTracker(persist_path=path, fsync_interval=0.0)
+    
+    for step in range(1_000):
+        tracker.log_metric("loss", 1.0 / (step + 1), step)
+    tracker.log("done")
+    tracker.close()
+    tracker.close()
+    
+    data = path.read_bytes()
+    assert data[:4] == b"CLOG"
+    # 1,000 points at 24 bytes each, plus headers and the name and log records.
+    assert 24_000 < len(data) < 25_000
+
+
+def test_remote_trackers_are_aggregated():
+    """Test that ranks streaming to a collector are tagged and aggregated."""
+    collector = ClogTracker()
+    address = collector.serve(world_size=2)
+    ranks = [RemoteTracker(address, rank=rank) for rank in range(2)]
+    
+    for step in range(100):
+        for rank, tracker in enumerate(ranks):
+            tracker.log_metric("loss", float(rank + step), step)
+    for tracker in ranks:
+        tracker.close()
+    
+    deadline = time.time() + 10
+    while (collector.summary("loss@mean") or {}).get("count") != 100:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert collector.summary("loss@rank1")["last"] == 100.0
+    assert collector.summary("loss@mean")["last"] == 99.5
+    assert collector.summary("loss@min")["last"] == 99.0
+    with pytest.raises(RuntimeError):
+        collector.serve()
+
+
+def test_serve_http():
+    """Test that a served tracker exposes deltas and an OpenMetrics scrape."""
+    tracker = ClogTracker()
+    tracker.log_metric("train/loss", 0.5, 1)
+    address = tracker.serve_http()
+    
+    with urllib.request.urlopen(f"http://{address}/deltas") as response:
+        assert response.headers["X-Clog-Reset"] == "1"
+        assert int(response.headers["X-Clog-Cursor"]) > 0
+        assert len(response.read()) > 0
+    
+    tracker.log_metric("train/loss", 0.25, 2)
+    with urllib.request.urlopen(f"http://{address}/metrics") as response:
+        scrape = response.read().decode()
+    assert 'clog_step{metric="train/loss"} 2' in scrape
+    assert 'clog_value{metric="train/loss"} 0.25' in scrape
+    assert 'clog_points_total{metric="train/loss"} 2' in scrape
+    assert scrape.endswith("# EOF\n")
+    with pytest.raises(RuntimeError):
+        tracker.serve_http()
+
+
+def test_shared_memory_from_subprocess():
+    """Test that a child process can log through a shared-memory channel."""
+    tracker = ClogTracker()
+    name = tracker.shared_memory(capacity=1024)
+    child = (
+        "import sys\n"
+        "from clog import SharedMemoryWriter\n"
+        "writer = SharedMemoryWriter(sys.argv[1])\n"
+        "for step in range(500):\n"
+        "    writer.log_metrics({'worker/load_time': step * 0.5, 'worker/queue': 1.0}, step)\n"
+    )
+    subprocess.run([sys.executable, "-c", child, name], check=True)
+    
+    tracker.flush()
+    assert tracker.summary("worker/load_time")["count"] == 500
+    assert tracker.summary("worker/load_time")["last"] == 249.5
+    with pytest.raises(ValueError):
+        SharedMemoryWriter(name).log_metric("x" * 100, 1.0, 0)
+
+
+def test_timers():
+    """Test timing sections with a context manager and a decorator."""
+    tracker = ClogTracker()
+    
+    for _ in range(20):
+        with tracker.timer("sleep"):
+            time.sleep(0.001)
+    
+    @tracker.timed("square")
+    def square(x):
+        return x * x
+    
+    assert square(3) == 9
+    with pytest.raises(ZeroDivisionError):
+        with tracker.timer("fails"):
+            1 / 0
+    
+    stats = tracker.timer_stats("sleep")
+    assert stats["count"] == 20
+    assert stats["window_count"] == 20
+    assert 0.001 <= stats["p50"] <= stats["p99"] <= stats["max"] < 1.0
+    assert tracker.timer_stats("square")["count"] == 1
+    assert tracker.timer_stats("fails")["count"] == 1
+    assert tracker.timer_stats("missing") is None
+
+
 def test_log_messages():
     """Test logging messages."""
     tracker = ClogTracker()
@@ -32,6 +385,46 @@ def test_log_messages():
     tracker.log_message("Custom", "info")
 
 
+def test_log_spill_is_flushed(tmp_path):
+    """Test that lines evicted to the spill file are on disk after flush."""
+    path = tmp_path / "spill.log"
+    tracker = ClogTracker(max_logs=2, log_spill_path=path)
+    for i in range(5):
+        tracker.log(f"message {i}")
+    
+    tracker.flush()
+    lines = path.read_text().splitlines()
+    assert len(lines) == 3
+    assert lines[0].endswith(" INFO message 0")
+    tracker.close()
+
+
+def test_logging_handler(tmp_path):
+    """Test that stdlib logging records reach the tracker."""
+    path = tmp_path / "run.clog"
+    tracker = ClogTracker(persist_path=path, fsync_interval=0.0)
+    logger = logging.getLogger("clog.test")
+    logger.propagate = False
+    handler = LoggingHandler(tracker, level=logging.INFO)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    
+    try:
+        logger.debug("dropped %s", "record")
+        logger.info("epoch %d done", 3)
+        logger.critical("diverged")
+    finally:
+        logger.removeHandler(handler)
+    tracker.close()
+    
+    data = path.read_bytes()
+    assert b"epoch 3 done" in data
+    assert b"diverged" in data
+    assert b"dropped" not in data
+    with pytest.raises(ValueError):
+        tracker._tracker.log_record("bad", 99, 0.0)
+
+
 def test_ui_starts_and_stops():
     """Test that UI can start and stop."""
     tracker = ClogTracker()
@@ -46,5 +439,18 @@ def test_ui_starts_and_stops():
     tracker.log_metric("test", 1.0, 0)
     tracker.log("Test message")
     
-    # Stop the UI thread (in the future we'd have a proper stop method)
-    tracker.stop_ui()
\ No newline at end of file
+    tracker.stop_ui(timeout=5)
+    assert not tracker._ui_thread.is_alive()
+    
+    # A stop right after starting is not lost while the thread starts up
+    tracker.run_ui(threaded=True)
+    tracker.stop_ui(timeout=5)
+    assert not tracker._ui_thread.is_alive()
+
+
+def test_compare_checks_runs():
+    """Test that compare rejects bad runs before opening the UI."""
+    with pytest.raises(ValueError):
+        compare(ClogTracker(), ClogTracker(), labels=["only one"])
+    with pytest.raises(RuntimeError):
+        compare(ClogTracker(), "/nonexistent/run.clog")